@@ -13,6 +13,8 @@ function Dashboard({ initialView = 'orders' }) {
     const [orders, setOrders] = useState([]);
     const [loadingOrders, setLoadingOrders] = useState(initialView === 'orders');
     const [errorOrders, setErrorOrders] = useState(null);
+    const [nextOrdersCursor, setNextOrdersCursor] = useState(null);
+    const [loadingMoreOrders, setLoadingMoreOrders] = useState(false);
     const [filterStatus, setFilterStatus] = useState('new'); // Default filter
     const [ingesting, setIngesting] = useState(false);
     const [ingestionMessage, setIngestionMessage] = useState('');
@@ -64,18 +66,24 @@ function Dashboard({ initialView = 'orders' }) {
       return paymentMethodString.trim();
     };
 
-    const fetchOrders = useCallback(async (signal) => {
+    const ORDERS_PAGE_SIZE = 100;
+
+    // cursor = null loads the first page and replaces the list; otherwise the page is appended.
+    const fetchOrders = useCallback(async (signal, cursor = null) => {
         if (!currentUser) {
-            setOrders([]); setLoadingOrders(false); setErrorOrders(null); return;
+            setOrders([]); setNextOrdersCursor(null); setLoadingOrders(false); setErrorOrders(null); return;
         }
-        setLoadingOrders(true); setErrorOrders(null);
+        const setLoading = cursor ? setLoadingMoreOrders : setLoadingOrders;
+        setLoading(true); setErrorOrders(null);
         if (!VITE_API_BASE_URL) {
-            setErrorOrders("API URL not configured."); setLoadingOrders(false); return;
+            setErrorOrders("API URL not configured."); setLoading(false); return;
         }
         try {
             const token = await currentUser.getIdToken(true);
-            const statusParam = filterStatus ? `?status=${encodeURIComponent(filterStatus)}` : '';
-            const displayOrdersApiUrl = `${VITE_API_BASE_URL}/orders${statusParam}`;
+            const params = new URLSearchParams({ limit: String(ORDERS_PAGE_SIZE) });
+            if (filterStatus) params.set('status', filterStatus);
+            if (cursor) params.set('cursor', cursor);
+            const displayOrdersApiUrl = `${VITE_API_BASE_URL}/orders?${params.toString()}`;
             const response = await fetch(displayOrdersApiUrl, {
                 signal, headers: { 'Authorization': `Bearer ${token}` }
             });
@@ -88,13 +96,17 @@ function Dashboard({ initialView = 'orders' }) {
             }
             const data = await response.json();
             if (signal?.aborted) return;
-            if (!Array.isArray(data)) throw new Error("Received orders data is not in the expected array format.");
-            data.sort((a, b) => (new Date(b.order_date) || 0) - (new Date(a.order_date) || 0));
-            setOrders(data || []);
+            if (!data || !Array.isArray(data.orders)) throw new Error("Received orders data is not in the expected format.");
+            // Pages arrive already sorted newest first (order_date, id).
+            setOrders(prev => cursor ? [...prev, ...data.orders] : data.orders);
+            setNextOrdersCursor(data.has_more ? data.next_cursor : null);
         } catch (err) {
-            if (err.name !== 'AbortError') { setErrorOrders(err.message || "Failed to fetch orders."); setOrders([]); }
+            if (err.name !== 'AbortError') {
+                setErrorOrders(err.message || "Failed to fetch orders.");
+                if (!cursor) { setOrders([]); setNextOrdersCursor(null); }
+            }
         } finally {
-            if (!signal || !signal.aborted) setLoadingOrders(false);
+            if (!signal || !signal.aborted) setLoading(false);
         }
     }, [filterStatus, VITE_API_BASE_URL, currentUser]);
 
@@ -207,7 +219,7 @@ function Dashboard({ initialView = 'orders' }) {
             return;
         }
         if (!currentUser) {
-            setOrders([]); setStatusCounts({}); setLoadingOrders(false); setLoadingCounts(false);
+            setOrders([]); setNextOrdersCursor(null); setStatusCounts({}); setLoadingOrders(false); setLoadingCounts(false);
             setErrorOrders(null); setHasPendingOrders(false); 
             setDailyRevenueData([]); setLoadingRevenue(false); setErrorRevenue(null);
             return;
@@ -331,6 +343,13 @@ function Dashboard({ initialView = 'orders' }) {
                                     })}
                                 </tbody>
                             </table>
+                            {nextOrdersCursor && (
+                                <div style={{ textAlign: 'center', margin: '15px 0' }}>
+                                    <button onClick={() => fetchOrders(undefined, nextOrdersCursor)} disabled={loadingMoreOrders || loadingOrders} className="btn btn-secondary">
+                                        {loadingMoreOrders ? 'Loading...' : 'Load More Orders'}
+                                    </button>
+                                </div>
+                            )}
                         </div>
                     )}
                      <div className="ingest-controls-sticky-wrapper">
@@ -1,14 +1,25 @@
 // src/components/QuickbooksSync.jsx
-import React, { useState, useContext, useEffect } from 'react'; // Added useEffect if you plan to use it
+import React, { useState, useContext, useEffect, useRef } from 'react';
 import { AuthContext } from '../contexts/AuthContext';
 import './QuickbooksSync.css';
 
+const JOB_POLL_INTERVAL_MS = 3000;
+const JOB_POLL_MAX_DURATION_MS = 30 * 60 * 1000; // give up polling (the job keeps running server-side)
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
 const QuickbooksSync = () => {
     const [isLoading, setIsLoading] = useState(false);
     const [syncStatus, setSyncStatus] = useState('');
     const [lastSyncTime, setLastSyncTime] = useState(null);
     const [error, setError] = useState('');
     const { apiService } = useContext(AuthContext);
+    const isMountedRef = useRef(true);
+
+    // Stops the job polling loop (and its state updates) once the component unmounts.
+    useEffect(() => {
+        isMountedRef.current = true;
+        return () => { isMountedRef.current = false; };
+    }, []);
 
     const handleSync = async () => {
         setIsLoading(true);
@@ -17,7 +28,31 @@ const QuickbooksSync = () => {
         try {
             // apiService.post ALREADY returns the parsed JSON data if successful,
             // or throws an error if not response.ok
-            const data = await apiService.post('/quickbooks/trigger-sync', {});
+            let data = await apiService.post('/quickbooks/trigger-sync', {});
+
+            // The backend queues the sync as a background job (202 + job_id); poll until it finishes.
+            // Without a job_id the sync ran inline and `data` is already the final result.
+            if (data && data.job_id) {
+                if (data.deduplicated) setSyncStatus(data.message);
+                let job = data;
+                const pollDeadline = Date.now() + JOB_POLL_MAX_DURATION_MS;
+                while (job.status === 'queued' || job.status === 'running') {
+                    if (Date.now() > pollDeadline) {
+                        throw new Error(`Stopped waiting for job ${data.job_id} (still ${job.status}); it may still finish on the server.`);
+                    }
+                    await sleep(JOB_POLL_INTERVAL_MS);
+                    if (!isMountedRef.current) return;
+                    job = await apiService.get(`/quickbooks/jobs/${data.job_id}`);
+                    if (!isMountedRef.current) return;
+                    if (job.progress) setSyncStatus(job.progress);
+                }
+                if (job.status !== 'succeeded') {
+                    const failure = new Error(job.error || 'QuickBooks sync failed.');
+                    failure.data = job.result || { error: job.error };
+                    throw failure;
+                }
+                data = job.result || { message: 'QuickBooks sync completed.' };
+            }
 
             // Now, 'data' is the JSON object returned by the backend,
             // e.g., {"message": "Sync completed successfully. No pending items."}
@@ -42,13 +77,14 @@ const QuickbooksSync = () => {
             }
 
         } catch (err) { // Errors thrown by apiService will be caught here
+            if (!isMountedRef.current) return;
             console.error("Error during QuickBooks sync:", err);
             // err.data might contain the JSON error details from the server if apiService attached it
             const errorMessage = err.data?.details || err.data?.error || err.message || 'Network error or server unavailable.';
             setError(`An error occurred: ${errorMessage}`);
             setSyncStatus('Sync process encountered an error.');
         } finally {
-            setIsLoading(false);
+            if (isMountedRef.current) setIsLoading(false);
         }
     };
 
@@ -2,6 +2,7 @@
 
 import os
 import time
+import threading
 import traceback
 from functools import wraps
 from flask import Flask, jsonify, request, g, current_app
@@ -51,6 +52,11 @@ except ImportError as e:
     print(f"WARN: Could not import email_service: {e}")
     email_service = None
 
+import hpe_mapping_cache
+import http_client
+import firebase_token_cache
+import json_serialization
+
 try:
     import iif_generator
 except ImportError as e:
@@ -139,6 +145,7 @@ COUNTRY_ISO_TO_NAME = {
 }
 
 app = Flask(__name__)
+app.json = json_serialization.AppJSONProvider(app)
 print("DEBUG APP_SETUP: Flask object created.")
 
 allowed_origin = os.environ.get('ALLOWED_CORS_ORIGIN')
@@ -228,7 +235,16 @@ COMPANY_LOGO_GCS_URI = os.getenv("COMPANY_LOGO_GCS_URI")
 if COMPANY_LOGO_GCS_URI:
     print(f"DEBUG APP_SETUP: Company logo URI configured: {COMPANY_LOGO_GCS_URI}")
 else:
-    print("WARN APP_SETUP: COMPANY_LOGO_GCS_URI environment variable not set. PDFs will not have a logo.")
+    print("WARN APP_SETUP: COMPANY_LOGO_GCS_URI environment variable not set. PDFs will use the bundled logo.")
+
+# Pre-load the logo into document_generator's cache off the request path.
+if document_generator and os.getenv("WARM_LOGO_CACHE_ON_STARTUP", "true").lower() == "true":
+    threading.Thread(target=document_generator.warm_logo_cache, args=(COMPANY_LOGO_GCS_URI,), name="logo-warmup", daemon=True).start()
+
+# Optional PDF rendering processes (PDF_RENDER_POOL_ENABLED); workers preload fonts, styles and logo.
+if document_generator:
+    import pdf_render_pool
+    pdf_render_pool.start()
 
 bc_api_base_url_v2 = None
 bc_headers = None
@@ -275,43 +291,45 @@ except Exception as e_engine:
     engine = None
 print("DEBUG APP_SETUP: Finished DB engine init block.")
 
-storage_client = None
-if storage:
-    try:
-        print("DEBUG APP_SETUP: Attempting GCS client init...")
-        storage_client = storage.Client()
-        print("DEBUG APP_SETUP: Google Cloud Storage client initialized successfully.")
-    except Exception as gcs_e:
-        print(f"ERROR APP_SETUP: Failed to initialize Google Cloud Storage client: {gcs_e}")
-        traceback.print_exc()
-        storage_client = None
-else:
+import db_schema
+db_schema.ensure_schema_objects(engine)
+
+import gcs_service
+storage_client = gcs_service.get_storage_client() if storage else None  # shared with gcs_service / document_generator
+if not storage:
     print("WARN APP_SETUP: Google Cloud Storage library not loaded. File uploads will be skipped.")
+elif storage_client is None:
+    print("ERROR APP_SETUP: Failed to initialize Google Cloud Storage client.")
 print("DEBUG APP_SETUP: Finished GCS client init block.")
 
 def convert_row_to_dict(row):
+    """
+    Row -> plain dict in one pass: naive datetimes are tagged UTC and compliance_info is parsed into
+    a dict. Decimal/datetime values stay native; app.json (json_serialization) encodes them.
+    """
     if not row: return None
-    row_dict = row._asdict() if hasattr(row, '_asdict') else dict(getattr(row, '_mapping', {}))
-    row_dict = {str(k): v for k, v in row_dict.items()}
-    for key, value in row_dict.items():
-        if isinstance(value, Decimal): row_dict[key] = value
-        elif isinstance(value, datetime):
+    mapping = row._mapping if hasattr(row, '_mapping') else row._asdict()
+    row_dict = {}
+    for key, value in mapping.items():
+        key = str(key)
+        if isinstance(value, datetime):
             if value.tzinfo is None: value = value.replace(tzinfo=timezone.utc)
-            row_dict[key] = value
-        # Handle JSONB fields that might be strings and need parsing
-        elif key == 'compliance_info' and isinstance(value, str): # Specifically for compliance_info
-            try:
-                row_dict[key] = json.loads(value) if value else {}
-            except json.JSONDecodeError:
-                print(f"WARN convert_row_to_dict: Could not parse compliance_info JSON string: {value}")
-                row_dict[key] = {} # Default to empty dict on parse error
-        elif key == 'compliance_info' and value is None: # Ensure None becomes empty dict for frontend
-             row_dict[key] = {}
-
-
+        elif key == 'compliance_info':
+            # JSONB may arrive as a string; None becomes {} for the frontend
+            if value is None:
+                value = {}
+            elif isinstance(value, str):
+                try:
+                    value = json.loads(value) if value else {}
+                except json.JSONDecodeError:
+                    print(f"WARN convert_row_to_dict: Could not parse compliance_info JSON string: {value}")
+                    value = {} # Default to empty dict on parse error
+        row_dict[key] = value
     return row_dict
 
 def make_json_safe(data):
+    # Responses no longer need this (app.json encodes Decimal/datetime); kept for callers that
+    # need plain str values outside of jsonify.
     if isinstance(data, dict): return {key: make_json_safe(value) for key, value in data.items()}
     elif isinstance(data, list): return [make_json_safe(item) for item in data]
     elif isinstance(data, Decimal): return str(data)
@@ -324,7 +342,7 @@ def _get_bc_shipping_address_id(bc_order_id):
     if not bc_api_base_url_v2 or not bc_headers: return None
     try:
         shipping_addr_url = f"{bc_api_base_url_v2}orders/{bc_order_id}/shippingaddresses"
-        response = requests.get(shipping_addr_url, headers=bc_headers)
+        response = http_client.get(shipping_addr_url, headers=bc_headers)
         response.raise_for_status()
         shipping_addresses = response.json()
         if shipping_addresses and isinstance(shipping_addresses, list) and shipping_addresses[0].get('id'):
@@ -334,21 +352,87 @@ def _get_bc_shipping_address_id(bc_order_id):
         print(f"ERROR _get_bc_shipping_address_id for order {bc_order_id}: {e}")
         return None
 
-def get_hpe_mapping_with_fallback(original_sku_from_order, db_conn): 
-    hpe_option_pn, hpe_pn_type, sku_actually_mapped = None, None, original_sku_from_order
+def allocate_po_numbers(db_conn, count=1):
+    """
+    Hands out `count` unique PO numbers (as strings, ascending) from the po_number_seq sequence.
+
+    nextval() is not rolled back with the caller's transaction, so a failed request leaves a gap
+    in the numbering; in exchange concurrent requests can never receive the same number.
+    """
+    if count < 1: return []
+    allocated = db_conn.execute(
+        text("SELECT nextval('po_number_seq') AS po_number FROM generate_series(1, :count)"), {"count": count}
+    ).scalars().all()
+    return [str(po_number) for po_number in sorted(allocated)]
+
+def get_hpe_mapping_with_fallback(original_sku_from_order, db_conn):
     if not original_sku_from_order: return None, None, original_sku_from_order
-    query_map = text("SELECT option_pn, pn_type FROM hpe_part_mappings WHERE sku = :sku")
-    result = db_conn.execute(query_map, {"sku": original_sku_from_order}).fetchone()
-    if result:
-        hpe_option_pn, hpe_pn_type = result.option_pn, result.pn_type
-    elif '_' in original_sku_from_order:
-        sku_after_underscore = original_sku_from_order.split('_')[-1]
-        if sku_after_underscore and sku_after_underscore != original_sku_from_order:
-            result_fallback = db_conn.execute(query_map, {"sku": sku_after_underscore}).fetchone()
-            if result_fallback:
-                hpe_option_pn, hpe_pn_type = result_fallback.option_pn, result_fallback.pn_type
-                sku_actually_mapped = sku_after_underscore
-    return hpe_option_pn, hpe_pn_type, sku_actually_mapped
+    mapping = resolve_hpe_mappings_bulk([original_sku_from_order], db_conn)[original_sku_from_order]
+    return mapping["option_pn"], mapping["pn_type"], mapping["sku_mapped"]
+
+def _hpe_sku_lookup_candidates(original_sku):
+    # Same order as get_hpe_mapping_with_fallback: full SKU first, then the part after the last underscore.
+    if not original_sku: return []
+    candidates = [original_sku]
+    if '_' in original_sku:
+        sku_after_underscore = original_sku.split('_')[-1]
+        if sku_after_underscore and sku_after_underscore != original_sku:
+            candidates.append(sku_after_underscore)
+    return candidates
+
+def resolve_hpe_mappings_bulk(original_skus, db_conn):
+    """
+    Set-based version of get_hpe_mapping_with_fallback for a whole order.
+
+    Resolves every SKU (plus its underscore-suffix fallback) to option_pn, pn_type and the
+    custom po_description with a single joined query.
+
+    Returns:
+        dict: original_sku -> {"option_pn", "pn_type", "sku_mapped", "po_description"}.
+              Unmapped SKUs are present with None values and sku_mapped = original_sku.
+    """
+    unique_skus = list(dict.fromkeys(sku for sku in original_skus if sku))
+    resolved = {sku: {"option_pn": None, "pn_type": None, "sku_mapped": sku, "po_description": None} for sku in unique_skus}
+    all_candidates = list(dict.fromkeys(c for sku in unique_skus for c in _hpe_sku_lookup_candidates(sku)))
+    if not all_candidates: return resolved
+
+    # Repeat lookups are answered from the in-process cache; only unseen candidates hit the DB.
+    cached_by_sku, uncached_candidates = hpe_mapping_cache.get_cached(hpe_mapping_cache.sku_mapping_cache, all_candidates)
+    if uncached_candidates:
+        query_bulk = text("""
+            SELECT m.sku, m.option_pn, m.pn_type, d.po_description
+            FROM hpe_part_mappings m
+            LEFT JOIN hpe_description_mappings d ON d.option_pn = m.option_pn
+            WHERE m.sku = ANY(:skus)
+        """)
+        fetched_by_sku = {candidate: None for candidate in uncached_candidates}
+        for row in db_conn.execute(query_bulk, {"skus": uncached_candidates}).fetchall():
+            if fetched_by_sku.get(row.sku) is None:
+                fetched_by_sku[row.sku] = (row.option_pn, row.pn_type, row.po_description)
+        hpe_mapping_cache.store(hpe_mapping_cache.sku_mapping_cache, fetched_by_sku)
+        cached_by_sku.update(fetched_by_sku)
+
+    for sku in unique_skus:
+        for candidate in _hpe_sku_lookup_candidates(sku):
+            mapped = cached_by_sku.get(candidate)
+            if mapped:
+                option_pn, pn_type, po_description = mapped
+                resolved[sku] = {"option_pn": option_pn, "pn_type": pn_type, "sku_mapped": candidate, "po_description": po_description}
+                break
+    return resolved
+
+def get_hpe_descriptions_for_option_pns(option_pns, db_conn):
+    """Returns {option_pn: po_description} for every option PN that has a custom description, in one query."""
+    unique_option_pns = list(dict.fromkeys(pn for pn in option_pns if pn))
+    if not unique_option_pns: return {}
+    cached_descriptions, uncached_option_pns = hpe_mapping_cache.get_cached(hpe_mapping_cache.description_cache, unique_option_pns)
+    if uncached_option_pns:
+        query_desc = text("SELECT option_pn, po_description FROM hpe_description_mappings WHERE option_pn = ANY(:option_pns)")
+        fetched_descriptions = {pn: None for pn in uncached_option_pns}
+        fetched_descriptions.update({row.option_pn: row.po_description for row in db_conn.execute(query_desc, {"option_pns": uncached_option_pns}).fetchall()})
+        hpe_mapping_cache.store(hpe_mapping_cache.description_cache, fetched_descriptions)
+        cached_descriptions.update(fetched_descriptions)
+    return {pn: desc for pn, desc in cached_descriptions.items() if desc is not None}
 
 
 def get_country_name_from_iso(iso_code):
@@ -371,7 +455,7 @@ def verify_firebase_token(f):
             print("AUTH DECORATOR: No ID token found in Authorization header.")
             return jsonify({"error": "Unauthorized", "message": "Authorization token is missing."}), 401
         try:
-            decoded_token = firebase_auth.verify_id_token(id_token, check_revoked=True)
+            decoded_token = firebase_token_cache.verify_id_token_cached(id_token, firebase_auth.verify_id_token)
             g.user_uid = decoded_token.get('uid')
             g.user_email = decoded_token.get('email')
             g.decoded_token = decoded_token
@@ -443,6 +527,12 @@ app.register_blueprint(customs_info_bp, url_prefix='/api')
 
 print("DEBUG APP_SETUP: All Blueprints registered.")
 
+import outbox
+outbox.start_worker(engine, app)
+
+import background_jobs
+background_jobs.init(engine, app)
+
 
 if __name__ == '__main__':
     print(f"Starting G1 PO App Backend...")
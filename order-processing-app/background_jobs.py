@@ -0,0 +1,214 @@
+# background_jobs.py
+# Runs long admin tasks (QuickBooks IIF syncs) off the request thread.
+#
+# Routes call submit(), which records the job in background_jobs and hands its id to a small
+# in-process thread pool; the route returns 202 with the job id straight away and clients poll
+# get_job(). Jobs that share a dedupe_key never run concurrently: a partial unique index allows
+# only one queued/running row per key, across all instances, and a second submit() returns the
+# job already in flight. Handlers report progress through a callback that also acts as a
+# heartbeat; an active job whose heartbeat is older than BACKGROUND_JOB_STALE_SECONDS (instance
+# died mid-run) is marked failed, on submit and whenever jobs are read, so its key is released and
+# pollers see the failure.
+#
+# Unlike outbox.py, jobs are not retried automatically. On Cloud Run, work continuing after the
+# response needs CPU allocated outside requests; set BACKGROUND_JOBS_ENABLED=false to run inline.
+
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS_ENABLED", "true").lower() == "true"
+BACKGROUND_JOB_WORKERS = int(os.getenv("BACKGROUND_JOB_WORKERS", "1"))
+BACKGROUND_JOB_STALE_SECONDS = int(os.getenv("BACKGROUND_JOB_STALE_SECONDS", "1800"))
+
+_handlers = {}
+_executor = None
+_executor_lock = threading.Lock()
+_engine = None
+_flask_app = None
+
+_JOB_COLUMNS = """id, job_type, dedupe_key, status, progress, payload, result, error, requested_by,
+                  created_at, started_at, heartbeat_at, finished_at"""
+
+
+class JobFailed(Exception):
+    """Raised by a handler to fail its job while still recording a result payload."""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def job_handler(job_type):
+    """Decorator registering fn(payload, progress) for job_type. Its return value is stored as the job result."""
+    def decorator(fn):
+        _handlers[job_type] = fn
+        return fn
+    return decorator
+
+
+def init(engine, flask_app=None):
+    """Binds the engine and app used by job threads. Called once from app.py."""
+    global _engine, _flask_app
+    _engine = engine
+    _flask_app = flask_app
+
+
+def is_enabled():
+    return BACKGROUND_JOBS_ENABLED and _engine is not None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, BACKGROUND_JOB_WORKERS), thread_name_prefix="background-job")
+    return _executor
+
+
+def _row_to_job(row):
+    return dict(row._mapping) if row is not None else None
+
+
+def _expire_stale_jobs(conn, dedupe_key=None):
+    """Fails active jobs whose heartbeat is older than BACKGROUND_JOB_STALE_SECONDS (all keys when dedupe_key is None)."""
+    expired = conn.execute(
+        text("""
+            UPDATE background_jobs
+            SET status = 'failed', finished_at = NOW(), error = :error
+            WHERE (CAST(:dedupe_key AS TEXT) IS NULL OR dedupe_key = :dedupe_key) AND status IN ('queued', 'running')
+              AND COALESCE(heartbeat_at, created_at) < NOW() - make_interval(secs => :stale_seconds)
+            RETURNING id, dedupe_key
+        """),
+        {"dedupe_key": dedupe_key, "stale_seconds": BACKGROUND_JOB_STALE_SECONDS,
+         "error": f"Abandoned: no progress for {BACKGROUND_JOB_STALE_SECONDS}s (worker stopped?)."}
+    ).fetchall()
+    for row in expired:
+        print(f"WARN BACKGROUND_JOBS: Marked stale job {row.id} ('{row.dedupe_key}') as failed.")
+
+
+def submit(job_type, payload=None, dedupe_key=None, requested_by=None):
+    """
+    Queues job_type and starts it on the pool. Returns (job, created): when another job with the
+    same dedupe_key is still queued or running, that job is returned with created=False.
+    """
+    if job_type not in _handlers:
+        raise ValueError(f"No background job handler registered for '{job_type}'.")
+    insert_sql = text(f"""
+        INSERT INTO background_jobs (job_type, dedupe_key, status, payload, requested_by, created_at, heartbeat_at)
+        VALUES (:job_type, :dedupe_key, 'queued', CAST(:payload AS JSONB), :requested_by, NOW(), NOW())
+        ON CONFLICT (dedupe_key) WHERE status IN ('queued', 'running') DO NOTHING
+        RETURNING {_JOB_COLUMNS}
+    """)
+    active_sql = text(f"""
+        SELECT {_JOB_COLUMNS} FROM background_jobs
+        WHERE dedupe_key = :dedupe_key AND status IN ('queued', 'running') ORDER BY id DESC LIMIT 1
+    """)
+    params = {"job_type": job_type, "dedupe_key": dedupe_key, "payload": json.dumps(payload or {}, default=str),
+              "requested_by": requested_by}
+
+    for _ in range(3):  # the active job can finish between the conflict and the lookup
+        with _engine.begin() as conn:
+            if dedupe_key:
+                _expire_stale_jobs(conn, dedupe_key)
+            job = _row_to_job(conn.execute(insert_sql, params).fetchone())
+            if job is None and dedupe_key:
+                active_job = _row_to_job(conn.execute(active_sql, {"dedupe_key": dedupe_key}).fetchone())
+                if active_job is not None:
+                    print(f"INFO BACKGROUND_JOBS: '{job_type}' not queued; job {active_job['id']} ({active_job['job_type']}) already {active_job['status']}.")
+                    return active_job, False
+                continue
+        _get_executor().submit(_run_job, job["id"])
+        print(f"INFO BACKGROUND_JOBS: Queued job {job['id']} ({job_type}).")
+        return job, True
+    raise RuntimeError(f"Could not queue background job '{job_type}'.")
+
+
+def _update_progress(job_id, message):
+    try:
+        with _engine.begin() as conn:
+            conn.execute(text("UPDATE background_jobs SET progress = :progress, heartbeat_at = NOW() WHERE id = :id"),
+                         {"progress": str(message)[:1000], "id": job_id})
+    except Exception as e:
+        print(f"WARN BACKGROUND_JOBS: Could not record progress for job {job_id}: {e}")
+
+
+def _finish_job(job_id, status, result=None, error=None):
+    """Records the outcome unless the job was already expired as stale (its key may now belong to a newer job)."""
+    with _engine.begin() as conn:
+        finished = conn.execute(
+            text("""
+                UPDATE background_jobs
+                SET status = :status, result = CAST(:result AS JSONB), error = :error, finished_at = NOW(), heartbeat_at = NOW()
+                WHERE id = :id AND status = 'running'
+            """),
+            {"status": status, "result": json.dumps(result, default=str) if result is not None else None,
+             "error": error[:4000] if error else None, "id": job_id}
+        )
+    if finished.rowcount == 0:
+        print(f"WARN BACKGROUND_JOBS: Job {job_id} was no longer running (expired as stale?); its {status} outcome was not recorded.")
+
+
+def _run_job(job_id):
+    try:
+        with _engine.begin() as conn:
+            job = conn.execute(
+                text("""
+                    UPDATE background_jobs SET status = 'running', started_at = NOW(), heartbeat_at = NOW()
+                    WHERE id = :id AND status = 'queued'
+                    RETURNING job_type, payload
+                """),
+                {"id": job_id}
+            ).fetchone()
+        if job is None:
+            return
+        payload = job.payload if isinstance(job.payload, dict) else json.loads(job.payload or "{}")
+        handler = _handlers[job.job_type]
+        print(f"INFO BACKGROUND_JOBS: Job {job_id} ({job.job_type}) started.")
+
+        def progress(message):
+            _update_progress(job_id, message)
+
+        try:
+            if _flask_app is not None:
+                with _flask_app.app_context():
+                    result = handler(payload, progress)
+            else:
+                result = handler(payload, progress)
+        except JobFailed as e:
+            _finish_job(job_id, "failed", result=e.result, error=str(e))
+            print(f"ERROR BACKGROUND_JOBS: Job {job_id} ({job.job_type}) failed: {e}")
+            return
+        except Exception as e:
+            traceback.print_exc()
+            _finish_job(job_id, "failed", error=f"{type(e).__name__}: {e}")
+            print(f"ERROR BACKGROUND_JOBS: Job {job_id} ({job.job_type}) crashed: {e}")
+            return
+        _finish_job(job_id, "succeeded", result=result)
+        print(f"INFO BACKGROUND_JOBS: Job {job_id} ({job.job_type}) succeeded.")
+    except Exception as e:
+        print(f"ERROR BACKGROUND_JOBS: Could not run job {job_id}: {e}")
+        traceback.print_exc()
+
+
+def get_job(job_id):
+    with _engine.begin() as conn:
+        _expire_stale_jobs(conn)
+        return _row_to_job(conn.execute(text(f"SELECT {_JOB_COLUMNS} FROM background_jobs WHERE id = :id"), {"id": job_id}).fetchone())
+
+
+def list_jobs(job_types=None, limit=20):
+    sql = f"SELECT {_JOB_COLUMNS} FROM background_jobs"
+    params = {"limit": limit}
+    if job_types:
+        sql += " WHERE job_type = ANY(:job_types)"
+        params["job_types"] = list(job_types)
+    sql += " ORDER BY id DESC LIMIT :limit"
+    with _engine.begin() as conn:
+        _expire_stale_jobs(conn)
+        return [_row_to_job(row) for row in conn.execute(text(sql), params).fetchall()]
@@ -0,0 +1,89 @@
+# benchmark_document_generator.py
+# Per-document render time for the four PDF generators.
+#
+#   python benchmark_document_generator.py [--iterations 50]
+#
+# Each generator is timed with the shared, prebuilt stylesheet (current behaviour) and with the
+# stylesheet rebuilt for every document (how get_custom_styles() used to work). No logo URI is
+# passed, so the bundled logo is used and nothing touches GCS.
+
+import argparse
+import statistics
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import document_generator
+
+SAMPLE_ORDER = {
+    'bigcommerce_order_id': 106157639, 'processed_date_display': '06/02/2025', 'invoice_date_display': '06/02/2025',
+    'customer_company': 'BlueSouth', 'customer_name': 'Federico Perez Sabater',
+    'customer_shipping_address_line1': '87 Lefferts Lane', 'customer_shipping_address_line2': '',
+    'customer_shipping_city': 'Clark', 'customer_shipping_state': 'NJ', 'customer_shipping_zip': '07066',
+    'customer_shipping_country': 'United States', 'customer_shipping_country_iso2': 'US',
+    'customer_billing_company': 'BlueSouth', 'customer_billing_first_name': 'Federico', 'customer_billing_last_name': 'Perez',
+    'customer_billing_street_1': '710 W Hallandale Beach Blvd', 'customer_billing_street_2': 'Suite 103',
+    'customer_billing_city': 'Hallandale Beach', 'customer_billing_state': 'FL', 'customer_billing_zip': '33009',
+    'customer_billing_country': 'United States', 'customer_billing_country_iso2': 'US',
+    'customer_shipping_method': 'Standard Ground (UPS Ground)', 'payment_method': 'Net 30 Terms [with credit approval]',
+    'customer_notes': "Please handle with care.\nDeliver to loading dock.",
+    'bc_shipping_cost_ex_tax': Decimal('15.00'), 'bigcommerce_order_tax': Decimal('10.53'), 'total_sale_price': Decimal('1294.53'),
+}
+SAMPLE_SUPPLIER = {'name': 'Test Supplier Inc.', 'address_line1': '123 Test St', 'city': 'Testville', 'state': 'TS',
+                   'zip': '12345', 'country': 'USA', 'payment_terms': 'Net 30'}
+SAMPLE_LINES = [
+    {'sku': f'7270{n:02d}-B21', 'description': f'HPE Ethernet 10Gb 2-port Adapter #{n}', 'name': f'HPE Ethernet 10Gb 2-port Adapter #{n}',
+     'pdf_description': f'HPE Ethernet 10Gb 2-port Adapter #{n}', 'quantity': n % 3 + 1, 'unit_cost': 75.25, 'sale_price': '159.00'}
+    for n in range(12)
+]
+
+GENERATORS = {
+    "purchase_order": lambda: document_generator.generate_purchase_order_pdf(
+        order_data=SAMPLE_ORDER, supplier_data=SAMPLE_SUPPLIER, po_number='BENCH-PO-1', po_date=datetime.now(timezone.utc),
+        po_items=SAMPLE_LINES, payment_terms='Net 30', payment_instructions="Pay by wire.\nReference the PO number."),
+    "packing_slip": lambda: document_generator.generate_packing_slip_pdf(
+        order_data=SAMPLE_ORDER, items_in_this_shipment=SAMPLE_LINES[:8], items_shipping_separately=SAMPLE_LINES[8:]),
+    "wire_invoice": lambda: document_generator.generate_wire_transfer_invoice_pdf(SAMPLE_ORDER, SAMPLE_LINES, apply_wire_fee=True),
+    "receipt": lambda: document_generator.generate_receipt_pdf(SAMPLE_ORDER, SAMPLE_LINES),
+}
+
+
+def time_generator(render, iterations):
+    render()  # warm-up: fonts, logo cache, shared stylesheet
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        render()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {"mean": statistics.mean(samples), "median": statistics.median(samples),
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document_generator render times.")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    shared_get_custom_styles = document_generator.get_custom_styles
+    modes = (("per-document styles", document_generator._build_custom_styles), ("shared styles", shared_get_custom_styles))
+    results = {}
+    try:
+        for mode, styles_fn in modes:
+            document_generator.get_custom_styles = styles_fn
+            for name, render in GENERATORS.items():
+                results[(name, mode)] = time_generator(render, args.iterations)
+    finally:
+        document_generator.get_custom_styles = shared_get_custom_styles
+
+    print(f"\n{'document':<16}{'mode':<22}{'mean ms':>9}{'median ms':>11}{'p95 ms':>9}")
+    for name in GENERATORS:
+        for mode, _ in modes:
+            r = results[(name, mode)]
+            print(f"{name:<16}{mode:<22}{r['mean']:>9.2f}{r['median']:>11.2f}{r['p95']:>9.2f}")
+        before, after = results[(name, modes[0][0])]["median"], results[(name, modes[1][0])]["median"]
+        print(f"{'':<16}{'median speed-up':<22}{before / after:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
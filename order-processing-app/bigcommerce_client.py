@@ -0,0 +1,135 @@
+# bigcommerce_client.py
+# Shared BigCommerce V2 API access for bulk work (order ingestion).
+# Requests go through http_client's pooled session (timeouts, 5xx retries, metrics); a process-wide
+# gate on top honours the X-Rate-Limit-* headers BigCommerce returns so concurrent fetches back off together.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+
+BC_FETCH_MAX_WORKERS = int(os.getenv("BC_FETCH_MAX_WORKERS", "8"))
+BC_REQUEST_TIMEOUT_SECONDS = float(os.getenv("BC_REQUEST_TIMEOUT_SECONDS", "30"))
+BC_MAX_RETRIES_ON_429 = int(os.getenv("BC_MAX_RETRIES_ON_429", "3"))
+
+
+class _RateLimitGate:
+    """
+    Tracks BigCommerce's quota headers. When the remaining quota drops to the number of
+    in-flight workers (or a 429 arrives) every caller waits until the window resets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+
+    def wait(self):
+        with self._lock:
+            delay = self._blocked_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, response, reserve):
+        headers = response.headers
+        try:
+            requests_left = int(headers.get("X-Rate-Limit-Requests-Left", ""))
+        except ValueError:
+            requests_left = None
+        try:
+            reset_ms = int(headers.get("X-Rate-Limit-Time-Reset-Ms", ""))
+        except ValueError:
+            reset_ms = None
+        if response.status_code == 429 or (requests_left is not None and requests_left <= reserve):
+            pause_seconds = (reset_ms / 1000.0) if reset_ms is not None else 1.0
+            with self._lock:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause_seconds)
+            print(f"WARN BC_CLIENT: Rate limit reached (left={requests_left}, status={response.status_code}). Pausing {pause_seconds:.2f}s.")
+
+
+_rate_limit_gate = _RateLimitGate()
+
+
+def bc_get(url, headers, params=None, reserve=1):
+    """
+    GET through the shared http_client session, waiting out BigCommerce rate-limit windows and retrying 429s.
+    Returns the final requests.Response; callers still call raise_for_status().
+    """
+    for attempt in range(BC_MAX_RETRIES_ON_429 + 1):
+        _rate_limit_gate.wait()
+        # 429s are handled here (the gate knows the window reset time); http_client retries 5xx/network errors.
+        response = http_client.get(url, headers=headers, params=params,
+                                   timeout=(http_client.HTTP_CONNECT_TIMEOUT_SECONDS, BC_REQUEST_TIMEOUT_SECONDS),
+                                   retry_statuses=http_client.RETRY_STATUSES - {429})
+        _rate_limit_gate.update(response, reserve)
+        if response.status_code != 429 or attempt == BC_MAX_RETRIES_ON_429:
+            return response
+    return response
+
+
+def _parse_json_list(response):
+    # BigCommerce answers 204 / empty body when an order has no rows for a sub-resource.
+    if response.status_code == 204 or not response.text or not response.text.strip():
+        return []
+    data = response.json()
+    return data if isinstance(data, list) else []
+
+
+def _fetch_one_order_subresources(bc_order_id, api_base_url_v2, headers, reserve):
+    shipping_res = bc_get(f"{api_base_url_v2}orders/{bc_order_id}/shippingaddresses", headers, reserve=reserve)
+    shipping_res.raise_for_status()
+    products_res = bc_get(f"{api_base_url_v2}orders/{bc_order_id}/products", headers, reserve=reserve)
+    products_res.raise_for_status()
+    return {"shipping_addresses": _parse_json_list(shipping_res), "products": _parse_json_list(products_res)}
+
+
+def fetch_order_subresources(bc_order_ids, api_base_url_v2, headers, max_workers=None):
+    """
+    Fetches /shippingaddresses and /products for many orders concurrently.
+
+    Returns:
+        dict: bc_order_id -> {"shipping_addresses": list, "products": list} on success,
+              or the exception raised for that order (callers decide whether to skip it).
+    """
+    unique_ids = list(dict.fromkeys(oid for oid in bc_order_ids if oid is not None))
+    if not unique_ids:
+        return {}
+    workers = max(1, min(max_workers or BC_FETCH_MAX_WORKERS, len(unique_ids)))
+    started = time.monotonic()
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bc-fetch") as executor:
+        futures = {
+            executor.submit(_fetch_one_order_subresources, oid, api_base_url_v2, headers, workers): oid
+            for oid in unique_ids
+        }
+        for future, oid in futures.items():
+            try:
+                results[oid] = future.result()
+            except Exception as e:
+                results[oid] = e
+    failed = sum(1 for r in results.values() if isinstance(r, Exception))
+    print(f"INFO BC_CLIENT: Fetched sub-resources for {len(unique_ids)} orders with {workers} workers in {time.monotonic() - started:.2f}s ({failed} failed).")
+    return results
+
+
+def fetch_all_pages(url, headers, params=None, page_limit=250, max_pages=None):
+    """
+    Follows BigCommerce V2 `page`/`limit` pagination until a short or empty page.
+    Returns (rows, truncated): the concatenated list, and True when max_pages (BC_MAX_ORDER_PAGES,
+    a guard against runaway loops) was reached with a full last page, so more results may remain.
+    """
+    max_pages = max_pages or int(os.getenv("BC_MAX_ORDER_PAGES", "40"))
+    all_rows, truncated = [], False
+    for page in range(1, max_pages + 1):
+        page_params = dict(params or {}, page=page, limit=page_limit)
+        response = bc_get(url, headers, params=page_params)
+        response.raise_for_status()
+        rows = _parse_json_list(response)
+        all_rows.extend(rows)
+        if len(rows) < page_limit:
+            break
+    else:
+        truncated = True
+        print(f"WARN BC_CLIENT: Stopped after {max_pages} pages of {url}; more results may remain.")
+    return all_rows, truncated
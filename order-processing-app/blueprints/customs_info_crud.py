@@ -6,7 +6,7 @@ from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import insert # For potential future "upsert" needs
 
 # Imports from the main app.py
-from app import engine, verify_firebase_token, convert_row_to_dict, make_json_safe
+from app import engine, verify_firebase_token, convert_row_to_dict
 
 customs_info_bp = Blueprint('customs_info_bp', __name__)
 
@@ -60,7 +60,7 @@ def create_customs_info_entry():
 
         new_entry_dict = convert_row_to_dict(new_entry_row)
         print(f"DEBUG CREATE_CUSTOMS_INFO: Inserted Customs Info. ID: {new_entry_dict.get('id')}")
-        return jsonify({"message": "Customs Information entry created successfully", "data": make_json_safe(new_entry_dict)}), 201
+        return jsonify({"message": "Customs Information entry created successfully", "data": new_entry_dict}), 201
 
     except sqlalchemy.exc.IntegrityError as e: # Example: if you add unique constraints later
         if conn and trans and trans.is_active: trans.rollback()
@@ -132,7 +132,7 @@ def list_customs_info_entries():
         total_pages = (total_items + per_page - 1) // per_page if per_page > 0 else 0
 
         return jsonify({
-            "entries": make_json_safe(entries_list),
+            "entries": entries_list,
             "pagination": {
                 "currentPage": page, "perPage": per_page,
                 "totalItems": total_items, "totalPages": total_pages
@@ -167,7 +167,7 @@ def get_customs_info_entry(item_id):
         
         entry_dict = convert_row_to_dict(result)
         print(f"DEBUG GET_CUSTOMS_INFO: Found entry for ID: {item_id}.")
-        return jsonify(make_json_safe(entry_dict)), 200
+        return jsonify(entry_dict), 200
     except Exception as e:
         print(f"DEBUG GET_CUSTOMS_INFO: Unexpected exception for ID {item_id}: {e}")
         traceback.print_exc()
@@ -11,9 +11,10 @@ from decimal import Decimal # Not directly used but good practice
 # Imports from the main app.py
 from app import (
     engine, verify_firebase_token,
-    convert_row_to_dict, make_json_safe,
-    get_hpe_mapping_with_fallback # This helper is used by get_description_for_sku
+    convert_row_to_dict,
+    resolve_hpe_mappings_bulk # This helper is used by get_description_for_sku
 )
+import hpe_mapping_cache
 # No specific service modules like document_generator are directly used by these CRUD/lookup routes
 
 hpe_mappings_bp = Blueprint('hpe_mappings_bp', __name__)
@@ -53,6 +54,7 @@ def create_hpe_description_mapping():
         conn.execute(insert_stmt)
 
         trans.commit()
+        hpe_mapping_cache.invalidate_all(reason=f"created description for {option_pn}")
         print(f"DEBUG CREATE_HPE_DESC: Inserted HPE Description Mapping for Option PN: {option_pn}")
         return jsonify({"message": "HPE Description Mapping created successfully", "option_pn": option_pn, "po_description": po_description}), 201
     except sqlalchemy.exc.IntegrityError as e:
@@ -116,7 +118,7 @@ def list_hpe_description_mappings():
         total_pages = (total_items + per_page - 1) // per_page if per_page > 0 else 0
 
         return jsonify({
-            "mappings": make_json_safe(mappings_list),
+            "mappings": mappings_list,
             "pagination": {
                 "currentPage": page, "perPage": per_page,
                 "totalItems": total_items, "totalPages": total_pages
@@ -148,7 +150,7 @@ def get_hpe_description_mapping(mapping_id):
         
         mapping_dict = convert_row_to_dict(result)
         print(f"DEBUG GET_HPE_DESC: Found HPE mapping for Option PN: {option_pn_param}.")
-        return jsonify(make_json_safe(mapping_dict)), 200
+        return jsonify(mapping_dict), 200
     except Exception as e:
         print(f"DEBUG GET_HPE_DESC: Unexpected exception: {e}")
         traceback.print_exc()
@@ -187,7 +189,8 @@ def update_hpe_description_mapping(mapping_id):
             trans.rollback()
             return jsonify({"message": f"HPE Mapping with Option PN {option_pn_param} found but not updated (no change or error)."}), 404
 
-        trans.commit(); print(f"DEBUG UPDATE_HPE_DESC: Updated HPE mapping for Option PN: {option_pn_param}")
+        trans.commit(); hpe_mapping_cache.invalidate_all(reason=f"updated description for {option_pn_param}")
+        print(f"DEBUG UPDATE_HPE_DESC: Updated HPE mapping for Option PN: {option_pn_param}")
         return jsonify({"message": f"HPE Mapping for Option PN {option_pn_param} updated successfully"}), 200
     except Exception as e:
         if conn and trans and trans.is_active: trans.rollback()
@@ -213,7 +216,8 @@ def delete_hpe_description_mapping(mapping_id):
             trans.rollback(); print(f"DEBUG DELETE_HPE_DESC: HPE Mapping with Option PN {option_pn_param} not found.")
             return jsonify({"message": f"HPE Mapping with Option PN {option_pn_param} not found."}), 404
         
-        trans.commit(); print(f"DEBUG DELETE_HPE_DESC: Deleted HPE mapping for Option PN: {option_pn_param}")
+        trans.commit(); hpe_mapping_cache.invalidate_all(reason=f"deleted description for {option_pn_param}")
+        print(f"DEBUG DELETE_HPE_DESC: Deleted HPE mapping for Option PN: {option_pn_param}")
         return jsonify({"message": f"HPE Mapping for Option PN {option_pn_param} deleted successfully"}), 200
     except Exception as e:
         if conn and trans and trans.is_active: trans.rollback()
@@ -262,21 +266,20 @@ def get_description_for_sku(sku_value):
         if engine is None: return jsonify({"error": "Database engine not available."}), 500
         db_conn = engine.connect() # Use db_conn as per original
 
-        # Logic using get_hpe_mapping_with_fallback for consistency with order details
-        # This helper function already checks hpe_part_mappings
-        hpe_option_pn, _, _ = get_hpe_mapping_with_fallback(sku_value, db_conn) # Pass db_conn
+        # Same resolver as order details: hpe_part_mappings (with underscore fallback) joined to
+        # hpe_description_mappings in a single query.
+        hpe_mapping = resolve_hpe_mappings_bulk([sku_value], db_conn)[sku_value]
+        hpe_option_pn = hpe_mapping['option_pn']
 
         if hpe_option_pn:
-            # If we got an option_pn (either direct match or via spare part mapping), look it up in hpe_description_mappings
-            desc_query = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn")
-            description = db_conn.execute(desc_query, {"option_pn": hpe_option_pn}).scalar_one_or_none()
+            description = hpe_mapping['po_description']
             if description:
                 print(f"DEBUG LOOKUP_DESC: Found description in hpe_description_mappings for (mapped/direct) OptionPN '{hpe_option_pn}'.")
         
         # Fallback: If no description from hpe_description_mappings, or if sku_value didn't map to an option_pn,
         # try the original products table (standard_description column).
         # Note: Your original code had a complex series of fallbacks.
-        # The current `get_hpe_mapping_with_fallback` and then `hpe_description_mappings` should cover most cases.
+        # The current `resolve_hpe_mappings_bulk` lookup should cover most cases.
         # If you need to check `products.standard_description` as an ultimate fallback, add it here.
         # For now, aligning with the primary purpose of custom PO descriptions:
         if description is None:
@@ -299,4 +302,18 @@ def get_description_for_sku(sku_value):
     finally:
         if db_conn and not db_conn.closed:
             db_conn.close()
-            print(f"DEBUG LOOKUP_DESC: DB connection closed for SKU {sku_value}.")
\ No newline at end of file
+            print(f"DEBUG LOOKUP_DESC: DB connection closed for SKU {sku_value}.")
+
+
+@hpe_mappings_bp.route('/hpe-mappings/cache', methods=['GET'])
+@verify_firebase_token
+def get_hpe_mapping_cache_stats():
+    return jsonify(hpe_mapping_cache.get_cache_stats()), 200
+
+
+@hpe_mappings_bp.route('/hpe-mappings/cache/invalidate', methods=['POST', 'OPTIONS'])
+@verify_firebase_token
+def invalidate_hpe_mapping_cache():
+    # For out-of-band edits (e.g. a CSV reload of hpe_part_mappings) that should not wait for the TTL.
+    hpe_mapping_cache.invalidate_all(reason="manual invalidation via API")
+    return jsonify({"message": "HPE mapping cache invalidated.", **hpe_mapping_cache.get_cache_stats()}), 200
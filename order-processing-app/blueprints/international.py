@@ -16,18 +16,32 @@ from app import (
     COMPANY_LOGO_GCS_URI,
     GCS_BUCKET_NAME,
     get_country_name_from_iso,
-    get_hpe_mapping_with_fallback,
+    resolve_hpe_mappings_bulk,
+    get_hpe_descriptions_for_option_pns,
+    allocate_po_numbers,
     _get_bc_shipping_address_id,
     bc_api_base_url_v2,
     bc_shipped_status_id
 )
 import shipping_service
 import gcs_service
-from document_generator import generate_purchase_order_pdf, generate_packing_slip_pdf
+from pdf_render_pool import generate_purchase_order_pdf, generate_packing_slip_pdf
 import email_service
 
 international_bp = Blueprint('international_bp', __name__)
 
+
+def _upload_dropship_documents(document_uploads, label_blob_name):
+    """
+    Uploads the shipping label and its PO / packing slip PDFs to GCS in parallel.
+    Returns {blob_name: public URL or None}; raises if the label itself could not be stored.
+    """
+    urls = {result["blob_name"]: result["public_url"] for result in gcs_service.upload_files_parallel(document_uploads)}
+    if not urls.get(label_blob_name):
+        raise Exception("Failed to upload shipping label PDF to GCS.")
+    logging.info(f"INTL_DROPSHIP_ROUTE: Uploaded {sum(1 for url in urls.values() if url)}/{len(urls)} documents to GCS (label: {urls[label_blob_name]}).")
+    return urls
+
 # --- get_international_details function (remains the same from last correct version) ---
 @international_bp.route("/order/<int:order_id>/international-details", methods=['GET'])
 @verify_firebase_token
@@ -85,6 +99,7 @@ def get_international_details(order_id):
 
             line_items_customs_info = []
             if line_items_results:
+                hpe_mappings_by_sku = resolve_hpe_mappings_bulk([row.sku for row in line_items_results], conn)
                 for item_row_mapping in line_items_results:
                     item = dict(item_row_mapping._mapping)
                     original_sku = item['sku']
@@ -101,7 +116,7 @@ def get_international_details(order_id):
                         "harmonized_tariff_code": "N/A",
                         "default_country_of_origin": "US"
                     }
-                    hpe_option_pn, _, _ = get_hpe_mapping_with_fallback(original_sku, conn)
+                    hpe_option_pn = hpe_mappings_by_sku.get(original_sku, {}).get('option_pn')
                     customs_data["option_pn_used_for_lookup"] = hpe_option_pn
                     if hpe_option_pn:
                         pt_query = text("SELECT product_type FROM product_types WHERE option_pn = :option_pn LIMIT 1")
@@ -277,11 +292,8 @@ def process_international_dropship_route(order_id):
                 label_timestamp = current_utc_datetime.strftime("%Y%m%d%H%M%S")
                 label_gcs_folder = f"shipping_labels/order_{bc_order_id_for_paths}"
                 label_gcs_filename_part = f"{label_gcs_folder}/UPS_INTL_DS_{tracking_number}_{label_timestamp}.pdf"
-                gcs_label_http_url = gcs_service.upload_file_bytes(label_pdf_bytes, label_gcs_filename_part, "application/pdf")
-                if not gcs_label_http_url:
-                    raise Exception("Failed to upload shipping label PDF to GCS.")
-                logging.info(f"INTL_DROPSHIP_ROUTE: Successfully uploaded shipping label PDF to {gcs_label_http_url}")
-                # Shipment DB record will be inserted after PO/G1 Onsite logic
+                # Uploaded together with the PO / packing slip below; shipment DB record is inserted after that.
+                document_uploads = [(label_pdf_bytes, label_gcs_filename_part, "application/pdf")]
 
                 # Initialize common GCS folder prefix parts
                 gcs_common_prefix_main_part = f"processed_orders/order_{bc_order_id_for_paths}"
@@ -300,14 +312,7 @@ def process_international_dropship_route(order_id):
                         raise ValueError("Supplier ID and line items are required for PO.")
 
                     # PO Number Generation
-                    starting_po_sequence = 200001
-                    max_po_query = text("SELECT MAX(CAST(numeric_po_number AS INTEGER)) FROM (SELECT po_number AS numeric_po_number FROM purchase_orders WHERE CAST(po_number AS TEXT) ~ '^[0-9]+$') AS numeric_pos")
-                    max_po_value_from_db = db_connection.execute(max_po_query).scalar_one_or_none()
-                    next_sequence_num = starting_po_sequence
-                    if max_po_value_from_db is not None:
-                        try: next_sequence_num = max(starting_po_sequence, int(max_po_value_from_db) + 1)
-                        except ValueError: logging.warning(f"Could not parse max PO number '{max_po_value_from_db}'.")
-                    generated_po_number = str(next_sequence_num)
+                    generated_po_number = allocate_po_numbers(db_connection, 1)[0]
 
                     total_po_amount = sum(Decimal(str(item.get('quantity', 0))) * Decimal(str(item.get('unitCost', '0'))) for item in line_items_from_frontend)
                     po_insert_query = text("INSERT INTO purchase_orders (po_number, order_id, supplier_id, payment_instructions, status, created_by, po_date, total_amount) VALUES (:po_number, :order_id, :supplier_id, :payment_instructions, :status, :created_by, :po_date, :total_amount) RETURNING id;")
@@ -342,12 +347,12 @@ def process_international_dropship_route(order_id):
                     # Packing Slip for PO
                     packing_slip_items_for_po_ps_gen = []
                     original_bc_item_name_query_po = text("SELECT name FROM order_line_items WHERE id = :original_line_item_id")
-                    hpe_po_desc_query_po = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn_param LIMIT 1")
+                    hpe_descriptions_by_option_pn = get_hpe_descriptions_for_option_pns([item.get("sku") for item in po_line_items_for_db_and_pdf], db_connection)
                     for po_item_detail in po_line_items_for_db_and_pdf:
                         ps_sku = po_item_detail.get("sku")
                         ps_desc = None
                         original_oli_id = po_item_detail.get("original_order_line_item_id")
-                        hpe_mapped_desc = db_connection.execute(hpe_po_desc_query_po, {"option_pn_param": ps_sku}).scalar_one_or_none()
+                        hpe_mapped_desc = hpe_descriptions_by_option_pn.get(ps_sku)
                         if hpe_mapped_desc: ps_desc = hpe_mapped_desc
                         elif original_oli_id:
                             original_bc_name = db_connection.execute(original_bc_item_name_query_po, {"original_line_item_id": original_oli_id}).scalar_one_or_none()
@@ -361,13 +366,20 @@ def process_international_dropship_route(order_id):
                     common_gcs_folder_for_po = f"{gcs_common_prefix_main_part}_PO_{generated_po_number}{gcs_blind_suffix}"
                     po_pdf_gcs_path_part = f"{common_gcs_folder_for_po}/po_{generated_po_number}_{gcs_timestamp_suffix}.pdf"
                     po_pdf_gs_uri_db = f"gs://{GCS_BUCKET_NAME}/{po_pdf_gcs_path_part}"
-                    po_pdf_http_url = gcs_service.upload_file_bytes(po_pdf_bytes_for_email, po_pdf_gcs_path_part, "application/pdf")
-                    if po_pdf_http_url: db_connection.execute(text("UPDATE purchase_orders SET po_pdf_gcs_path = :path WHERE id = :id"), {"path": po_pdf_gs_uri_db, "id": new_po_id})
-
+                    document_uploads.append((po_pdf_bytes_for_email, po_pdf_gcs_path_part, "application/pdf"))
+                    ps_pdf_gcs_path_part_po = None
                     if packing_slip_pdf_bytes_for_email:
                         ps_pdf_gcs_path_part_po = f"{common_gcs_folder_for_po}/ps_{generated_po_number}_{gcs_timestamp_suffix}.pdf"
+                        document_uploads.append((packing_slip_pdf_bytes_for_email, ps_pdf_gcs_path_part_po, "application/pdf"))
+
+                    uploaded_urls = _upload_dropship_documents(document_uploads, label_gcs_filename_part)
+                    gcs_label_http_url = uploaded_urls[label_gcs_filename_part]
+                    po_pdf_http_url = uploaded_urls.get(po_pdf_gcs_path_part)
+                    if po_pdf_http_url: db_connection.execute(text("UPDATE purchase_orders SET po_pdf_gcs_path = :path WHERE id = :id"), {"path": po_pdf_gs_uri_db, "id": new_po_id})
+
+                    if ps_pdf_gcs_path_part_po:
                         ps_pdf_gs_uri_db_po = f"gs://{GCS_BUCKET_NAME}/{ps_pdf_gcs_path_part_po}"
-                        packing_slip_http_url = gcs_service.upload_file_bytes(packing_slip_pdf_bytes_for_email, ps_pdf_gcs_path_part_po, "application/pdf")
+                        packing_slip_http_url = uploaded_urls.get(ps_pdf_gcs_path_part_po)
                         if packing_slip_http_url: db_connection.execute(text("UPDATE purchase_orders SET packing_slip_gcs_path = :path WHERE id = :id"), {"path": ps_pdf_gs_uri_db_po, "id": new_po_id})
 
                     # Insert shipment record for this PO's label
@@ -399,17 +411,16 @@ def process_international_dropship_route(order_id):
                     bc_line_items_for_shipment_api = [] # For G1 shipment
 
                     if all_order_line_items_results:
-                        hpe_po_desc_query_g1 = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn_param LIMIT 1")
+                        hpe_mappings_by_sku_g1 = resolve_hpe_mappings_bulk([row.sku for row in all_order_line_items_results], db_connection)
                         for item_row in all_order_line_items_results:
                             item = dict(item_row._mapping)
                             ps_sku = item.get('sku')
                             ps_desc = item.get('name')
                             # Apply HPE mapping for PS description if applicable
-                            mapped_sku_for_hpe_lookup, _, _ = get_hpe_mapping_with_fallback(ps_sku, db_connection) # get_hpe_mapping_with_fallback needs connection
-                            if mapped_sku_for_hpe_lookup: # If original SKU maps to an Option PN
-                                hpe_desc = db_connection.execute(hpe_po_desc_query_g1, {"option_pn_param": mapped_sku_for_hpe_lookup}).scalar_one_or_none()
-                                if hpe_desc: ps_desc = hpe_desc
-                                ps_sku = mapped_sku_for_hpe_lookup # Use Option PN as SKU on PS
+                            hpe_mapping_g1 = hpe_mappings_by_sku_g1.get(ps_sku, {})
+                            if hpe_mapping_g1.get('option_pn'): # If original SKU maps to an Option PN
+                                if hpe_mapping_g1.get('po_description'): ps_desc = hpe_mapping_g1['po_description']
+                                ps_sku = hpe_mapping_g1['option_pn'] # Use Option PN as SKU on PS
 
                             items_for_g1_packing_slip.append({'sku': ps_sku, 'name': ps_desc, 'quantity': item.get('quantity')})
                             if item.get('bigcommerce_line_item_id'):
@@ -421,12 +432,16 @@ def process_international_dropship_route(order_id):
                             ps_gcs_folder_g1 = f"{gcs_common_prefix_main_part}_G1OnsiteIntl{gcs_blind_suffix}"
                             ps_gcs_filename_part_g1 = f"{ps_gcs_folder_g1}/ps_g1intl_{gcs_timestamp_suffix}.pdf"
                             ps_gs_uri_db_g1 = f"gs://{GCS_BUCKET_NAME}/{ps_gcs_filename_part_g1}"
-                            packing_slip_http_url = gcs_service.upload_file_bytes(packing_slip_pdf_bytes_for_email, ps_gcs_filename_part_g1, "application/pdf")
+                            document_uploads.append((packing_slip_pdf_bytes_for_email, ps_gcs_filename_part_g1, "application/pdf"))
                         else:
                             logging.warning(f"INTL_DROPSHIP_ROUTE: G1 Onsite - Failed to generate packing slip for order {order_id}")
                     else:
                         logging.info(f"INTL_DROPSHIP_ROUTE: G1 Onsite - No line items on order {order_id} to generate packing slip for.")
 
+                    uploaded_urls = _upload_dropship_documents(document_uploads, label_gcs_filename_part)
+                    gcs_label_http_url = uploaded_urls[label_gcs_filename_part]
+                    if ps_gs_uri_db_g1: packing_slip_http_url = uploaded_urls.get(ps_gcs_filename_part_g1)
+
                     # Insert shipment record for G1 Onsite International
                     shipment_insert_query_g1 = text("INSERT INTO shipments (order_id, carrier, tracking_number, label_gcs_url, created_at, service_used, purchase_order_id, packing_slip_gcs_path) VALUES (:order_id, :carrier, :tracking, :label_url, :created_at, :service, NULL, :ps_path)")
                     db_connection.execute(shipment_insert_query_g1, {"order_id": order_id, "carrier": "UPS", "tracking": tracking_number, "label_url": gcs_label_http_url, "created_at": current_utc_datetime, "service": shipment_data.get('ShipmentRequest', {}).get('Shipment', {}).get('Service', {}).get('Code'), "ps_path": ps_gs_uri_db_g1 })
@@ -1,7 +1,8 @@
 # order-processing-app/blueprints/orders.py
 import os
 import traceback
-from flask import Blueprint, jsonify, request, g, current_app
+from flask import Blueprint, jsonify, request, g, current_app, Response, stream_with_context
+import sqlalchemy
 from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime, timezone, timedelta, date # Ensure date is imported
@@ -11,11 +12,15 @@ import sys
 import re
 import html
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 
 from app import (
-    engine, storage_client, verify_firebase_token,
-    convert_row_to_dict, make_json_safe,
-    _get_bc_shipping_address_id, get_hpe_mapping_with_fallback,
+    engine, verify_firebase_token,
+    convert_row_to_dict,
+    _get_bc_shipping_address_id, resolve_hpe_mappings_bulk, allocate_po_numbers,
     bc_api_base_url_v2, bc_headers, bc_processing_status_id, bc_shipped_status_id, domestic_country_code,
     G1_ONSITE_FULFILLMENT_IDENTIFIER,
     SHIP_FROM_NAME, SHIP_FROM_CONTACT, SHIP_FROM_STREET1, SHIP_FROM_STREET2,
@@ -24,7 +29,15 @@ from app import (
 )
 
 import document_generator
+import gcs_service
+import pdf_artifact_cache
+import pdf_merge
+import pdf_render_pool
 import shipping_service
+import bigcommerce_client
+import outbox
+import db_schema
+from json_serialization import stream_query_as_json
 import email_service
 
 from xml.sax.saxutils import escape
@@ -33,26 +46,100 @@ import requests
 
 orders_bp = Blueprint('orders_bp', __name__)
 
+# Columns the order list actually renders; billing/compliance/shipping-address detail stays on GET /orders/<id>.
+ORDER_LIST_COLUMNS = [
+    "id", "bigcommerce_order_id", "order_date", "status", "customer_name", "customer_company",
+    "customer_shipping_city", "customer_shipping_state", "customer_shipping_method",
+    "payment_method", "is_international", "customer_notes", "total_sale_price", "created_at", "updated_at"
+]
+ORDERS_PAGE_DEFAULT_LIMIT = 50
+ORDERS_PAGE_MAX_LIMIT = 200
+
+# Sort key of the paginated list: orders without an order_date sort last instead of being skipped
+# by the keyset comparison. Matches idx_orders_list_sort / idx_orders_status_list_sort.
+ORDERS_PAGE_SORT_DATE = "COALESCE(order_date, '-infinity')"
+
+def _encode_orders_cursor(order_date, order_id):
+    raw = f"{order_date.isoformat() if order_date is not None else 'null'}|{order_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _decode_orders_cursor(cursor):
+    """Returns (order_date or None, id) from a cursor produced by _encode_orders_cursor. Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        date_part, id_part = raw.rsplit("|", 1)
+        return (None if date_part == "null" else datetime.fromisoformat(date_part)), int(id_part)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
 @orders_bp.route('/orders', methods=['GET'])
 @verify_firebase_token
 def get_orders():
+    """
+    Order list, newest first.
+
+    Paginated mode (any of limit/cursor given): keyset pagination on (order_date, id), orders
+    without an order_date last, using only ORDER_LIST_COLUMNS. Returns {"orders", "next_cursor",
+    "has_more"} plus "total_count" when include_total=true. Without limit/cursor the legacy full-table list is streamed as a JSON array.
+    """
     print("DEBUG GET_ORDERS: Received request")
     status_filter = request.args.get('status')
     print(f"DEBUG GET_ORDERS: Status filter = {status_filter}")
+    paginated = 'limit' in request.args or 'cursor' in request.args
     db_conn = None
     try:
         if engine is None: return jsonify({"error": "Database engine not available."}), 500
-        db_conn = engine.connect()
-        base_query = "SELECT * FROM orders"
+        where_clauses = []
         params = {}
         if status_filter and status_filter != 'all':
-            base_query += " WHERE status = :status_filter"
+            where_clauses.append("status = :status_filter")
             params["status_filter"] = status_filter
-        base_query += " ORDER BY order_date DESC, id DESC"
-        query = text(base_query)
-        records = db_conn.execute(query, params).fetchall()
+
+        if not paginated:
+            base_query = "SELECT * FROM orders"
+            if where_clauses: base_query += " WHERE " + " AND ".join(where_clauses)
+            base_query += " ORDER BY order_date DESC, id DESC"
+            # Full table: stream rows to the client instead of building the whole list in memory.
+            return stream_query_as_json(engine, text(base_query), params, row_to_dict=convert_row_to_dict)
+
+        try:
+            limit = int(request.args.get('limit', ORDERS_PAGE_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        limit = max(1, min(limit, ORDERS_PAGE_MAX_LIMIT))
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+
+        page_where = list(where_clauses)
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                params["cursor_date"], params["cursor_id"] = _decode_orders_cursor(cursor)
+            except ValueError as ve:
+                return jsonify({"error": str(ve)}), 400
+            # Row-value comparison matches the index order and stays sargable.
+            page_where.append(f"({ORDERS_PAGE_SORT_DATE}, id) < (COALESCE(CAST(:cursor_date AS TIMESTAMPTZ), '-infinity'), :cursor_id)")
+
+        page_query = f"SELECT {', '.join(ORDER_LIST_COLUMNS)} FROM orders"
+        if page_where: page_query += " WHERE " + " AND ".join(page_where)
+        page_query += f" ORDER BY {ORDERS_PAGE_SORT_DATE} DESC, id DESC LIMIT :limit_plus_one"
+        params["limit_plus_one"] = limit + 1
+
+        db_conn = engine.connect()
+        records = db_conn.execute(text(page_query), params).fetchall()
+        has_more = len(records) > limit
+        records = records[:limit]
         orders_list = [convert_row_to_dict(row) for row in records]
-        return jsonify(make_json_safe(orders_list)), 200
+
+        next_cursor = None
+        if has_more and records:
+            next_cursor = _encode_orders_cursor(records[-1].order_date, records[-1].id)
+
+        response_payload = {"orders": orders_list, "next_cursor": next_cursor, "has_more": has_more, "limit": limit}
+        if include_total:
+            count_query = "SELECT COUNT(*) FROM orders"
+            if where_clauses: count_query += " WHERE " + " AND ".join(where_clauses)
+            response_payload["total_count"] = db_conn.execute(text(count_query), {k: v for k, v in params.items() if k == "status_filter"}).scalar_one()
+        return jsonify(response_payload), 200
     except Exception as e:
         print(f"ERROR GET_ORDERS: {e}")
         return jsonify({"error": "Failed to fetch orders", "details": str(e)}), 500
@@ -95,18 +182,14 @@ def get_order_details(order_id):
                    oli.created_at AS line_item_created_at, oli.updated_at AS line_item_updated_at
             FROM order_line_items oli WHERE oli.order_id = :order_id_param ORDER BY oli.id """
         base_line_items_records = db_conn.execute(text(base_line_items_sql), {"order_id_param": order_id}).fetchall()
+        hpe_mappings_by_sku = resolve_hpe_mappings_bulk([row.original_sku for row in base_line_items_records], db_conn)
         augmented_line_items_list = []
         for row in base_line_items_records:
             item_dict = convert_row_to_dict(row)
-            original_sku_for_item = item_dict.get('original_sku')
-            hpe_option_pn, hpe_pn_type, sku_mapped = get_hpe_mapping_with_fallback(original_sku_for_item, db_conn)
-            item_dict['hpe_option_pn'] = hpe_option_pn
-            item_dict['hpe_pn_type'] = hpe_pn_type
-            item_dict['hpe_po_description'] = None
-            if hpe_option_pn:
-                desc_query = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn")
-                custom_desc_result = db_conn.execute(desc_query, {"option_pn": hpe_option_pn}).scalar_one_or_none()
-                if custom_desc_result: item_dict['hpe_po_description'] = custom_desc_result
+            hpe_mapping = hpe_mappings_by_sku.get(item_dict.get('original_sku'), {})
+            item_dict['hpe_option_pn'] = hpe_mapping.get('option_pn')
+            item_dict['hpe_pn_type'] = hpe_mapping.get('pn_type')
+            item_dict['hpe_po_description'] = hpe_mapping.get('po_description') or None
             augmented_line_items_list.append(item_dict)
         
         print(f"DEBUG GET_ORDER: Found order ID {order_id} with {len(augmented_line_items_list)} augmented line items.")
@@ -126,7 +209,7 @@ def get_order_details(order_id):
             else:
                 order_data_dict['actual_cost_of_goods_sold'] = Decimal('0.00') 
         
-        response_data = {"order": make_json_safe(order_data_dict), "line_items": make_json_safe(augmented_line_items_list)}
+        response_data = {"order": order_data_dict, "line_items": augmented_line_items_list}
         return jsonify(response_data), 200
         
     except Exception as e:
@@ -140,36 +223,69 @@ def get_order_details(order_id):
             print(f"DEBUG GET_ORDER: Database connection closed for order ID {order_id}.")
 
 
+ORDER_STATUS_DEFINED = ['new', 'RFQ Sent', 'Processed', 'Unpaid/Not Invoiced', 'Unpaid/Invoiced', 'international_manual', 'pending', 'Completed Offline']
+# True once the order_status_counts triggers (db_schema) are known to exist. Only a positive result
+# is cached: until then every request re-checks, so the table is picked up as soon as it is created.
+_status_counts_table_ready = False
+_status_counts_missing_logged = False
+
+def _read_order_status_counts(db_conn):
+    """Counts from the trigger-maintained order_status_counts table, or a live GROUP BY if it is not set up."""
+    global _status_counts_table_ready, _status_counts_missing_logged
+    if not _status_counts_table_ready:
+        _status_counts_table_ready = bool(db_conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_status_counts_ins')"
+        )).scalar())
+        if not _status_counts_table_ready and not _status_counts_missing_logged:
+            _status_counts_missing_logged = True
+            print("WARN GET_STATUS_COUNTS: order_status_counts triggers missing; counting orders live.")
+    if _status_counts_table_ready:
+        sql_query = text("SELECT status, order_count FROM order_status_counts WHERE order_count <> 0")
+    else:
+        sql_query = text("SELECT status, COUNT(id) AS order_count FROM orders WHERE status IS NOT NULL GROUP BY status")
+    return {row.status: int(row.order_count) for row in db_conn.execute(sql_query)}
+
 @orders_bp.route('/orders/status-counts', methods=['GET'])
 @verify_firebase_token
 def get_order_status_counts():
-    print("DEBUG GET_STATUS_COUNTS: Received request")
+    """Per-status order counts. Sends an ETag; a matching If-None-Match gets 304 Not Modified."""
     db_conn = None
     try:
         if engine is None:
             print("ERROR GET_STATUS_COUNTS: Database engine not available.")
             return jsonify({"error": "Database engine not available."}), 500
         db_conn = engine.connect()
-        print("DEBUG GET_STATUS_COUNTS: DB connection established.")
-        sql_query = text("SELECT status, COUNT(id) AS order_count FROM orders GROUP BY status;")
-        records = db_conn.execute(sql_query).fetchall()
-        status_counts_dict = {}
-        for row in records:
-            row_dict = convert_row_to_dict(row)
-            if row_dict and row_dict.get('status') is not None:
-                status_counts_dict[row_dict['status']] = row_dict.get('order_count', 0)
-        print(f"DEBUG GET_STATUS_COUNTS: Fetched counts: {status_counts_dict}")
-        defined_statuses = ['new', 'RFQ Sent', 'Processed', 'Unpaid/Not Invoiced', 'Unpaid/Invoiced', 'international_manual', 'pending', 'Completed Offline']
-        for s in defined_statuses:
+        status_counts_dict = _read_order_status_counts(db_conn)
+        for s in ORDER_STATUS_DEFINED:
             if s not in status_counts_dict: status_counts_dict[s] = 0
-        return jsonify(make_json_safe(status_counts_dict)), 200
+        etag = hashlib.sha1(json.dumps(status_counts_dict, sort_keys=True).encode("utf-8")).hexdigest()
+        response = jsonify(status_counts_dict)
+        response.set_etag(etag)
+        # Browsers revalidate on every poll and reuse the cached body on 304.
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         print(f"ERROR GET_STATUS_COUNTS: {e}")
         return jsonify({"error": "Failed to fetch order status counts", "details": str(e)}), 500
     finally:
         if db_conn and not db_conn.closed:
             db_conn.close()
-            print("DEBUG GET_STATUS_COUNTS: DB connection closed.")
+
+@orders_bp.route('/orders/status-counts/rebuild', methods=['POST', 'OPTIONS'])
+@verify_firebase_token
+def rebuild_order_status_counts():
+    """Recounts order_status_counts from the orders table (repair after manual SQL with triggers disabled)."""
+    if engine is None:
+        return jsonify({"error": "Database engine not available."}), 500
+    try:
+        with engine.begin() as conn:
+            for statement in db_schema.REBUILD_ORDER_STATUS_COUNTS_STATEMENTS:
+                conn.execute(text(statement))
+            counts = _read_order_status_counts(conn)
+        return jsonify({"message": "Order status counts rebuilt.", "counts": counts}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error rebuilding order status counts: {e}", exc_info=True)
+        return jsonify({"error": "Failed to rebuild order status counts.", "details": str(e)}), 500
 
 @orders_bp.route('/orders/<int:order_id>/status', methods=['POST'])
 @verify_firebase_token
@@ -196,7 +312,7 @@ def update_order_status(order_id):
         transaction.commit()
         updated_data = convert_row_to_dict(updated_row)
         print(f"DEBUG UPDATE_STATUS: Successfully updated order {order_id} status to '{new_status}'.")
-        return jsonify({"message": f"Order {order_id} status updated to {new_status}", "order": make_json_safe(updated_data)}), 200
+        return jsonify({"message": f"Order {order_id} status updated to {new_status}", "order": updated_data}), 200
     except Exception as e:
         if transaction and transaction.is_active: transaction.rollback()
         print(f"ERROR UPDATE_STATUS: Failed for order {order_id}: {e}")
@@ -206,6 +322,43 @@ def update_order_status(order_id):
         print(f"DEBUG UPDATE_STATUS: DB connection closed for order ID {order_id}.")
 
 
+# Local statuses that ingest must never overwrite ('Unpaid/Invoiced' included so an invoiced order is not reverted).
+INGEST_FINALIZED_OR_MANUAL_STATUSES = ['Processed', 'Completed Offline', 'pending', 'RFQ Sent', 'Unpaid/Invoiced']
+INGEST_DEFAULT_MODE = os.getenv("BC_INGEST_DEFAULT_MODE", "full")
+INGEST_INCREMENTAL_OVERLAP_SECONDS = int(os.getenv("BC_INGEST_INCREMENTAL_OVERLAP_SECONDS", "120"))
+
+INGEST_UPSERT_CHUNK_SIZE = int(os.getenv("BC_INGEST_UPSERT_CHUNK_SIZE", "200"))
+# Columns ingest refreshes on an order it already holds (anything else is owned by the app after first insert).
+INGEST_UPDATABLE_ORDER_COLUMNS = ['is_international', 'payment_method', 'status']
+INSERT_ORDER_LINE_ITEM_SQL = text("""
+    INSERT INTO order_line_items (order_id, bigcommerce_line_item_id, sku, name, quantity, sale_price, created_at, updated_at)
+    VALUES (:order_id, :bigcommerce_line_item_id, :sku, :name, :quantity, :sale_price, :created_at, :updated_at)
+""")
+
+def _build_orders_upsert_stmt(order_rows):
+    """
+    Multi-row INSERT ... ON CONFLICT (bigcommerce_order_id) DO UPDATE for ingest.
+    Existing rows are only touched when not finalized and one of INGEST_UPDATABLE_ORDER_COLUMNS changed.
+    RETURNING gives (id, bigcommerce_order_id, inserted) for every row written; untouched rows are not returned.
+    """
+    orders_table = sqlalchemy.table('orders', *[sqlalchemy.column(col) for col in ['id'] + list(order_rows[0].keys())])
+    stmt = insert(orders_table).values(order_rows)
+    changed = sqlalchemy.or_(*[orders_table.c[col].is_distinct_from(stmt.excluded[col]) for col in INGEST_UPDATABLE_ORDER_COLUMNS])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['bigcommerce_order_id'],
+        set_={**{col: stmt.excluded[col] for col in INGEST_UPDATABLE_ORDER_COLUMNS}, 'updated_at': stmt.excluded.updated_at},
+        where=sqlalchemy.and_(orders_table.c.status.notin_(INGEST_FINALIZED_OR_MANUAL_STATUSES), changed)
+    )
+    return stmt.returning(orders_table.c.id, orders_table.c.bigcommerce_order_id, sqlalchemy.literal_column('(xmax = 0)').label('inserted'))
+
+def _parse_bc_datetime(value):
+    """Parses BigCommerce V2 RFC-2822 timestamps ('Tue, 20 May 2025 14:03:11 +0000'); None if absent/invalid."""
+    if not value: return None
+    try:
+        return datetime.strptime(value, '%a, %d %b %Y %H:%M:%S %z')
+    except (ValueError, TypeError):
+        return None
+
 @orders_bp.route('/ingest_orders', methods=['POST'])
 @verify_firebase_token
 def ingest_orders_route():
@@ -224,264 +377,282 @@ def ingest_orders_route():
             current_app.logger.error("ERROR INGEST: Database engine not initialized.", flush=True)
             return jsonify({"message": "Database engine not initialized."}), 500
         
-        orders_list_endpoint = f"{bc_api_base_url_v2}orders"
-        api_params = {'status_id': target_status_id, 'sort': 'date_created:asc', 'limit': 250}
-        current_app.logger.info(f"DEBUG INGEST: Fetching orders with status ID {target_status_id} from {orders_list_endpoint}", flush=True)
+        ingest_mode = (request.args.get('mode') or (request.get_json(silent=True) or {}).get('mode') or INGEST_DEFAULT_MODE).lower()
+        if ingest_mode not in ('full', 'incremental'):
+            return jsonify({"message": f"Unknown ingest mode '{ingest_mode}'. Use 'full' or 'incremental'."}), 400
+        sync_key = f"orders_status_{target_status_id}"
 
-        response = requests.get(orders_list_endpoint, headers=bc_headers, params=api_params)
-        response.raise_for_status() 
+        orders_list_endpoint = f"{bc_api_base_url_v2}orders"
+        # Full runs page in creation order (stable while paging); incremental runs walk date_modified.
+        api_params = {'status_id': target_status_id, 'sort': 'date_created:asc'}
+        if ingest_mode == 'incremental':
+            api_params['sort'] = 'date_modified:asc'
+            with engine.connect() as conn:
+                high_water_mark = conn.execute(
+                    text("SELECT last_date_modified FROM bc_sync_state WHERE sync_key = :sync_key"), {"sync_key": sync_key}
+                ).scalar_one_or_none()
+            if high_water_mark:
+                # Small overlap so edits landing in the same second as the previous run are not missed.
+                min_modified = high_water_mark - timedelta(seconds=INGEST_INCREMENTAL_OVERLAP_SECONDS)
+                api_params['min_date_modified'] = min_modified.astimezone(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
+            else:
+                current_app.logger.info(f"INFO INGEST: No high-water mark for '{sync_key}' yet; incremental run falls back to a full fetch.")
+        current_app.logger.info(f"DEBUG INGEST: Fetching orders ({ingest_mode}) with params {api_params} from {orders_list_endpoint}")
 
-        orders_list_from_bc = []
-        if response.text and response.text.strip(): 
-            try:
-                orders_list_from_bc = response.json()
-            except json.JSONDecodeError as json_err:
-                current_app.logger.error(f"ERROR INGEST: Failed to decode JSON from BigCommerce. Error: {json_err}. Response text: {response.text[:500]}", flush=True)
-                return jsonify({"message": "Ingestion failed: Could not parse response from BigCommerce."}), 500
-        else:
-            current_app.logger.info("INFO INGEST: BigCommerce API returned an empty response. No orders to process for this status.", flush=True)
-        
-        if not isinstance(orders_list_from_bc, list):
-            current_app.logger.error(f"ERROR INGEST: Unexpected API response format after JSON parse. Expected list, got {type(orders_list_from_bc)}", flush=True)
-            return jsonify({"message": "Ingestion failed: Unexpected API response format."}), 500
+        try:
+            orders_list_from_bc, fetch_truncated = bigcommerce_client.fetch_all_pages(orders_list_endpoint, bc_headers, params=api_params)
+        except ValueError as json_err:
+            current_app.logger.error(f"ERROR INGEST: Failed to decode JSON from BigCommerce. Error: {json_err}")
+            return jsonify({"message": "Ingestion failed: Could not parse response from BigCommerce."}), 500
+        # A truncated date_modified walk has covered everything up to its last row; a truncated
+        # date_created walk says nothing about the date_modified of the orders it did not reach.
+        covered_through_modified = None
+        if fetch_truncated and api_params['sort'] == 'date_modified:asc' and isinstance(orders_list_from_bc[-1], dict):
+            covered_through_modified = _parse_bc_datetime(orders_list_from_bc[-1].get('date_modified'))
+        # Pages can overlap when orders are modified mid-run; keep the latest copy of each order once.
+        orders_list_from_bc = list({o.get('id'): o for o in orders_list_from_bc if isinstance(o, dict)}.values())
 
         if not orders_list_from_bc:
-            current_app.logger.info(f"INFO INGEST: Successfully ingested 0 orders with BC status ID '{target_status_id}'.", flush=True)
-            return jsonify({"message": f"Successfully ingested 0 orders with BC status ID '{target_status_id}'."}), 200
+            current_app.logger.info(f"INFO INGEST: Successfully ingested 0 orders with BC status ID '{target_status_id}'.")
+            return jsonify({"message": f"Successfully ingested 0 orders with BC status ID '{target_status_id}'.", "mode": ingest_mode}), 200
+
+        run_high_water_mark = max((d for d in (_parse_bc_datetime(o.get('date_modified')) for o in orders_list_from_bc) if d), default=None)
+        if fetch_truncated:
+            # Orders past the page cap were never fetched: the mark must not move past them.
+            if covered_through_modified and run_high_water_mark:
+                run_high_water_mark = min(run_high_water_mark, covered_through_modified - timedelta(seconds=1))
+            else:
+                run_high_water_mark = None
+            current_app.logger.warning(f"WARN INGEST: Order list truncated at the page cap ({ingest_mode} run); high-water mark held at {run_high_water_mark}.")
 
-        ingested_count, inserted_count_this_run, updated_count_this_run = 0, 0, 0
+        # Orders we already hold in a finalized/manual status are never touched by ingest, so
+        # drop them before spending API calls on their sub-resources.
+        bc_ids_in_run = [o.get('id') for o in orders_list_from_bc if o.get('id') is not None]
+        with engine.connect() as conn:
+            existing_orders_by_bc_id = {
+                row.bigcommerce_order_id: row for row in conn.execute(
+                    text("SELECT id, bigcommerce_order_id, status FROM orders WHERE bigcommerce_order_id = ANY(:bc_ids)"),
+                    {"bc_ids": bc_ids_in_run}
+                ).fetchall()
+            }
+        finalized_bc_ids = {bc_id for bc_id, row in existing_orders_by_bc_id.items() if row.status in INGEST_FINALIZED_OR_MANUAL_STATUSES}
+        skipped_finalized_count = len([o for o in orders_list_from_bc if o.get('id') in finalized_bc_ids])
+        orders_list_from_bc = [o for o in orders_list_from_bc if o.get('id') not in finalized_bc_ids]
+        current_app.logger.info(f"DEBUG INGEST: {len(orders_list_from_bc)} orders to process; skipped {skipped_finalized_count} already finalized.")
+
+        # Fetch every order's sub-resources concurrently before opening the DB transaction.
+        subresources_by_bc_id = bigcommerce_client.fetch_order_subresources(
+            [o.get('id') for o in orders_list_from_bc], bc_api_base_url_v2, bc_headers
+        )
+
+        # Parse every order in memory first; the DB phase below is a handful of set-based statements.
+        run_started_utc = datetime.now(timezone.utc)
+        order_rows, products_by_bc_id = [], {}
+        failed_dates_modified = []  # orders that could not be read; the next incremental run must fetch them again
+        for bc_order_summary in orders_list_from_bc:
+            order_id_from_bc = bc_order_summary.get('id')
+            current_app.logger.info(f"--- DEBUG INGEST FOR BC ORDER ID: {order_id_from_bc} ---")
+            bc_billing_address = bc_order_summary.get('billing_address', {})
+            if order_id_from_bc is None:
+                current_app.logger.warn("WARN INGEST: Skipping order summary with missing 'id'.")
+                continue
+
+            shipping_addresses_list, products_list = [], []
+            is_international = False
+            calculated_shipping_method_name = 'N/A'
+            customer_shipping_address = {}
+
+            fetched = subresources_by_bc_id.get(order_id_from_bc)
+            if fetched is None or isinstance(fetched, Exception):
+                current_app.logger.error(f"ERROR INGEST: Could not fetch sub-resources for BC Order {order_id_from_bc}: {fetched}. Skipping this order.")
+                failed_dates_modified.append(_parse_bc_datetime(bc_order_summary.get('date_modified')))
+                continue
+            shipping_addresses_list, products_list = fetched["shipping_addresses"], fetched["products"]
+            if shipping_addresses_list and shipping_addresses_list[0]:
+                customer_shipping_address = shipping_addresses_list[0]
+                shipping_country_code = customer_shipping_address.get('country_iso2')
+                is_international = bool(shipping_country_code and shipping_country_code.upper() != domestic_country_code.upper())
+                calculated_shipping_method_name = customer_shipping_address.get('shipping_method', bc_order_summary.get('shipping_method', 'N/A'))
+            else:
+                current_app.logger.warn(f"WARN INGEST: No valid shipping address found for BC Order {order_id_from_bc}.")
+            
+            raw_customer_message = bc_order_summary.get('customer_message', '').strip()
+            compliance_ids_data = {} 
+            message_for_freight_and_user_notes = raw_customer_message 
+            compliance_block_raw = None
+            compliance_separator_literal = " ||| "
+            match = re.search(r'^(.*?)(?:\s*' + re.escape(compliance_separator_literal) + r'\s*(\[.*?\];))?$', raw_customer_message, re.DOTALL)
+            if match:
+                potential_compliance_block = match.group(2)
+                text_before_compliance_block = match.group(1).strip()
+                if potential_compliance_block and potential_compliance_block.startswith("[") and potential_compliance_block.endswith("];"):
+                    compliance_block_raw = potential_compliance_block
+                    message_for_freight_and_user_notes = text_before_compliance_block
+                else:
+                    message_for_freight_and_user_notes = raw_customer_message
+            if not compliance_block_raw and raw_customer_message.startswith("[") and raw_customer_message.endswith("];"):
+                if re.match(r'^\[([A-Za-z0-9\s\(\)\-\.\/]+:\s*[^;]+;\s*)+\];$', raw_customer_message):
+                    compliance_block_raw = raw_customer_message
+                    message_for_freight_and_user_notes = ""
+            if compliance_block_raw:
+                compliance_content = compliance_block_raw[1:-2]
+                id_pairs = compliance_content.split(';')
+                for pair in id_pairs:
+                    pair = pair.strip() 
+                    if pair and ':' in pair: 
+                        label, value = pair.split(':', 1)
+                        compliance_ids_data[label.strip()] = value.strip()
+            parsed_customer_carrier, parsed_customer_selected_ups_service, parsed_customer_ups_account_num = None, None, None
+            is_bill_to_customer_ups_acct = False
+            parsed_customer_selected_fedex_service, parsed_customer_fedex_account_num = None, None
+            is_bill_to_customer_fedex_acct = False
+            customer_ups_account_zipcode = None
+            customer_notes_for_db = message_for_freight_and_user_notes.strip() 
+            freight_delimiter_pattern = " || " 
+            if freight_delimiter_pattern + "Carrier:" in message_for_freight_and_user_notes and \
+               (freight_delimiter_pattern + "Account#:" in message_for_freight_and_user_notes or "account#:" in message_for_freight_and_user_notes.lower()):
+                freight_parts = message_for_freight_and_user_notes.split(freight_delimiter_pattern)
+                temp_carrier, temp_service, temp_account, temp_zip = None, None, None, None
+                customer_notes_for_db = freight_parts[0].strip()
+                for i in range(1, len(freight_parts)): 
+                    part_content = freight_parts[i]
+                    content_lower = part_content.lower()
+                    if content_lower.startswith("carrier:"): temp_carrier = part_content.split(":", 1)[1].strip()
+                    elif content_lower.startswith("service:"): temp_service = part_content.split(":", 1)[1].strip()
+                    elif content_lower.startswith("account#:"): temp_account = part_content.split(":", 1)[1].strip()
+                    elif content_lower.startswith("zip:"): temp_zip = part_content.split(":",1)[1].strip()
+                if temp_carrier and temp_account:
+                    parsed_customer_carrier = temp_carrier
+                    if "UPS" in temp_carrier.upper():
+                        parsed_customer_selected_ups_service = temp_service
+                        parsed_customer_ups_account_num = temp_account
+                        customer_ups_account_zipcode = temp_zip
+                        is_bill_to_customer_ups_acct = True
+                    elif "FEDEX" in temp_carrier.upper() or "FED EX" in temp_carrier.upper():
+                        parsed_customer_selected_fedex_service = temp_service
+                        parsed_customer_fedex_account_num = temp_account
+                        is_bill_to_customer_fedex_acct = True
+            if customer_notes_for_db: 
+                sensitive_pattern = re.compile(r'\*{10}.*?\*{10}', re.DOTALL)
+                customer_notes_for_db = sensitive_pattern.sub('', customer_notes_for_db).strip()
+            if compliance_ids_data:
+                current_app.logger.info(f"DEBUG INGEST: Parsed Compliance IDs for BC Order {order_id_from_bc}: {compliance_ids_data}", flush=True) # Changed print to logger
+            else:
+                current_app.logger.info(f"DEBUG INGEST: No Compliance IDs parsed for BC Order {order_id_from_bc}. Raw message: '{raw_customer_message}' -> Freight/User Notes part: '{message_for_freight_and_user_notes}'", flush=True) # Changed print to logger
+            db_compliance_info = json.dumps(compliance_ids_data) if compliance_ids_data else None
+
+            bc_total_tax = Decimal(bc_order_summary.get('total_tax', '0.00'))
+            bc_total_inc_tax = Decimal(bc_order_summary.get('total_inc_tax', '0.00'))
+            bc_shipping_cost_from_api = Decimal(bc_order_summary.get('shipping_cost_ex_tax', '0.00'))
+            current_time_utc = datetime.now(timezone.utc)
+            
+            # --- MODIFIED STATUS DETERMINATION LOGIC ---
+            payment_method_for_status = bc_order_summary.get('payment_method', '').lower()
+            current_app.logger.info(f"DEBUG INGEST: Raw Payment Method from BC for order {order_id_from_bc}: '{bc_order_summary.get('payment_method', '')}' -> Lowercase: '{payment_method_for_status}'")
+            
+            if 'bank deposit' in payment_method_for_status or \
+               'wire transfer' in payment_method_for_status or \
+               'bank transfer' in payment_method_for_status: # Add other variations if necessary
+                target_app_status = 'Unpaid/Not Invoiced'
+            else:
+                target_app_status = 'new' # Default for other payment methods
+            current_app.logger.info(f"DEBUG INGEST: Order {order_id_from_bc} - Determined App Status: '{target_app_status}'")
+            # --- END OF MODIFIED STATUS DETERMINATION LOGIC ---
+
+            order_values = {
+                "bigcommerce_order_id": order_id_from_bc,
+                "customer_company": customer_shipping_address.get('company'),
+                "customer_name": f"{customer_shipping_address.get('first_name', '')} {customer_shipping_address.get('last_name', '')}".strip(),
+                "customer_shipping_address_line1": customer_shipping_address.get('street_1'), 
+                "customer_shipping_address_line2": customer_shipping_address.get('street_2'),
+                "customer_shipping_city": customer_shipping_address.get('city'), 
+                "customer_shipping_state": customer_shipping_address.get('state'),
+                "customer_shipping_zip": customer_shipping_address.get('zip'),
+                "customer_shipping_country": customer_shipping_address.get('country'),
+                "customer_shipping_country_iso2": customer_shipping_address.get('country_iso2'),
+                "customer_phone": customer_shipping_address.get('phone'), 
+                "customer_email": bc_billing_address.get('email', customer_shipping_address.get('email')),
+                "customer_shipping_method": calculated_shipping_method_name, 
+                "customer_notes": customer_notes_for_db, 
+                "compliance_info": db_compliance_info, 
+                "order_date": datetime.strptime(bc_order_summary['date_created'], '%a, %d %b %Y %H:%M:%S %z').replace(tzinfo=timezone.utc) if bc_order_summary.get('date_created') else current_time_utc,
+                "total_sale_price": bc_total_inc_tax, 
+                "bigcommerce_order_tax": bc_total_tax, 
+                "bc_shipping_cost_ex_tax": bc_shipping_cost_from_api,
+                "status": target_app_status, # Use the determined status
+                "is_international": is_international, 
+                "payment_method": bc_order_summary.get('payment_method'), # Store the raw payment method
+                "created_at": current_time_utc, "updated_at": current_time_utc,
+                "customer_selected_freight_service": parsed_customer_selected_ups_service, 
+                "customer_ups_account_number": parsed_customer_ups_account_num,
+                "customer_ups_account_zipcode": customer_ups_account_zipcode,
+                "is_bill_to_customer_account": is_bill_to_customer_ups_acct,
+                "customer_selected_fedex_service": parsed_customer_selected_fedex_service, 
+                "customer_fedex_account_number": parsed_customer_fedex_account_num,
+                "is_bill_to_customer_fedex_account": is_bill_to_customer_fedex_acct,
+                "customer_billing_first_name": bc_billing_address.get('first_name'), 
+                "customer_billing_last_name": bc_billing_address.get('last_name'),
+                "customer_billing_company": bc_billing_address.get('company'), 
+                "customer_billing_street_1": bc_billing_address.get('street_1'),
+                "customer_billing_street_2": bc_billing_address.get('street_2'), 
+                "customer_billing_city": bc_billing_address.get('city'),
+                "customer_billing_state": bc_billing_address.get('state'), 
+                "customer_billing_zip": bc_billing_address.get('zip'),
+                "customer_billing_country": bc_billing_address.get('country'), 
+                "customer_billing_country_iso2": bc_billing_address.get('country_iso2'),
+                "customer_billing_phone": bc_billing_address.get('phone')
+            }
+            order_rows.append(order_values)
+            products_by_bc_id[order_id_from_bc] = [item for item in products_list if isinstance(item, dict)]
+
+        if failed_dates_modified and run_high_water_mark:
+            # Keep the mark below the earliest failed order so it stays inside the next run's window.
+            if any(d is None for d in failed_dates_modified):
+                run_high_water_mark = None
+            else:
+                run_high_water_mark = min(run_high_water_mark, min(failed_dates_modified) - timedelta(seconds=1))
+            current_app.logger.warn(f"WARN INGEST: {len(failed_dates_modified)} order(s) failed; high-water mark held at {run_high_water_mark}.")
+
+        ingested_count, inserted_count_this_run, updated_count_this_run = skipped_finalized_count, 0, 0
         with engine.connect() as conn:
             with conn.begin():
-                current_app.logger.info(f"DEBUG INGEST: Processing {len(orders_list_from_bc)} orders from BigCommerce.", flush=True)
-                for bc_order_summary in orders_list_from_bc:
-                    order_id_from_bc = bc_order_summary.get('id')
-                    current_app.logger.info(f"--- DEBUG INGEST FOR BC ORDER ID: {order_id_from_bc} ---", flush=True) # Changed print to logger
-                    bc_billing_address = bc_order_summary.get('billing_address', {})
-                    if order_id_from_bc is None:
-                        current_app.logger.warn("WARN INGEST: Skipping order summary with missing 'id'.", flush=True)
-                        continue
-
-                    shipping_addresses_list, products_list = [], []
-                    is_international = False
-                    calculated_shipping_method_name = 'N/A'
-                    customer_shipping_address = {}
-
-                    try:
-                        shipping_addr_url = f"{bc_api_base_url_v2}orders/{order_id_from_bc}/shippingaddresses"
-                        shipping_res = requests.get(shipping_addr_url, headers=bc_headers)
-                        shipping_res.raise_for_status()
-                        shipping_addresses_list = shipping_res.json()
-                        if shipping_addresses_list and isinstance(shipping_addresses_list, list) and shipping_addresses_list[0]:
-                            customer_shipping_address = shipping_addresses_list[0]
-                            shipping_country_code = customer_shipping_address.get('country_iso2')
-                            is_international = bool(shipping_country_code and shipping_country_code.upper() != domestic_country_code.upper())
-                            calculated_shipping_method_name = customer_shipping_address.get('shipping_method', bc_order_summary.get('shipping_method', 'N/A'))
-                        else:
-                            current_app.logger.warn(f"WARN INGEST: No valid shipping address found for BC Order {order_id_from_bc}.", flush=True)
-
-                        products_url = f"{bc_api_base_url_v2}orders/{order_id_from_bc}/products"
-                        products_res = requests.get(products_url, headers=bc_headers)
-                        products_res.raise_for_status()
-                        products_list = products_res.json()
-                        if not isinstance(products_list, list):
-                            current_app.logger.warn(f"WARN INGEST: Products list for BC Order {order_id_from_bc} is not a list. Treating as empty.", flush=True)
-                            products_list = []
-                    except requests.exceptions.RequestException as sub_req_e:
-                        current_app.logger.error(f"ERROR INGEST: Could not fetch sub-resources for BC Order {order_id_from_bc}: {sub_req_e}. Skipping this order.", flush=True)
-                        continue
-                    
-                    raw_customer_message = bc_order_summary.get('customer_message', '').strip()
-                    compliance_ids_data = {} 
-                    message_for_freight_and_user_notes = raw_customer_message 
-                    compliance_block_raw = None
-                    compliance_separator_literal = " ||| "
-                    match = re.search(r'^(.*?)(?:\s*' + re.escape(compliance_separator_literal) + r'\s*(\[.*?\];))?$', raw_customer_message, re.DOTALL)
-                    if match:
-                        potential_compliance_block = match.group(2)
-                        text_before_compliance_block = match.group(1).strip()
-                        if potential_compliance_block and potential_compliance_block.startswith("[") and potential_compliance_block.endswith("];"):
-                            compliance_block_raw = potential_compliance_block
-                            message_for_freight_and_user_notes = text_before_compliance_block
+                current_app.logger.info(f"DEBUG INGEST: Upserting {len(order_rows)} orders ({len([r for r in order_rows if r['bigcommerce_order_id'] in existing_orders_by_bc_id])} already known).")
+                inserted_order_ids_by_bc_id = {}
+                for chunk_start in range(0, len(order_rows), INGEST_UPSERT_CHUNK_SIZE):
+                    for row in conn.execute(_build_orders_upsert_stmt(order_rows[chunk_start:chunk_start + INGEST_UPSERT_CHUNK_SIZE])).fetchall():
+                        if row.inserted:
+                            inserted_order_ids_by_bc_id[row.bigcommerce_order_id] = row.id
+                            inserted_count_this_run += 1
                         else:
-                            message_for_freight_and_user_notes = raw_customer_message
-                    if not compliance_block_raw and raw_customer_message.startswith("[") and raw_customer_message.endswith("];"):
-                        if re.match(r'^\[([A-Za-z0-9\s\(\)\-\.\/]+:\s*[^;]+;\s*)+\];$', raw_customer_message):
-                            compliance_block_raw = raw_customer_message
-                            message_for_freight_and_user_notes = ""
-                    if compliance_block_raw:
-                        compliance_content = compliance_block_raw[1:-2]
-                        id_pairs = compliance_content.split(';')
-                        for pair in id_pairs:
-                            pair = pair.strip() 
-                            if pair and ':' in pair: 
-                                label, value = pair.split(':', 1)
-                                compliance_ids_data[label.strip()] = value.strip()
-                    parsed_customer_carrier, parsed_customer_selected_ups_service, parsed_customer_ups_account_num = None, None, None
-                    is_bill_to_customer_ups_acct = False
-                    parsed_customer_selected_fedex_service, parsed_customer_fedex_account_num = None, None
-                    is_bill_to_customer_fedex_acct = False
-                    customer_ups_account_zipcode = None
-                    customer_notes_for_db = message_for_freight_and_user_notes.strip() 
-                    freight_delimiter_pattern = " || " 
-                    if freight_delimiter_pattern + "Carrier:" in message_for_freight_and_user_notes and \
-                       (freight_delimiter_pattern + "Account#:" in message_for_freight_and_user_notes or "account#:" in message_for_freight_and_user_notes.lower()):
-                        freight_parts = message_for_freight_and_user_notes.split(freight_delimiter_pattern)
-                        temp_carrier, temp_service, temp_account, temp_zip = None, None, None, None
-                        customer_notes_for_db = freight_parts[0].strip()
-                        for i in range(1, len(freight_parts)): 
-                            part_content = freight_parts[i]
-                            content_lower = part_content.lower()
-                            if content_lower.startswith("carrier:"): temp_carrier = part_content.split(":", 1)[1].strip()
-                            elif content_lower.startswith("service:"): temp_service = part_content.split(":", 1)[1].strip()
-                            elif content_lower.startswith("account#:"): temp_account = part_content.split(":", 1)[1].strip()
-                            elif content_lower.startswith("zip:"): temp_zip = part_content.split(":",1)[1].strip()
-                        if temp_carrier and temp_account:
-                            parsed_customer_carrier = temp_carrier
-                            if "UPS" in temp_carrier.upper():
-                                parsed_customer_selected_ups_service = temp_service
-                                parsed_customer_ups_account_num = temp_account
-                                customer_ups_account_zipcode = temp_zip
-                                is_bill_to_customer_ups_acct = True
-                            elif "FEDEX" in temp_carrier.upper() or "FED EX" in temp_carrier.upper():
-                                parsed_customer_selected_fedex_service = temp_service
-                                parsed_customer_fedex_account_num = temp_account
-                                is_bill_to_customer_fedex_acct = True
-                    if customer_notes_for_db: 
-                        sensitive_pattern = re.compile(r'\*{10}.*?\*{10}', re.DOTALL)
-                        customer_notes_for_db = sensitive_pattern.sub('', customer_notes_for_db).strip()
-                    if compliance_ids_data:
-                        current_app.logger.info(f"DEBUG INGEST: Parsed Compliance IDs for BC Order {order_id_from_bc}: {compliance_ids_data}", flush=True) # Changed print to logger
-                    else:
-                        current_app.logger.info(f"DEBUG INGEST: No Compliance IDs parsed for BC Order {order_id_from_bc}. Raw message: '{raw_customer_message}' -> Freight/User Notes part: '{message_for_freight_and_user_notes}'", flush=True) # Changed print to logger
-                    db_compliance_info = json.dumps(compliance_ids_data) if compliance_ids_data else None
-
-                    existing_order_row = conn.execute(
-                        text("""SELECT id, status, is_international, payment_method,
-                                      bigcommerce_order_tax, customer_notes, compliance_info,
-                                      customer_selected_freight_service, customer_ups_account_number, customer_ups_account_zipcode,
-                                      is_bill_to_customer_account,
-                                      customer_selected_fedex_service, customer_fedex_account_number,
-                                      is_bill_to_customer_fedex_account,
-                                      bc_shipping_cost_ex_tax,
-                                      customer_billing_first_name, customer_billing_last_name, customer_billing_company,
-                                      customer_billing_street_1, customer_billing_street_2, customer_billing_city,
-                                      customer_billing_state, customer_billing_zip, customer_billing_country,
-                                      customer_billing_country_iso2, customer_billing_phone
-                              FROM orders WHERE bigcommerce_order_id = :bc_order_id"""),
-                        {"bc_order_id": order_id_from_bc}
-                    ).fetchone()
-
-                    bc_total_tax = Decimal(bc_order_summary.get('total_tax', '0.00'))
-                    bc_total_inc_tax = Decimal(bc_order_summary.get('total_inc_tax', '0.00'))
-                    bc_shipping_cost_from_api = Decimal(bc_order_summary.get('shipping_cost_ex_tax', '0.00'))
-                    current_time_utc = datetime.now(timezone.utc)
-                    
-                    # --- MODIFIED STATUS DETERMINATION LOGIC ---
-                    payment_method_for_status = bc_order_summary.get('payment_method', '').lower()
-                    current_app.logger.info(f"DEBUG INGEST: Raw Payment Method from BC for order {order_id_from_bc}: '{bc_order_summary.get('payment_method', '')}' -> Lowercase: '{payment_method_for_status}'")
-                    
-                    if 'bank deposit' in payment_method_for_status or \
-                       'wire transfer' in payment_method_for_status or \
-                       'bank transfer' in payment_method_for_status: # Add other variations if necessary
-                        target_app_status = 'Unpaid/Not Invoiced'
-                    else:
-                        target_app_status = 'new' # Default for other payment methods
-                    current_app.logger.info(f"DEBUG INGEST: Order {order_id_from_bc} - Determined App Status: '{target_app_status}'")
-                    # --- END OF MODIFIED STATUS DETERMINATION LOGIC ---
-
-                    if existing_order_row:
-                        db_status = existing_order_row.status
-                        # Add 'Unpaid/Invoiced' to prevent reverting it if it was already processed to that stage
-                        finalized_or_manual_statuses = ['Processed', 'Completed Offline', 'pending', 'RFQ Sent', 'Unpaid/Invoiced']
-                        if db_status in finalized_or_manual_statuses:
-                            ingested_count += 1
-                            current_app.logger.info(f"DEBUG INGEST: Order {order_id_from_bc} (DB ID: {existing_order_row.id}) already in status '{db_status}'. Skipping further processing for this order by ingest_orders.", flush=True)
-                            continue
-                        
-                        update_fields = {}
-                        # ... (Your existing logic for comparing and adding fields to update_fields) ...
-                        if existing_order_row.is_international != is_international: update_fields['is_international'] = is_international
-                        if existing_order_row.payment_method != bc_order_summary.get('payment_method'): update_fields['payment_method'] = bc_order_summary.get('payment_method')
-                        # ... (ensure all relevant fields are compared and added to update_fields if changed)
-                        
-                        # Always update 'status' if it's different from the newly determined target_app_status
-                        # and the current DB status is not one of the finalized/manual ones.
-                        if db_status != target_app_status: # No need to check finalized_or_manual_statuses here again as we `continue` above
-                            update_fields['status'] = target_app_status
-                        
-                        if update_fields:
-                            update_fields['updated_at'] = current_time_utc
-                            set_clauses = [f"{key} = :{key}" for key in update_fields.keys()]
-                            conn.execute(text(f"UPDATE orders SET {', '.join(set_clauses)} WHERE id = :id"), {"id": existing_order_row.id, **update_fields})
                             updated_count_this_run += 1
-                            current_app.logger.info(f"DEBUG INGEST: Updated existing order {order_id_from_bc} (DB ID: {existing_order_row.id}). Fields updated: {list(update_fields.keys())}", flush=True)
-                        else:
-                            current_app.logger.info(f"DEBUG INGEST: No updates needed for existing order {order_id_from_bc} (DB ID: {existing_order_row.id}) which is not in a finalized status.", flush=True)
-
-                    else: 
-                        order_values = {
-                            "bigcommerce_order_id": order_id_from_bc,
-                            "customer_company": customer_shipping_address.get('company'),
-                            "customer_name": f"{customer_shipping_address.get('first_name', '')} {customer_shipping_address.get('last_name', '')}".strip(),
-                            "customer_shipping_address_line1": customer_shipping_address.get('street_1'), 
-                            "customer_shipping_address_line2": customer_shipping_address.get('street_2'),
-                            "customer_shipping_city": customer_shipping_address.get('city'), 
-                            "customer_shipping_state": customer_shipping_address.get('state'),
-                            "customer_shipping_zip": customer_shipping_address.get('zip'),
-                            "customer_shipping_country": customer_shipping_address.get('country'),
-                            "customer_shipping_country_iso2": customer_shipping_address.get('country_iso2'),
-                            "customer_phone": customer_shipping_address.get('phone'), 
-                            "customer_email": bc_billing_address.get('email', customer_shipping_address.get('email')),
-                            "customer_shipping_method": calculated_shipping_method_name, 
-                            "customer_notes": customer_notes_for_db, 
-                            "compliance_info": db_compliance_info, 
-                            "order_date": datetime.strptime(bc_order_summary['date_created'], '%a, %d %b %Y %H:%M:%S %z').replace(tzinfo=timezone.utc) if bc_order_summary.get('date_created') else current_time_utc,
-                            "total_sale_price": bc_total_inc_tax, 
-                            "bigcommerce_order_tax": bc_total_tax, 
-                            "bc_shipping_cost_ex_tax": bc_shipping_cost_from_api,
-                            "status": target_app_status, # Use the determined status
-                            "is_international": is_international, 
-                            "payment_method": bc_order_summary.get('payment_method'), # Store the raw payment method
-                            "created_at": current_time_utc, "updated_at": current_time_utc,
-                            "customer_selected_freight_service": parsed_customer_selected_ups_service, 
-                            "customer_ups_account_number": parsed_customer_ups_account_num,
-                            "customer_ups_account_zipcode": customer_ups_account_zipcode,
-                            "is_bill_to_customer_account": is_bill_to_customer_ups_acct,
-                            "customer_selected_fedex_service": parsed_customer_selected_fedex_service, 
-                            "customer_fedex_account_number": parsed_customer_fedex_account_num,
-                            "is_bill_to_customer_fedex_account": is_bill_to_customer_fedex_acct,
-                            "customer_billing_first_name": bc_billing_address.get('first_name'), 
-                            "customer_billing_last_name": bc_billing_address.get('last_name'),
-                            "customer_billing_company": bc_billing_address.get('company'), 
-                            "customer_billing_street_1": bc_billing_address.get('street_1'),
-                            "customer_billing_street_2": bc_billing_address.get('street_2'), 
-                            "customer_billing_city": bc_billing_address.get('city'),
-                            "customer_billing_state": bc_billing_address.get('state'), 
-                            "customer_billing_zip": bc_billing_address.get('zip'),
-                            "customer_billing_country": bc_billing_address.get('country'), 
-                            "customer_billing_country_iso2": bc_billing_address.get('country_iso2'),
-                            "customer_billing_phone": bc_billing_address.get('phone')
-                        }
-                        
-                        order_columns = list(order_values.keys())
-                        order_placeholders = [f":{col}" for col in order_columns]
-                        insert_sql_str = f"INSERT INTO orders ({', '.join(order_columns)}) VALUES ({', '.join(order_placeholders)}) RETURNING id"
-                        insert_sql = text(insert_sql_str)
-                        inserted_order_id = conn.execute(insert_sql, order_values).scalar_one()
-                        inserted_count_this_run += 1
-                        current_app.logger.info(f"DEBUG INGEST: Inserted new order {order_id_from_bc} with DB ID {inserted_order_id} and status '{target_app_status}'.", flush=True)
-
-
-                        if products_list:
-                            for item in products_list:
-                                if not isinstance(item, dict): continue
-                                li_values = {"order_id": inserted_order_id, "bigcommerce_line_item_id": item.get('id'), "sku": item.get('sku'), "name": item.get('name'), "quantity": item.get('quantity'), "sale_price": Decimal(item.get('price_ex_tax', '0.00')), "created_at": current_time_utc, "updated_at": current_time_utc}
-                                li_cols_list = list(li_values.keys())
-                                li_placeholders = [f":{col}" for col in li_cols_list]
-                                conn.execute(text(f"INSERT INTO order_line_items ({', '.join(li_cols_list)}) VALUES ({', '.join(li_placeholders)})"), li_values)
-                    ingested_count += 1
+                ingested_count += len(order_rows)
+
+                # Line items are only written for orders created in this run, as before.
+                line_item_rows = [
+                    {"order_id": db_order_id, "bigcommerce_line_item_id": item.get('id'), "sku": item.get('sku'), "name": item.get('name'),
+                     "quantity": item.get('quantity'), "sale_price": Decimal(item.get('price_ex_tax', '0.00')),
+                     "created_at": run_started_utc, "updated_at": run_started_utc}
+                    for bc_id, db_order_id in inserted_order_ids_by_bc_id.items()
+                    for item in products_by_bc_id.get(bc_id, [])
+                ]
+                if line_item_rows:
+                    conn.execute(INSERT_ORDER_LINE_ITEM_SQL, line_item_rows)
+                current_app.logger.info(f"DEBUG INGEST: Inserted {inserted_count_this_run} orders with {len(line_item_rows)} line items; updated {updated_count_this_run}.")
+
+                if run_high_water_mark:
+                    conn.execute(text("""
+                        INSERT INTO bc_sync_state (sync_key, last_date_modified, last_run_at, last_run_order_count, updated_at)
+                        VALUES (:sync_key, :hwm, NOW(), :order_count, NOW())
+                        ON CONFLICT (sync_key) DO UPDATE SET
+                            last_date_modified = GREATEST(bc_sync_state.last_date_modified, EXCLUDED.last_date_modified),
+                            last_run_at = EXCLUDED.last_run_at, last_run_order_count = EXCLUDED.last_run_order_count, updated_at = NOW()
+                    """), {"sync_key": sync_key, "hwm": run_high_water_mark, "order_count": ingested_count})
         current_app.logger.info(f"INFO INGEST: Processed {ingested_count} orders. Inserted: {inserted_count_this_run}, Updated: {updated_count_this_run}.", flush=True)
-        return jsonify({"message": f"Processed {ingested_count} orders. Inserted {inserted_count_this_run} new. Updated {updated_count_this_run}."}), 200
+        return jsonify({
+            "message": f"Processed {ingested_count} orders. Inserted {inserted_count_this_run} new. Updated {updated_count_this_run}.",
+            "mode": ingest_mode, "skipped_finalized": skipped_finalized_count, "failed": len(failed_dates_modified),
+            "truncated": fetch_truncated
+        }), 200
     except requests.exceptions.RequestException as req_e:
         error_msg = f"BC API Request failed: {req_e}"
         status_code, resp_preview = (req_e.response.status_code, req_e.response.text[:500]) if req_e.response is not None else ('N/A', 'N/A')
@@ -492,11 +663,485 @@ def ingest_orders_route():
         return jsonify({"message": f"Unexpected error: {str(e)}", "error_type": type(e).__name__}), 500
     
 
+# --- Outbox job handlers for process_order_route side effects (run by the outbox worker) ---
+
+def _load_outbox_attachments(attachments):
+    """
+    Postmark attachments for an outbox payload. Documents already uploaded to GCS are stored in the
+    payload by gs:// path and downloaded here; inline ones (GCS unavailable) carry their base64 Content.
+    """
+    stored = [attachment for attachment in attachments if attachment.get('gcs_uri')]
+    contents = gcs_service.download_files_parallel([attachment['gcs_uri'] for attachment in stored])
+    missing = [attachment['gcs_uri'] for attachment, content in zip(stored, contents) if not content]
+    if missing:
+        raise RuntimeError(f"Could not download attachment(s) from GCS: {', '.join(missing)}")
+    contents_by_uri = {attachment['gcs_uri']: content for attachment, content in zip(stored, contents)}
+    return [_pdf_attachment(attachment['Name'], contents_by_uri[attachment['gcs_uri']]) if attachment.get('gcs_uri') else attachment
+            for attachment in attachments]
+
+@outbox.job_handler('email_supplier_po')
+def _outbox_send_supplier_po_email(payload):
+    if not email_service: raise RuntimeError("email_service is not available.")
+    po_id = payload.get('purchase_order_id')
+    with engine.connect() as conn:
+        current_po_status = conn.execute(text("SELECT status FROM purchase_orders WHERE id = :id"), {"id": po_id}).scalar_one_or_none()
+    if current_po_status == 'SENT_TO_SUPPLIER':
+        print(f"INFO OUTBOX PO_EMAIL: PO {payload.get('po_number')} already marked SENT_TO_SUPPLIER. Skipping resend.")
+        return True
+    if not email_service.send_po_email(supplier_email=payload['supplier_email'], po_number=payload['po_number'],
+                                       attachments=_load_outbox_attachments(payload['attachments']),
+                                       is_blind_drop_ship=payload.get('is_blind_drop_ship', False)):
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE purchase_orders SET status = 'SENT_TO_SUPPLIER', updated_at = NOW() WHERE id = :po_id"), {"po_id": po_id})
+    return True
+
+@outbox.job_handler('email_sales_notification')
+def _outbox_send_sales_notification_email(payload):
+    if not email_service or not hasattr(email_service, 'send_sales_notification_email'):
+        raise RuntimeError("email_service.send_sales_notification_email is not available.")
+    return email_service.send_sales_notification_email(recipient_email=payload['recipient_email'], subject=payload['subject'],
+                                                       html_body=payload['html_body'], text_body=payload['text_body'],
+                                                       attachments=_load_outbox_attachments(payload['attachments']))
+
+@outbox.job_handler('bc_create_shipment')
+def _outbox_create_bigcommerce_shipment(payload):
+    if not shipping_service: raise RuntimeError("shipping_service is not available.")
+    bc_order_id, tracking_number = payload['bigcommerce_order_id'], str(payload['tracking_number'])
+    # The POST is not idempotent: an earlier attempt may have created the shipment before its response was lost.
+    existing_shipments = shipping_service.get_bigcommerce_shipments(bc_order_id)
+    if existing_shipments is None:
+        return False
+    if any(str(shipment.get('tracking_number') or '') == tracking_number for shipment in existing_shipments):
+        print(f"INFO OUTBOX BC_SHIPMENT: Order {bc_order_id} already has a shipment with tracking {tracking_number}. Skipping.")
+        return True
+    bc_address_id = _get_bc_shipping_address_id(bc_order_id)
+    if bc_address_id is None:
+        raise RuntimeError(f"No BigCommerce shipping address id for order {bc_order_id}.")
+    try:
+        return shipping_service.create_bigcommerce_shipment(
+            bigcommerce_order_id=bc_order_id, tracking_number=tracking_number,
+            shipping_method_name=payload['shipping_method_name'], line_items_in_shipment=payload['line_items'],
+            order_address_id=bc_address_id, shipping_provider=payload.get('shipping_provider'), raise_on_rejection=True)
+    except shipping_service.BigCommerceRequestRejected as e:
+        raise outbox.PermanentJobError(str(e))
+
+@outbox.job_handler('bc_set_order_status')
+def _outbox_set_bigcommerce_order_status(payload):
+    if not shipping_service: raise RuntimeError("shipping_service is not available.")
+    return shipping_service.set_bigcommerce_order_status(bigcommerce_order_id=payload['bigcommerce_order_id'], status_id=int(payload['status_id']))
+
+
+def _gcs_available():
+    return bool(GCS_BUCKET_NAME and gcs_service.get_storage_client())
+
+def _upload_pdfs_and_sign(pdfs):
+    """Uploads [(blob_name, pdf_bytes)] to GCS in parallel. Returns [(gs:// path, 60-minute signed URL or None)] in order."""
+    results = gcs_service.upload_files_parallel([(pdf_bytes, blob_name, 'application/pdf') for blob_name, pdf_bytes in pdfs], sign_urls=True)
+    failed = [r for r in results if r["error"]]
+    if failed:
+        raise RuntimeError(f"GCS upload failed for {failed[0]['blob_name']}: {failed[0]['error']}")
+    return [(r["gs_uri"], r["signed_url"]) for r in results]
+
+def _render_packing_slip_pdf(**kwargs):
+    """generate_packing_slip_pdf via pdf_artifact_cache, so re-processing an unchanged order reuses the slip."""
+    # The slip prints today's date, so the day is part of the key.
+    cache_inputs = dict(kwargs, slip_date=datetime.now(timezone.utc).strftime("%m/%d/%Y"))
+    pdf_bytes, _ = pdf_artifact_cache.get_or_render("packing_slip", cache_inputs, lambda: pdf_render_pool.generate_packing_slip_pdf(**kwargs))
+    return pdf_bytes
+
+def _pdf_attachment(name, pdf_bytes):
+    return {"Name": name, "Content": base64.b64encode(pdf_bytes).decode('utf-8'), "ContentType": "application/pdf"}
+
+def _outbox_attachment(name, gcs_uri, pdf_bytes):
+    """Attachment for an outbox payload: a reference to the uploaded copy, or the content itself if it was not uploaded."""
+    if gcs_uri:
+        return {"Name": name, "gcs_uri": gcs_uri, "ContentType": "application/pdf"}
+    return _pdf_attachment(name, pdf_bytes)
+
+def _packing_slip_item(order_line_item, hpe_mappings_by_sku, quantity):
+    ps_sku, ps_desc = order_line_item.get('original_sku', 'N/A'), order_line_item.get('line_item_name', 'N/A')
+    hpe_mapping = hpe_mappings_by_sku.get(order_line_item.get('original_sku'), {})
+    if hpe_mapping.get('option_pn'):
+        ps_sku = hpe_mapping['option_pn']
+        if hpe_mapping.get('po_description'): ps_desc = hpe_mapping['po_description']
+    return {'sku': ps_sku, 'name': ps_desc, 'quantity': quantity}
+
+def _label_ship_from_is_complete(ship_from_address):
+    return all([ship_from_address.get('street_1'), ship_from_address.get('city'), ship_from_address.get('state'),
+                ship_from_address.get('zip'), ship_from_address.get('country'), ship_from_address.get('phone')])
+
+def _generate_label_for_assignment(ctx, weight_lbs):
+    """Calls UPS or FedEx for one assignment. Returns (label_pdf_bytes, tracking_number)."""
+    if ctx['carrier'] == 'fedex':
+        return shipping_service.generate_fedex_label(
+            order_data=ctx['order_data_for_label'], ship_from_address=ctx['ship_from_address'],
+            total_weight_lbs=weight_lbs, customer_shipping_method_name=ctx['method_for_label_generation'])
+    return shipping_service.generate_ups_label(
+        order_data=ctx['order_data_for_label'], ship_from_address=ctx['ship_from_address'],
+        total_weight_lbs=weight_lbs, customer_shipping_method_name=ctx['method_for_label_generation'],
+        is_bill_to_customer_ups_account=ctx['is_bill_to_customer_ups'],
+        customer_ups_account_number=ctx['customer_ups_account'],
+        customer_ups_account_zipcode=ctx['effective_ups_third_party_zip'])
+
+def _build_assignment_context(assignment_data, order_id, order_data_dict_original, local_order_line_items_list):
+    """Per-assignment carrier, billing, ship-from and shipping-method decisions (pure, no I/O)."""
+    supplier_id_from_payload = assignment_data.get('supplier_id')
+    shipment_method_from_processing_form = assignment_data.get('shipment_method')
+    po_line_items_input = assignment_data.get('po_line_items', [])
+    carrier_from_payload = assignment_data.get('carrier', 'ups').lower()
+    is_bill_to_customer_fedex_from_payload = assignment_data.get('is_bill_to_customer_fedex_account', False)
+    customer_fedex_account_from_payload = assignment_data.get('customer_fedex_account_number')
+    is_bill_to_customer_ups_from_payload = assignment_data.get('is_bill_to_customer_ups_account', False)
+    customer_ups_account_from_payload = assignment_data.get('customer_ups_account_number')
+    is_blind_drop_ship_from_payload = assignment_data.get('is_blind_drop_ship', False)
+
+    order_data_for_label = order_data_dict_original.copy()
+    if carrier_from_payload == 'fedex':
+        order_data_for_label['is_bill_to_customer_fedex_account'] = is_bill_to_customer_fedex_from_payload
+        order_data_for_label['customer_fedex_account_number'] = customer_fedex_account_from_payload
+        order_data_for_label['is_bill_to_customer_account'] = False
+        order_data_for_label['customer_ups_account_number'] = None
+    elif carrier_from_payload == 'ups':
+        order_data_for_label['is_bill_to_customer_account'] = is_bill_to_customer_ups_from_payload
+        order_data_for_label['customer_ups_account_number'] = customer_ups_account_from_payload
+        order_data_for_label['is_bill_to_customer_fedex_account'] = False
+        order_data_for_label['customer_fedex_account_number'] = None
+
+    effective_ups_third_party_zip = None
+    if carrier_from_payload == 'ups' and is_bill_to_customer_ups_from_payload:
+        customer_ups_account_zipcode_from_db = order_data_dict_original.get('customer_ups_account_zipcode')
+        customer_billing_zip_from_db = order_data_dict_original.get('customer_billing_zip')
+        if customer_ups_account_zipcode_from_db and str(customer_ups_account_zipcode_from_db).strip() and str(customer_ups_account_zipcode_from_db).strip().lower() != 'none':
+            effective_ups_third_party_zip = str(customer_ups_account_zipcode_from_db).strip()
+        elif customer_billing_zip_from_db and str(customer_billing_zip_from_db).strip():
+            effective_ups_third_party_zip = str(customer_billing_zip_from_db).strip()
+            print(f"DEBUG PROCESS_ORDER: Using customer_billing_zip ('{effective_ups_third_party_zip}') for UPS 3rd party as customer_ups_account_zipcode was not set or invalid.", flush=True)
+        else:
+            print(f"WARN PROCESS_ORDER: Neither customer_ups_account_zipcode nor customer_billing_zip is valid for UPS 3rd party billing. Label generation may fail or default to BillShipper.", flush=True)
+        order_data_for_label['customer_ups_account_zipcode'] = effective_ups_third_party_zip
+
+    effective_logo_gcs_uri = COMPANY_LOGO_GCS_URI
+    packing_slip_custom_ship_from = None
+    if is_blind_drop_ship_from_payload:
+        print(f"DEBUG PROCESS_ORDER: Blind drop ship for order {order_id}, assignment to supplier/mode {supplier_id_from_payload}. Using customer billing address as ship-from.", flush=True)
+        current_ship_from_address = {
+            'name': order_data_dict_original.get('customer_billing_company') or f"{order_data_dict_original.get('customer_billing_first_name', '')} {order_data_dict_original.get('customer_billing_last_name', '')}".strip(),
+            'contact_person': f"{order_data_dict_original.get('customer_billing_first_name', '')} {order_data_dict_original.get('customer_billing_last_name', '')}".strip(),
+            'street_1': order_data_dict_original.get('customer_billing_street_1'),
+            'street_2': order_data_dict_original.get('customer_billing_street_2', ''),
+            'city': order_data_dict_original.get('customer_billing_city'),
+            'state': order_data_dict_original.get('customer_billing_state'),
+            'zip': order_data_dict_original.get('customer_billing_zip'),
+            'country': order_data_dict_original.get('customer_billing_country_iso2', 'US'),
+            'phone': order_data_dict_original.get('customer_billing_phone')
+        }
+        if not all(val for key, val in current_ship_from_address.items() if key not in ['street_2', 'contact_person']):
+            raise ValueError("Blind drop ship selected, but customer billing address (used as ship-from) is incomplete. Required: name/company, street1, city, state, zip, country, phone.")
+        effective_logo_gcs_uri = None
+        packing_slip_custom_ship_from = current_ship_from_address
+    else:
+        current_ship_from_address = {
+            'name': SHIP_FROM_NAME, 'contact_person': SHIP_FROM_CONTACT,
+            'street_1': SHIP_FROM_STREET1, 'street_2': SHIP_FROM_STREET2,
+            'city': SHIP_FROM_CITY, 'state': SHIP_FROM_STATE,
+            'zip': SHIP_FROM_ZIP, 'country': SHIP_FROM_COUNTRY, 'phone': SHIP_FROM_PHONE
+        }
+
+    method_for_label_generation = shipment_method_from_processing_form
+    if carrier_from_payload == 'ups' and is_bill_to_customer_ups_from_payload and order_data_dict_original.get('customer_selected_freight_service'):
+        method_for_label_generation = order_data_dict_original.get('customer_selected_freight_service')
+    elif carrier_from_payload == 'fedex' and is_bill_to_customer_fedex_from_payload and order_data_dict_original.get('customer_selected_fedex_service'):
+        method_for_label_generation = order_data_dict_original.get('customer_selected_fedex_service')
+    elif not shipment_method_from_processing_form and (local_order_line_items_list or supplier_id_from_payload == G1_ONSITE_FULFILLMENT_IDENTIFIER):
+        method_for_label_generation = order_data_dict_original.get('customer_shipping_method', 'UPS Ground')
+    elif not (local_order_line_items_list or (supplier_id_from_payload == G1_ONSITE_FULFILLMENT_IDENTIFIER and po_line_items_input)):
+        method_for_label_generation = None
+
+    return {
+        "supplier_id": supplier_id_from_payload,
+        "total_shipment_weight_lbs_str": assignment_data.get('total_shipment_weight_lbs'),
+        "payment_instructions": assignment_data.get('payment_instructions', ""),
+        "po_line_items_input": po_line_items_input,
+        "carrier": carrier_from_payload,
+        "is_bill_to_customer_ups": is_bill_to_customer_ups_from_payload,
+        "customer_ups_account": customer_ups_account_from_payload,
+        "is_blind_drop_ship": is_blind_drop_ship_from_payload,
+        "order_data_for_label": order_data_for_label,
+        "effective_ups_third_party_zip": effective_ups_third_party_zip,
+        "ship_from_address": current_ship_from_address,
+        "logo_gcs_uri": effective_logo_gcs_uri,
+        "packing_slip_custom_ship_from": packing_slip_custom_ship_from,
+        "method_for_label_generation": method_for_label_generation,
+    }
+
+def _prepare_g1_onsite_assignment(ctx, order_id, local_order_line_items_list, hpe_mappings_by_sku, current_utc_datetime):
+    """
+    Renders the G1 packing slip, buys the label and uploads both. No DB access: returns the rows
+    and outbox jobs for the write phase plus the response entry.
+    """
+    order_data_for_label = ctx['order_data_for_label']
+    bc_order_id = order_data_for_label.get('bigcommerce_order_id')
+    total_shipment_weight_lbs_str = ctx['total_shipment_weight_lbs_str']
+    method_for_label_generation = ctx['method_for_label_generation']
+    is_blind = ctx['is_blind_drop_ship']
+    carrier = ctx['carrier']
+    result = {"kind": "g1_onsite", "shipment_row": None, "jobs": [], "processed_line_item_ids": set()}
+
+    g1_ps_blob_name_for_db, g1_label_blob_name_for_db, g1_ps_signed_url, g1_label_signed_url = None, None, None, None
+    g1_tracking_number, generated_label_pdf_bytes, g1_packing_slip_pdf_bytes = None, None, None
+    if not local_order_line_items_list:
+        print(f"DEBUG PROCESS_ORDER (G1 Onsite): No line items for order {order_id}. Skipping PS/Label.", flush=True)
+    else:
+        if not total_shipment_weight_lbs_str or not method_for_label_generation:
+            if is_blind:
+                raise ValueError("Blind Drop Ship (G1): Shipment method and weight are required when items exist.")
+            raise ValueError("Shipment method and weight are required for G1 Onsite Fulfillment with items.")
+        try:
+            current_g1_weight = float(total_shipment_weight_lbs_str)
+            if current_g1_weight <= 0: raise ValueError("Shipment weight must be positive for G1 Onsite Fulfillment.")
+        except ValueError:
+            raise ValueError("Invalid shipment weight format for G1 Onsite Fulfillment.")
+
+        items_for_g1_packing_slip = []
+        for item_detail in local_order_line_items_list:
+            items_for_g1_packing_slip.append(_packing_slip_item(item_detail, hpe_mappings_by_sku, item_detail.get('quantity')))
+            result["processed_line_item_ids"].add(item_detail['line_item_id'])
+
+        ts_suffix = current_utc_datetime.strftime("%Y%m%d%H%M%S")
+        gcs_available = _gcs_available()
+        if document_generator and items_for_g1_packing_slip:
+            g1_packing_slip_pdf_bytes = _render_packing_slip_pdf(
+                order_data=order_data_for_label, items_in_this_shipment=items_for_g1_packing_slip,
+                items_shipping_separately=[], logo_gcs_uri=ctx['logo_gcs_uri'], is_g1_onsite_fulfillment=True,
+                is_blind_slip=is_blind, custom_ship_from_address=ctx['packing_slip_custom_ship_from'])
+            if g1_packing_slip_pdf_bytes and gcs_available:
+                g1_ps_blob_name = f"processed_orders/order_{bc_order_id}_G1Onsite/ps_g1_{'blind_' if is_blind else ''}{ts_suffix}.pdf"
+                g1_ps_blob_name_for_db, g1_ps_signed_url = _upload_pdfs_and_sign([(g1_ps_blob_name, g1_packing_slip_pdf_bytes)])[0]
+
+        if shipping_service and total_shipment_weight_lbs_str and method_for_label_generation:
+            if _label_ship_from_is_complete(ctx['ship_from_address']):
+                try:
+                    generated_label_pdf_bytes, g1_tracking_number = _generate_label_for_assignment(ctx, float(total_shipment_weight_lbs_str))
+                    if generated_label_pdf_bytes and g1_tracking_number and gcs_available:
+                        g1_label_blob_name = f"processed_orders/order_{bc_order_id}_G1Onsite/label_{carrier.upper()}_{g1_tracking_number}_{ts_suffix}.pdf"
+                        g1_label_blob_name_for_db, g1_label_signed_url = _upload_pdfs_and_sign([(g1_label_blob_name, generated_label_pdf_bytes)])[0]
+                        result["shipment_row"] = {"order_id": order_id, "po_id": None, "track_num": g1_tracking_number, "method": method_for_label_generation,
+                                                  "weight": float(total_shipment_weight_lbs_str), "label_path": g1_label_blob_name_for_db,
+                                                  "ps_path": g1_ps_blob_name_for_db, "now": current_utc_datetime}
+                except Exception as label_e_g1: print(f"ERROR G1 Onsite {carrier.upper()} Label: {label_e_g1}", flush=True)
+            else:
+                print(f"WARN G1 Onsite: Ship From address (effective) incomplete for label generation. Label not generated. Address used: {ctx['ship_from_address']}", flush=True)
+
+    if email_service:
+        g1_email_attachments = []
+        if g1_packing_slip_pdf_bytes: g1_email_attachments.append(_outbox_attachment(f"PackingSlip_Order_{bc_order_id}_G1{'_BLIND' if is_blind else ''}.pdf", g1_ps_blob_name_for_db, g1_packing_slip_pdf_bytes))
+        if generated_label_pdf_bytes: g1_email_attachments.append(_outbox_attachment(f"ShippingLabel_Order_{bc_order_id}_G1_{carrier.upper()}.pdf", g1_label_blob_name_for_db, generated_label_pdf_bytes))
+        email_subject_g1_suffix = " (Blind Drop Ship)" if is_blind else ""
+        email_html_body_g1 = (f"<p>Order {bc_order_id} has been fulfilled from G1 stock{email_subject_g1_suffix}. Docs attached.</p><p>Tracking: {g1_tracking_number or 'N/A'}</p>")
+        email_text_body_g1 = (f"Order {bc_order_id} fulfilled{email_subject_g1_suffix}. Docs attached.\nTracking: {g1_tracking_number or 'N/A'}")
+        send_g1_email = False
+        if local_order_line_items_list:
+            send_g1_email = bool(g1_packing_slip_pdf_bytes and generated_label_pdf_bytes)
+        elif g1_packing_slip_pdf_bytes:
+            send_g1_email = True
+            email_html_body_g1 = (f"<p>Order {bc_order_id} processed (G1 Onsite - Packing Slip Only{email_subject_g1_suffix}). Docs attached.</p>")
+            email_text_body_g1 = (f"Order {bc_order_id} processed (G1 Onsite - Packing Slip Only{email_subject_g1_suffix}). Docs attached.")
+        if send_g1_email and g1_email_attachments:
+            result["jobs"].append(("email_sales_notification", {
+                "recipient_email": "sales@globalonetechnology.com",
+                "subject": f"G1 Onsite Fulfillment Processed{email_subject_g1_suffix}: Order {bc_order_id}",
+                "html_body": email_html_body_g1, "text_body": email_text_body_g1, "attachments": g1_email_attachments}))
+        elif local_order_line_items_list and not send_g1_email:
+            print(f"WARN G1 Onsite Email: Email not sent for order {bc_order_id} due to missing documents, despite having items.", flush=True)
+
+    if shipping_service and bc_api_base_url_v2 and bc_order_id:
+        if g1_tracking_number and local_order_line_items_list:
+            bc_items_for_g1_shipment = [{"order_product_id": item_d.get('bigcommerce_line_item_id'), "quantity": item_d.get('quantity')} for item_d in local_order_line_items_list if item_d.get('bigcommerce_line_item_id')]
+            if bc_items_for_g1_shipment:
+                result["jobs"].append(("bc_create_shipment", {
+                    "bigcommerce_order_id": bc_order_id, "tracking_number": g1_tracking_number,
+                    "shipping_method_name": method_for_label_generation, "line_items": bc_items_for_g1_shipment, "shipping_provider": carrier}))
+        if bc_shipped_status_id and (g1_tracking_number or not local_order_line_items_list):
+            result["jobs"].append(("bc_set_order_status", {"bigcommerce_order_id": bc_order_id, "status_id": int(bc_shipped_status_id)}))
+
+    result["response"] = {"po_number": "N/A (G1 Onsite)", "supplier_id": G1_ONSITE_FULFILLMENT_IDENTIFIER, "tracking_number": g1_tracking_number, "po_pdf_gcs_uri": None, "packing_slip_gcs_uri": g1_ps_signed_url, "label_gcs_uri": g1_label_signed_url, "is_blind_drop_ship": is_blind}
+    return result
+
+class _SupplierPreparationAborted(Exception):
+    """A parallel supplier PO stopped before buying its label because a sibling PO failed."""
+
+def _prepare_supplier_po_assignment(ctx, order_id, po_number, supplier_data_dict, local_order_line_items_list, hpe_mappings_by_sku,
+                                    current_utc_datetime, is_multi_actual_supplier_po_scenario, abort_event=None):
+    """
+    Renders the PO and packing slip, buys the label and uploads everything for one supplier PO.
+    No DB access: returns the PO/line item/shipment rows and outbox jobs for the write phase.
+    abort_event is set when another supplier's preparation failed: the order will fail anyway,
+    so no label is bought after that.
+    """
+    po_line_items_input = ctx['po_line_items_input']
+    order_data_for_label = ctx['order_data_for_label']
+    bc_order_id = order_data_for_label.get('bigcommerce_order_id')
+    total_shipment_weight_lbs_str = ctx['total_shipment_weight_lbs_str']
+    method_for_label_generation = ctx['method_for_label_generation']
+    is_blind = ctx['is_blind_drop_ship']
+    carrier = ctx['carrier']
+    line_items_by_id = {oli['line_item_id']: oli for oli in local_order_line_items_list}
+
+    po_total_amount = sum(Decimal(str(item.get('quantity', 0))) * Decimal(str(item.get('unit_cost', '0'))) for item in po_line_items_input)
+    po_items_for_pdf, po_item_rows, items_for_packing_slip_this_po_supplier, ids_in_this_po = [], [], [], set()
+    for item_input in po_line_items_input:
+        original_oli_id = item_input.get("original_order_line_item_id")
+        if original_oli_id is None: raise ValueError(f"Missing 'original_order_line_item_id' for PO {po_number}")
+        ids_in_this_po.add(original_oli_id)
+        po_items_for_pdf.append({"sku": item_input.get('sku'), "description": item_input.get('description'), "quantity": int(item_input.get("quantity",0)), "unit_cost": Decimal(str(item_input.get("unit_cost", '0'))), "condition": item_input.get("condition", "New")})
+        original_line_item_detail = line_items_by_id.get(original_oli_id)
+        if not original_line_item_detail: raise ValueError(f"Original line item details for ID {original_oli_id} not found.")
+        items_for_packing_slip_this_po_supplier.append(_packing_slip_item(original_line_item_detail, hpe_mappings_by_sku, int(item_input.get('quantity',0))))
+        po_item_rows.append({"orig_id": original_oli_id, "sku_for_db": item_input.get('sku'), "desc": item_input.get('description'), "qty": int(item_input.get("quantity", 0)), "cost": Decimal(str(item_input.get("unit_cost", '0'))), "cond": item_input.get("condition", "New"), "now": current_utc_datetime})
+
+    po_pdf_bytes, ps_pdf_bytes_supplier, label_pdf_bytes_supplier, tracking_this_po = None, None, None, None
+    if document_generator:
+        po_pdf_bytes = pdf_render_pool.generate_purchase_order_pdf(
+            supplier_data=supplier_data_dict, po_number=po_number, po_date=current_utc_datetime, po_items=po_items_for_pdf,
+            payment_terms=supplier_data_dict.get('payment_terms'), payment_instructions=ctx['payment_instructions'],
+            order_data=order_data_for_label, logo_gcs_uri=COMPANY_LOGO_GCS_URI, is_partial_fulfillment=is_multi_actual_supplier_po_scenario)
+        items_shipping_separately_supplier = [
+            _packing_slip_item(orig_item_db, hpe_mappings_by_sku, orig_item_db.get('quantity'))
+            for orig_item_db in local_order_line_items_list if orig_item_db.get('line_item_id') not in ids_in_this_po
+        ]
+        ps_pdf_bytes_supplier = _render_packing_slip_pdf(
+            order_data=order_data_for_label, items_in_this_shipment=items_for_packing_slip_this_po_supplier,
+            items_shipping_separately=items_shipping_separately_supplier, logo_gcs_uri=ctx['logo_gcs_uri'],
+            is_g1_onsite_fulfillment=False, is_blind_slip=is_blind, custom_ship_from_address=ctx['packing_slip_custom_ship_from'])
+
+    label_was_attempted_for_supplier_po = False
+    current_weight_supplier = None
+    if shipping_service and total_shipment_weight_lbs_str and method_for_label_generation:
+        try:
+            current_weight_supplier = float(total_shipment_weight_lbs_str)
+            if current_weight_supplier > 0 and _label_ship_from_is_complete(ctx['ship_from_address']):
+                if abort_event is not None and abort_event.is_set():
+                    raise _SupplierPreparationAborted(f"PO {po_number}: another supplier PO failed; label not purchased.")
+                label_was_attempted_for_supplier_po = True
+                label_pdf_bytes_supplier, tracking_this_po = _generate_label_for_assignment(ctx, current_weight_supplier)
+            elif current_weight_supplier > 0:
+                print(f"WARN Supplier PO Label: Ship From address (effective) incomplete for label generation. PO: {po_number}. Label not generated. Address used: {ctx['ship_from_address']}", flush=True)
+                label_was_attempted_for_supplier_po = True
+        except _SupplierPreparationAborted:
+            raise
+        except Exception as label_e_supplier:
+            print(f"ERROR Supplier PO {carrier.upper()} Label: {label_e_supplier}", flush=True)
+    if not po_pdf_bytes:
+        raise ValueError(f"PO PDF failed to generate for PO {po_number}. Cannot proceed with this PO.")
+    if not ps_pdf_bytes_supplier:
+        raise ValueError(f"Packing Slip PDF failed to generate for PO {po_number}. Cannot proceed with this PO.")
+    if label_was_attempted_for_supplier_po and not label_pdf_bytes_supplier:
+        error_detail_label = f"Shipping Label failed to generate for PO {po_number}."
+        if tracking_this_po: error_detail_label += f" Tracking '{tracking_this_po}' might exist, but label PDF is missing."
+        else: error_detail_label += " No tracking number was obtained either."
+        raise ValueError(error_detail_label + " Cannot proceed with this PO.")
+
+    available_document_count = 3 if label_pdf_bytes_supplier else 2
+    min_attachments_required = 3 if label_was_attempted_for_supplier_po else 2
+    if email_service and supplier_data_dict.get('email') and available_document_count < min_attachments_required:
+        raise ValueError(f"PO {po_number}: Email not sent as not all required documents were available (Label attempted: {label_was_attempted_for_supplier_po}, attachments: {available_document_count}).")
+
+    gs_po_pdf_path_supplier, gs_ps_path_supplier, gs_label_path_supplier = None, None, None
+    po_pdf_signed_url, ps_signed_url_supplier, label_signed_url_supplier = None, None, None
+    if _gcs_available():
+        ts_suffix = current_utc_datetime.strftime("%Y%m%d%H%M%S")
+        common_prefix_supplier = f"processed_orders/order_{bc_order_id}_PO_{po_number}{'_BLIND' if is_blind else ''}"
+        supplier_pdfs = [(f"{common_prefix_supplier}/po_{po_number}_{ts_suffix}.pdf", po_pdf_bytes),
+                         (f"{common_prefix_supplier}/ps_{po_number}_{ts_suffix}.pdf", ps_pdf_bytes_supplier)]
+        if label_pdf_bytes_supplier and tracking_this_po:
+            supplier_pdfs.append((f"{common_prefix_supplier}/label_{carrier.upper()}_{tracking_this_po}_{ts_suffix}.pdf", label_pdf_bytes_supplier))
+        uploaded_supplier_pdfs = _upload_pdfs_and_sign(supplier_pdfs)
+        gs_po_pdf_path_supplier, po_pdf_signed_url = uploaded_supplier_pdfs[0]
+        gs_ps_path_supplier, ps_signed_url_supplier = uploaded_supplier_pdfs[1]
+        if len(uploaded_supplier_pdfs) > 2:
+            gs_label_path_supplier, label_signed_url_supplier = uploaded_supplier_pdfs[2]
+
+    attachments_to_supplier = [_outbox_attachment(f"PO_{po_number}.pdf", gs_po_pdf_path_supplier, po_pdf_bytes),
+                               _outbox_attachment(f"PackingSlip_{po_number}{'_BLIND' if is_blind else ''}.pdf", gs_ps_path_supplier, ps_pdf_bytes_supplier)]
+    if label_pdf_bytes_supplier:
+        attachments_to_supplier.append(_outbox_attachment(f"ShippingLabel_{carrier.upper()}_{tracking_this_po}.pdf", gs_label_path_supplier, label_pdf_bytes_supplier))
+
+    result = {
+        "kind": "supplier_po", "processed_line_item_ids": ids_in_this_po, "jobs": [],
+        "po_row": {"po_number": po_number, "order_id": order_id, "supplier_id": ctx['supplier_id'], "po_date": current_utc_datetime,
+                   "payment_instructions": ctx['payment_instructions'], "status": "New", "total_amount": po_total_amount,
+                   "po_pdf_path": gs_po_pdf_path_supplier, "ps_path": gs_ps_path_supplier, "now": current_utc_datetime},
+        "po_item_rows": po_item_rows,
+        "shipment_row": None,
+    }
+    if label_pdf_bytes_supplier and tracking_this_po:
+        result["shipment_row"] = {"order_id": order_id, "track_num": tracking_this_po, "method": method_for_label_generation,
+                                  "weight": current_weight_supplier, "label_path": gs_label_path_supplier, "ps_path": None, "now": current_utc_datetime}
+    if email_service and supplier_data_dict.get('email'):
+        result["jobs"].append(("email_supplier_po", {"supplier_email": supplier_data_dict['email'], "po_number": po_number,
+                                                     "attachments": attachments_to_supplier, "is_blind_drop_ship": is_blind}))
+    if shipping_service and bc_api_base_url_v2 and tracking_this_po and bc_order_id:
+        quantities_by_oli_id = {pi.get("original_order_line_item_id"): pi.get('quantity') for pi in reversed(po_line_items_input)}
+        bc_items_for_this_ship_api = [
+            {"order_product_id": oli_detail.get('bigcommerce_line_item_id'), "quantity": quantities_by_oli_id[oli_detail.get('line_item_id')]}
+            for oli_detail in local_order_line_items_list
+            if oli_detail.get('line_item_id') in ids_in_this_po and oli_detail.get('bigcommerce_line_item_id')
+        ]
+        if bc_items_for_this_ship_api:
+            result["jobs"].append(("bc_create_shipment", {
+                "bigcommerce_order_id": bc_order_id, "tracking_number": tracking_this_po,
+                "shipping_method_name": method_for_label_generation, "line_items": bc_items_for_this_ship_api, "shipping_provider": carrier}))
+    result["response"] = {"po_number": po_number, "supplier_id": ctx['supplier_id'], "tracking_number": tracking_this_po, "po_pdf_gcs_uri": po_pdf_signed_url, "packing_slip_gcs_uri": ps_signed_url_supplier, "label_gcs_uri": label_signed_url_supplier, "status": "Processed", "is_blind_drop_ship": is_blind}
+    return result
+
+# Per-supplier PDF/label/upload work for multi-supplier orders runs in a thread pool; set to false to build them serially.
+PROCESS_ORDER_PARALLEL_SUPPLIERS = os.getenv("PROCESS_ORDER_PARALLEL_SUPPLIERS", "true").lower() == "true"
+PROCESS_ORDER_MAX_SUPPLIER_WORKERS = int(os.getenv("PROCESS_ORDER_MAX_SUPPLIER_WORKERS", "4"))
+
+# How long a process request's claim on an order (orders.processing_claimed_at) keeps other requests out.
+PROCESS_ORDER_CLAIM_TTL_SECONDS = int(os.getenv("PROCESS_ORDER_CLAIM_TTL_SECONDS", "600"))
+
+def _claim_order_for_processing(order_id):
+    """
+    Marks the order as being processed unless it is already processed or claimed by another request
+    (within PROCESS_ORDER_CLAIM_TTL_SECONDS). Returns the claim timestamp, or None if not claimed.
+    Taken before any label is bought, so a request that loses the race never pays for one.
+    """
+    with engine.begin() as db_conn:
+        return db_conn.execute(text("""
+            UPDATE orders SET processing_claimed_at = clock_timestamp()
+            WHERE id = :id AND LOWER(COALESCE(status, '')) NOT IN ('processed', 'completed offline')
+              AND (processing_claimed_at IS NULL OR processing_claimed_at < NOW() - make_interval(secs => :ttl))
+            RETURNING processing_claimed_at
+        """), {"id": order_id, "ttl": PROCESS_ORDER_CLAIM_TTL_SECONDS}).scalar_one_or_none()
+
+def _release_order_claim(order_id, claimed_at):
+    try:
+        with engine.begin() as db_conn:
+            db_conn.execute(text("UPDATE orders SET processing_claimed_at = NULL WHERE id = :id AND processing_claimed_at = :claimed_at"),
+                            {"id": order_id, "claimed_at": claimed_at})
+    except Exception as e:
+        print(f"WARN PROCESS_ORDER: Could not release processing claim on order {order_id}: {e}", flush=True)
+
+INSERT_PO_SQL = text("INSERT INTO purchase_orders (po_number, order_id, supplier_id, po_date, payment_instructions, status, total_amount, po_pdf_gcs_path, packing_slip_gcs_path, created_at, updated_at) VALUES (:po_number, :order_id, :supplier_id, :po_date, :payment_instructions, :status, :total_amount, :po_pdf_path, :ps_path, :now, :now) RETURNING id")
+INSERT_PO_ITEM_SQL = text("INSERT INTO po_line_items (purchase_order_id, original_order_line_item_id, sku, description, quantity, unit_cost, condition, created_at, updated_at) VALUES (:po_id, :orig_id, :sku_for_db, :desc, :qty, :cost, :cond, :now, :now)")
+INSERT_SHIPMENT_SQL = text("INSERT INTO shipments (order_id, purchase_order_id, tracking_number, shipping_method_name, weight_lbs, label_gcs_path, packing_slip_gcs_path, created_at, updated_at) VALUES (:order_id, :po_id, :track_num, :method, :weight, :label_path, :ps_path, :now, :now)")
+
 @orders_bp.route('/orders/<int:order_id>/process', methods=['POST'])
 @verify_firebase_token
 def process_order_route(order_id):
+    """
+    Processes an order's assignments in three phases so no DB connection is held across slow I/O:
+      1. short read of the order, line items, mappings and suppliers, then a claim on the order so
+         no concurrent request buys labels for it;
+      2. PDFs, carrier labels and GCS uploads with no connection checked out;
+      3. one short transaction writing PO/shipment rows and enqueueing outbox jobs for the
+         emails and BigCommerce updates, which the outbox worker executes with retries.
+    """
     print(f"DEBUG PROCESS_ORDER: Received request to process order ID: {order_id}", flush=True)
-    db_conn, transaction, processed_pos_info_for_response = None, None, []
+    processed_pos_info_for_response = []
+    claimed_at = None
     try:
         payload = request.get_json()
         if not payload or 'assignments' not in payload or not isinstance(payload['assignments'], list):
@@ -512,427 +1157,168 @@ def process_order_route(order_id):
             print("ERROR PROCESS_ORDER: Database engine not available.", flush=True)
             return jsonify({"error": "Database engine not available."}), 500
 
-        db_conn = engine.connect()
-        transaction = db_conn.begin()
+        actual_supplier_assignments = [a for a in assignments if a.get('supplier_id') != G1_ONSITE_FULFILLMENT_IDENTIFIER]
+        is_multi_actual_supplier_po_scenario = len(actual_supplier_assignments) > 1
 
-        order_record = db_conn.execute(
-            text("""SELECT * FROM orders WHERE id = :id"""),
-            {"id": order_id}
-        ).fetchone()
+        # --- Phase 1: read snapshot ---
+        with engine.connect() as db_conn:
+            order_record = db_conn.execute(text("SELECT * FROM orders WHERE id = :id"), {"id": order_id}).fetchone()
+            if not order_record:
+                return jsonify({"error": f"Order with ID {order_id} not found"}), 404
+            order_data_dict_original = convert_row_to_dict(order_record)
+            order_status_from_db = order_data_dict_original.get('status')
+            if order_status_from_db and order_status_from_db.lower() in ['processed', 'completed offline']:
+                return jsonify({"error": f"Order {order_id} status is '{order_status_from_db}' and cannot be reprocessed."}), 400
+
+            local_order_line_items_records = db_conn.execute(
+                text("SELECT id AS line_item_id, bigcommerce_line_item_id, sku AS original_sku, name AS line_item_name, quantity FROM order_line_items WHERE order_id = :order_id_param ORDER BY id"),
+                {"order_id_param": order_id}
+            ).fetchall()
+            local_order_line_items_list = [convert_row_to_dict(row) for row in local_order_line_items_records]
+            hpe_mappings_by_sku = resolve_hpe_mappings_bulk([item.get('original_sku') for item in local_order_line_items_list], db_conn)
+
+            suppliers_by_assignment_index = {}
+            for idx, assignment_data in enumerate(assignments):
+                if assignment_data.get('supplier_id') == G1_ONSITE_FULFILLMENT_IDENTIFIER or not assignment_data.get('po_line_items'):
+                    continue
+                supplier_record = db_conn.execute(text("SELECT * FROM suppliers WHERE id = :id"), {"id": assignment_data.get('supplier_id')}).fetchone()
+                if not supplier_record: raise ValueError(f"Supplier with ID {assignment_data.get('supplier_id')} not found.")
+                suppliers_by_assignment_index[idx] = convert_row_to_dict(supplier_record)
 
-        if not order_record:
-            if transaction.is_active: transaction.rollback()
-            return jsonify({"error": f"Order with ID {order_id} not found"}), 404
+            # One PO number per supplier assignment that has items, allocated in a single call.
+            allocated_po_numbers = iter(allocate_po_numbers(db_conn, len(suppliers_by_assignment_index)))
 
-        order_data_dict_original = convert_row_to_dict(order_record)
+        claimed_at = _claim_order_for_processing(order_id)
+        if claimed_at is None:
+            return jsonify({"error": f"Order {order_id} is already being processed or was processed by another request."}), 409
 
-        order_status_from_db = order_data_dict_original.get('status')
-        if order_status_from_db and order_status_from_db.lower() in ['processed', 'completed offline']:
-            if transaction.is_active: transaction.rollback()
-            return jsonify({"error": f"Order {order_id} status is '{order_status_from_db}' and cannot be reprocessed."}), 400
-
-        local_order_line_items_records = db_conn.execute(
-            text("SELECT id AS line_item_id, bigcommerce_line_item_id, sku AS original_sku, name AS line_item_name, quantity FROM order_line_items WHERE order_id = :order_id_param ORDER BY id"),
-            {"order_id_param": order_id}
-        ).fetchall()
-        local_order_line_items_list = [convert_row_to_dict(row) for row in local_order_line_items_records]
         all_original_order_line_item_db_ids = {item['line_item_id'] for item in local_order_line_items_list}
         processed_original_order_line_item_db_ids_this_batch = set()
-
         current_utc_datetime = datetime.now(timezone.utc)
 
-        actual_supplier_assignments = [a for a in assignments if a.get('supplier_id') != G1_ONSITE_FULFILLMENT_IDENTIFIER]
-        is_multi_actual_supplier_po_scenario = len(actual_supplier_assignments) > 1
+        # --- Phase 2: documents, labels and uploads (no DB connection held) ---
+        # PO numbers are handed out in assignment order first, so numbering does not depend on
+        # which supplier's documents finish first when they are built concurrently.
+        assignment_results = [None] * len(assignments)
+        supplier_po_tasks = []
+        for idx, assignment_data in enumerate(assignments):
+            ctx = _build_assignment_context(assignment_data, order_id, order_data_dict_original, local_order_line_items_list)
+            if ctx['supplier_id'] == G1_ONSITE_FULFILLMENT_IDENTIFIER:
+                assignment_results[idx] = _prepare_g1_onsite_assignment(ctx, order_id, local_order_line_items_list, hpe_mappings_by_sku, current_utc_datetime)
+            elif not ctx['po_line_items_input']:
+                print(f"WARN PROCESS_ORDER: No line items provided for supplier PO to supplier ID {ctx['supplier_id']}. Skipping PO generation for this assignment.", flush=True)
+                assignment_results[idx] = {"kind": "skipped", "jobs": [], "processed_line_item_ids": set(),
+                                           "response": { "po_number": "N/A (No Items)", "supplier_id": ctx['supplier_id'], "tracking_number": None, "po_pdf_gcs_uri": None, "packing_slip_gcs_uri": None, "label_gcs_uri": None, "status": "Skipped - No Items", "is_blind_drop_ship": ctx['is_blind_drop_ship']}}
+            else:
+                generated_po_number = next(allocated_po_numbers)
+                supplier_po_tasks.append((idx, ctx, generated_po_number))
+
+        # Set by the first supplier PO that fails: queued ones are cancelled, running ones stop before buying a label.
+        supplier_po_abort = threading.Event()
 
-        next_sequence_num = None
-        if actual_supplier_assignments:
-            starting_po_sequence = 200001
-            max_po_query = text("SELECT MAX(CAST(numeric_po_number AS INTEGER)) FROM (SELECT po_number AS numeric_po_number FROM purchase_orders WHERE CAST(po_number AS TEXT) ~ '^[0-9]+$') AS numeric_pos")
-            max_po_value_from_db = db_conn.execute(max_po_query).scalar_one_or_none()
-            next_sequence_num = starting_po_sequence
-            if max_po_value_from_db is not None:
+        def _run_supplier_po_task(task):
+            idx, ctx, generated_po_number = task
+            return idx, _prepare_supplier_po_assignment(
+                ctx, order_id, generated_po_number, suppliers_by_assignment_index[idx], local_order_line_items_list,
+                hpe_mappings_by_sku, current_utc_datetime, is_multi_actual_supplier_po_scenario, abort_event=supplier_po_abort)
+
+        if PROCESS_ORDER_PARALLEL_SUPPLIERS and is_multi_actual_supplier_po_scenario and len(supplier_po_tasks) > 1:
+            flask_app = current_app._get_current_object()
+            def _run_supplier_po_task_in_app_context(task):
                 try:
-                    next_sequence_num = max(starting_po_sequence, int(max_po_value_from_db) + 1)
-                except ValueError:
-                    print(f"WARN PROCESS_ORDER: Could not parse max PO number '{max_po_value_from_db}'. Defaulting PO sequence.", flush=True)
-
-        for assignment_data in assignments:
-            supplier_id_from_payload = assignment_data.get('supplier_id')
-            shipment_method_from_processing_form = assignment_data.get('shipment_method')
-            total_shipment_weight_lbs_str = assignment_data.get('total_shipment_weight_lbs')
-            payment_instructions_from_frontend = assignment_data.get('payment_instructions', "")
-            po_line_items_input = assignment_data.get('po_line_items', [])
-
-            carrier_from_payload = assignment_data.get('carrier', 'ups').lower()
-            is_bill_to_customer_fedex_from_payload = assignment_data.get('is_bill_to_customer_fedex_account', False)
-            customer_fedex_account_from_payload = assignment_data.get('customer_fedex_account_number')
-            is_bill_to_customer_ups_from_payload = assignment_data.get('is_bill_to_customer_ups_account', False)
-            customer_ups_account_from_payload = assignment_data.get('customer_ups_account_number')
-            is_blind_drop_ship_from_payload = assignment_data.get('is_blind_drop_ship', False)
-
-            g1_ps_signed_url, g1_label_signed_url = None, None
-            po_pdf_signed_url, ps_signed_url_supplier, label_signed_url_supplier = None, None, None
-
-            order_data_for_label = order_data_dict_original.copy() 
-            
-            if carrier_from_payload == 'fedex':
-                order_data_for_label['is_bill_to_customer_fedex_account'] = is_bill_to_customer_fedex_from_payload
-                order_data_for_label['customer_fedex_account_number'] = customer_fedex_account_from_payload
-                order_data_for_label['is_bill_to_customer_account'] = False 
-                order_data_for_label['customer_ups_account_number'] = None
-            elif carrier_from_payload == 'ups':
-                order_data_for_label['is_bill_to_customer_account'] = is_bill_to_customer_ups_from_payload
-                order_data_for_label['customer_ups_account_number'] = customer_ups_account_from_payload
-                order_data_for_label['is_bill_to_customer_fedex_account'] = False
-                order_data_for_label['customer_fedex_account_number'] = None
-            
-            effective_ups_third_party_zip = None
-            if carrier_from_payload == 'ups' and is_bill_to_customer_ups_from_payload:
-                customer_ups_account_zipcode_from_db = order_data_dict_original.get('customer_ups_account_zipcode')
-                customer_billing_zip_from_db = order_data_dict_original.get('customer_billing_zip')
-
-                if customer_ups_account_zipcode_from_db and str(customer_ups_account_zipcode_from_db).strip() and str(customer_ups_account_zipcode_from_db).strip().lower() != 'none':
-                    effective_ups_third_party_zip = str(customer_ups_account_zipcode_from_db).strip()
-                elif customer_billing_zip_from_db and str(customer_billing_zip_from_db).strip():
-                    effective_ups_third_party_zip = str(customer_billing_zip_from_db).strip()
-                    print(f"DEBUG PROCESS_ORDER: Using customer_billing_zip ('{effective_ups_third_party_zip}') for UPS 3rd party as customer_ups_account_zipcode was not set or invalid.", flush=True)
-                else:
-                    print(f"WARN PROCESS_ORDER: Neither customer_ups_account_zipcode nor customer_billing_zip is valid for UPS 3rd party billing. Label generation may fail or default to BillShipper.", flush=True)
-                order_data_for_label['customer_ups_account_zipcode'] = effective_ups_third_party_zip
-
-
-            current_ship_from_address = {}
-            effective_logo_gcs_uri = COMPANY_LOGO_GCS_URI
-            packing_slip_custom_ship_from = None
-
-            if is_blind_drop_ship_from_payload:
-                print(f"DEBUG PROCESS_ORDER: Blind drop ship for order {order_id}, assignment to supplier/mode {supplier_id_from_payload}. Using customer billing address as ship-from.", flush=True)
-                current_ship_from_address = {
-                    'name': order_data_dict_original.get('customer_billing_company') or f"{order_data_dict_original.get('customer_billing_first_name', '')} {order_data_dict_original.get('customer_billing_last_name', '')}".strip(),
-                    'contact_person': f"{order_data_dict_original.get('customer_billing_first_name', '')} {order_data_dict_original.get('customer_billing_last_name', '')}".strip(),
-                    'street_1': order_data_dict_original.get('customer_billing_street_1'),
-                    'street_2': order_data_dict_original.get('customer_billing_street_2', ''),
-                    'city': order_data_dict_original.get('customer_billing_city'),
-                    'state': order_data_dict_original.get('customer_billing_state'),
-                    'zip': order_data_dict_original.get('customer_billing_zip'),
-                    'country': order_data_dict_original.get('customer_billing_country_iso2', 'US'),
-                    'phone': order_data_dict_original.get('customer_billing_phone')
-                }
-                if not all(val for key, val in current_ship_from_address.items() if key not in ['street_2', 'contact_person']):
-                    raise ValueError("Blind drop ship selected, but customer billing address (used as ship-from) is incomplete. Required: name/company, street1, city, state, zip, country, phone.")
-                effective_logo_gcs_uri = None
-                packing_slip_custom_ship_from = current_ship_from_address
-            else:
-                current_ship_from_address = {
-                    'name': SHIP_FROM_NAME, 'contact_person': SHIP_FROM_CONTACT,
-                    'street_1': SHIP_FROM_STREET1, 'street_2': SHIP_FROM_STREET2,
-                    'city': SHIP_FROM_CITY, 'state': SHIP_FROM_STATE,
-                    'zip': SHIP_FROM_ZIP, 'country': SHIP_FROM_COUNTRY, 'phone': SHIP_FROM_PHONE
-                }
-
-            method_for_label_generation = shipment_method_from_processing_form
-            if carrier_from_payload == 'ups' and is_bill_to_customer_ups_from_payload and order_data_dict_original.get('customer_selected_freight_service'):
-                method_for_label_generation = order_data_dict_original.get('customer_selected_freight_service')
-            elif carrier_from_payload == 'fedex' and is_bill_to_customer_fedex_from_payload and order_data_dict_original.get('customer_selected_fedex_service'):
-                 method_for_label_generation = order_data_dict_original.get('customer_selected_fedex_service')
-            elif not shipment_method_from_processing_form and (local_order_line_items_list or supplier_id_from_payload == G1_ONSITE_FULFILLMENT_IDENTIFIER):
-                method_for_label_generation = order_data_dict_original.get('customer_shipping_method', 'UPS Ground')
-            elif not (local_order_line_items_list or (supplier_id_from_payload == G1_ONSITE_FULFILLMENT_IDENTIFIER and po_line_items_input)):
-                method_for_label_generation = None
-
-            if supplier_id_from_payload == G1_ONSITE_FULFILLMENT_IDENTIFIER:
-                g1_ps_blob_name_for_db, g1_label_blob_name_for_db = None, None
-                g1_tracking_number = None
-                generated_label_pdf_bytes = None
-                if not local_order_line_items_list: 
-                    print(f"DEBUG PROCESS_ORDER (G1 Onsite): No line items for order {order_id}. Skipping PS/Label.", flush=True)
-                else: 
-                    if not total_shipment_weight_lbs_str or not method_for_label_generation:
-                         if is_blind_drop_ship_from_payload and (not total_shipment_weight_lbs_str or not method_for_label_generation):
-                             raise ValueError("Blind Drop Ship (G1): Shipment method and weight are required when items exist.")
-                         elif not is_blind_drop_ship_from_payload: 
-                             raise ValueError("Shipment method and weight are required for G1 Onsite Fulfillment with items.")
-                    try:
-                        current_g1_weight = float(total_shipment_weight_lbs_str)
-                        if current_g1_weight <= 0: raise ValueError("Shipment weight must be positive for G1 Onsite Fulfillment.")
-                    except ValueError:
-                        raise ValueError("Invalid shipment weight format for G1 Onsite Fulfillment.")
-
-                    items_for_g1_packing_slip = []
-                    for item_detail in local_order_line_items_list:
-                        ps_sku, ps_desc = item_detail.get('original_sku', 'N/A'), item_detail.get('line_item_name', 'N/A')
-                        hpe_opt_pn, _, _ = get_hpe_mapping_with_fallback(ps_sku, db_conn)
-                        if hpe_opt_pn:
-                            ps_sku = hpe_opt_pn
-                            mapped_ps_desc = db_conn.execute(text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn"), {"option_pn": hpe_opt_pn}).scalar_one_or_none()
-                            if mapped_ps_desc: ps_desc = mapped_ps_desc
-                        items_for_g1_packing_slip.append({'sku': ps_sku, 'name': ps_desc, 'quantity': item_detail.get('quantity')})
-                        processed_original_order_line_item_db_ids_this_batch.add(item_detail['line_item_id'])
-
-                    g1_packing_slip_pdf_bytes = None
-                    if document_generator and items_for_g1_packing_slip:
-                        ps_args = {
-                            "order_data": order_data_for_label,
-                            "items_in_this_shipment": items_for_g1_packing_slip,
-                            "items_shipping_separately": [],
-                            "logo_gcs_uri": effective_logo_gcs_uri,
-                            "is_g1_onsite_fulfillment": True,
-                            "is_blind_slip": is_blind_drop_ship_from_payload,
-                            "custom_ship_from_address": packing_slip_custom_ship_from
-                        }
-                        g1_packing_slip_pdf_bytes = document_generator.generate_packing_slip_pdf(**ps_args)
-                        if g1_packing_slip_pdf_bytes and storage_client and GCS_BUCKET_NAME:
-                            ts_suffix = current_utc_datetime.strftime("%Y%m%d%H%M%S")
-                            g1_ps_blob_name = f"processed_orders/order_{order_data_for_label['bigcommerce_order_id']}_G1Onsite/ps_g1_{'blind_' if is_blind_drop_ship_from_payload else ''}{ts_suffix}.pdf"
-                            g1_ps_blob_name_for_db = f"gs://{GCS_BUCKET_NAME}/{g1_ps_blob_name}"
-                            g1_ps_blob = storage_client.bucket(GCS_BUCKET_NAME).blob(g1_ps_blob_name)
-                            g1_ps_blob.upload_from_string(g1_packing_slip_pdf_bytes, content_type='application/pdf')
-                            try: g1_ps_signed_url = g1_ps_blob.generate_signed_url(version="v4", expiration=timedelta(minutes=60), method="GET")
-                            except Exception as e_sign_g1ps: print(f"ERROR G1_ONSITE generating signed URL for PS: {e_sign_g1ps}", flush=True)
-
-                    if shipping_service and total_shipment_weight_lbs_str and method_for_label_generation and local_order_line_items_list:
-                        if all([current_ship_from_address.get('street_1'), current_ship_from_address.get('city'), current_ship_from_address.get('state'), current_ship_from_address.get('zip'), current_ship_from_address.get('country'), current_ship_from_address.get('phone')]):
-                            try:
-                                if carrier_from_payload == 'fedex':
-                                    generated_label_pdf_bytes, g1_tracking_number = shipping_service.generate_fedex_label(
-                                        order_data=order_data_for_label, ship_from_address=current_ship_from_address,
-                                        total_weight_lbs=float(total_shipment_weight_lbs_str),
-                                        customer_shipping_method_name=method_for_label_generation )
-                                else: 
-                                    generated_label_pdf_bytes, g1_tracking_number = shipping_service.generate_ups_label(
-                                        order_data=order_data_for_label, ship_from_address=current_ship_from_address,
-                                        total_weight_lbs=float(total_shipment_weight_lbs_str),
-                                        customer_shipping_method_name=method_for_label_generation,
-                                        is_bill_to_customer_ups_account=is_bill_to_customer_ups_from_payload,
-                                        customer_ups_account_number=customer_ups_account_from_payload,
-                                        customer_ups_account_zipcode=effective_ups_third_party_zip
-                                    )
-                                if generated_label_pdf_bytes and g1_tracking_number and storage_client and GCS_BUCKET_NAME:
-                                    ts_suffix = current_utc_datetime.strftime("%Y%m%d%H%M%S")
-                                    g1_label_blob_name = f"processed_orders/order_{order_data_for_label['bigcommerce_order_id']}_G1Onsite/label_{carrier_from_payload.upper()}_{g1_tracking_number}_{ts_suffix}.pdf"
-                                    g1_label_blob_name_for_db = f"gs://{GCS_BUCKET_NAME}/{g1_label_blob_name}"
-                                    g1_label_blob = storage_client.bucket(GCS_BUCKET_NAME).blob(g1_label_blob_name)
-                                    g1_label_blob.upload_from_string(generated_label_pdf_bytes, content_type='application/pdf')
-                                    try: g1_label_signed_url = g1_label_blob.generate_signed_url(version="v4", expiration=timedelta(minutes=60), method="GET")
-                                    except Exception as e_sign_g1lbl: print(f"ERROR G1_ONSITE gen signed URL Label: {e_sign_g1lbl}", flush=True)
-                                    insert_g1_shipment_sql = text("""INSERT INTO shipments (order_id, purchase_order_id, tracking_number, shipping_method_name, weight_lbs, label_gcs_path, packing_slip_gcs_path, created_at, updated_at) VALUES (:order_id, NULL, :track_num, :method, :weight, :label_path, :ps_path, :now, :now)""")
-                                    g1_shipment_params = { "order_id": order_id, "track_num": g1_tracking_number, "method": method_for_label_generation, "weight": float(total_shipment_weight_lbs_str), "label_path": g1_label_blob_name_for_db, "ps_path": g1_ps_blob_name_for_db, "now": current_utc_datetime }
-                                    db_conn.execute(insert_g1_shipment_sql, g1_shipment_params)
-                            except Exception as label_e_g1: print(f"ERROR G1 Onsite {carrier_from_payload.upper()} Label: {label_e_g1}", flush=True)
-                        else:
-                            print(f"WARN G1 Onsite: Ship From address (effective) incomplete for label generation. Label not generated. Address used: {current_ship_from_address}", flush=True)
-                    if email_service:
-                        g1_email_attachments = []
-                        if g1_packing_slip_pdf_bytes: g1_email_attachments.append({ "Name": f"PackingSlip_Order_{order_data_for_label['bigcommerce_order_id']}_G1{'_BLIND' if is_blind_drop_ship_from_payload else ''}.pdf", "Content": base64.b64encode(g1_packing_slip_pdf_bytes).decode('utf-8'), "ContentType": "application/pdf" })
-                        if generated_label_pdf_bytes: g1_email_attachments.append({ "Name": f"ShippingLabel_Order_{order_data_for_label['bigcommerce_order_id']}_G1_{carrier_from_payload.upper()}.pdf", "Content": base64.b64encode(generated_label_pdf_bytes).decode('utf-8'), "ContentType": "application/pdf" })
-                        email_subject_g1_suffix = " (Blind Drop Ship)" if is_blind_drop_ship_from_payload else ""
-                        email_subject_g1 = f"G1 Onsite Fulfillment Processed{email_subject_g1_suffix}: Order {order_data_for_label['bigcommerce_order_id']}"
-                        email_html_body_g1 = (f"<p>Order {order_data_for_label['bigcommerce_order_id']} has been fulfilled from G1 stock{email_subject_g1_suffix}. Docs attached.</p><p>Tracking: {g1_tracking_number or 'N/A'}</p>")
-                        email_text_body_g1 = (f"Order {order_data_for_label['bigcommerce_order_id']} fulfilled{email_subject_g1_suffix}. Docs attached.\nTracking: {g1_tracking_number or 'N/A'}")
-                        send_g1_email = False
-                        if local_order_line_items_list:
-                            if g1_packing_slip_pdf_bytes and generated_label_pdf_bytes:
-                                send_g1_email = True
-                        elif g1_packing_slip_pdf_bytes : 
-                            send_g1_email = True
-                            email_html_body_g1 = (f"<p>Order {order_data_for_label['bigcommerce_order_id']} processed (G1 Onsite - Packing Slip Only{email_subject_g1_suffix}). Docs attached.</p>")
-                            email_text_body_g1 = (f"Order {order_data_for_label['bigcommerce_order_id']} processed (G1 Onsite - Packing Slip Only{email_subject_g1_suffix}). Docs attached.")
-                        if send_g1_email and g1_email_attachments:
-                            if hasattr(email_service, 'send_sales_notification_email'):
-                                email_service.send_sales_notification_email( recipient_email="sales@globalonetechnology.com", subject=email_subject_g1, html_body=email_html_body_g1, text_body=email_text_body_g1, attachments=g1_email_attachments )
-                        elif local_order_line_items_list and not send_g1_email:
-                             print(f"WARN G1 Onsite Email: Email not sent for order {order_data_for_label['bigcommerce_order_id']} due to missing documents, despite having items.", flush=True)
-                bc_order_id_for_update = order_data_for_label.get('bigcommerce_order_id')
-                if shipping_service and bc_api_base_url_v2 and bc_order_id_for_update:
-                    if g1_tracking_number and local_order_line_items_list:
-                        bc_address_id = _get_bc_shipping_address_id(bc_order_id_for_update)
-                        bc_items_for_g1_shipment = [{"order_product_id": item_d.get('bigcommerce_line_item_id'), "quantity": item_d.get('quantity')} for item_d in local_order_line_items_list if item_d.get('bigcommerce_line_item_id')]
-                        if bc_address_id is not None and bc_items_for_g1_shipment:
-                            shipping_service.create_bigcommerce_shipment( bigcommerce_order_id=bc_order_id_for_update, tracking_number=g1_tracking_number, shipping_method_name=method_for_label_generation, line_items_in_shipment=bc_items_for_g1_shipment, order_address_id=bc_address_id, shipping_provider=carrier_from_payload )
-                    if bc_shipped_status_id and (g1_tracking_number or not local_order_line_items_list): 
-                        shipping_service.set_bigcommerce_order_status(bc_order_id_for_update, int(bc_shipped_status_id))
-                db_conn.execute(text("UPDATE orders SET status = 'Completed Offline', updated_at = :now WHERE id = :order_id"), {"now": current_utc_datetime, "order_id": order_id})
-                processed_pos_info_for_response.append({ "po_number": "N/A (G1 Onsite)", "supplier_id": G1_ONSITE_FULFILLMENT_IDENTIFIER, "tracking_number": g1_tracking_number, "po_pdf_gcs_uri": None, "packing_slip_gcs_uri": g1_ps_signed_url, "label_gcs_uri": g1_label_signed_url, "is_blind_drop_ship": is_blind_drop_ship_from_payload })
-            else: 
-                if not po_line_items_input:
-                    print(f"WARN PROCESS_ORDER: No line items provided for supplier PO to supplier ID {supplier_id_from_payload}. Skipping PO generation for this assignment.", flush=True)
-                    processed_pos_info_for_response.append({ "po_number": "N/A (No Items)", "supplier_id": supplier_id_from_payload, "tracking_number": None, "po_pdf_gcs_uri": None, "packing_slip_gcs_uri": None, "label_gcs_uri": None, "status": "Skipped - No Items", "is_blind_drop_ship": is_blind_drop_ship_from_payload})
-                    continue
-                supplier_record = db_conn.execute(text("SELECT * FROM suppliers WHERE id = :id"), {"id": supplier_id_from_payload}).fetchone()
-                if not supplier_record: raise ValueError(f"Supplier with ID {supplier_id_from_payload} not found.")
-                supplier_data_dict = convert_row_to_dict(supplier_record)
-                if next_sequence_num is None: raise Exception("PO Number sequence not initialized for supplier POs.")
-                generated_po_number = str(next_sequence_num); next_sequence_num += 1
-                po_total_amount = sum(Decimal(str(item.get('quantity', 0))) * Decimal(str(item.get('unit_cost', '0'))) for item in po_line_items_input)
-                insert_po_sql = text("INSERT INTO purchase_orders (po_number, order_id, supplier_id, po_date, payment_instructions, status, total_amount, created_at, updated_at) VALUES (:po_number, :order_id, :supplier_id, :po_date, :payment_instructions, :status, :total_amount, :now, :now) RETURNING id")
-                po_params = {"po_number": generated_po_number, "order_id": order_id, "supplier_id": supplier_id_from_payload, "po_date": current_utc_datetime, "payment_instructions": payment_instructions_from_frontend, "status": "New", "total_amount": po_total_amount, "now": current_utc_datetime}
-                new_purchase_order_id = db_conn.execute(insert_po_sql, po_params).scalar_one()
-                insert_po_item_sql = text("INSERT INTO po_line_items (purchase_order_id, original_order_line_item_id, sku, description, quantity, unit_cost, condition, created_at, updated_at) VALUES (:po_id, :orig_id, :sku_for_db, :desc, :qty, :cost, :cond, :now, :now)")
-                po_items_for_pdf, items_for_packing_slip_this_po_supplier, ids_in_this_po = [], [], set()
-                for item_input in po_line_items_input:
-                    original_oli_id = item_input.get("original_order_line_item_id")
-                    if original_oli_id is None: raise ValueError(f"Missing 'original_order_line_item_id' for PO {generated_po_number}")
-                    ids_in_this_po.add(original_oli_id)
-                    processed_original_order_line_item_db_ids_this_batch.add(original_oli_id)
-                    po_items_for_pdf.append({"sku": item_input.get('sku'), "description": item_input.get('description'), "quantity": int(item_input.get("quantity",0)), "unit_cost": Decimal(str(item_input.get("unit_cost", '0'))), "condition": item_input.get("condition", "New")})
-                    original_line_item_detail = next((oli for oli in local_order_line_items_list if oli['line_item_id'] == original_oli_id), None)
-                    if not original_line_item_detail: raise ValueError(f"Original line item details for ID {original_oli_id} not found.")
-                    ps_sku, ps_desc = original_line_item_detail.get('original_sku', 'N/A'), original_line_item_detail.get('line_item_name', 'N/A')
-                    hpe_opt_pn_ps, _, _ = get_hpe_mapping_with_fallback(ps_sku, db_conn)
-                    if hpe_opt_pn_ps:
-                        ps_sku = hpe_opt_pn_ps
-                        mapped_ps_desc = db_conn.execute(text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn"), {"option_pn": hpe_opt_pn_ps}).scalar_one_or_none()
-                        if mapped_ps_desc: ps_desc = mapped_ps_desc
-                    items_for_packing_slip_this_po_supplier.append({'sku': ps_sku, 'name': ps_desc, 'quantity': int(item_input.get('quantity',0))})
-                    po_item_db_params = {"po_id": new_purchase_order_id, "orig_id": original_oli_id, "sku_for_db": item_input.get('sku'), "desc": item_input.get('description'), "qty": int(item_input.get("quantity", 0)), "cost": Decimal(str(item_input.get("unit_cost", '0'))), "cond": item_input.get("condition", "New"), "now": current_utc_datetime}
-                    db_conn.execute(insert_po_item_sql, po_item_db_params)
-                po_pdf_bytes, ps_pdf_bytes_supplier, label_pdf_bytes_supplier, tracking_this_po = None, None, None, None
-                if document_generator:
-                    po_args = {"supplier_data": supplier_data_dict, "po_number": generated_po_number, "po_date": current_utc_datetime, "po_items": po_items_for_pdf, "payment_terms": supplier_data_dict.get('payment_terms'), "payment_instructions": payment_instructions_from_frontend, "order_data": order_data_for_label, "logo_gcs_uri": COMPANY_LOGO_GCS_URI, "is_partial_fulfillment": is_multi_actual_supplier_po_scenario}
-                    po_pdf_bytes = document_generator.generate_purchase_order_pdf(**po_args)
-                    items_shipping_separately_supplier = []
-                    for orig_item_db in local_order_line_items_list:
-                        if orig_item_db.get('line_item_id') not in ids_in_this_po:
-                            sep_sku_ps, sep_desc_ps = orig_item_db.get('original_sku', 'N/A'), orig_item_db.get('line_item_name', 'N/A')
-                            hpe_opt_pn_sep_ps, _, _ = get_hpe_mapping_with_fallback(sep_sku_ps, db_conn)
-                            if hpe_opt_pn_sep_ps:
-                                sep_sku_ps = hpe_opt_pn_sep_ps
-                                mapped_sep_desc_ps = db_conn.execute(text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn"), {"option_pn": hpe_opt_pn_sep_ps}).scalar_one_or_none()
-                                if mapped_sep_desc_ps: sep_desc_ps = mapped_sep_desc_ps
-                            items_shipping_separately_supplier.append({'sku': sep_sku_ps, 'name': sep_desc_ps, 'quantity': orig_item_db.get('quantity')})
-                    ps_args_supplier = {
-                        "order_data": order_data_for_label,
-                        "items_in_this_shipment": items_for_packing_slip_this_po_supplier,
-                        "items_shipping_separately": items_shipping_separately_supplier,
-                        "logo_gcs_uri": effective_logo_gcs_uri,
-                        "is_g1_onsite_fulfillment": False,
-                        "is_blind_slip": is_blind_drop_ship_from_payload,
-                        "custom_ship_from_address": packing_slip_custom_ship_from
-                    }
-                    ps_pdf_bytes_supplier = document_generator.generate_packing_slip_pdf(**ps_args_supplier)
-                label_was_attempted_for_supplier_po = False
-                if shipping_service and total_shipment_weight_lbs_str and method_for_label_generation:
-                    try:
-                        current_weight_supplier = float(total_shipment_weight_lbs_str)
-                        if current_weight_supplier > 0 and all([current_ship_from_address.get('street_1'), current_ship_from_address.get('city'), current_ship_from_address.get('state'), current_ship_from_address.get('zip'), current_ship_from_address.get('country'), current_ship_from_address.get('phone')]):
-                            label_was_attempted_for_supplier_po = True
-                            if carrier_from_payload == 'fedex':
-                                label_pdf_bytes_supplier, tracking_this_po = shipping_service.generate_fedex_label(
-                                    order_data=order_data_for_label, ship_from_address=current_ship_from_address,
-                                    total_weight_lbs=current_weight_supplier, customer_shipping_method_name=method_for_label_generation )
-                            else: 
-                                label_pdf_bytes_supplier, tracking_this_po = shipping_service.generate_ups_label(
-                                    order_data=order_data_for_label, ship_from_address=current_ship_from_address,
-                                    total_weight_lbs=current_weight_supplier, customer_shipping_method_name=method_for_label_generation,
-                                    is_bill_to_customer_ups_account=is_bill_to_customer_ups_from_payload,
-                                    customer_ups_account_number=customer_ups_account_from_payload,
-                                    customer_ups_account_zipcode=effective_ups_third_party_zip 
-                                )
-                            if label_pdf_bytes_supplier and tracking_this_po:
-                                insert_ship_sql = text("INSERT INTO shipments (order_id, purchase_order_id, tracking_number, shipping_method_name, weight_lbs, created_at, updated_at) VALUES (:order_id, :po_id, :track, :method, :weight, :now, :now) RETURNING id")
-                                ship_params = {"order_id": order_id, "po_id": new_purchase_order_id, "track": tracking_this_po, "method": method_for_label_generation, "weight": current_weight_supplier, "now": current_utc_datetime}
-                                db_conn.execute(insert_ship_sql, ship_params)
-                        elif current_weight_supplier > 0:
-                            print(f"WARN Supplier PO Label: Ship From address (effective) incomplete for label generation. PO: {generated_po_number}. Label not generated. Address used: {current_ship_from_address}", flush=True)
-                            label_was_attempted_for_supplier_po = True
-                    except Exception as label_e_supplier:
-                        print(f"ERROR Supplier PO {carrier_from_payload.upper()} Label: {label_e_supplier}", flush=True)
-                if not po_pdf_bytes:
-                    raise ValueError(f"PO PDF failed to generate for PO {generated_po_number}. Cannot proceed with this PO.")
-                if not ps_pdf_bytes_supplier:
-                    raise ValueError(f"Packing Slip PDF failed to generate for PO {generated_po_number}. Cannot proceed with this PO.")
-                if label_was_attempted_for_supplier_po and not label_pdf_bytes_supplier:
-                    error_detail_label = f"Shipping Label failed to generate for PO {generated_po_number}."
-                    if tracking_this_po: error_detail_label += f" Tracking '{tracking_this_po}' might exist, but label PDF is missing."
-                    else: error_detail_label += " No tracking number was obtained either."
-                    raise ValueError(error_detail_label + " Cannot proceed with this PO.")
-                if storage_client and GCS_BUCKET_NAME:
-                    ts_suffix = current_utc_datetime.strftime("%Y%m%d%H%M%S")
-                    blind_suffix = "_BLIND" if is_blind_drop_ship_from_payload else ""
-                    common_prefix_supplier = f"processed_orders/order_{order_data_for_label['bigcommerce_order_id']}_PO_{generated_po_number}{blind_suffix}"
-                    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-                    gs_po_pdf_path_supplier, gs_ps_path_supplier, gs_label_path_supplier = None, None, None
-                    if po_pdf_bytes:
-                        po_blob_name = f"{common_prefix_supplier}/po_{generated_po_number}_{ts_suffix}.pdf"
-                        gs_po_pdf_path_supplier = f"gs://{GCS_BUCKET_NAME}/{po_blob_name}"
-                        po_blob = bucket.blob(po_blob_name); po_blob.upload_from_string(po_pdf_bytes, content_type='application/pdf')
-                        db_conn.execute(text("UPDATE purchase_orders SET po_pdf_gcs_path = :path WHERE id = :id"), {"path": gs_po_pdf_path_supplier, "id": new_purchase_order_id})
-                        try: po_pdf_signed_url = po_blob.generate_signed_url(version="v4", expiration=timedelta(minutes=60), method="GET") 
-                        except Exception as e_sign_po: print(f"ERROR gen signed URL PO: {e_sign_po}", flush=True)
-                    if ps_pdf_bytes_supplier:
-                        ps_blob_name = f"{common_prefix_supplier}/ps_{generated_po_number}_{ts_suffix}.pdf"
-                        gs_ps_path_supplier = f"gs://{GCS_BUCKET_NAME}/{ps_blob_name}"
-                        ps_blob = bucket.blob(ps_blob_name); ps_blob.upload_from_string(ps_pdf_bytes_supplier, content_type='application/pdf')
-                        db_conn.execute(text("UPDATE purchase_orders SET packing_slip_gcs_path = :path WHERE id = :id"), {"path": gs_ps_path_supplier, "id": new_purchase_order_id})
-                        try: ps_signed_url_supplier = ps_blob.generate_signed_url(version="v4", expiration=timedelta(minutes=60), method="GET")
-                        except Exception as e_sign_ps: print(f"ERROR gen signed URL PS: {e_sign_ps}", flush=True)
-                    if label_pdf_bytes_supplier and tracking_this_po:
-                        label_blob_name = f"{common_prefix_supplier}/label_{carrier_from_payload.upper()}_{tracking_this_po}_{ts_suffix}.pdf"
-                        gs_label_path_supplier = f"gs://{GCS_BUCKET_NAME}/{label_blob_name}"
-                        label_blob = bucket.blob(label_blob_name); label_blob.upload_from_string(label_pdf_bytes_supplier, content_type='application/pdf')
-                        db_conn.execute(text("UPDATE shipments SET label_gcs_path = :path WHERE purchase_order_id = :po_id AND tracking_number = :track"), {"path": gs_label_path_supplier, "po_id": new_purchase_order_id, "track": tracking_this_po})
-                        try: label_signed_url_supplier = label_blob.generate_signed_url(version="v4", expiration=timedelta(minutes=60), method="GET")
-                        except Exception as e_sign_label: print(f"ERROR gen signed URL Label: {e_sign_label}", flush=True)
-                attachments_to_supplier = []
-                if po_pdf_bytes: attachments_to_supplier.append({"Name": f"PO_{generated_po_number}.pdf", "Content": base64.b64encode(po_pdf_bytes).decode('utf-8'), "ContentType": "application/pdf"})
-                if ps_pdf_bytes_supplier: attachments_to_supplier.append({"Name": f"PackingSlip_{generated_po_number}{'_BLIND' if is_blind_drop_ship_from_payload else ''}.pdf", "Content": base64.b64encode(ps_pdf_bytes_supplier).decode('utf-8'), "ContentType": "application/pdf"})
-                if label_pdf_bytes_supplier: attachments_to_supplier.append({"Name": f"ShippingLabel_{carrier_from_payload.upper()}_{tracking_this_po}.pdf", "Content": base64.b64encode(label_pdf_bytes_supplier).decode('utf-8'), "ContentType": "application/pdf"})
-                min_attachments_required = 3 if label_was_attempted_for_supplier_po else 2
-                if email_service and supplier_data_dict.get('email') and len(attachments_to_supplier) >= min_attachments_required:
-                    email_service.send_po_email(supplier_email=supplier_data_dict['email'], po_number=generated_po_number, attachments=attachments_to_supplier, is_blind_drop_ship=is_blind_drop_ship_from_payload)
-                    db_conn.execute(text("UPDATE purchase_orders SET status = 'SENT_TO_SUPPLIER', updated_at = :now WHERE id = :po_id"), {"po_id": new_purchase_order_id, "now": current_utc_datetime})
-                elif email_service and supplier_data_dict.get('email'):
-                    raise ValueError(f"PO {generated_po_number}: Email not sent as not all required documents were available (Label attempted: {label_was_attempted_for_supplier_po}, attachments: {len(attachments_to_supplier)}).")
-                if shipping_service and bc_api_base_url_v2 and tracking_this_po:
-                    bc_order_id_bc_update = order_data_for_label.get('bigcommerce_order_id')
-                    bc_address_id_ship = _get_bc_shipping_address_id(bc_order_id_bc_update)
-                    bc_items_for_this_ship_api = []
-                    for oli_detail in local_order_line_items_list:
-                        if oli_detail.get('line_item_id') in ids_in_this_po:
-                            po_item_for_bc_qty = next((pi_input for pi_input in po_line_items_input if pi_input.get("original_order_line_item_id") == oli_detail.get('line_item_id')), None)
-                            if po_item_for_bc_qty and oli_detail.get('bigcommerce_line_item_id'):
-                                bc_items_for_this_ship_api.append({"order_product_id": oli_detail.get('bigcommerce_line_item_id'), "quantity": po_item_for_bc_qty.get('quantity')})
-                    if bc_order_id_bc_update and bc_address_id_ship is not None and bc_items_for_this_ship_api:
-                        shipping_service.create_bigcommerce_shipment( bigcommerce_order_id=bc_order_id_bc_update, tracking_number=tracking_this_po, shipping_method_name=method_for_label_generation, line_items_in_shipment=bc_items_for_this_ship_api, order_address_id=bc_address_id_ship, shipping_provider=carrier_from_payload )
-                processed_pos_info_for_response.append({ "po_number": generated_po_number, "supplier_id": supplier_id_from_payload, "tracking_number": tracking_this_po, "po_pdf_gcs_uri": po_pdf_signed_url, "packing_slip_gcs_uri": ps_signed_url_supplier, "label_gcs_uri": label_signed_url_supplier, "status": "Processed", "is_blind_drop_ship": is_blind_drop_ship_from_payload })
-        is_only_g1_onsite_processed = all(a.get('supplier_id') == G1_ONSITE_FULFILLMENT_IDENTIFIER for a in assignments)
-        if is_only_g1_onsite_processed:
-            pass
-        else: 
-            db_conn.execute(text("UPDATE orders SET status = 'Processed', updated_at = :now WHERE id = :order_id"), {"now": current_utc_datetime, "order_id": order_id})
-            if all_original_order_line_item_db_ids.issubset(processed_original_order_line_item_db_ids_this_batch):
-                if shipping_service and bc_api_base_url_v2 and bc_shipped_status_id and order_data_dict_original.get('bigcommerce_order_id'):
-                    any_supplier_po_with_tracking = any(
-                        po_info.get('tracking_number') 
-                        for po_info in processed_pos_info_for_response 
-                        if po_info.get("supplier_id") != G1_ONSITE_FULFILLMENT_IDENTIFIER and po_info.get("status") == "Processed"
-                    )
-                    if any_supplier_po_with_tracking:
-                        shipping_service.set_bigcommerce_order_status( 
-                            bigcommerce_order_id=order_data_dict_original.get('bigcommerce_order_id'), 
-                            status_id=int(bc_shipped_status_id) 
+                    with flask_app.app_context():
+                        return _run_supplier_po_task(task)
+                except Exception:
+                    supplier_po_abort.set()
+                    raise
+            phase2_started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=min(PROCESS_ORDER_MAX_SUPPLIER_WORKERS, len(supplier_po_tasks)), thread_name_prefix="po-docs") as executor:
+                futures = [executor.submit(_run_supplier_po_task_in_app_context, task) for task in supplier_po_tasks]
+                try:
+                    for future in as_completed(futures):
+                        idx, assignment_result = future.result()
+                        assignment_results[idx] = assignment_result
+                except Exception as supplier_po_error:
+                    supplier_po_abort.set()
+                    cancelled_count = sum(1 for pending_future in futures if pending_future.cancel())
+                    print(f"ERROR PROCESS_ORDER: A supplier PO failed; cancelled {cancelled_count} queued PO(s), running ones skip their labels.", flush=True)
+                    if isinstance(supplier_po_error, _SupplierPreparationAborted):
+                        # A sibling finished aborting first; report the failure that caused it.
+                        wait(futures)
+                        for failed_future in futures:
+                            if not failed_future.cancelled() and failed_future.exception() and not isinstance(failed_future.exception(), _SupplierPreparationAborted):
+                                raise failed_future.exception()
+                    raise
+            print(f"DEBUG PROCESS_ORDER: Built {len(supplier_po_tasks)} supplier POs concurrently in {time.monotonic() - phase2_started:.2f}s.", flush=True)
+        else:
+            for task in supplier_po_tasks:
+                idx, assignment_result = _run_supplier_po_task(task)
+                assignment_results[idx] = assignment_result
+
+        for assignment_result in assignment_results:
+            processed_original_order_line_item_db_ids_this_batch |= assignment_result["processed_line_item_ids"]
+            processed_pos_info_for_response.append(assignment_result["response"])
+
+        # --- Phase 3: one short write transaction (rows + outbox jobs) ---
+        # The order is only marked Shipped in BigCommerce once every shipment job has succeeded.
+        enqueued_job_count, shipment_job_ids = 0, []
+        with engine.begin() as db_conn:
+            locked_order = db_conn.execute(text("SELECT status, processing_claimed_at FROM orders WHERE id = :id FOR UPDATE"), {"id": order_id}).fetchone()
+            if locked_order.status and locked_order.status.lower() in ['processed', 'completed offline']:
+                raise ValueError(f"Order {order_id} was processed concurrently (status '{locked_order.status}').")
+            if locked_order.processing_claimed_at != claimed_at:
+                raise ValueError(f"Order {order_id}: processing claim expired and was taken by another request.")
+
+            for assignment_result in assignment_results:
+                new_purchase_order_id = None
+                if assignment_result["kind"] == "supplier_po":
+                    new_purchase_order_id = db_conn.execute(INSERT_PO_SQL, assignment_result["po_row"]).scalar_one()
+                    db_conn.execute(INSERT_PO_ITEM_SQL, [{"po_id": new_purchase_order_id, **row} for row in assignment_result["po_item_rows"]])
+                if assignment_result.get("shipment_row"):
+                    db_conn.execute(INSERT_SHIPMENT_SQL, {**assignment_result["shipment_row"], "po_id": new_purchase_order_id})
+                if assignment_result["kind"] == "g1_onsite":
+                    db_conn.execute(text("UPDATE orders SET status = 'Completed Offline', updated_at = :now WHERE id = :order_id"), {"now": current_utc_datetime, "order_id": order_id})
+                for job_type, job_payload in assignment_result["jobs"]:
+                    if job_type == "email_supplier_po":
+                        job_payload = {**job_payload, "purchase_order_id": new_purchase_order_id}
+                    job_id = outbox.enqueue(db_conn, job_type, job_payload, order_id=order_id,
+                                            depends_on=shipment_job_ids if job_type == "bc_set_order_status" else None)
+                    if job_type == "bc_create_shipment":
+                        shipment_job_ids.append(job_id)
+                    enqueued_job_count += 1
+
+            is_only_g1_onsite_processed = all(a.get('supplier_id') == G1_ONSITE_FULFILLMENT_IDENTIFIER for a in assignments)
+            if not is_only_g1_onsite_processed:
+                db_conn.execute(text("UPDATE orders SET status = 'Processed', updated_at = :now WHERE id = :order_id"), {"now": current_utc_datetime, "order_id": order_id})
+                if all_original_order_line_item_db_ids.issubset(processed_original_order_line_item_db_ids_this_batch):
+                    if shipping_service and bc_api_base_url_v2 and bc_shipped_status_id and order_data_dict_original.get('bigcommerce_order_id'):
+                        any_supplier_po_with_tracking = any(
+                            po_info.get('tracking_number')
+                            for po_info in processed_pos_info_for_response
+                            if po_info.get("supplier_id") != G1_ONSITE_FULFILLMENT_IDENTIFIER and po_info.get("status") == "Processed"
                         )
-                    else:
-                        print(f"INFO PROCESS_ORDER: Order {order_id} fully processed for app, but no supplier tracking numbers from *processed* POs. BC status NOT set to Shipped.", flush=True)
-            else:
-                 print(f"INFO PROCESS_ORDER: Order {order_id} processed for app, but not all original line items were part of this batch of supplier POs. BC status NOT set to Shipped by this operation.", flush=True)
-        transaction.commit()
+                        if any_supplier_po_with_tracking:
+                            outbox.enqueue(db_conn, "bc_set_order_status", {"bigcommerce_order_id": order_data_dict_original.get('bigcommerce_order_id'), "status_id": int(bc_shipped_status_id)},
+                                           order_id=order_id, depends_on=shipment_job_ids)
+                            enqueued_job_count += 1
+                        else:
+                            print(f"INFO PROCESS_ORDER: Order {order_id} fully processed for app, but no supplier tracking numbers from *processed* POs. BC status NOT set to Shipped.", flush=True)
+                else:
+                    print(f"INFO PROCESS_ORDER: Order {order_id} processed for app, but not all original line items were part of this batch of supplier POs. BC status NOT set to Shipped by this operation.", flush=True)
+        outbox.notify()
+        print(f"DEBUG PROCESS_ORDER: Order {order_id} committed with {enqueued_job_count} outbox jobs.", flush=True)
         final_message = f"Order {order_id} processed successfully."
-        return jsonify({ "message": final_message, "order_id": order_id, "processed_purchase_orders": make_json_safe(processed_pos_info_for_response) }), 201
+        return jsonify({ "message": final_message, "order_id": order_id, "processed_purchase_orders": processed_pos_info_for_response, "queued_side_effects": enqueued_job_count }), 201
     except ValueError as ve:
-        if transaction and transaction.is_active: transaction.rollback()
         print(f"ERROR PROCESS_ORDER (ValueError): {ve}", flush=True); traceback.print_exc(file=sys.stderr); sys.stderr.flush()
         return jsonify({"error": "Processing failed due to invalid data or missing document.", "details": str(ve)}), 400
     except Exception as e:
-        if transaction and transaction.is_active:
-             try: transaction.rollback()
-             except Exception as rb_e: print(f"ERROR PROCESS_ORDER: Error during transaction rollback: {rb_e}", flush=True)
         print(f"ERROR PROCESS_ORDER (Exception): Unhandled Exception: {e}", flush=True); traceback.print_exc(file=sys.stderr); sys.stderr.flush()
         return jsonify({"error": "An unexpected error occurred during order processing.", "details": str(e)}), 500
     finally:
-        if db_conn and not db_conn.closed:
-            db_conn.close()
-            print(f"DEBUG PROCESS_ORDER: DB Connection closed for order {order_id}", flush=True)
+        if claimed_at is not None:
+            _release_order_claim(order_id, claimed_at)
+        print(f"DEBUG PROCESS_ORDER: Finished request for order {order_id}", flush=True)
 
 # --- START OF NEW ENDPOINT: Send Receipt ---
 @orders_bp.route('/orders/<int:order_id>/send-receipt', methods=['POST'])
@@ -994,23 +1380,15 @@ def send_order_receipt_route(order_id):
             WHERE oli.order_id = :order_id_param ORDER BY oli.id
         """
         base_line_items_records = db_conn.execute(text(base_line_items_sql), {"order_id_param": order_id}).fetchall()
+        hpe_mappings_by_sku = resolve_hpe_mappings_bulk([row.original_sku for row in base_line_items_records], db_conn)
         
         line_items_data = []
         for row in base_line_items_records:
             item_dict = convert_row_to_dict(row)
-            original_sku_for_item = item_dict.get('original_sku')
-            
-            # Use get_hpe_mapping_with_fallback to find the option_pn
-            hpe_option_pn, hpe_pn_type, _ = get_hpe_mapping_with_fallback(original_sku_for_item, db_conn) # Ensure get_hpe_mapping_with_fallback is imported from app
+            hpe_mapping = hpe_mappings_by_sku.get(item_dict.get('original_sku'), {})
             
-            item_dict['hpe_option_pn'] = hpe_option_pn # Useful if PDF generator wants to optionally show it elsewhere
-            item_dict['hpe_po_description'] = None # Default to None
-
-            if hpe_option_pn:
-                desc_query = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn")
-                custom_desc_result = db_conn.execute(desc_query, {"option_pn": hpe_option_pn}).scalar_one_or_none()
-                if custom_desc_result:
-                    item_dict['hpe_po_description'] = custom_desc_result
+            item_dict['hpe_option_pn'] = hpe_mapping.get('option_pn') # Useful if PDF generator wants to optionally show it elsewhere
+            item_dict['hpe_po_description'] = hpe_mapping.get('po_description') or None
             
             # Fallback for PDF description if hpe_po_description is still None
             if not item_dict['hpe_po_description']:
@@ -1036,7 +1414,10 @@ def send_order_receipt_route(order_id):
         # Generate PDF
         current_app.logger.info(f"SEND_RECEIPT: Generating PDF for order ID {order_id}")
         logo_uri = os.getenv("COMPANY_LOGO_GCS_URI") 
-        pdf_bytes = document_generator.generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=logo_uri) 
+        pdf_bytes, from_cache = pdf_artifact_cache.get_or_render(
+            "receipt", {"order_data": order_data, "line_items_data": line_items_data, "logo_gcs_uri": logo_uri},
+            lambda: pdf_render_pool.generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=logo_uri))
+        if from_cache: current_app.logger.info(f"SEND_RECEIPT: Using cached PDF for order ID {order_id}")
         
         if not pdf_bytes:
             current_app.logger.error(f"SEND_RECEIPT: PDF generation failed for order ID {order_id}.")
@@ -1141,15 +1522,11 @@ def send_wire_invoice_route(order_id):
             WHERE oli.order_id = :order_id_param ORDER BY oli.id
         """
         base_line_items_records = db_conn.execute(text(base_line_items_sql), {"order_id_param": order_id}).fetchall()
+        hpe_mappings_by_sku = resolve_hpe_mappings_bulk([row.original_sku for row in base_line_items_records], db_conn)
         line_items_data_for_pdf = []
         for row in base_line_items_records:
             item_dict = convert_row_to_dict(row)
-            hpe_option_pn, _, _ = get_hpe_mapping_with_fallback(item_dict.get('original_sku'), db_conn)
-            item_dict['hpe_po_description'] = None
-            if hpe_option_pn:
-                desc_query = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn")
-                custom_desc = db_conn.execute(desc_query, {"option_pn": hpe_option_pn}).scalar_one_or_none()
-                if custom_desc: item_dict['hpe_po_description'] = custom_desc
+            item_dict['hpe_po_description'] = hpe_mappings_by_sku.get(item_dict.get('original_sku'), {}).get('po_description') or None
             item_dict['pdf_description'] = item_dict['hpe_po_description'] or item_dict.get('line_item_name', 'N/A')
             line_items_data_for_pdf.append(item_dict)
         
@@ -1164,12 +1541,18 @@ def send_wire_invoice_route(order_id):
         
         # The generate_wire_transfer_invoice_pdf will handle adding the fee to line items and total internally based on apply_wire_fee
         logo_uri = os.getenv("COMPANY_LOGO_GCS_URI")
-        pdf_bytes = document_generator.generate_wire_transfer_invoice_pdf(
-            order_data, 
-            line_items_data_for_pdf, 
-            apply_wire_fee=add_wire_fee_frontend_flag, 
-            logo_gcs_uri=logo_uri
+        pdf_bytes, from_cache = pdf_artifact_cache.get_or_render(
+            "wire_invoice",
+            {"order_data": order_data, "line_items_data": line_items_data_for_pdf,
+             "apply_wire_fee": add_wire_fee_frontend_flag, "logo_gcs_uri": logo_uri},
+            lambda: pdf_render_pool.generate_wire_transfer_invoice_pdf(
+                order_data, 
+                line_items_data_for_pdf, 
+                apply_wire_fee=add_wire_fee_frontend_flag, 
+                logo_gcs_uri=logo_uri
+            )
         )
+        if from_cache: current_app.logger.info(f"SEND_WIRE_INVOICE: Using cached PDF for order ID {order_id}")
         
         if not pdf_bytes:
             if transaction.is_active: transaction.rollback()
@@ -1227,4 +1610,182 @@ def send_wire_invoice_route(order_id):
         if db_conn: 
             db_conn.close()
             current_app.logger.debug(f"SEND_WIRE_INVOICE: DB Connection closed for order ID {order_id}")
-# --- END OF send_wire_invoice_route ---
\ No newline at end of file
+# --- END OF send_wire_invoice_route ---
+
+
+# --- Batch reprint: packing slips + stored labels as one PDF ---
+BATCH_REPRINT_MAX_ORDERS = int(os.getenv("BATCH_REPRINT_MAX_ORDERS", "200"))
+BATCH_REPRINT_CHUNK_ORDERS = int(os.getenv("BATCH_REPRINT_CHUNK_ORDERS", "20"))
+
+class _NothingToReprint(Exception):
+    """No document of a batch reprint could be produced; raised before any byte is sent."""
+
+    def __init__(self, skipped):
+        super().__init__(f"{len(skipped)} document(s) could not be produced.")
+        self.skipped = skipped
+
+def _resolve_batch_reprint_order_ids(db_conn, payload):
+    """Order ids to reprint, in output order: as given, or by first shipment time for a date range."""
+    if payload.get('order_ids'):
+        requested_ids = list(dict.fromkeys(int(order_id) for order_id in payload['order_ids']))
+        found_ids = {row.id for row in db_conn.execute(text("SELECT id FROM orders WHERE id = ANY(:ids)"), {"ids": requested_ids})}
+        return [order_id for order_id in requested_ids if order_id in found_ids]
+    start_date = date.fromisoformat(payload['start_date'])
+    end_date = date.fromisoformat(payload.get('end_date') or payload['start_date'])
+    if end_date < start_date:
+        raise ValueError("end_date is before start_date.")
+    rows = db_conn.execute(text("""
+        SELECT order_id FROM shipments
+        WHERE created_at >= :start_ts AND created_at < :end_ts
+        GROUP BY order_id ORDER BY MIN(created_at), order_id LIMIT :limit
+    """), {"start_ts": datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc),
+           "end_ts": datetime.combine(end_date + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc),
+           "limit": BATCH_REPRINT_MAX_ORDERS + 1})
+    return [row.order_id for row in rows]
+
+def _load_batch_reprint_chunk(db_conn, order_ids, include_labels):
+    """Orders, packing slip items, supplier-fulfilled order ids and label URIs for one chunk of the reprint."""
+    orders_by_id = {}
+    for row in db_conn.execute(text("SELECT * FROM orders WHERE id = ANY(:ids)"), {"ids": order_ids}):
+        order_data = convert_row_to_dict(row)
+        order_data['customer_notes'] = order_data.get('customer_notes') or ''
+        orders_by_id[order_data['id']] = order_data
+    line_items = [dict(row._mapping) for row in db_conn.execute(text(
+        "SELECT order_id, sku AS original_sku, name AS line_item_name, quantity FROM order_line_items WHERE order_id = ANY(:ids) ORDER BY order_id, id"
+    ), {"ids": order_ids})]
+    hpe_mappings_by_sku = resolve_hpe_mappings_bulk([item['original_sku'] for item in line_items], db_conn)
+    items_by_order = {}
+    for item in line_items:
+        items_by_order.setdefault(item['order_id'], []).append(_packing_slip_item(item, hpe_mappings_by_sku, item['quantity']))
+    # Orders with a purchase order were drop-shipped by a supplier; the rest were fulfilled on site by G1.
+    supplier_order_ids = {row.order_id for row in db_conn.execute(
+        text("SELECT DISTINCT order_id FROM purchase_orders WHERE order_id = ANY(:ids)"), {"ids": order_ids})}
+    labels_by_order = {}
+    if include_labels:
+        # Domestic shipments store a gs:// path, international ones the public URL.
+        for row in db_conn.execute(text("""
+            SELECT order_id, COALESCE(label_gcs_path, label_gcs_url) AS label_uri FROM shipments
+            WHERE order_id = ANY(:ids) AND COALESCE(label_gcs_path, label_gcs_url) IS NOT NULL
+            ORDER BY order_id, created_at, id
+        """), {"ids": order_ids}):
+            labels_by_order.setdefault(row.order_id, []).append(row.label_uri)
+    return orders_by_id, items_by_order, supplier_order_ids, labels_by_order
+
+def _iter_batch_reprint_documents(order_ids, include_labels, skipped):
+    """Yields (order_id, description, pdf_bytes) per document, chunk by chunk; missing ones go to skipped."""
+    for chunk_start in range(0, len(order_ids), BATCH_REPRINT_CHUNK_ORDERS):
+        chunk_ids = order_ids[chunk_start:chunk_start + BATCH_REPRINT_CHUNK_ORDERS]
+        with engine.connect() as db_conn:
+            orders_by_id, items_by_order, supplier_order_ids, labels_by_order = _load_batch_reprint_chunk(db_conn, chunk_ids, include_labels)
+        # Several shipments can share one label file: download it once, use it for each.
+        label_uris = list(dict.fromkeys(uri for order_id in chunk_ids for uri in labels_by_order.get(order_id, [])))
+        label_bytes_by_uri = dict(zip(label_uris, gcs_service.download_files_parallel(label_uris)))
+
+        for order_id in chunk_ids:
+            order_data = orders_by_id.get(order_id)
+            if order_data is None:
+                continue
+            if items_by_order.get(order_id):
+                try:
+                    # Fonts, the shared stylesheet and the logo are loaded once per process (or pool worker).
+                    yield order_id, "packing slip", pdf_render_pool.generate_packing_slip_pdf(
+                        order_data=order_data, items_in_this_shipment=items_by_order[order_id], items_shipping_separately=[],
+                        logo_gcs_uri=COMPANY_LOGO_GCS_URI, is_g1_onsite_fulfillment=order_id not in supplier_order_ids)
+                except Exception as e:
+                    print(f"ERROR BATCH_REPRINT: Packing slip for order {order_id} failed: {e}")
+                    skipped.append(f"order {order_id} packing slip ({e})")
+            for uri in labels_by_order.get(order_id, []):
+                if label_bytes_by_uri.get(uri):
+                    yield order_id, uri, label_bytes_by_uri[uri]
+                else:
+                    skipped.append(f"order {order_id} label {uri} (download failed)")
+
+def _generate_batch_reprint(order_ids, include_labels):
+    """
+    Yields the merged PDF. Orders are loaded and rendered BATCH_REPRINT_CHUNK_ORDERS at a time and
+    each document is written out as soon as it is added, so memory holds one chunk's labels at most.
+    Nothing is yielded until the first document has been merged: if none can be, _NothingToReprint
+    is raised from the first next() so the route can still answer with an error. After that the
+    status code is fixed, so documents that fail are listed on a summary page appended at the end.
+    """
+    merger = pdf_merge.StreamingPdfMerger()
+    pending_header = merger.begin()
+    skipped, stopped_reason = [], None
+    try:
+        for order_id, description, pdf_bytes in _iter_batch_reprint_documents(order_ids, include_labels, skipped):
+            try:
+                pdf_chunk = merger.add(pdf_bytes)
+            except Exception as e:
+                print(f"ERROR BATCH_REPRINT: Could not merge {description} for order {order_id}: {e}")
+                skipped.append(f"order {order_id} {description} (unreadable PDF)")
+                continue
+            if pending_header is not None:
+                pdf_chunk, pending_header = pending_header + pdf_chunk, None
+            yield pdf_chunk
+    except Exception as e:
+        if pending_header is not None:
+            raise
+        print(f"ERROR BATCH_REPRINT: Reprint stopped mid-response: {e}")
+        traceback.print_exc()
+        stopped_reason = str(e) or type(e).__name__
+    if pending_header is not None:
+        raise _NothingToReprint(skipped)
+    if skipped or stopped_reason:
+        print(f"WARN BATCH_REPRINT: {len(skipped)} document(s) left out: {'; '.join(skipped)}")
+        try:
+            yield merger.add(document_generator.generate_batch_reprint_summary_pdf(len(order_ids), skipped, stopped_reason))
+        except Exception as e:
+            print(f"ERROR BATCH_REPRINT: Could not add the summary page: {e}")
+    print(f"INFO BATCH_REPRINT: Wrote {merger.page_count} page(s) for {len(order_ids)} order(s).")
+    yield merger.finish()
+
+@orders_bp.route('/orders/batch-reprint', methods=['POST'])
+@verify_firebase_token
+def batch_reprint_documents():
+    """
+    Streams one PDF holding, per order, a packing slip for all its line items followed by every
+    stored shipping label. Body: {"order_ids": [...]} (kept in the given order) or
+    {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"} for orders with shipments created in
+    that range (UTC, inclusive). "include_labels": false leaves the labels out. Documents that
+    could not be produced are listed on a final summary page.
+    """
+    if engine is None:
+        return jsonify({"error": "Database engine not available."}), 500
+    if pdf_merge.pypdf is None:
+        return jsonify({"error": "Batch reprint is unavailable: pypdf is not installed."}), 501
+    payload = request.get_json(silent=True) or {}
+    if 'order_ids' in payload and not isinstance(payload['order_ids'], list):
+        return jsonify({"error": "order_ids must be a list of order ids."}), 400
+    if not payload.get('order_ids') and not payload.get('start_date'):
+        return jsonify({"error": "Provide order_ids or start_date (and optionally end_date)."}), 400
+    try:
+        with engine.connect() as db_conn:
+            order_ids = _resolve_batch_reprint_order_ids(db_conn, payload)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid order_ids or date range.", "details": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"BATCH_REPRINT: Could not resolve orders: {e}", exc_info=True)
+        return jsonify({"error": "Failed to look up orders for reprint.", "details": str(e)}), 500
+    if not order_ids:
+        return jsonify({"error": "No matching orders found."}), 404
+    if len(order_ids) > BATCH_REPRINT_MAX_ORDERS:
+        return jsonify({"error": f"Too many orders; at most {BATCH_REPRINT_MAX_ORDERS} can be reprinted at once."}), 400
+
+    include_labels = payload.get('include_labels', True) is not False
+    print(f"INFO BATCH_REPRINT: Reprinting {len(order_ids)} order(s), labels {'included' if include_labels else 'excluded'}.")
+    reprint = _generate_batch_reprint(order_ids, include_labels)
+    try:
+        first_chunk = next(reprint)  # renders until the first document is merged
+    except _NothingToReprint as e:
+        status_code = 500 if e.skipped else 404
+        return jsonify({"error": "None of the documents for these orders could be produced." if e.skipped
+                        else "These orders have no packing slip items or stored labels to reprint.", "skipped": e.skipped}), status_code
+    except Exception as e:
+        current_app.logger.error(f"BATCH_REPRINT: Reprint failed before any output: {e}", exc_info=True)
+        return jsonify({"error": "Failed to build the reprint.", "details": str(e)}), 500
+    def _stream_reprint():
+        yield first_chunk
+        yield from reprint
+    filename = f"reprint_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.pdf"
+    return Response(stream_with_context(_stream_reprint()), mimetype="application/pdf",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -1,7 +1,7 @@
 # order-processing-app/blueprints/quickbooks.py
 
 import traceback
-from flask import Blueprint, jsonify, request, g, current_app
+from flask import Blueprint, jsonify, request, g, current_app, Response
 from sqlalchemy import text # Not directly used here but can be if needed for status checks
 from datetime import datetime, timezone
 import sys # For traceback
@@ -15,9 +15,54 @@ from app import (
 # Import service modules
 import iif_generator # This blueprint heavily uses iif_generator
 import email_service # iif_generator uses this, but trigger_sync also calls it
+import iif_batch_store # Stored IIF batches for re-download / re-send
+import background_jobs # Runs the IIF syncs off the request thread
+
+# Both sync flows flip PO sync statuses, so they share one key: only one may be queued or running.
+QB_SYNC_DEDUPE_KEY = "quickbooks-iif-sync"
+QB_ON_DEMAND_SYNC_JOB = "quickbooks_on_demand_sync"
+QB_DAILY_IIF_BATCH_JOB = "quickbooks_daily_iif_batch"
+QB_TODAY_IIF_JOB = "quickbooks_today_iif"
+QB_SYNC_JOB_TYPES = (QB_ON_DEMAND_SYNC_JOB, QB_DAILY_IIF_BATCH_JOB, QB_TODAY_IIF_JOB)
 
 quickbooks_bp = Blueprint('quickbooks_bp', __name__)
 
+def _queue_sync_job(job_type, requested_by):
+    """Submits a sync job and builds the 202 response (pointing at the in-flight job if one exists)."""
+    job, created = background_jobs.submit(job_type, dedupe_key=QB_SYNC_DEDUPE_KEY, requested_by=requested_by)
+    message = ("QuickBooks sync queued." if created
+               else f"A QuickBooks sync (job {job['id']}, {job['job_type']}) is already {job['status']}; not starting another.")
+    return jsonify({"message": message, "job_id": job["id"], "job_type": job["job_type"], "status": job["status"],
+                    "deduplicated": not created, "status_url": f"/api/quickbooks/jobs/{job['id']}"}), 202
+
+
+def run_daily_iif_batch(progress=None):
+    """Yesterday's PO IIF batch: generate, store, email, update statuses. Returns (response_dict, status_code)."""
+    if progress: progress("Generating, storing and emailing yesterday's Purchase Order IIF batch.")
+    # This function was designed for POs from yesterday
+    iif_generator.create_and_email_daily_iif_batch(engine) # Passes engine
+    print(f"INFO QB_BP (DAILY IIF BATCH): Daily IIF batch (yesterday's POs) task completed.", flush=True)
+    return {"message": "Daily IIF batch (yesterday's POs) task completed."}, 200
+
+
+def run_today_iif(progress=None):
+    """Today's PO IIF: generate and email. Returns (response_dict, status_code)."""
+    if progress: progress("Generating and emailing today's Purchase Order IIF.")
+    print("INFO QB_BP (TODAY IIF USER): Calling iif_generator.create_and_email_iif_for_today...", flush=True)
+    # This function was designed for POs from today
+    success, result_message_or_content = iif_generator.create_and_email_iif_for_today(engine) # Passes engine
+
+    if success:
+        # Avoid printing potentially large IIF content to log
+        log_result = result_message_or_content
+        if isinstance(result_message_or_content, str) and len(result_message_or_content) > 200:
+            log_result = f"IIF content generated (length: {len(result_message_or_content)})"
+        print(f"INFO QB_BP (TODAY IIF USER): Today's IIF task completed. Success: {success}, Result: {log_result}", flush=True)
+        return {"message": "IIF generation for today's POs triggered and email sent (if configured)."}, 200
+    print(f"ERROR QB_BP (TODAY IIF USER): Today's IIF task failed. Success: {success}, Message: {result_message_or_content}", flush=True)
+    return {"error": result_message_or_content or "IIF generation for today failed. Check logs."}, 500
+
+
 # SCHEDULER ROUTE FOR THE MAIN DAILY BATCH (YESTERDAY'S POs) - POs only
 @quickbooks_bp.route('/tasks/scheduler/trigger-daily-iif-batch', methods=['POST'])
 def scheduler_trigger_daily_iif_batch():
@@ -34,12 +79,11 @@ def scheduler_trigger_daily_iif_batch():
         print("ERROR QB_BP (DAILY IIF BATCH): Database engine not initialized.", flush=True)
         return jsonify({"error": "Database engine not available."}), 500
     try:
-        print("INFO QB_BP (DAILY IIF BATCH): Calling iif_generator.create_and_email_daily_iif_batch...", flush=True)
-        # This function was designed for POs from yesterday
-        iif_generator.create_and_email_daily_iif_batch(engine) # Passes engine
-
-        print(f"INFO QB_BP (DAILY IIF BATCH): Daily IIF batch (yesterday's POs) task triggered successfully.", flush=True)
-        return jsonify({"message": "Daily IIF batch (yesterday's POs) task triggered."}), 200
+        if background_jobs.is_enabled():
+            return _queue_sync_job(QB_DAILY_IIF_BATCH_JOB, requested_by="scheduler")
+        print("INFO QB_BP (DAILY IIF BATCH): Background jobs disabled; running daily IIF batch inline...", flush=True)
+        result, status_code = run_daily_iif_batch()
+        return jsonify(result), status_code
     except Exception as e:
         print(f"ERROR QB_BP (DAILY IIF BATCH): Unhandled exception in route: {e}", flush=True)
         traceback.print_exc(file=sys.stderr)
@@ -58,37 +102,31 @@ def user_trigger_iif_for_today():
         print("ERROR QB_BP (TODAY IIF USER): Database engine not initialized.", flush=True)
         return jsonify({"error": "Database engine not available."}), 500
     try:
-        print("INFO QB_BP (TODAY IIF USER): Calling iif_generator.create_and_email_iif_for_today...", flush=True)
-        # This function was designed for POs from today
-        success, result_message_or_content = iif_generator.create_and_email_iif_for_today(engine) # Passes engine
-
-        if success:
-            # Avoid printing potentially large IIF content to log
-            log_result = result_message_or_content
-            if isinstance(result_message_or_content, str) and len(result_message_or_content) > 200:
-                log_result = f"IIF content generated (length: {len(result_message_or_content)})"
-            print(f"INFO QB_BP (TODAY IIF USER): Today's IIF task completed. Success: {success}, Result: {log_result}", flush=True)
-            return jsonify({"message": "IIF generation for today's POs triggered and email sent (if configured)."}), 200
-        else:
-            print(f"ERROR QB_BP (TODAY IIF USER): Today's IIF task failed. Success: {success}, Message: {result_message_or_content}", flush=True)
-            return jsonify({"error": result_message_or_content or "IIF generation for today failed. Check logs."}), 500
+        if background_jobs.is_enabled():
+            requested_by = getattr(g, "user_email", None) or getattr(g, "user_uid", None)
+            return _queue_sync_job(QB_TODAY_IIF_JOB, requested_by=requested_by)
+        print("INFO QB_BP (TODAY IIF USER): Background jobs disabled; running today's IIF inline...", flush=True)
+        result, status_code = run_today_iif()
+        return jsonify(result), status_code
     except Exception as e:
         print(f"ERROR QB_BP (TODAY IIF USER): Unhandled exception in route: {e}", flush=True)
         traceback.print_exc(file=sys.stderr)
         sys.stderr.flush()
         return jsonify({"error": "An error occurred during user-triggered IIF generation.", "details": str(e)}), 500
 
-@quickbooks_bp.route('/quickbooks/trigger-sync', methods=['POST'])
-@verify_firebase_token
-def trigger_quickbooks_sync_on_demand():
-    print("INFO QB_BP (ON-DEMAND SYNC): Received request to trigger on-demand QuickBooks IIF generation.", flush=True)
+def run_quickbooks_sync(progress=None):
+    """
+    Generates, stores and emails IIF for ALL pending POs and Sales Orders, then marks them synced.
+    Returns (response_dict, status_code); runs as a background job or inline (see trigger_quickbooks_sync_on_demand).
+    """
+    report_progress = progress or (lambda message: None)
     try:
         if iif_generator is None:
             print("ERROR QB_BP (ON-DEMAND SYNC): iif_generator module not loaded.", flush=True)
-            return jsonify({"error": "IIF generation module not available at the server.", "details": "iif_generator is None"}), 500
+            return {"error": "IIF generation module not available at the server.", "details": "iif_generator is None"}, 500
         if engine is None:
             print("ERROR QB_BP (ON-DEMAND SYNC): Database engine not initialized.", flush=True)
-            return jsonify({"error": "Database engine not available at the server.", "details": "engine is None"}), 500
+            return {"error": "Database engine not available at the server.", "details": "engine is None"}, 500
 
         po_sync_success = False
         po_sync_message = "PO sync not initiated."
@@ -104,6 +142,7 @@ def trigger_quickbooks_sync_on_demand():
         # --- Process Purchase Orders ---
         try:
             print("INFO QB_BP (ON-DEMAND SYNC): Generating IIF for ALL PENDING Purchase Orders...", flush=True)
+            report_progress("Generating and emailing Purchase Order IIF.")
             # The `generate_po_iif_content_for_date` in iif_generator.py will handle filtering for pending
             po_iif_content, po_mapping_failures, po_ids_in_batch = iif_generator.generate_po_iif_content_for_date(engine, process_all_pending=True) # Pass engine
             
@@ -123,8 +162,8 @@ def trigger_quickbooks_sync_on_demand():
                             po_email_warning_html = "\n".join(po_warn_lines)
                         
                         # Use the send_iif_batch_email from the imported email_service module
-                        email_sent_po = email_service.send_iif_batch_email(
-                            iif_content_string=po_iif_content,
+                        email_sent_po, _ = iif_generator.store_and_email_iif_batch(
+                            engine, "po", po_iif_content, po_ids_in_batch, po_mapping_failures,
                             batch_date_str=f"OnDemand_AllPendingPOs_{current_time_for_sync.strftime('%Y%m%d_%H%M%S')}",
                             warning_message_html=po_email_warning_html, # Pass formatted warnings
                             custom_subject=f"QB SYNC POs | {current_time_for_sync.strftime('%Y-%m-%d %H:%M')}"
@@ -138,6 +177,8 @@ def trigger_quickbooks_sync_on_demand():
                             po_sync_message = f"Purchase Order IIF generated for {len(po_ids_in_batch)} items, but email FAILED."
                     else:
                         print("WARN QB_BP (ON-DEMAND SYNC): Email service not available for POs. IIF not emailed.", flush=True)
+                        iif_generator.store_iif_batch(engine, "po", po_iif_content, po_ids_in_batch, po_mapping_failures,
+                                                      label=f"OnDemand_AllPendingPOs_{current_time_for_sync.strftime('%Y%m%d_%H%M%S')}")
                         po_sync_success = True # IIF generated, just not emailed
                         processed_po_db_ids_for_db_update = po_ids_in_batch
                         po_sync_message = f"Purchase Order IIF generated for {len(po_ids_in_batch)} items, but email service unavailable."
@@ -161,6 +202,7 @@ def trigger_quickbooks_sync_on_demand():
         # --- Process Sales Orders ---
         try:
             print("INFO QB_BP (ON-DEMAND SYNC): Generating IIF for ALL PENDING Sales Orders/Invoices...", flush=True)
+            report_progress(f"{po_sync_message} Generating and emailing Sales Order IIF.")
             sales_iif_content, sales_mapping_failures, sales_ids_in_batch = iif_generator.generate_sales_iif_content_for_date(engine, process_all_pending=True) # Pass engine
             
             if sales_iif_content:
@@ -180,8 +222,8 @@ def trigger_quickbooks_sync_on_demand():
                             sales_warn_lines.append("</ul><hr>")
                             sales_email_warning_html = "\n".join(sales_warn_lines)
                         
-                        email_sent_sales = email_service.send_iif_batch_email(
-                            iif_content_string=sales_iif_content,
+                        email_sent_sales, _ = iif_generator.store_and_email_iif_batch(
+                            engine, "sales", sales_iif_content, sales_ids_in_batch, sales_mapping_failures,
                             batch_date_str=f"OnDemand_AllPendingSales_{current_time_for_sync.strftime('%Y%m%d_%H%M%S')}",
                             warning_message_html=sales_email_warning_html,
                             custom_subject=f"QB SYNC Sales | {current_time_for_sync.strftime('%Y-%m-%d %H:%M')}"
@@ -195,6 +237,8 @@ def trigger_quickbooks_sync_on_demand():
                             sales_sync_message = f"Sales Order IIF generated for {len(sales_ids_in_batch)} items, but email FAILED."
                     else:
                         print("WARN QB_BP (ON-DEMAND SYNC): Email service not available for Sales. IIF not emailed.", flush=True)
+                        iif_generator.store_iif_batch(engine, "sales", sales_iif_content, sales_ids_in_batch, sales_mapping_failures,
+                                                      label=f"OnDemand_AllPendingSales_{current_time_for_sync.strftime('%Y%m%d_%H%M%S')}")
                         sales_sync_success = True
                         processed_sales_order_db_ids_for_db_update = sales_ids_in_batch
                         sales_sync_message = f"Sales Order IIF generated for {len(sales_ids_in_batch)} items, but email service unavailable."
@@ -215,6 +259,7 @@ def trigger_quickbooks_sync_on_demand():
             sales_sync_message = f"Error generating/processing Sales IIF: {str(e_sales)}"
 
         # --- Database Status Updates ---
+        report_progress("Updating QuickBooks sync statuses.")
         try:
             with engine.connect() as conn: # Use 'conn' as the variable name for the connection
                 with conn.begin(): # Start a transaction on this connection
@@ -247,7 +292,7 @@ def trigger_quickbooks_sync_on_demand():
 
         print(f"INFO QB_BP (ON-DEMAND SYNC): Finalizing response. Overall success: {overall_success}. Message: {final_status_message}", flush=True)
         if overall_success:
-            return jsonify({"message": final_status_message, "po_status": po_sync_message, "sales_status": sales_sync_message, "db_update_info": db_update_error_message or "DB status updates successful (if any)."}), 200
+            return {"message": final_status_message, "po_status": po_sync_message, "sales_status": sales_sync_message, "db_update_info": db_update_error_message or "DB status updates successful (if any)."}, 200
         else:
             # Be more specific in the top-level error message if possible
             error_summary = "One or more operations had issues."
@@ -255,10 +300,172 @@ def trigger_quickbooks_sync_on_demand():
             if not sales_sync_success and "No pending Sales Orders" not in sales_sync_message : error_summary += " Sales sync failed."
             if db_update_error_message: error_summary += " DB update failed."
 
-            return jsonify({"error": error_summary.strip(), "details": final_status_message, "po_status": po_sync_message, "sales_status": sales_sync_message, "db_update_info": db_update_error_message}), 500
+            return {"error": error_summary.strip(), "details": final_status_message, "po_status": po_sync_message, "sales_status": sales_sync_message, "db_update_info": db_update_error_message}, 500
 
     except Exception as e: # Catch-all for the entire route
         print(f"CRITICAL ERROR QB_BP (ON-DEMAND SYNC): Unhandled exception in main route try-block: {e}", flush=True)
         traceback.print_exc(file=sys.stderr)
         sys.stderr.flush()
-        return jsonify({"error": "A critical unexpected error occurred during the sync process.", "details": str(e)}), 500
\ No newline at end of file
+        return {"error": "A critical unexpected error occurred during the sync process.", "details": str(e)}, 500
+
+
+@background_jobs.job_handler(QB_ON_DEMAND_SYNC_JOB)
+def _quickbooks_sync_job(payload, progress):
+    result, status_code = run_quickbooks_sync(progress)
+    if status_code >= 400:
+        raise background_jobs.JobFailed(result.get("error") or "QuickBooks sync failed.", result)
+    return result
+
+
+@background_jobs.job_handler(QB_DAILY_IIF_BATCH_JOB)
+def _daily_iif_batch_job(payload, progress):
+    result, _ = run_daily_iif_batch(progress)
+    return result
+
+
+@background_jobs.job_handler(QB_TODAY_IIF_JOB)
+def _today_iif_job(payload, progress):
+    result, status_code = run_today_iif(progress)
+    if status_code >= 400:
+        raise background_jobs.JobFailed(result.get("error") or "IIF generation for today failed.", result)
+    return result
+
+
+@quickbooks_bp.route('/quickbooks/trigger-sync', methods=['POST'])
+@verify_firebase_token
+def trigger_quickbooks_sync_on_demand():
+    print("INFO QB_BP (ON-DEMAND SYNC): Received request to trigger on-demand QuickBooks IIF generation.", flush=True)
+    if iif_generator is None:
+        print("ERROR QB_BP (ON-DEMAND SYNC): iif_generator module not loaded.", flush=True)
+        return jsonify({"error": "IIF generation module not available at the server.", "details": "iif_generator is None"}), 500
+    if engine is None:
+        print("ERROR QB_BP (ON-DEMAND SYNC): Database engine not initialized.", flush=True)
+        return jsonify({"error": "Database engine not available at the server.", "details": "engine is None"}), 500
+    if background_jobs.is_enabled():
+        try:
+            return _queue_sync_job(QB_ON_DEMAND_SYNC_JOB, requested_by=getattr(g, "user_email", None) or getattr(g, "user_uid", None))
+        except Exception as e:
+            print(f"ERROR QB_BP (ON-DEMAND SYNC): Could not queue sync job: {e}", flush=True)
+            traceback.print_exc(file=sys.stderr)
+            return jsonify({"error": "Could not queue the QuickBooks sync.", "details": str(e)}), 500
+    result, status_code = run_quickbooks_sync()
+    return jsonify(result), status_code
+
+
+@quickbooks_bp.route('/quickbooks/jobs/<int:job_id>', methods=['GET'])
+@verify_firebase_token
+def get_quickbooks_job(job_id):
+    try:
+        job = background_jobs.get_job(job_id)
+    except Exception as e:
+        print(f"ERROR QB_BP (JOBS): Failed to load job {job_id}: {e}", flush=True)
+        return jsonify({"error": "Failed to load job.", "details": str(e)}), 500
+    if job is None or job["job_type"] not in QB_SYNC_JOB_TYPES:
+        return jsonify({"error": f"Job {job_id} not found."}), 404
+    return jsonify(job), 200
+
+
+@quickbooks_bp.route('/quickbooks/jobs', methods=['GET'])
+@verify_firebase_token
+def list_quickbooks_jobs():
+    limit = max(1, min(request.args.get('limit', 20, type=int) or 20, 100))
+    try:
+        return jsonify(background_jobs.list_jobs(job_types=QB_SYNC_JOB_TYPES, limit=limit)), 200
+    except Exception as e:
+        print(f"ERROR QB_BP (JOBS): Failed to list jobs: {e}", flush=True)
+        return jsonify({"error": "Failed to list jobs.", "details": str(e)}), 500
+
+
+# --- Stored IIF batches (re-download / re-send without regenerating; see iif_batch_store.py) ---
+def _iif_batch_summary(batch):
+    return {key: batch.get(key) for key in ("id", "batch_type", "batch_label", "filename", "content_sha256",
+                                            "content_bytes", "record_count", "email_status", "emailed_at", "created_at")}
+
+
+@quickbooks_bp.route('/quickbooks/iif-batches', methods=['GET'])
+@verify_firebase_token
+def list_iif_batches():
+    batch_type = request.args.get('type')
+    if batch_type and batch_type not in iif_batch_store.BATCH_TYPES:
+        return jsonify({"error": f"type must be one of {', '.join(iif_batch_store.BATCH_TYPES)}."}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int) or 50, 200))
+    try:
+        batches = iif_batch_store.list_batches(engine, batch_type=batch_type, limit=limit)
+        return jsonify([_iif_batch_summary(batch) for batch in batches]), 200
+    except Exception as e:
+        print(f"ERROR QB_BP (IIF BATCHES): Failed to list IIF batches: {e}", flush=True)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Failed to list IIF batches.", "details": str(e)}), 500
+
+
+@quickbooks_bp.route('/quickbooks/iif-batches/<int:batch_id>', methods=['GET'])
+@verify_firebase_token
+def get_iif_batch_manifest(batch_id):
+    try:
+        batch = iif_batch_store.get_batch(engine, batch_id)
+    except Exception as e:
+        print(f"ERROR QB_BP (IIF BATCHES): Failed to load IIF batch {batch_id}: {e}", flush=True)
+        return jsonify({"error": "Failed to load IIF batch.", "details": str(e)}), 500
+    if batch is None:
+        return jsonify({"error": f"IIF batch {batch_id} not found."}), 404
+    manifest = _iif_batch_summary(batch)
+    manifest.update(record_ids=batch["record_ids"], mapping_failures=batch.get("mapping_failures") or [])
+    return jsonify(manifest), 200
+
+
+@quickbooks_bp.route('/quickbooks/iif-batches/<int:batch_id>/download', methods=['GET'])
+@verify_firebase_token
+def download_iif_batch(batch_id):
+    try:
+        batch = iif_batch_store.get_batch(engine, batch_id)
+        if batch is None:
+            return jsonify({"error": f"IIF batch {batch_id} not found."}), 404
+        # Content is immutable per hash, so a matching ETag never needs the artifact read.
+        if batch["content_sha256"] in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(batch["content_sha256"])
+            return response
+        content_bytes = iif_batch_store.read_batch_content(batch)
+    except iif_batch_store.IIFBatchIntegrityError as e:
+        print(f"ERROR QB_BP (IIF BATCHES): {e}", flush=True)
+        return jsonify({"error": "Stored IIF batch is missing or corrupted.", "details": str(e)}), 500
+    except Exception as e:
+        print(f"ERROR QB_BP (IIF BATCHES): Failed to read IIF batch {batch_id}: {e}", flush=True)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Failed to read IIF batch.", "details": str(e)}), 500
+
+    response = Response(content_bytes, mimetype=iif_batch_store.IIF_CONTENT_TYPE)
+    response.headers["Content-Disposition"] = f'attachment; filename="{batch["filename"]}"'
+    response.headers["Cache-Control"] = "private, max-age=86400, immutable"
+    response.set_etag(batch["content_sha256"])
+    return response
+
+
+@quickbooks_bp.route('/quickbooks/iif-batches/<int:batch_id>/resend-email', methods=['POST'])
+@verify_firebase_token
+def resend_iif_batch_email(batch_id):
+    if not email_service:
+        return jsonify({"error": "Email service not available."}), 500
+    try:
+        batch = iif_batch_store.get_batch(engine, batch_id)
+        if batch is None:
+            return jsonify({"error": f"IIF batch {batch_id} not found."}), 404
+        content_bytes = iif_batch_store.read_batch_content(batch)
+        batch_label = batch.get("batch_label") or f"Batch_{batch_id}"
+        email_sent = email_service.send_iif_batch_email(
+            iif_content_string=content_bytes.decode("utf-8"),
+            batch_date_str=batch_label,
+            custom_subject=f"QB SYNC {'POs' if batch['batch_type'] == 'po' else 'Sales'} | Re-send of batch #{batch_id} ({batch_label})",
+            iif_filename=batch["filename"]
+        )
+        iif_batch_store.mark_email_result(engine, batch_id, email_sent)
+    except iif_batch_store.IIFBatchIntegrityError as e:
+        print(f"ERROR QB_BP (IIF BATCHES): {e}", flush=True)
+        return jsonify({"error": "Stored IIF batch is missing or corrupted.", "details": str(e)}), 500
+    except Exception as e:
+        print(f"ERROR QB_BP (IIF BATCHES): Failed to re-send IIF batch {batch_id}: {e}", flush=True)
+        traceback.print_exc(file=sys.stderr)
+        return jsonify({"error": "Failed to re-send IIF batch.", "details": str(e)}), 500
+    if not email_sent:
+        return jsonify({"error": f"Email for IIF batch {batch_id} failed to send."}), 502
+    return jsonify({"message": f"IIF batch {batch_id} re-sent.", "batch": _iif_batch_summary(dict(batch, email_status="sent"))}), 200
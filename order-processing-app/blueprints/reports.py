@@ -1,67 +1,163 @@
 # order-processing-app/blueprints/reports.py
 
+import os
 import traceback
 from flask import Blueprint, jsonify, request, g, current_app
 from sqlalchemy import text
-from datetime import datetime, timezone, timedelta
-from decimal import Decimal # Though not directly used, good to have if other reports are added
+from datetime import date, timedelta
+from decimal import Decimal
 
 # Imports from the main app.py
 from app import (
-    engine, verify_firebase_token,
-    convert_row_to_dict, make_json_safe
+    engine, verify_firebase_token
 )
 # No specific service modules are directly used by this report route
 
 reports_bp = Blueprint('reports_bp', __name__)
 
+REPORTS_DEFAULT_TIMEZONE = os.getenv("REPORTS_DEFAULT_TIMEZONE", "UTC")
+REVENUE_REPORT_DEFAULT_DAYS = 14
+REVENUE_REPORT_MAX_DAYS = 366 * 10
+REVENUE_GRANULARITIES = ('day', 'week', 'month')
+REVENUE_BREAKDOWNS = {'status': 'status', 'payment_method': 'payment_method'}
+# True once the order_revenue_hourly triggers (db_schema) are known to exist. Only a positive result
+# is cached, so the rollup is used as soon as it is created.
+_revenue_rollup_ready = False
+_revenue_rollup_missing_logged = False
+
+
+def _period_start(day, granularity):
+    if granularity == 'week': return day - timedelta(days=day.weekday())  # date_trunc('week') = Monday
+    if granularity == 'month': return day.replace(day=1)
+    return day
+
+
+def _revenue_periods(start_date, end_date, granularity):
+    """Every period start between the two dates (inclusive), newest first, for zero-filling."""
+    periods, current = [], _period_start(end_date, granularity)
+    first = _period_start(start_date, granularity)
+    while current >= first:
+        periods.append(current)
+        if granularity == 'week': current -= timedelta(days=7)
+        elif granularity == 'month': current = (current - timedelta(days=1)).replace(day=1)
+        else: current -= timedelta(days=1)
+    return periods
+
+
+def _revenue_query(db_conn, granularity, breakdown_column):
+    """
+    Rollup query when order_revenue_hourly is maintained, otherwise the same aggregation over orders.
+    Both filter with a half-open range on the stored timestamp (local midnight -> UTC instant),
+    so the index is used; time zone conversion happens only on the already-filtered rows.
+    order_date is read as UTC in both paths (as db_schema._UTC_HOUR_BUCKET does), whatever the
+    session TimeZone.
+    """
+    global _revenue_rollup_ready, _revenue_rollup_missing_logged
+    if not _revenue_rollup_ready:
+        _revenue_rollup_ready = bool(db_conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_revenue_hourly_ins')"
+        )).scalar())
+        if not _revenue_rollup_ready and not _revenue_rollup_missing_logged:
+            _revenue_rollup_missing_logged = True
+            print("WARN DAILY_REVENUE_BP: order_revenue_hourly triggers missing; aggregating orders live.")
+    range_start = "(CAST(:start_date AS TIMESTAMP) AT TIME ZONE :tz)"
+    range_end = "(CAST(:end_date_exclusive AS TIMESTAMP) AT TIME ZONE :tz)"
+    if _revenue_rollup_ready:
+        source, ts_column, instant_expr = "order_revenue_hourly", "bucket_hour", "bucket_hour"
+        count_expr, revenue_expr = "SUM(order_count)", "SUM(revenue)"
+    else:
+        # Range bounds become UTC wall-clock times so they compare with order_date directly.
+        source, ts_column, instant_expr = "orders", "order_date", "(order_date AT TIME ZONE 'UTC')"
+        count_expr, revenue_expr = "COUNT(*)", "COALESCE(SUM(total_sale_price), 0)"
+        range_start, range_end = f"({range_start} AT TIME ZONE 'UTC')", f"({range_end} AT TIME ZONE 'UTC')"
+    group_column = f", COALESCE({breakdown_column}, '') AS breakdown_key" if breakdown_column else ""
+    return text(f"""
+        SELECT CAST(date_trunc('{granularity}', {instant_expr} AT TIME ZONE :tz) AS DATE) AS period_start{group_column},
+               {count_expr} AS order_count, {revenue_expr} AS revenue
+        FROM {source}
+        WHERE {ts_column} >= {range_start}
+          AND {ts_column} < {range_end}
+        GROUP BY 1{', 2' if breakdown_column else ''}
+    """)
+
+
 @reports_bp.route('/reports/daily-revenue', methods=['GET'])
 @verify_firebase_token
 def get_daily_revenue_report():
-    print("DEBUG DAILY_REVENUE_BP: Received request for daily revenue report.")
+    """
+    Revenue per period, newest first, with empty periods filled with zeros.
+
+    Query params (all optional; defaults reproduce the original 14-day UTC report):
+      start_date / end_date  YYYY-MM-DD, inclusive, in `tz` (default: last `days` days ending today)
+      days                   window length when start_date is omitted (default 14)
+      granularity            day | week | month
+      tz                     IANA time zone name with a whole-hour UTC offset (default REPORTS_DEFAULT_TIMEZONE)
+      breakdown              status | payment_method -> adds "breakdown": {key: {revenue, order_count}}
+    Each entry: {"sale_date": period start, "daily_revenue": float, "order_count": int[, "breakdown"]}.
+    """
     db_conn = None
     try:
         if engine is None:
             print("ERROR DAILY_REVENUE_BP: Database engine not available.")
             return jsonify({"error": "Database engine not available."}), 500
+
+        granularity = request.args.get('granularity', 'day').lower()
+        if granularity not in REVENUE_GRANULARITIES:
+            return jsonify({"error": f"granularity must be one of {', '.join(REVENUE_GRANULARITIES)}"}), 400
+        breakdown = request.args.get('breakdown')
+        if breakdown and breakdown not in REVENUE_BREAKDOWNS:
+            return jsonify({"error": f"breakdown must be one of {', '.join(REVENUE_BREAKDOWNS)}"}), 400
+        tz_name = request.args.get('tz', REPORTS_DEFAULT_TIMEZONE)
+
         db_conn = engine.connect()
-        print("DEBUG DAILY_REVENUE_BP: DB connection established.")
-        
-        today_utc = datetime.now(timezone.utc).date()
-        start_date_utc = today_utc - timedelta(days=13) # For the last 14 days including today
-        
-        sql_query = text("""
-            SELECT DATE(order_date AT TIME ZONE 'UTC') AS sale_date, SUM(total_sale_price) AS daily_revenue
-            FROM orders WHERE DATE(order_date AT TIME ZONE 'UTC') >= :start_date
-            GROUP BY sale_date ORDER BY sale_date DESC LIMIT 14;
-        """)
-        
-        records = db_conn.execute(sql_query, {"start_date": start_date_utc}).fetchall()
-        
-        # Convert records to a dictionary for easier lookup
-        revenue_map = {}
+        tz_offset_seconds = db_conn.execute(
+            text("SELECT EXTRACT(EPOCH FROM utc_offset) FROM pg_timezone_names WHERE name = :tz"), {"tz": tz_name}).scalar()
+        if tz_offset_seconds is None:
+            return jsonify({"error": f"Unknown time zone '{tz_name}'."}), 400
+        if int(tz_offset_seconds) % 3600:
+            # The rollup is bucketed by UTC hour, so local days must start on a UTC hour boundary.
+            return jsonify({"error": f"Time zone '{tz_name}' is not a whole-hour UTC offset; only whole-hour zones are supported."}), 400
+        today_local = db_conn.execute(text("SELECT CAST(NOW() AT TIME ZONE :tz AS DATE)"), {"tz": tz_name}).scalar()
+
+        try:
+            end_date = date.fromisoformat(request.args['end_date']) if request.args.get('end_date') else today_local
+            if request.args.get('start_date'):
+                start_date = date.fromisoformat(request.args['start_date'])
+            else:
+                start_date = end_date - timedelta(days=int(request.args.get('days', REVENUE_REPORT_DEFAULT_DAYS)) - 1)
+        except ValueError as ve:
+            return jsonify({"error": f"Invalid date range parameter: {ve}"}), 400
+        if start_date > end_date:
+            return jsonify({"error": "start_date must be on or before end_date."}), 400
+        if (end_date - start_date).days >= REVENUE_REPORT_MAX_DAYS:
+            return jsonify({"error": f"Date range is limited to {REVENUE_REPORT_MAX_DAYS} days."}), 400
+
+        records = db_conn.execute(
+            _revenue_query(db_conn, granularity, REVENUE_BREAKDOWNS.get(breakdown)),
+            {"tz": tz_name, "start_date": start_date, "end_date_exclusive": end_date + timedelta(days=1)}
+        ).fetchall()
+
+        totals = {}
         for row in records:
-            row_dict = convert_row_to_dict(row) # Use your helper
-            if row_dict and row_dict.get('sale_date') is not None:
-                # Ensure sale_date is a string in 'YYYY-MM-DD' format for the map key
-                sale_date_str = row_dict['sale_date'].strftime('%Y-%m-%d') if isinstance(row_dict['sale_date'], datetime) else str(row_dict['sale_date'])
-                revenue_map[sale_date_str] = float(row_dict.get('daily_revenue', 0.0))
-
-        # Prepare the final list for the last 14 days, filling in zeros for days with no sales
-        complete_daily_revenue = []
-        for i in range(14): # Iterate 0 to 13
-            current_date = today_utc - timedelta(days=i)
-            current_date_str = current_date.strftime('%Y-%m-%d')
-            complete_daily_revenue.append({
-                "sale_date": current_date_str,
-                "daily_revenue": revenue_map.get(current_date_str, 0.0)
-            })
-        
-        # The report should be in chronological order for the frontend usually
-        # complete_daily_revenue.reverse() # Reverse to have oldest day first, newest day last
-
-        print(f"DEBUG DAILY_REVENUE_BP: Fetched daily revenue for last 14 days. Count: {len(complete_daily_revenue)}")
-        return jsonify(make_json_safe(complete_daily_revenue)), 200
+            entry = totals.setdefault(row.period_start, {"revenue": Decimal("0"), "order_count": 0, "breakdown": {}})
+            entry["revenue"] += row.revenue or 0
+            entry["order_count"] += int(row.order_count or 0)
+            if breakdown:
+                entry["breakdown"][row.breakdown_key] = {"revenue": float(row.revenue or 0), "order_count": int(row.order_count or 0)}
+
+        report = []
+        for period in _revenue_periods(start_date, end_date, granularity):
+            entry = totals.get(period)
+            item = {
+                "sale_date": period.strftime('%Y-%m-%d'),
+                "daily_revenue": float(entry["revenue"]) if entry else 0.0,
+                "order_count": entry["order_count"] if entry else 0,
+            }
+            if breakdown: item["breakdown"] = entry["breakdown"] if entry else {}
+            report.append(item)
+
+        print(f"DEBUG DAILY_REVENUE_BP: {granularity} revenue {start_date}..{end_date} ({tz_name}), {len(report)} periods.")
+        return jsonify(report), 200
     except Exception as e:
         print(f"ERROR DAILY_REVENUE_BP: {e}")
         traceback.print_exc()
@@ -69,4 +165,3 @@ def get_daily_revenue_report():
     finally:
         if db_conn and not db_conn.closed:
             db_conn.close()
-            print("DEBUG DAILY_REVENUE_BP: DB connection closed.")
\ No newline at end of file
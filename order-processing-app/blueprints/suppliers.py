@@ -11,8 +11,9 @@ from decimal import Decimal # For get_supplier data conversion
 # Imports from the main app.py
 from app import (
     engine, verify_firebase_token,
-    convert_row_to_dict, make_json_safe
+    convert_row_to_dict
 )
+from json_serialization import stream_query_as_json
 # No specific service modules like document_generator are directly used by supplier CRUD
 
 suppliers_bp = Blueprint('suppliers_bp', __name__)
@@ -92,21 +93,14 @@ def create_supplier():
 def list_suppliers():
     print("Received request for GET /api/suppliers")
     if engine is None: return jsonify({"message": "Database engine not initialized."}), 500
-    conn = None
     try:
-        conn = engine.connect()
         query = text("SELECT * FROM suppliers ORDER BY name") # sqlalchemy.text
-        result = conn.execute(query)
-        # Use convert_row_to_dict and make_json_safe for consistency
-        suppliers_list = [convert_row_to_dict(row) for row in result]
-        print(f"DEBUG LIST_SUPPLIERS: Found {len(suppliers_list)} suppliers.")
-        return jsonify(make_json_safe(suppliers_list)), 200
+        # Streamed from the cursor; convert_row_to_dict for consistency
+        return stream_query_as_json(engine, query, row_to_dict=convert_row_to_dict)
     except Exception as e:
         print(f"DEBUG LIST_SUPPLIERS: Caught unexpected exception: {e}")
         traceback.print_exc()
         return jsonify({"message": f"Error fetching suppliers: {e}", "error_type": type(e).__name__}), 500
-    finally:
-        if conn and not conn.closed: conn.close(); print("DEBUG LIST_SUPPLIERS: Database connection closed.")
 
 @suppliers_bp.route('/suppliers/<int:supplier_id>', methods=['GET'])
 @verify_firebase_token
@@ -124,7 +118,7 @@ def get_supplier(supplier_id):
         
         supplier_dict = convert_row_to_dict(result) # Use helper
         print(f"DEBUG GET_SUPPLIER: Found supplier with ID: {supplier_id}.")
-        return jsonify(make_json_safe(supplier_dict)), 200 # Use helper
+        return jsonify(supplier_dict), 200 # Use helper
     except Exception as e:
         print(f"DEBUG GET_SUPPLIER: Caught unexpected exception: {e}")
         traceback.print_exc()
@@ -172,7 +172,7 @@ from sqlalchemy import text # Make sure text is imported
 # Imports from the main app.py or other modules
 # Ensure these imports point to your main app instance correctly
 # If utils_routes.py is in 'blueprints' and app.py is in parent:
-from app import engine, verify_firebase_token 
+from app import engine, verify_firebase_token
 # If app.py is in the same directory (less common for blueprints):
 # from app import engine, verify_firebase_token 
 
@@ -246,4 +246,65 @@ def delete_order_by_bc_id_route(bc_order_id_str):
     except Exception as e:
         # The transaction will be rolled back automatically by the `with conn.begin()` context manager if an exception occurs
         current_app.logger.error(f"Error deleting order with BigCommerce ID {bc_order_id_to_delete}: {e}", exc_info=True)
-        return jsonify({"error": "An unexpected server error occurred during order deletion.", "details": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "An unexpected server error occurred during order deletion.", "details": str(e)}), 500
+
+import outbox
+
+@utils_bp.route('/outbox', methods=['GET'])
+@verify_firebase_token
+def get_outbox_summary_route():
+    """Counts of outbox jobs by type/status and the latest failures (emails, BigCommerce updates)."""
+    if engine is None:
+        return jsonify({"error": "Database engine not available."}), 500
+    try:
+        with engine.connect() as conn:
+            summary = outbox.get_outbox_summary(conn)
+        return jsonify(summary), 200
+    except Exception as e:
+        current_app.logger.error(f"Error reading outbox summary: {e}", exc_info=True)
+        return jsonify({"error": "Failed to read outbox summary.", "details": str(e)}), 500
+
+@utils_bp.route('/outbox/jobs/<int:job_id>/retry', methods=['POST', 'OPTIONS'])
+@verify_firebase_token
+def retry_outbox_job_route(job_id):
+    if engine is None:
+        return jsonify({"error": "Database engine not available."}), 500
+    try:
+        with engine.begin() as conn:
+            was_reset = outbox.retry_job(conn, job_id)
+        if not was_reset:
+            return jsonify({"error": f"Outbox job {job_id} not found or not in 'failed' status."}), 404
+        outbox.notify()
+        return jsonify({"message": f"Outbox job {job_id} re-queued."}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error retrying outbox job {job_id}: {e}", exc_info=True)
+        return jsonify({"error": "Failed to retry outbox job.", "details": str(e)}), 500
+
+@utils_bp.route('/carrier-tokens', methods=['GET'])
+@verify_firebase_token
+def get_carrier_token_cache_route():
+    """Cached UPS/FedEx OAuth token state (expiry, hits, refreshes, last error). Tokens are never returned."""
+    return jsonify(shipping_service.get_carrier_token_cache_stats()), 200
+
+import http_client
+
+@utils_bp.route('/http-metrics', methods=['GET'])
+@verify_firebase_token
+def get_http_metrics_route():
+    """Per-host outbound call counts, status codes, retries and latency (BigCommerce, UPS, FedEx, Postmark)."""
+    return jsonify(http_client.get_metrics()), 200
+
+import firebase_token_cache
+
+@utils_bp.route('/auth-cache', methods=['GET'])
+@verify_firebase_token
+def get_auth_cache_stats_route():
+    return jsonify(firebase_token_cache.get_cache_stats()), 200
+
+import pdf_artifact_cache
+
+@utils_bp.route('/pdf-cache', methods=['GET'])
+@verify_firebase_token
+def get_pdf_cache_stats_route():
+    """Rendered-PDF cache hits, misses, evictions and template versions."""
+    return jsonify(pdf_artifact_cache.get_cache_stats()), 200
@@ -0,0 +1,120 @@
+# carrier_token_cache.py
+# Process-wide cache for carrier OAuth access tokens (UPS, FedEx).
+# Tokens are keyed by carrier + environment + account, reused until shortly before they expire,
+# and refreshed by a single caller at a time: concurrent label requests that find the token stale
+# wait for the one in-flight refresh instead of each hitting the carrier's OAuth endpoint.
+
+import os
+import threading
+import time
+
+CARRIER_TOKEN_CACHE_ENABLED = os.getenv("CARRIER_TOKEN_CACHE_ENABLED", "true").lower() == "true"
+# Refresh this many seconds before the carrier-reported expiry.
+CARRIER_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("CARRIER_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Used when a token response has no usable expires_in.
+CARRIER_TOKEN_DEFAULT_TTL_SECONDS = int(os.getenv("CARRIER_TOKEN_DEFAULT_TTL_SECONDS", "1800"))
+
+
+class CarrierTokenCache:
+    """Thread-safe token store with expiry-aware, single-flight refresh."""
+
+    def __init__(self, refresh_margin_seconds=CARRIER_TOKEN_REFRESH_MARGIN_SECONDS,
+                 default_ttl_seconds=CARRIER_TOKEN_DEFAULT_TTL_SECONDS, enabled=CARRIER_TOKEN_CACHE_ENABLED):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.default_ttl_seconds = default_ttl_seconds
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._refresh_locks = {}
+        self._entries = {}  # key -> {"token", "expires_at", "fetched_at"}
+        self._stats = {}    # key -> counters / last error, kept even after invalidation
+
+    @staticmethod
+    def make_key(carrier, environment, account):
+        return f"{carrier}:{environment or 'default'}:{account or 'default'}"
+
+    def _key_stats(self, key):
+        return self._stats.setdefault(key, {"hits": 0, "refreshes": 0, "refresh_failures": 0, "invalidations": 0,
+                                            "last_refresh_at": None, "last_error": None})
+
+    def _fresh_token(self, key):
+        entry = self._entries.get(key)
+        if entry and time.time() < entry["expires_at"] - self.refresh_margin_seconds:
+            return entry["token"]
+        return None
+
+    def _parse_expires_in(self, expires_in):
+        try:
+            seconds = int(float(expires_in))
+        except (TypeError, ValueError):
+            return self.default_ttl_seconds
+        return seconds if seconds > 0 else self.default_ttl_seconds
+
+    def get_token(self, key, fetcher, force_refresh=False):
+        """
+        Returns a cached token for key, or calls fetcher() to obtain one.
+        fetcher must return (access_token, expires_in) and (None, None) on failure; failures are not cached.
+        """
+        if not self.enabled:
+            token, _ = fetcher()
+            return token
+
+        with self._lock:
+            token = None if force_refresh else self._fresh_token(key)
+            if token:
+                self._key_stats(key)["hits"] += 1
+                return token
+            refresh_lock = self._refresh_locks.setdefault(key, threading.Lock())
+        requested_at = time.time()
+
+        with refresh_lock:
+            # Another thread may have refreshed while we waited for the lock.
+            with self._lock:
+                token = self._fresh_token(key)
+                if token and (not force_refresh or self._entries[key]["fetched_at"] >= requested_at):
+                    self._key_stats(key)["hits"] += 1
+                    return token
+            try:
+                token, expires_in = fetcher()
+                error = None if token else "Token endpoint returned no access_token."
+            except Exception as e:
+                token, expires_in, error = None, None, f"{type(e).__name__}: {e}"
+            now = time.time()
+            with self._lock:
+                stats = self._key_stats(key)
+                if not token:
+                    stats["refresh_failures"] += 1
+                    stats["last_error"] = error
+                    return None
+                ttl = self._parse_expires_in(expires_in)
+                self._entries[key] = {"token": token, "expires_at": now + ttl, "fetched_at": now}
+                stats["refreshes"] += 1
+                stats["last_refresh_at"] = now
+                stats["last_error"] = None
+            print(f"INFO CARRIER_TOKEN_CACHE: Refreshed token for '{key}', valid for {ttl}s.")
+            return token
+
+    def invalidate(self, key=None, reason=""):
+        """Drops one key (or all keys), e.g. after the carrier rejects a token with 401."""
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries.keys())
+            for k in keys:
+                if self._entries.pop(k, None) is not None:
+                    self._key_stats(k)["invalidations"] += 1
+        print(f"INFO CARRIER_TOKEN_CACHE: Invalidated {keys or 'nothing'}. Reason: {reason or 'not specified'}")
+
+    def get_stats(self):
+        """Per-key state for monitoring. Never includes the token itself."""
+        now = time.time()
+        with self._lock:
+            result = {"enabled": self.enabled, "refresh_margin_seconds": self.refresh_margin_seconds, "tokens": {}}
+            for key in sorted(set(self._entries) | set(self._stats)):
+                entry = self._entries.get(key)
+                state = dict(self._key_stats(key))
+                state["cached"] = entry is not None
+                state["expires_in_seconds"] = int(entry["expires_at"] - now) if entry else None
+                state["age_seconds"] = int(now - entry["fetched_at"]) if entry else None
+                result["tokens"][key] = state
+            return result
+
+
+token_cache = CarrierTokenCache()
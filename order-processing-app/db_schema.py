@@ -0,0 +1,288 @@
+# db_schema.py
+# Idempotent DDL for indexes/tables the backend relies on beyond the original hand-made schema.
+# Applied once at startup from app.py (set APPLY_DB_SCHEMA_ON_STARTUP=false to skip, e.g. when
+# the app user lacks DDL rights and a DBA applies these statements instead).
+
+import os
+import traceback
+from sqlalchemy import text
+
+APPLY_DB_SCHEMA_ON_STARTUP = os.getenv("APPLY_DB_SCHEMA_ON_STARTUP", "true").lower() == "true"
+
+# order_date truncated to its UTC hour, as TIMESTAMPTZ (order_revenue_hourly.bucket_hour). Epoch
+# arithmetic keeps it independent of the writing session's TimeZone: a timestamp-without-time-zone
+# order_date counts as UTC (EXTRACT(EPOCH) treats it like order_date AT TIME ZONE 'UTC') and a
+# TIMESTAMPTZ one is its own instant.
+_UTC_HOUR_BUCKET = "to_timestamp(floor(EXTRACT(EPOCH FROM order_date) / 3600) * 3600)"
+
+# Statements the code cannot work without: if one fails, startup is aborted with the hint instead of
+# carrying on and failing on every request that depends on it.
+REQUIRED_SCHEMA_OBJECTS = {
+    "uq_orders_bigcommerce_order_id": (
+        "Order ingestion upserts on orders.bigcommerce_order_id and needs this unique index. If it failed "
+        "because of duplicate rows, list them with "
+        "'SELECT bigcommerce_order_id, array_agg(id ORDER BY id) FROM orders GROUP BY bigcommerce_order_id HAVING COUNT(*) > 1', "
+        "merge or delete the extra rows (and their order_line_items, purchase_orders and shipments), then restart. "
+        "Set APPLY_DB_SCHEMA_ON_STARTUP=false only once the index has been created by hand."
+    ),
+}
+
+# (name, statement). Every statement must be safe to run repeatedly.
+SCHEMA_STATEMENTS = [
+    # Unpaginated GET /api/orders (streamed in this order) and order_date range filters.
+    ("idx_orders_order_date_id",
+     "CREATE INDEX IF NOT EXISTS idx_orders_order_date_id ON orders (order_date DESC, id DESC)"),
+    # Keyset pagination for GET /api/orders, with and without a status filter. The sort key is
+    # orders.ORDERS_PAGE_SORT_DATE, so orders without an order_date are paged (last) too.
+    ("idx_orders_list_sort",
+     "CREATE INDEX IF NOT EXISTS idx_orders_list_sort ON orders ((COALESCE(order_date, '-infinity')) DESC, id DESC)"),
+    ("idx_orders_status_list_sort",
+     "CREATE INDEX IF NOT EXISTS idx_orders_status_list_sort ON orders (status, (COALESCE(order_date, '-infinity')) DESC, id DESC)"),
+    ("drop_idx_orders_status_order_date_id",
+     "DROP INDEX IF EXISTS idx_orders_status_order_date_id"),
+    # Target of the ingest upsert (INSERT ... ON CONFLICT (bigcommerce_order_id)).
+    ("uq_orders_bigcommerce_order_id",
+     "CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_bigcommerce_order_id ON orders (bigcommerce_order_id)"),
+    # Claim taken by POST /orders/<id>/process before it buys labels (see _claim_order_for_processing).
+    ("orders_processing_claimed_at",
+     "ALTER TABLE orders ADD COLUMN IF NOT EXISTS processing_claimed_at TIMESTAMPTZ"),
+    # High-water marks for incremental BigCommerce ingestion (one row per sync stream).
+    ("bc_sync_state",
+     """CREATE TABLE IF NOT EXISTS bc_sync_state (
+            sync_key VARCHAR(100) PRIMARY KEY,
+            last_date_modified TIMESTAMPTZ,
+            last_run_at TIMESTAMPTZ,
+            last_run_order_count INTEGER,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )"""),
+    # Transactional outbox for external side effects (see outbox.py).
+    ("outbox_jobs",
+     """CREATE TABLE IF NOT EXISTS outbox_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            job_type VARCHAR(100) NOT NULL,
+            payload JSONB NOT NULL,
+            order_id INTEGER,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 6,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            locked_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            completed_at TIMESTAMPTZ
+        )"""),
+    ("idx_outbox_jobs_due",
+     "CREATE INDEX IF NOT EXISTS idx_outbox_jobs_due ON outbox_jobs (status, next_attempt_at)"),
+    # Jobs that may only run after other jobs are done (e.g. order status after its shipments).
+    ("outbox_jobs_depends_on",
+     "ALTER TABLE outbox_jobs ADD COLUMN IF NOT EXISTS depends_on_job_ids BIGINT[]"),
+    # PO numbers (see app.allocate_po_numbers). Numbering starts at 200001.
+    ("po_number_seq",
+     "CREATE SEQUENCE IF NOT EXISTS po_number_seq START WITH 200001 MINVALUE 1"),
+    # Re-seed past any numeric PO already stored (legacy MAX()-allocated or manually entered).
+    # Never moves the sequence backwards, so running it on every startup is safe.
+    ("po_number_seq_seed",
+     """SELECT setval('po_number_seq', GREATEST(
+            (SELECT COALESCE(MAX(CAST(po_number AS BIGINT)), 0) FROM purchase_orders WHERE CAST(po_number AS TEXT) ~ '^[0-9]+$'),
+            200000,
+            (SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM po_number_seq)
+        ), true)"""),
+    # Per-status order counts for GET /api/orders/status-counts, maintained by statement-level
+    # triggers on orders (transition tables, so a bulk ingest upsert costs one aggregate per statement).
+    ("order_status_counts",
+     """CREATE TABLE IF NOT EXISTS order_status_counts (
+            status VARCHAR(100) PRIMARY KEY,
+            order_count BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )"""),
+    ("order_status_counts_apply_fn",
+     """CREATE OR REPLACE FUNCTION order_status_counts_apply() RETURNS trigger LANGUAGE plpgsql AS $fn$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO order_status_counts (status, order_count, updated_at)
+                SELECT status, COUNT(*), NOW() FROM new_rows WHERE status IS NOT NULL GROUP BY status
+                ON CONFLICT (status) DO UPDATE SET order_count = order_status_counts.order_count + EXCLUDED.order_count, updated_at = NOW();
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE order_status_counts c SET order_count = c.order_count - d.removed, updated_at = NOW()
+                FROM (SELECT status, COUNT(*) AS removed FROM old_rows WHERE status IS NOT NULL GROUP BY status) d
+                WHERE c.status = d.status;
+            ELSE
+                INSERT INTO order_status_counts (status, order_count, updated_at)
+                SELECT status, SUM(delta), NOW() FROM (
+                    SELECT status, 1 AS delta FROM new_rows WHERE status IS NOT NULL
+                    UNION ALL
+                    SELECT status, -1 AS delta FROM old_rows WHERE status IS NOT NULL
+                ) changes
+                GROUP BY status HAVING SUM(delta) <> 0
+                ON CONFLICT (status) DO UPDATE SET order_count = order_status_counts.order_count + EXCLUDED.order_count, updated_at = NOW();
+            END IF;
+            RETURN NULL;
+        END
+        $fn$"""),
+    # Creates the triggers and seeds the counts in one transaction while writes to orders are
+    # blocked, so no change can fall between the seed and the first trigger firing. Runs only once.
+    ("order_status_counts_triggers",
+     """DO $do$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_status_counts_ins') THEN
+                LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE;
+                CREATE TRIGGER trg_orders_status_counts_ins AFTER INSERT ON orders
+                    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_status_counts_apply();
+                CREATE TRIGGER trg_orders_status_counts_upd AFTER UPDATE ON orders
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_status_counts_apply();
+                CREATE TRIGGER trg_orders_status_counts_del AFTER DELETE ON orders
+                    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION order_status_counts_apply();
+                DELETE FROM order_status_counts;
+                INSERT INTO order_status_counts (status, order_count, updated_at)
+                SELECT status, COUNT(*), NOW() FROM orders WHERE status IS NOT NULL GROUP BY status;
+            END IF;
+        END
+        $do$"""),
+    # Revenue rollup for /api/reports/daily-revenue. Buckets are UTC hours rather than days so any
+    # whole-hour time zone can be re-aggregated to local days/weeks/months exactly; a multi-year
+    # report reads ~9k rows per year instead of scanning orders. Maintained like order_status_counts.
+    # (A timestamp-without-time-zone order_date is read as UTC, as the report always assumed.)
+    ("order_revenue_hourly",
+     """CREATE TABLE IF NOT EXISTS order_revenue_hourly (
+            bucket_hour TIMESTAMPTZ NOT NULL,
+            status TEXT NOT NULL DEFAULT '',
+            payment_method TEXT NOT NULL DEFAULT '',
+            order_count BIGINT NOT NULL DEFAULT 0,
+            revenue NUMERIC NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (bucket_hour, status, payment_method)
+        )"""),
+    ("order_revenue_hourly_apply_fn",
+     f"""CREATE OR REPLACE FUNCTION order_revenue_hourly_apply() RETURNS trigger LANGUAGE plpgsql AS $fn$
+        BEGIN
+            -- Net change per bucket: +1/+price for rows as they are now, -1/-price for rows as they were.
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO order_revenue_hourly (bucket_hour, status, payment_method, order_count, revenue, updated_at)
+                SELECT {_UTC_HOUR_BUCKET}, COALESCE(status, ''), COALESCE(payment_method, ''), COUNT(*), COALESCE(SUM(total_sale_price), 0), NOW()
+                FROM new_rows WHERE order_date IS NOT NULL
+                GROUP BY 1, 2, 3
+                ON CONFLICT (bucket_hour, status, payment_method) DO UPDATE
+                    SET order_count = order_revenue_hourly.order_count + EXCLUDED.order_count,
+                        revenue = order_revenue_hourly.revenue + EXCLUDED.revenue, updated_at = NOW();
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE order_revenue_hourly r
+                SET order_count = r.order_count - d.removed_count, revenue = r.revenue - d.removed_revenue, updated_at = NOW()
+                FROM (
+                    SELECT {_UTC_HOUR_BUCKET} AS bucket_hour, COALESCE(status, '') AS status, COALESCE(payment_method, '') AS payment_method,
+                           COUNT(*) AS removed_count, COALESCE(SUM(total_sale_price), 0) AS removed_revenue
+                    FROM old_rows WHERE order_date IS NOT NULL GROUP BY 1, 2, 3
+                ) d
+                WHERE r.bucket_hour = d.bucket_hour AND r.status = d.status AND r.payment_method = d.payment_method;
+            ELSE
+                INSERT INTO order_revenue_hourly (bucket_hour, status, payment_method, order_count, revenue, updated_at)
+                SELECT bucket_hour, status, payment_method, SUM(count_delta), SUM(revenue_delta), NOW() FROM (
+                    SELECT {_UTC_HOUR_BUCKET} AS bucket_hour, COALESCE(status, '') AS status, COALESCE(payment_method, '') AS payment_method,
+                           1 AS count_delta, COALESCE(total_sale_price, 0) AS revenue_delta
+                    FROM new_rows WHERE order_date IS NOT NULL
+                    UNION ALL
+                    SELECT {_UTC_HOUR_BUCKET}, COALESCE(status, ''), COALESCE(payment_method, ''), -1, -COALESCE(total_sale_price, 0)
+                    FROM old_rows WHERE order_date IS NOT NULL
+                ) changes
+                GROUP BY bucket_hour, status, payment_method
+                HAVING SUM(count_delta) <> 0 OR SUM(revenue_delta) <> 0
+                ON CONFLICT (bucket_hour, status, payment_method) DO UPDATE
+                    SET order_count = order_revenue_hourly.order_count + EXCLUDED.order_count,
+                        revenue = order_revenue_hourly.revenue + EXCLUDED.revenue, updated_at = NOW();
+            END IF;
+            RETURN NULL;
+        END
+        $fn$"""),
+    ("order_revenue_hourly_triggers",
+     f"""DO $do$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_orders_revenue_hourly_ins') THEN
+                LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE;
+                CREATE TRIGGER trg_orders_revenue_hourly_ins AFTER INSERT ON orders
+                    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_revenue_hourly_apply();
+                CREATE TRIGGER trg_orders_revenue_hourly_upd AFTER UPDATE ON orders
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION order_revenue_hourly_apply();
+                CREATE TRIGGER trg_orders_revenue_hourly_del AFTER DELETE ON orders
+                    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION order_revenue_hourly_apply();
+                DELETE FROM order_revenue_hourly;
+                INSERT INTO order_revenue_hourly (bucket_hour, status, payment_method, order_count, revenue, updated_at)
+                SELECT {_UTC_HOUR_BUCKET}, COALESCE(status, ''), COALESCE(payment_method, ''), COUNT(*), COALESCE(SUM(total_sale_price), 0), NOW()
+                FROM orders WHERE order_date IS NOT NULL
+                GROUP BY 1, 2, 3;
+            END IF;
+        END
+        $do$"""),
+    # Stored IIF batches (see iif_batch_store.py). One row per distinct batch content.
+    ("iif_batches",
+     """CREATE TABLE IF NOT EXISTS iif_batches (
+            id BIGSERIAL PRIMARY KEY,
+            batch_type VARCHAR(20) NOT NULL,
+            batch_label TEXT,
+            filename TEXT NOT NULL,
+            content_sha256 CHAR(64) NOT NULL,
+            content_bytes INTEGER NOT NULL,
+            record_ids BIGINT[] NOT NULL,
+            mapping_failures JSONB,
+            storage_uri TEXT NOT NULL,
+            email_status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            emailed_at TIMESTAMPTZ,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            UNIQUE (batch_type, content_sha256)
+        )"""),
+    ("idx_iif_batches_created_at",
+     "CREATE INDEX IF NOT EXISTS idx_iif_batches_created_at ON iif_batches (created_at DESC)"),
+    # Background jobs (see background_jobs.py). The partial unique index is the de-duplication
+    # guarantee: at most one queued/running job per dedupe_key across all instances.
+    ("background_jobs",
+     """CREATE TABLE IF NOT EXISTS background_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            job_type VARCHAR(100) NOT NULL,
+            dedupe_key VARCHAR(100),
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            progress TEXT,
+            payload JSONB,
+            result JSONB,
+            error TEXT,
+            requested_by TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            started_at TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        )"""),
+    ("uq_background_jobs_active_dedupe",
+     "CREATE UNIQUE INDEX IF NOT EXISTS uq_background_jobs_active_dedupe ON background_jobs (dedupe_key) WHERE status IN ('queued', 'running')"),
+]
+
+# Recount from scratch (POST /api/orders/status-counts/rebuild); the lock keeps triggers and recount consistent.
+REBUILD_ORDER_STATUS_COUNTS_STATEMENTS = [
+    "LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE",
+    "DELETE FROM order_status_counts",
+    """INSERT INTO order_status_counts (status, order_count, updated_at)
+       SELECT status, COUNT(*), NOW() FROM orders WHERE status IS NOT NULL GROUP BY status""",
+]
+
+
+def ensure_schema_objects(engine):
+    """
+    Runs every statement in SCHEMA_STATEMENTS in its own transaction. Failures are logged, except for
+    REQUIRED_SCHEMA_OBJECTS, which raise RuntimeError once every statement has been tried.
+    """
+    if engine is None or not APPLY_DB_SCHEMA_ON_STARTUP:
+        print(f"DEBUG DB_SCHEMA: Skipping schema check (engine={'set' if engine else 'None'}, enabled={APPLY_DB_SCHEMA_ON_STARTUP}).")
+        return
+    applied, failed = 0, []
+    for name, statement in SCHEMA_STATEMENTS:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+            applied += 1
+        except Exception as e:
+            failed.append(name)
+            print(f"ERROR DB_SCHEMA: Failed to apply '{name}': {e}")
+            traceback.print_exc()
+    print(f"INFO DB_SCHEMA: Schema check complete. Applied/verified: {applied}, failed: {failed or 'none'}.")
+    failed_required = [name for name in failed if name in REQUIRED_SCHEMA_OBJECTS]
+    if failed_required:
+        for name in failed_required:
+            print(f"CRITICAL DB_SCHEMA: Required schema object '{name}' is missing. {REQUIRED_SCHEMA_OBJECTS[name]}")
+        raise RuntimeError(f"Required schema objects could not be applied: {', '.join(failed_required)}. See the log above.")
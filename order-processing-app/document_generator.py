@@ -4,12 +4,15 @@ load_dotenv() # Add this line to load the .env file
 from datetime import datetime, timezone
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, KeepInFrame, HRFlowable
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle, StyleSheet1
 from reportlab.lib import colors
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 from io import BytesIO
+import copy
 import os
+import threading
+import time
 import traceback
 import re
 from xml.sax.saxutils import escape
@@ -65,18 +68,11 @@ except ImportError:
     print("ERROR DOC_GEN: Pillow library (PIL) not found. Image processing will fail. Please install it (`pip install Pillow`).")
     PILImage = None
 
-try:
-    from google.cloud import storage
-    storage_client = storage.Client()
-    print("DEBUG DOC_GEN: Google Cloud Storage client initialized successfully.")
-except ImportError:
-    print("WARN DOC_GEN: google-cloud-storage library not found. Logo download from GCS will fail.")
-    storage = None
-    storage_client = None
-except Exception as gcs_e:
-    print(f"ERROR DOC_GEN: Failed to initialize Google Cloud Storage client: {gcs_e}")
-    traceback.print_exc()
-    storage_client = None
+import gcs_service  # logo downloads use the shared, lazily created storage client
+
+# Bump a document's version when its layout changes without this file changing (e.g. fonts or
+# logo replaced in place); pdf_artifact_cache keys include it.
+TEMPLATE_VERSIONS = {"purchase_order": "1", "packing_slip": "1", "wire_invoice": "1", "receipt": "1"}
 
 COMPANY_NAME = "GLOBAL ONE TECHNOLOGY"
 COMPANY_ADDRESS_PO_HEADER = ""
@@ -121,7 +117,7 @@ def _format_payment_method_for_packing_slip(payment_method_string):
         # If no '[' is found, return the original string, stripped of whitespace
         return payment_method_string.strip()
     
-def get_custom_styles():
+def _build_custom_styles():
     styles = getSampleStyleSheet()
 
     styles.add(ParagraphStyle(name='Normal_Eloquia', fontName='Helvetica', fontSize=9, leading=11))
@@ -182,95 +178,238 @@ def get_custom_styles():
     return styles
 
 
+class _ReadOnlyStyleSheet(StyleSheet1):
+    """The shared stylesheet: lookups as usual, but no new styles can be added to it."""
+
+    def add(self, style, alias=None):
+        raise TypeError(f"The shared document stylesheet is read-only; derive a new ParagraphStyle(parent=...) instead of adding '{style.name}'.")
+
+
+_shared_styles = None
+_shared_styles_lock = threading.Lock()
+
+
+def get_custom_styles():
+    """
+    Returns the process-wide stylesheet, built on first use. Every generator (and page footer)
+    shares it, so nothing may modify it or its ParagraphStyles.
+    """
+    global _shared_styles
+    if _shared_styles is None:
+        with _shared_styles_lock:
+            if _shared_styles is None:
+                built = _build_custom_styles()
+                shared = _ReadOnlyStyleSheet()
+                shared.byName, shared.byAlias = built.byName, built.byAlias
+                _shared_styles = shared
+    return _shared_styles
+
+
+# Table styles that do not depend on the document's data. Table.setStyle() copies a TableStyle's
+# commands into the table, so each of these is built once and shared by every document.
+ADDRESS_TABLE_STYLE = TableStyle([  # PO vendor / ship-to, receipt bill-to / ship-to
+    ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+    ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+])
+PO_HEADER_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0,0), (-1,-1), 'TOP'), ('BOTTOMPADDING', (0,0), (0,0), 6),
+    ('BOTTOMPADDING', (0,1), (0,1), 6), ('LEFTPADDING', (0,0), (-1,-1), 0),
+    ('RIGHTPADDING', (0,0), (-1,-1), 0), ('SPAN', (0,0), (0,0)),
+])
+PO_ITEMS_TABLE_STYLE = TableStyle([
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
+])
+PACKING_SLIP_HEADER_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+    ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (0,0), 6),
+    ('SPAN', (0,0), (0,0)),
+])
+PACKING_SLIP_SHIPPING_DETAILS_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+    ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+    ('SPAN', (1,0), (1,0)),
+])
+PACKING_SLIP_ITEMS_TABLE_STYLE = TableStyle([
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('ALIGN', (0,0), (0,0), 'CENTER'), ('ALIGN', (1,0), (1,0), 'LEFT'),
+    ('ALIGN', (0,1), (0,-1), 'CENTER'),
+    ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
+    ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f0f0f0")),
+])
+PACKING_SLIP_SEPARATE_ITEMS_TABLE_STYLE = TableStyle([
+    ('GRID', (0,0), (-1,-1), 0.5, colors.darkgrey),
+    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('ALIGN', (0,0), (0,0), 'CENTER'), ('ALIGN', (1,0), (1,0), 'LEFT'),
+    ('ALIGN', (0,1), (0,-1), 'CENTER'),
+    ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
+    ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f0f0f0")),
+    ('TEXTCOLOR', (0,1), (-1,-1), colors.HexColor("#777777")),
+])
+INVOICE_HEADER_TABLE_STYLE = TableStyle([  # wire invoice and receipt
+    ('VALIGN', (0,0), (-1,-1), 'TOP'), ('ALIGN', (0,0), (0,0), 'LEFT'),
+    ('ALIGN', (1,0), (1,0), 'RIGHT'), ('LEFTPADDING', (0,0), (-1,-1), 0),
+    ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
+])
+INVOICE_ITEMS_TABLE_STYLE = TableStyle([
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('BACKGROUND', (0,0), (-1,0), colors.lightgrey), ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+    ('TOPPADDING', (0,0), (-1,-1), 5), ('LEFTPADDING', (0,1), (0,-1), 2),
+    ('RIGHTPADDING', (0,1), (0,-1), 2),
+])
+INVOICE_SUMMARY_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+    ('LEFTPADDING', (0,0), (-1,-1), 0), ('RIGHTPADDING', (0,0), (-1,-1), 0),
+    ('BOTTOMPADDING', (0,0), (-1,-1), 2), ('TOPPADDING', (0,0), (-1,-1), 2),
+    ('LINEABOVE', (1,3), (2,3), 0.5, colors.black),
+    ('TOPPADDING', (1,3), (2,3), 5), ('BOTTOMPADDING', (1,3), (2,3), 5)
+])
+WIRE_INSTRUCTIONS_TABLE_STYLE = TableStyle([
+    ('LEFTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 10)
+])
+PAID_STAMP_TABLE_STYLE = TableStyle([('ALIGN', (0,0), (0,0), 'CENTER')])
+
+
+# --- LOGO CACHE ---
+# The logo is the same for every document, so it is fetched and decoded once per process and
+# re-used. Entries are keyed by (URI, target width) and hold either the raw image bytes plus the
+# scaled dimensions (raster) or an already-scaled svglib Drawing (SVG). After
+# LOGO_CACHE_REVALIDATE_SECONDS the blob's ETag is re-read (one metadata call) and the logo is only
+# downloaded again if it changed. If GCS is unavailable the last good copy keeps being served; with
+# nothing cached (or no URI configured) the bundled g1-logo.png is used before falling back to the
+# plain company-name text.
+LOGO_CACHE_REVALIDATE_SECONDS = int(os.getenv("LOGO_CACHE_REVALIDATE_SECONDS", "3600"))
+LOGO_FALLBACK_PATH = os.getenv("LOGO_FALLBACK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "g1-logo.png"))
+# Widths used by the generators below (PO / packing slip, invoice / receipt), for warm_logo_cache().
+DEFAULT_LOGO_WIDTHS = (2.6*inch, 1.8*inch*1.3)
+
+_logo_cache = {}
+_logo_cache_lock = threading.Lock()
+
+
+def _parse_gcs_uri(logo_gcs_uri):
+    if not logo_gcs_uri.startswith("gs://"): raise ValueError("Invalid GCS URI format. Must start with 'gs://'.")
+    parts = logo_gcs_uri[5:].split('/', 1)
+    if len(parts) != 2: raise ValueError("Invalid GCS URI format. Could not parse bucket and blob name.")
+    return parts
+
+
+def _decode_logo(source_name, logo_bytes, desired_logo_width):
+    """Decodes logo bytes once into a cache entry: {'kind': 'svg', 'drawing'} or {'kind': 'image', 'bytes', 'width', 'height'}."""
+    if source_name.lower().endswith(".svg") and SVGLIB_AVAILABLE:
+        drawing = svg2rlg(BytesIO(logo_bytes))
+        if not drawing:
+            raise ValueError(f"svg2rlg failed to convert {source_name}.")
+        original_width, original_height = drawing.width, drawing.height
+        if original_width == 0 or original_height == 0:
+            raise ValueError(f"SVG {source_name} has zero width/height after svg2rlg.")
+        scale_factor = desired_logo_width / original_width
+        drawing.width = desired_logo_width
+        drawing.height = original_height * scale_factor
+        drawing.scale(scale_factor, scale_factor)
+        return {"kind": "svg", "drawing": drawing}
+
+    if source_name.lower().endswith(".svg"):
+        print(f"WARN _get_logo_element_from_gcs: SVG detected but svglib not available. Attempting with Pillow (may fail).")
+    actual_logo_height = 0.75 * inch
+    if PILImage:
+        with PILImage.open(BytesIO(logo_bytes)) as pillow_img:
+            pillow_img.verify()
+        with PILImage.open(BytesIO(logo_bytes)) as pillow_img:
+            img_width_px, img_height_px = pillow_img.size
+        if not img_width_px or not img_height_px:
+            raise ValueError("Pillow reported invalid image dimensions (0 or None).")
+        actual_logo_height = desired_logo_width * (float(img_height_px) / float(img_width_px))
+    return {"kind": "image", "bytes": logo_bytes, "width": desired_logo_width, "height": actual_logo_height}
+
+
+def _load_logo_entry_from_gcs(logo_gcs_uri, desired_logo_width, cached_entry):
+    """Returns a fresh or revalidated cache entry for the URI, downloading only when the ETag changed."""
+    bucket_name, blob_name = _parse_gcs_uri(logo_gcs_uri)
+    blob = gcs_service.get_storage_client().bucket(bucket_name).blob(blob_name)
+    blob.reload()  # Metadata only; raises NotFound if the logo is missing.
+    if cached_entry and cached_entry.get("etag") and cached_entry["etag"] == blob.etag:
+        return dict(cached_entry, checked_at=time.monotonic())
+    print(f"DEBUG _get_logo_element_from_gcs: Downloading logo from {logo_gcs_uri} (etag {blob.etag}).")
+    entry = _decode_logo(logo_gcs_uri, blob.download_as_bytes(), desired_logo_width)
+    entry.update(etag=blob.etag, checked_at=time.monotonic(), source=logo_gcs_uri)
+    return entry
+
+
+def _load_fallback_logo_entry(desired_logo_width):
+    if not LOGO_FALLBACK_PATH or not os.path.exists(LOGO_FALLBACK_PATH):
+        return None
+    with open(LOGO_FALLBACK_PATH, "rb") as f:
+        logo_bytes = f.read()
+    entry = _decode_logo(LOGO_FALLBACK_PATH, logo_bytes, desired_logo_width)
+    entry.update(etag=None, checked_at=time.monotonic(), source=LOGO_FALLBACK_PATH)
+    return entry
+
+
+def _get_logo_entry(logo_gcs_uri, desired_logo_width):
+    key = (logo_gcs_uri or "", round(float(desired_logo_width), 2))
+    with _logo_cache_lock:
+        cached_entry = _logo_cache.get(key)
+    if cached_entry is not None and time.monotonic() - cached_entry["checked_at"] < LOGO_CACHE_REVALIDATE_SECONDS:
+        return cached_entry
+
+    entry = None
+    if logo_gcs_uri and gcs_service.get_storage_client():
+        is_gcs_entry = cached_entry is not None and cached_entry.get("etag") is not None
+        try:
+            entry = _load_logo_entry_from_gcs(logo_gcs_uri, desired_logo_width, cached_entry if is_gcs_entry else None)
+        except Exception as e:
+            print(f"ERROR _get_logo_element_from_gcs: Failed to load logo from {logo_gcs_uri}: {e}")
+            traceback.print_exc()
+    elif logo_gcs_uri:
+        print("WARN _get_logo_element_from_gcs: GCS storage client not available. Using fallback logo.")
+
+    if entry is None and cached_entry is not None:
+        # Keep serving the last good copy (GCS or bundled); GCS is retried after another interval.
+        entry = dict(cached_entry, checked_at=time.monotonic())
+    if entry is None:
+        try:
+            entry = _load_fallback_logo_entry(desired_logo_width)
+        except Exception as e:
+            print(f"ERROR _get_logo_element_from_gcs: Failed to load fallback logo {LOGO_FALLBACK_PATH}: {e}")
+            traceback.print_exc()
+        if entry is None:
+            return None
+
+    with _logo_cache_lock:
+        _logo_cache[key] = entry
+    return entry
+
+
+def warm_logo_cache(logo_gcs_uri, widths=DEFAULT_LOGO_WIDTHS):
+    """Loads the logo for each width so the first PDF of the process does not pay for the download."""
+    for width in widths:
+        entry = _get_logo_entry(logo_gcs_uri, width)
+        print(f"INFO DOC_GEN: Logo cache warmed for width {width:.1f}pt from {entry['source'] if entry else 'nothing (company name text)'}.")
+
+
+def clear_logo_cache():
+    with _logo_cache_lock:
+        _logo_cache.clear()
+
+
 def _get_logo_element_from_gcs(styles, logo_gcs_uri=None, desired_logo_width=1.5*inch, is_blind_slip=False):
     if is_blind_slip:
         # For blind slips, return an empty paragraph or a minimal placeholder if absolutely necessary
         # Removing "SHIPPING DOCUMENT" text
         return Paragraph("", styles['H2_Eloquia']) # Empty string
 
-    if not logo_gcs_uri:
-        print("WARN _get_logo_element_from_gcs: No logo_gcs_uri provided. Using company name text.")
+    entry = _get_logo_entry(logo_gcs_uri, desired_logo_width)
+    if entry is None:
+        print("WARN _get_logo_element_from_gcs: No logo available. Using company name text.")
         return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
 
-    if not storage_client:
-        print("WARN _get_logo_element_from_gcs: GCS storage client not available. Using company name text.")
-        return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
-    logo_stream = None
-    try:
-        print(f"DEBUG _get_logo_element_from_gcs: Attempting to download logo from: {logo_gcs_uri}")
-        if not logo_gcs_uri.startswith("gs://"): raise ValueError("Invalid GCS URI format. Must start with 'gs://'.")
-        parts = logo_gcs_uri[5:].split('/', 1)
-        if len(parts) != 2: raise ValueError("Invalid GCS URI format. Could not parse bucket and blob name.")
-        bucket_name, blob_name = parts
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
-        if not blob.exists(): raise FileNotFoundError(f"Logo not found at {logo_gcs_uri}")
-        logo_bytes = blob.download_as_bytes()
-
-        if logo_gcs_uri.lower().endswith(".svg") and SVGLIB_AVAILABLE:
-            print(f"DEBUG _get_logo_element_from_gcs: Processing {logo_gcs_uri} as SVG with svglib.")
-            logo_file_like_object = BytesIO(logo_bytes)
-            drawing = svg2rlg(logo_file_like_object) # svg2rlg expects a file path or file-like object
-            logo_file_like_object.close() # Close BytesIO object
-
-            if drawing:
-                # Scale the drawing
-                original_width = drawing.width
-                original_height = drawing.height
-
-                if original_width == 0 or original_height == 0: # Should not happen for valid SVGs
-                    print(f"WARN _get_logo_element_from_gcs: SVG {logo_gcs_uri} has zero width/height after svg2rlg.")
-                    return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
-
-                scale_factor = desired_logo_width / original_width
-                drawing.width = desired_logo_width
-                drawing.height = original_height * scale_factor
-                drawing.scale(scale_factor, scale_factor) # Scale the drawing contents
-                
-                # The drawing object itself is a flowable
-                return drawing 
-            else:
-                print(f"WARN _get_logo_element_from_gcs: svg2rlg failed to convert {logo_gcs_uri}.")
-                return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
-        else: # Fallback to Pillow for other image types (PNG, JPG) or if SVG but svglib is not available
-            if logo_gcs_uri.lower().endswith(".svg") and not SVGLIB_AVAILABLE:
-                print(f"WARN _get_logo_element_from_gcs: SVG detected but svglib not available. Attempting with Pillow (may fail).")
-
-            print(f"DEBUG _get_logo_element_from_gcs: Processing {logo_gcs_uri} with Pillow.")
-
-        logo_stream = BytesIO(logo_bytes)
-        
-        actual_logo_width = desired_logo_width
-        actual_logo_height = None
-        if PILImage:
-            try:
-                logo_stream.seek(0)
-                pillow_img = PILImage.open(logo_stream)
-                pillow_img.verify()
-                logo_stream.seek(0)
-                pillow_img = PILImage.open(logo_stream)
-                img_width_px, img_height_px = pillow_img.size
-                if not img_width_px or not img_height_px or img_width_px == 0 or img_height_px == 0:
-                    raise ValueError("Pillow reported invalid image dimensions (0 or None).")
-                aspect_ratio = float(img_height_px) / float(img_width_px)
-                actual_logo_height = desired_logo_width * aspect_ratio
-                logo_stream.seek(0)
-            except Exception as pil_e:
-                print(f"ERROR _get_logo_element_from_gcs: Pillow failed: {pil_e}"); traceback.print_exc()
-                return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
-        else:
-            logo_stream.seek(0)
-            actual_logo_height = 0.75 * inch
-
-        logo = Image(logo_stream, width=actual_logo_width, height=actual_logo_height)
-        if not logo.imageWidth or not logo.imageHeight or logo.imageWidth == 0 or logo.imageHeight == 0:
-            print(f"WARN _get_logo_element_from_gcs: ReportLab Image dimensions seem invalid for '{logo_gcs_uri}'. Attempting fallback render.")
-            raise ValueError("ReportLab image dimensions invalid after Pillow processing or Pillow unavailable.")
-        return logo
-    except Exception as e:
-        print(f"ERROR _get_logo_element_from_gcs: Failed to load logo: {e}"); traceback.print_exc()
-        if logo_stream and not logo_stream.closed: logo_stream.close()
-        return Paragraph(f"<b>{COMPANY_NAME}</b>", styles['H2_Eloquia'])
+    # Flowables are stateful during a build, so every document gets its own instance built
+    # from the cached, already-decoded data.
+    if entry["kind"] == "svg":
+        return copy.deepcopy(entry["drawing"])
+    return Image(BytesIO(entry["bytes"]), width=entry["width"], height=entry["height"])
 
 
 def generate_purchase_order_pdf(order_data, supplier_data, po_number, po_date, po_items,
@@ -293,11 +432,7 @@ def generate_purchase_order_pdf(order_data, supplier_data, po_number, po_date, p
          Paragraph(f"Date: {formatted_po_date}<br/>P.O. No.: {po_number}", styles['Normal_Helvetica_Right'])]
     ]
     header_table = Table(header_data, colWidths=[4*inch, 3*inch])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('BOTTOMPADDING', (0,0), (0,0), 6),
-        ('BOTTOMPADDING', (0,1), (0,1), 6), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('SPAN', (0,0), (0,0)),
-    ]))
+    header_table.setStyle(PO_HEADER_TABLE_STYLE)
     story.append(header_table); story.append(Spacer(1, 0.25 * inch))
     vendor_ship_to_content = [
         [Paragraph("<b>Vendor</b>", styles['H3_Helvetica']), Paragraph("<b>Ship To</b>", styles['H3_Helvetica'])],
@@ -315,10 +450,7 @@ def generate_purchase_order_pdf(order_data, supplier_data, po_number, po_date, p
                    f"{escape(order_data.get('customer_shipping_country', ''))}", styles['Normal_Helvetica'])]
     ]
     vendor_ship_to_table = Table(vendor_ship_to_content, colWidths=[3.5*inch, 3.5*inch])
-    vendor_ship_to_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-    ]))
+    vendor_ship_to_table.setStyle(ADDRESS_TABLE_STYLE)
     story.append(vendor_ship_to_table); story.append(Spacer(1, 0.25 * inch))
     items_header = [
         Paragraph('<b>Item</b>', styles['Normal_Helvetica_Bold']),
@@ -339,10 +471,7 @@ def generate_purchase_order_pdf(order_data, supplier_data, po_number, po_date, p
             Paragraph(format_currency(item_amount), styles['Normal_Helvetica_Right'])
         ])
     items_table = Table(items_table_data, colWidths=[4.0*inch, 0.5*inch, 1.0*inch, 1.5*inch])
-    items_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
-    ]))
+    items_table.setStyle(PO_ITEMS_TABLE_STYLE)
     story.append(items_table); story.append(Spacer(1, 0.1 * inch))
     notes_and_total_data = []
     if payment_instructions:
@@ -448,11 +577,7 @@ def generate_packing_slip_pdf(order_data, items_in_this_shipment, items_shipping
         [company_address_display_ps_para, Paragraph(order_ref_text, styles['Normal_Eloquia_Right'])]
     ]
     header_table = Table(header_data, colWidths=[4*inch, 3*inch])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (0,0), 6),
-        ('SPAN', (0,0), (0,0)),
-    ]))
+    header_table.setStyle(PACKING_SLIP_HEADER_TABLE_STYLE)
     story.append(header_table)
     story.append(HRFlowable(width="100%", thickness=1, color=colors.black, spaceBefore=0.05*inch, spaceAfter=0.1*inch))
 
@@ -487,11 +612,7 @@ def generate_packing_slip_pdf(order_data, items_in_this_shipment, items_shipping
         [ship_to_para, KeepInFrame(3.5*inch, 1.2*inch, right_column_content)]
     ]
     shipping_details_table = Table(shipping_details_data, colWidths=[3.5*inch, 3.5*inch])
-    shipping_details_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-        ('SPAN', (1,0), (1,0)), 
-    ]))
+    shipping_details_table.setStyle(PACKING_SLIP_SHIPPING_DETAILS_TABLE_STYLE)
     story.append(shipping_details_table)
     story.append(Spacer(1, 0.15 * inch))
 
@@ -525,19 +646,12 @@ def generate_packing_slip_pdf(order_data, items_in_this_shipment, items_shipping
         ])
 
     items_table_shipped = Table(items_table_data_shipped, colWidths=[0.75*inch, 6.25*inch])
-    style_cmds_shipped = [
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('ALIGN', (0,0), (0,0), 'CENTER'), ('ALIGN', (1,0), (1,0), 'LEFT'),
-        ('ALIGN', (0,1), (0,-1), 'CENTER'),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f0f0f0")),
-    ]
+    items_table_shipped.setStyle(PACKING_SLIP_ITEMS_TABLE_STYLE)
     if not items_in_this_shipment:
-        style_cmds_shipped.append(('SPAN', (0, len(items_table_data_shipped)-1), (1, len(items_table_data_shipped)-1)))
-        style_cmds_shipped.append(('ALIGN', (0, len(items_table_data_shipped)-1), (0, len(items_table_data_shipped)-1), 'CENTER'))
-
-    items_table_shipped.setStyle(TableStyle(style_cmds_shipped))
+        items_table_shipped.setStyle(TableStyle([
+            ('SPAN', (0, len(items_table_data_shipped)-1), (1, len(items_table_data_shipped)-1)),
+            ('ALIGN', (0, len(items_table_data_shipped)-1), (0, len(items_table_data_shipped)-1), 'CENTER'),
+        ]))
     story.append(items_table_shipped)
     story.append(Spacer(1, 0.2 * inch))
 
@@ -556,15 +670,7 @@ def generate_packing_slip_pdf(order_data, items_in_this_shipment, items_shipping
                 Paragraph(escape(item_description_for_slip_sep), styles['ItemDesc_ShippingSeparately_Eloquia'])
             ])
         items_table_separate = Table(items_table_data_separate, colWidths=[0.75*inch, 6.25*inch])
-        items_table_separate.setStyle(TableStyle([
-            ('GRID', (0,0), (-1,-1), 0.5, colors.darkgrey),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('ALIGN', (0,0), (0,0), 'CENTER'), ('ALIGN', (1,0), (1,0), 'LEFT'),
-            ('ALIGN', (0,1), (0,-1), 'CENTER'),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 4), ('TOPPADDING', (0,0), (-1,-1), 4),
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#f0f0f0")),
-            ('TEXTCOLOR', (0,1), (-1,-1), colors.HexColor("#777777")),
-        ]))
+        items_table_separate.setStyle(PACKING_SLIP_SEPARATE_ITEMS_TABLE_STYLE)
         story.append(items_table_separate)
 
     draw_footer_with_flag = partial(_draw_packing_slip_footer, is_blind_slip=is_blind_slip)
@@ -688,11 +794,7 @@ def generate_wire_transfer_invoice_pdf(order_data, line_items_data, apply_wire_f
 
     top_header_data = [[logo_element, invoice_title_para]]
     top_header_table = Table(top_header_data, colWidths=[doc.width * 0.55, doc.width * 0.45]) 
-    top_header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('ALIGN', (0,0), (0,0), 'LEFT'),    
-        ('ALIGN', (1,0), (1,0), 'RIGHT'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6), 
-    ]))
+    top_header_table.setStyle(INVOICE_HEADER_TABLE_STYLE)
     story.append(top_header_table)
     story.append(HRFlowable(width="100%", thickness=0.5, color=colors.grey, spaceBefore=0.05*inch, spaceAfter=0.15*inch))
 
@@ -790,12 +892,7 @@ def generate_wire_transfer_invoice_pdf(order_data, line_items_data, apply_wire_f
     each_col_width = available_width_for_table * 0.15
     total_col_width = available_width_for_table * 0.15
     items_table = Table(items_table_data, colWidths=[desc_col_width, qty_col_width, each_col_width, total_col_width])
-    items_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey), ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-        ('TOPPADDING', (0,0), (-1,-1), 5), ('LEFTPADDING', (0,1), (0,-1), 2), 
-        ('RIGHTPADDING', (0,1), (0,-1), 2),
-    ]))
+    items_table.setStyle(INVOICE_ITEMS_TABLE_STYLE)
     story.append(items_table)
     story.append(Spacer(1, 0.05 * inch))
 
@@ -819,13 +916,7 @@ def generate_wire_transfer_invoice_pdf(order_data, line_items_data, apply_wire_f
     # ... (summary_table creation and styling as before) ...
     summary_table = Table(summary_data, 
                           colWidths=[summary_spacer_col_width, summary_label_col_width, summary_value_col_width])
-    summary_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('LEFTPADDING', (0,0), (-1,-1), 0), ('RIGHTPADDING', (0,0), (-1,-1), 0), 
-        ('BOTTOMPADDING', (0,0), (-1,-1), 2), ('TOPPADDING', (0,0), (-1,-1), 2),
-        ('LINEABOVE', (1,3), (2,3), 0.5, colors.black), 
-        ('TOPPADDING', (1,3), (2,3), 5), ('BOTTOMPADDING', (1,3), (2,3), 5)
-    ]))
+    summary_table.setStyle(INVOICE_SUMMARY_TABLE_STYLE)
     story.append(summary_table)
     story.append(Spacer(1, 0.2 * inch))
 
@@ -846,9 +937,7 @@ def generate_wire_transfer_invoice_pdf(order_data, line_items_data, apply_wire_f
     wire_instructions_para = Paragraph(wire_instructions_text, styles['Normal_Eloquia_Small'])
     instruction_table_data = [[wire_instructions_para]]
     instruction_table = Table(instruction_table_data, colWidths=[doc.width])
-    instruction_table.setStyle(TableStyle([
-        ('LEFTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 10)
-    ]))
+    instruction_table.setStyle(WIRE_INSTRUCTIONS_TABLE_STYLE)
     story.append(instruction_table)
 
     # --- Build with fixed footer ---
@@ -913,14 +1002,7 @@ def generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=None): # Rena
 
     top_header_data = [[logo_element, invoice_title_para]]
     top_header_table = Table(top_header_data, colWidths=[doc.width * 0.55, doc.width * 0.45]) 
-    top_header_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), 
-        ('ALIGN', (0,0), (0,0), 'LEFT'),    
-        ('ALIGN', (1,0), (1,0), 'RIGHT'),   
-        ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 6), 
-    ]))
+    top_header_table.setStyle(INVOICE_HEADER_TABLE_STYLE)
     story.append(top_header_table)
     story.append(HRFlowable(width="100%", thickness=0.5, color=colors.grey, spaceBefore=0.05*inch, spaceAfter=0.15*inch))
 
@@ -965,17 +1047,14 @@ def generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=None): # Rena
         [bill_to_para, ship_to_para]
     ]
     address_table = Table(address_data, colWidths=[doc.width * 0.5, doc.width * 0.5])
-    address_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'), ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), ('BOTTOMPADDING', (0,0), (-1,-1), 6),
-    ]))
+    address_table.setStyle(ADDRESS_TABLE_STYLE)
     story.append(address_table)
     story.append(Spacer(1, 0.05 * inch)) 
     
     rotated_paid_stamp = create_rotated_paid_stamp(styles) 
     paid_stamp_table_data = [[rotated_paid_stamp]]
     paid_stamp_table = Table(paid_stamp_table_data, colWidths=[doc.width])
-    paid_stamp_table.setStyle(TableStyle([('ALIGN', (0,0), (0,0), 'CENTER')]))
+    paid_stamp_table.setStyle(PAID_STAMP_TABLE_STYLE)
     story.append(paid_stamp_table)
     story.append(Spacer(1, 0.05 * inch))
 
@@ -1009,12 +1088,7 @@ def generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=None): # Rena
     total_col_width = available_width_for_table * 0.15
     
     items_table = Table(items_table_data, colWidths=[desc_col_width, qty_col_width, each_col_width, total_col_width])
-    items_table.setStyle(TableStyle([
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black), ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('BACKGROUND', (0,0), (-1,0), colors.lightgrey), ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-        ('TOPPADDING', (0,0), (-1,-1), 5), ('LEFTPADDING', (0,1), (0,-1), 2), 
-        ('RIGHTPADDING', (0,1), (0,-1), 2),
-    ]))
+    items_table.setStyle(INVOICE_ITEMS_TABLE_STYLE)
     story.append(items_table)
     story.append(Spacer(1, 0.05 * inch))
 
@@ -1036,16 +1110,7 @@ def generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=None): # Rena
     
     summary_table = Table(summary_data, 
                           colWidths=[summary_spacer_col_width, summary_label_col_width, summary_value_col_width])
-    summary_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('LEFTPADDING', (0,0), (-1,-1), 0), 
-        ('RIGHTPADDING', (0,0), (-1,-1), 0), 
-        ('BOTTOMPADDING', (0,0), (-1,-1), 2),
-        ('TOPPADDING', (0,0), (-1,-1), 2),
-        ('LINEABOVE', (1,3), (2,3), 0.5, colors.black), 
-        ('TOPPADDING', (1,3), (2,3), 5), 
-        ('BOTTOMPADDING', (1,3), (2,3), 5)
-    ]))
+    summary_table.setStyle(INVOICE_SUMMARY_TABLE_STYLE)
     story.append(summary_table)
     story.append(Spacer(1, 0.2 * inch))
 
@@ -1060,6 +1125,27 @@ def generate_receipt_pdf(order_data, line_items_data, logo_gcs_uri=None): # Rena
 # --- END OF generate_receipt_pdf FUNCTION ---
 
 
+def generate_batch_reprint_summary_pdf(order_count, skipped_documents, stopped_reason=None):
+    """Last page of a batch reprint: lists every document that could not be included."""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, leftMargin=0.75*inch, rightMargin=0.75*inch,
+                            topMargin=0.75*inch, bottomMargin=0.75*inch)
+    styles = get_custom_styles()
+    story = [Paragraph("<b>BATCH REPRINT - INCOMPLETE</b>", styles['H1_Eloquia']), Spacer(1, 0.15*inch),
+             Paragraph(escape(f"Printed {datetime.now(timezone.utc).strftime('%m/%d/%Y %H:%M')} UTC for {order_count} order(s). "
+                              f"{len(skipped_documents)} document(s) are missing from this file:"), styles['Normal_Eloquia']),
+             Spacer(1, 0.1*inch)]
+    if stopped_reason:
+        story.append(Paragraph(escape(f"The reprint stopped early ({stopped_reason}); later orders are not included."), styles['Normal_Eloquia_Bold']))
+        story.append(Spacer(1, 0.1*inch))
+    for description in skipped_documents:
+        story.append(Paragraph(f"&bull; {escape(description)}", styles['Normal_Eloquia']))
+    doc.build(story)
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+    return pdf_bytes
+
+
 
 if __name__ == '__main__':
     print("Running document_generator.py in local test mode.")
@@ -5,10 +5,14 @@ import base64
 import traceback
 import re
 import json # For parsing Postmark error responses if needed
+import threading
+import time
 from xml.sax.saxutils import escape
 from datetime import datetime, timezone # Not directly used in send_po_email but good practice
 from dotenv import load_dotenv
 
+import http_client
+
 
 # Attempt to import PostmarkClient
 try:
@@ -31,6 +35,34 @@ DAILY_IIF_EMAIL_SUBJECT_PREFIX = os.getenv("DAILY_IIF_EMAIL_SUBJECT_PREFIX", "Da
 COMPANY_NAME_FOR_EMAIL = os.getenv("COMPANY_NAME_FOR_EMAIL", "Global One Technology")
 COMPANY_WEBSITE = os.getenv("COMPANY_WEBSITE", "www.globalonetechnology.com") 
 
+POSTMARK_TIMEOUT_SECONDS = float(os.getenv("POSTMARK_TIMEOUT_SECONDS", "30"))
+POSTMARK_MAX_RETRIES = int(os.getenv("POSTMARK_MAX_RETRIES", "2"))  # Connection-level retries only.
+POSTMARK_METRICS_HOST = "api.postmarkapp.com"
+
+_postmark_client = None
+_postmark_client_lock = threading.Lock()
+
+def _get_postmark_client():
+    """One PostmarkClient per process so its keep-alive session is reused across emails."""
+    global _postmark_client
+    if _postmark_client is None:
+        with _postmark_client_lock:
+            if _postmark_client is None:
+                _postmark_client = PostmarkClient(server_token=EMAIL_API_KEY, max_retries=POSTMARK_MAX_RETRIES,
+                                                  timeout=POSTMARK_TIMEOUT_SECONDS)
+    return _postmark_client
+
+def _send_postmark_email(client, **email_params):
+    """client.emails.send() with the call's latency/outcome recorded in http_client's per-host metrics."""
+    started = time.monotonic()
+    try:
+        response = client.emails.send(**email_params)
+    except Exception as e:
+        http_client.record_call(POSTMARK_METRICS_HOST, time.monotonic() - started, error=f"{type(e).__name__}: {e}")
+        raise
+    http_client.record_call(POSTMARK_METRICS_HOST, time.monotonic() - started, status_code=200)
+    return response
+
 def _get_postmark_headers(): # This might not be needed if using PostmarkClient library
     """Helper to get Postmark API headers if using direct requests.
        Not typically used with the postmarker library."""
@@ -91,7 +123,7 @@ def send_po_email(supplier_email, po_number, attachments, is_blind_drop_ship=Fal
         return False
 
     try:
-        client = PostmarkClient(server_token=EMAIL_API_KEY)
+        client = _get_postmark_client()
 
         email_attachments_for_postmark = []
         if attachments:
@@ -138,7 +170,7 @@ def send_po_email(supplier_email, po_number, attachments, is_blind_drop_ship=Fal
             email_params["Bcc"] = EMAIL_BCC_ADDRESS
             print(f"DEBUG EMAIL_SERVICE (PO): BCCing to {EMAIL_BCC_ADDRESS}")
 
-        response = client.emails.send(**email_params)
+        response = _send_postmark_email(client, **email_params)
 
         print(f"INFO EMAIL_SERVICE (PO): Email for PO {po_number} sent successfully via Postmark. MessageID: {response.get('MessageID') if isinstance(response, dict) else 'N/A'}")
         return True
@@ -149,12 +181,26 @@ def send_po_email(supplier_email, po_number, attachments, is_blind_drop_ship=Fal
         traceback.print_exc()
         return False
 
+def iif_attachment_filename(batch_date_str, filename_prefix="IIF_Batch_"):
+    """Attachment filename for an IIF batch, e.g. IIF_Batch_20250115.iif."""
+    date_part_for_filename = batch_date_str.replace('-', '')
+    if "OnDemand" in batch_date_str:
+        date_match = re.search(r'(\d{8})', batch_date_str)
+        if date_match:
+            date_part_for_filename = date_match.group(1)
+        else:
+            date_part_for_filename = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    return f"{filename_prefix}{date_part_for_filename}.iif"
+
+
 def send_iif_batch_email(iif_content_string, batch_date_str,
                          warning_message_html=None,
                          custom_subject=None,
-                         filename_prefix="IIF_Batch_"):
+                         filename_prefix="IIF_Batch_",
+                         iif_filename=None):
     """
     Sends the daily IIF batch email using Postmark.
+    iif_filename overrides the attachment name (used when re-sending a stored batch).
     """
     print(f"DEBUG IIF_EMAIL: Attempting to send IIF batch email for context: {batch_date_str}, prefix: {filename_prefix}")
     if EMAIL_SERVICE_PROVIDER != "postmark":
@@ -168,20 +214,9 @@ def send_iif_batch_email(iif_content_string, batch_date_str,
         return False
 
     try:
-        client = PostmarkClient(server_token=EMAIL_API_KEY)
-
-        date_part_for_filename = batch_date_str.replace('-', '')
-        if "OnDemand" in batch_date_str:
-            try:
-                date_match = re.search(r'(\d{8})', batch_date_str)
-                if date_match:
-                    date_part_for_filename = date_match.group(1)
-                else:
-                    date_part_for_filename = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
-            except Exception:
-                date_part_for_filename = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+        client = _get_postmark_client()
 
-        iif_filename = f"{filename_prefix}{date_part_for_filename}.iif"
+        iif_filename = iif_filename or iif_attachment_filename(batch_date_str, filename_prefix)
         print(f"DEBUG IIF_EMAIL: Attachment filename will be: {iif_filename}")
 
         attachments = [{
@@ -219,7 +254,7 @@ def send_iif_batch_email(iif_content_string, batch_date_str,
 
 
         print(f"DEBUG IIF_EMAIL: Attempting to send IIF batch email for context {batch_date_str}")
-        response = client.emails.send(
+        response = _send_postmark_email(client,
             From=EMAIL_SENDER_ADDRESS,
             To=QUICKBOOKS_EMAIL_RECIPIENT,
             Subject=subject_to_send,
@@ -268,7 +303,7 @@ def send_sales_notification_email(recipient_email, subject, html_body, text_body
         return False
 
     try:
-        client = PostmarkClient(server_token=EMAIL_API_KEY)
+        client = _get_postmark_client()
         print(f"DEBUG EMAIL_SERVICE (SALES_NOTIF): Sending Postmark email to {recipient_email} with {len(attachments)} attachments.")
 
         email_params = {
@@ -282,7 +317,7 @@ def send_sales_notification_email(recipient_email, subject, html_body, text_body
             "MessageStream": "outbound"
         }
 
-        response = client.emails.send(**email_params)
+        response = _send_postmark_email(client, **email_params)
 
         print(f"INFO EMAIL_SERVICE (SALES_NOTIF): Notification email sent successfully via Postmark. MessageID: {response.get('MessageID') if isinstance(response, dict) else 'N/A'}")
         return True
@@ -320,7 +355,7 @@ def send_customer_receipt_email(recipient_email, order_number, customer_name, pd
         return False
 
     try:
-        client = PostmarkClient(server_token=EMAIL_API_KEY) #
+        client = _get_postmark_client()
 
         # Ensure COMPANY_NAME_FOR_EMAIL is loaded, fallback if necessary
         company_display_name = os.getenv("COMPANY_NAME_FOR_EMAIL", "Global One Technology") #
@@ -378,7 +413,7 @@ def send_customer_receipt_email(recipient_email, order_number, customer_name, pd
             print(f"DEBUG EMAIL_SERVICE (RECEIPT): BCCing to {bcc_address}")
 
 
-        response = client.emails.send(**email_params)
+        response = _send_postmark_email(client, **email_params)
 
         print(f"INFO EMAIL_SERVICE (RECEIPT): Receipt email for Order #{order_number} sent successfully via Postmark. MessageID: {response.get('MessageID') if isinstance(response, dict) else 'N/A'}")
         return True
@@ -416,7 +451,7 @@ def send_wire_transfer_invoice_email(recipient_email, order_number, customer_nam
         return False
 
     try:
-        client = PostmarkClient(server_token=EMAIL_API_KEY)
+        client = _get_postmark_client()
         company_display_name = COMPANY_NAME_FOR_EMAIL # Uses the global from this module
 
         subject = f"Invoice #{order_number} from {company_display_name} - Payment Instructions"
@@ -466,7 +501,7 @@ def send_wire_transfer_invoice_email(recipient_email, order_number, customer_nam
             email_params["Bcc"] = EMAIL_BCC_ADDRESS
             print(f"DEBUG EMAIL_SERVICE (WIRE_INVOICE): BCCing to {EMAIL_BCC_ADDRESS}")
 
-        response = client.emails.send(**email_params)
+        response = _send_postmark_email(client, **email_params)
 
         print(f"INFO EMAIL_SERVICE (WIRE_INVOICE): Wire Transfer Invoice email for Order #{order_number} sent successfully via Postmark. MessageID: {response.get('MessageID') if isinstance(response, dict) else 'N/A'}")
         return True
@@ -5,6 +5,8 @@ import requests
 import json
 from dotenv import load_dotenv
 
+import http_client
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -22,7 +24,7 @@ def fetch_bigcommerce_data(endpoint_url):
         "Content-Type": "application/json"
     }
     try:
-        response = requests.get(endpoint_url, headers=headers)
+        response = http_client.get(endpoint_url, headers=headers)
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
         return response.json()
     except requests.exceptions.RequestException as e:
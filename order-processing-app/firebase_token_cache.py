@@ -0,0 +1,80 @@
+# firebase_token_cache.py
+# Cache of verified Firebase ID token claims for verify_firebase_token.
+# verify_id_token(check_revoked=True) costs a round trip to Firebase (user lookup) on every call,
+# and the dashboard polls several endpoints with the same token. Claims are cached under a SHA-256
+# of the token until the token's own `exp`; the revocation check is repeated at most every
+# FIREBASE_REVOCATION_RECHECK_SECONDS per token (0 = on every request, the previous behaviour).
+# Only successful verifications are cached; failures always go back to Firebase.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+FIREBASE_TOKEN_CACHE_ENABLED = os.getenv("FIREBASE_TOKEN_CACHE_ENABLED", "true").lower() == "true"
+FIREBASE_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("FIREBASE_TOKEN_CACHE_MAX_ENTRIES", "1000"))
+FIREBASE_REVOCATION_RECHECK_SECONDS = int(os.getenv("FIREBASE_REVOCATION_RECHECK_SECONDS", "300"))
+# Treat tokens as expired slightly early so a cached entry never outlives the real token.
+FIREBASE_TOKEN_EXPIRY_SKEW_SECONDS = 30
+
+_entries = OrderedDict()  # token hash -> {"claims", "exp", "revocation_checked_at"}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "revocation_checks": 0, "evictions": 0}
+
+
+def _token_key(id_token):
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+
+def _store(key, claims):
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)):
+        return
+    with _lock:
+        _entries[key] = {"claims": claims, "exp": exp, "revocation_checked_at": time.monotonic()}
+        _entries.move_to_end(key)
+        while len(_entries) > max(1, FIREBASE_TOKEN_CACHE_MAX_ENTRIES):
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def verify_id_token_cached(id_token, verify_fn):
+    """
+    Returns the decoded claims for id_token. verify_fn is firebase_auth.verify_id_token; it is called
+    with check_revoked=True on a cache miss and whenever the entry's revocation check is due.
+    Exceptions from verify_fn (revoked, disabled, invalid) propagate and evict the entry.
+    """
+    if not FIREBASE_TOKEN_CACHE_ENABLED:
+        return verify_fn(id_token, check_revoked=True)
+
+    key = _token_key(id_token)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and time.time() >= entry["exp"] - FIREBASE_TOKEN_EXPIRY_SKEW_SECONDS:
+            del _entries[key]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(key)
+            if time.monotonic() - entry["revocation_checked_at"] < FIREBASE_REVOCATION_RECHECK_SECONDS:
+                _stats["hits"] += 1
+                return entry["claims"]
+            _stats["revocation_checks"] += 1
+        else:
+            _stats["misses"] += 1
+
+    try:
+        claims = verify_fn(id_token, check_revoked=True)
+    except Exception:
+        with _lock:
+            _entries.pop(key, None)
+        raise
+    _store(key, claims)
+    return claims
+
+
+def get_cache_stats():
+    with _lock:
+        return dict(_stats, enabled=FIREBASE_TOKEN_CACHE_ENABLED, entries=len(_entries),
+                    max_entries=FIREBASE_TOKEN_CACHE_MAX_ENTRIES,
+                    revocation_recheck_seconds=FIREBASE_REVOCATION_RECHECK_SECONDS)
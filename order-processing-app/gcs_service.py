@@ -1,41 +1,207 @@
 # gcs_service.py
+# Shared Google Cloud Storage access for the app.
+# get_storage_client() creates one storage.Client per process on first use (it holds the
+# credentials and HTTP session, so building one per upload was pure overhead); app.py,
+# document_generator and iif_batch_store all use it. upload_files_parallel() uploads a
+# shipment's documents (label, PO, packing slip) concurrently, each with an MD5 that GCS
+# verifies server-side; files above GCS_RESUMABLE_THRESHOLD_BYTES go through a chunked
+# resumable session so a dropped connection retries one chunk rather than the whole file.
+# download_files_parallel() fetches stored documents (e.g. labels for a batch reprint) the same way.
 
+import base64
+import hashlib
 import os
-from google.cloud import storage
-from flask import current_app
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import unquote
+
+from flask import current_app, has_app_context
+
+try:
+    from google.cloud import storage
+    from google.cloud.storage.retry import DEFAULT_RETRY
+except ImportError:
+    storage = None
+    DEFAULT_RETRY = None
+    print("WARN GCS_SERVICE: google-cloud-storage library not found. GCS uploads will be skipped.")
 
 # Configuration - Ensure your GCS_BUCKET_NAME is set in your .env file or app config
 # The Handover Report mentions a bucket gs://g1-po-app-documents/ for the logo,
 # so your labels might go into the same bucket or a similar one.
 # For example: GCS_BUCKET_NAME = "g1-po-app-documents"
+GCS_UPLOAD_MAX_WORKERS = int(os.getenv("GCS_UPLOAD_MAX_WORKERS", "4"))
+GCS_RESUMABLE_THRESHOLD_BYTES = int(os.getenv("GCS_RESUMABLE_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
+GCS_RESUMABLE_CHUNK_BYTES = 4 * 1024 * 1024  # must be a multiple of 256 KiB
+GCS_SIGNED_URL_MINUTES = int(os.getenv("GCS_SIGNED_URL_MINUTES", "60"))
+PUBLIC_URL_PREFIX = "https://storage.googleapis.com/"
+
+_storage_client = None
+_storage_client_lock = threading.Lock()
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+
+def _log_error(message):
+    print(f"ERROR GCS_SERVICE: {message}")
+    if has_app_context():
+        current_app.logger.error(message)
+
+
+def get_storage_client():
+    """Returns the process-wide GCS client, creating it on first use. None if GCS is unavailable."""
+    global _storage_client
+    if _storage_client is None and storage is not None:
+        with _storage_client_lock:
+            if _storage_client is None:
+                try:
+                    # GOOGLE_APPLICATION_CREDENTIALS environment variable should be set
+                    # for this to work automatically in local development and Cloud Run.
+                    _storage_client = storage.Client()
+                    print("DEBUG GCS_SERVICE: Google Cloud Storage client initialized successfully.")
+                except Exception as e:
+                    _log_error(f"Failed to initialize Google Cloud Storage client: {e}")
+    return _storage_client
 
-def _get_gcs_client():
-    """Initializes and returns a GCS client."""
-    try:
-        # GOOGLE_APPLICATION_CREDENTIALS environment variable should be set
-        # for this to work automatically in local development and Cloud Run.
-        client = storage.Client()
-        print("DEBUG GCS_SERVICE: Google Cloud Storage client initialized successfully.")
-        return client
-    except Exception as e:
-        current_app.logger.error(f"Failed to initialize Google Cloud Storage client: {e}", exc_info=True)
-        print(f"ERROR GCS_SERVICE: Failed to initialize Google Cloud Storage client: {e}")
-        return None
 
 def get_gcs_bucket_name():
-    """Gets the GCS bucket name from Flask app config or environment variable."""
-    bucket_name = current_app.config.get('GCS_BUCKET_NAME')
+    """Gets the GCS bucket name from Flask app config (when in an app context) or the environment."""
+    bucket_name = current_app.config.get('GCS_BUCKET_NAME') if has_app_context() else None
     if not bucket_name:
         bucket_name = os.environ.get('GCS_BUCKET_NAME')
-    
     if not bucket_name:
-        current_app.logger.error("GCS_BUCKET_NAME is not configured in app config or environment variables.")
-        print("ERROR GCS_SERVICE: GCS_BUCKET_NAME is not configured.")
-    else:
-        print(f"DEBUG GCS_SERVICE: Using GCS Bucket: {bucket_name}")
+        _log_error("GCS_BUCKET_NAME is not configured in app config or environment variables.")
     return bucket_name
 
 
+def gs_uri(blob_name, bucket_name=None):
+    return f"gs://{bucket_name or get_gcs_bucket_name()}/{blob_name}"
+
+
+def parse_gs_uri(uri):
+    """
+    Splits 'gs://bucket/path' or a public 'https://storage.googleapis.com/bucket/path' URL into
+    (bucket, path). Plain blob names return (None, name).
+    """
+    if uri.startswith("gs://"):
+        bucket_name, _, blob_name = uri[len("gs://"):].partition("/")
+        return bucket_name, blob_name
+    if uri.startswith(PUBLIC_URL_PREFIX):
+        bucket_name, _, blob_name = uri[len(PUBLIC_URL_PREFIX):].partition("/")
+        return bucket_name, unquote(blob_name)
+    return None, uri
+
+
+def _get_upload_executor():
+    global _upload_executor
+    if _upload_executor is None:
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(max_workers=max(1, GCS_UPLOAD_MAX_WORKERS), thread_name_prefix="gcs-upload")
+    return _upload_executor
+
+
+def _sign_blob(blob, expiration_minutes, method="GET"):
+    return blob.generate_signed_url(version="v4", expiration=timedelta(minutes=expiration_minutes), method=method)
+
+
+def generate_signed_url(blob_name_or_uri, expiration_minutes=None, method="GET"):
+    """
+    Returns a V4 signed URL for a blob name (in the configured bucket) or a gs:// URI, or None
+    if GCS is unavailable or signing fails.
+    """
+    bucket_name, blob_name = parse_gs_uri(blob_name_or_uri)
+    bucket_name = bucket_name or get_gcs_bucket_name()
+    client = get_storage_client()
+    if not client or not bucket_name or not blob_name:
+        return None
+    try:
+        return _sign_blob(client.bucket(bucket_name).blob(blob_name), expiration_minutes or GCS_SIGNED_URL_MINUTES, method)
+    except Exception as e:
+        _log_error(f"Failed to generate signed URL for gs://{bucket_name}/{blob_name}: {e}")
+        return None
+
+
+def _upload_one(bucket, file_bytes, destination_blob_name, content_type, sign_url):
+    result = {"blob_name": destination_blob_name, "gs_uri": f"gs://{bucket.name}/{destination_blob_name}",
+              "public_url": None, "signed_url": None, "md5_hash": None, "size": len(file_bytes or b""), "error": None}
+    if not file_bytes:
+        result["error"] = "No file content to upload."
+        return result
+    try:
+        blob = bucket.blob(destination_blob_name)
+        if len(file_bytes) > GCS_RESUMABLE_THRESHOLD_BYTES:
+            blob.chunk_size = GCS_RESUMABLE_CHUNK_BYTES
+        # Sent with the object metadata; GCS rejects the write if the received bytes don't match.
+        blob.md5_hash = base64.b64encode(hashlib.md5(file_bytes).digest()).decode("ascii")
+        # Object names are unique per shipment, so retrying a transient failure is safe.
+        blob.upload_from_string(file_bytes, content_type=content_type, checksum="md5", retry=DEFAULT_RETRY)
+        # Access control is managed by the bucket's IAM settings (Uniform access);
+        # public_url is the publicly accessible URL format, if the bucket allows it.
+        result["public_url"] = blob.public_url
+        result["md5_hash"] = blob.md5_hash
+        print(f"DEBUG GCS_SERVICE: Uploaded {result['gs_uri']} ({len(file_bytes)} bytes, md5 {blob.md5_hash}).")
+    except Exception as e:
+        result["error"] = str(e)
+        _log_error(f"Failed to upload to {result['gs_uri']}: {e}")
+        return result
+    if sign_url:
+        try:
+            result["signed_url"] = _sign_blob(blob, GCS_SIGNED_URL_MINUTES)
+        except Exception as e:
+            _log_error(f"Failed to generate signed URL for {result['gs_uri']}: {e}")
+    return result
+
+
+def upload_files_parallel(uploads, sign_urls=False):
+    """
+    Uploads several files to the configured bucket concurrently.
+
+    Args:
+        uploads: iterable of (file_bytes, destination_blob_name, content_type) tuples.
+        sign_urls (bool): also return a GCS_SIGNED_URL_MINUTES signed GET URL per file.
+
+    Returns:
+        list of dicts, in input order, with blob_name, gs_uri, public_url, signed_url, md5_hash,
+        size and error (None on success). Failures are reported per file and never raised.
+    """
+    uploads = list(uploads)
+    client = get_storage_client()
+    bucket_name = get_gcs_bucket_name()
+    if not client or not bucket_name:
+        _log_error("GCS client or bucket name not available. Cannot upload files.")
+        return [{"blob_name": name, "gs_uri": None, "public_url": None, "signed_url": None, "md5_hash": None,
+                 "size": len(data or b""), "error": "GCS not configured."} for data, name, _ in uploads]
+    bucket = client.bucket(bucket_name)
+    if len(uploads) <= 1:
+        return [_upload_one(bucket, data, name, content_type, sign_urls) for data, name, content_type in uploads]
+    futures = [_get_upload_executor().submit(_upload_one, bucket, data, name, content_type, sign_urls)
+               for data, name, content_type in uploads]
+    return [future.result() for future in futures]
+
+
+def download_bytes(blob_name_or_uri):
+    """Returns the contents of a blob name (in the configured bucket), gs:// URI or public URL, or None if unavailable."""
+    bucket_name, blob_name = parse_gs_uri(blob_name_or_uri)
+    bucket_name = bucket_name or get_gcs_bucket_name()
+    client = get_storage_client()
+    if not client or not bucket_name or not blob_name:
+        return None
+    try:
+        return client.bucket(bucket_name).blob(blob_name).download_as_bytes(retry=DEFAULT_RETRY)
+    except Exception as e:
+        _log_error(f"Failed to download gs://{bucket_name}/{blob_name}: {e}")
+        return None
+
+
+def download_files_parallel(blob_names_or_uris):
+    """download_bytes for several objects concurrently. Returns contents (or None per failure) in input order."""
+    blob_names_or_uris = list(blob_names_or_uris)
+    if len(blob_names_or_uris) <= 1:
+        return [download_bytes(uri) for uri in blob_names_or_uris]
+    return list(_get_upload_executor().map(download_bytes, blob_names_or_uris))
+
+
 def upload_file_bytes(file_bytes, destination_blob_name, content_type='application/pdf'):
     """
     Uploads a file (from bytes) to a GCS bucket.
@@ -53,36 +219,7 @@ def upload_file_bytes(file_bytes, destination_blob_name, content_type='applicati
     Returns:
         str: The public URL of the uploaded file, or None if upload failed.
     """
-    storage_client = _get_gcs_client()
-    bucket_name = get_gcs_bucket_name()
-
-    if not storage_client or not bucket_name:
-        current_app.logger.error("GCS client or bucket name not available. Cannot upload file.")
-        return None
-
-    try:
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(destination_blob_name)
-
-        print(f"DEBUG GCS_SERVICE: Uploading to gs://{bucket_name}/{destination_blob_name} with content type {content_type}")
-        
-        # Upload the file bytes
-        blob.upload_from_string(file_bytes, content_type=content_type)
-        
-        # The blob.make_public() call has been removed.
-        # Access control is now managed by the bucket's IAM settings (Uniform access).
-        
-        # The public_url attribute provides the publicly accessible URL format.
-        # Actual accessibility depends on the bucket's permissions.
-        public_url = blob.public_url
-        print(f"DEBUG GCS_SERVICE: File uploaded successfully. Public URL: {public_url}")
-        return public_url
-    except Exception as e:
-        # The previous error was a 'BadRequest: 400 ... Cannot get legacy ACL'
-        # which this change is intended to fix.
-        current_app.logger.error(f"Failed to upload file to GCS bucket '{bucket_name}' at '{destination_blob_name}': {e}", exc_info=True)
-        print(f"ERROR GCS_SERVICE: Failed to upload to gs://{bucket_name}/{destination_blob_name}: {e}")
-        return None
+    return upload_files_parallel([(file_bytes, destination_blob_name, content_type)])[0]["public_url"]
 
 if __name__ == '__main__':
     # This is for standalone testing if you run `python gcs_service.py`
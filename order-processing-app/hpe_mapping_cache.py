@@ -0,0 +1,102 @@
+# hpe_mapping_cache.py
+# In-process cache in front of hpe_part_mappings / hpe_description_mappings lookups.
+# The tables are bulk-loaded from CSV and rarely edited, but almost every order view, packing slip
+# and IIF run reads them. Entries expire after a TTL (covers out-of-band CSV reloads) and the whole
+# cache is dropped whenever the app itself writes to the mapping tables.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+HPE_MAPPING_CACHE_MAX_ENTRIES = int(os.getenv("HPE_MAPPING_CACHE_MAX_ENTRIES", "20000"))
+HPE_MAPPING_CACHE_TTL_SECONDS = int(os.getenv("HPE_MAPPING_CACHE_TTL_SECONDS", "900"))
+HPE_MAPPING_CACHE_ENABLED = os.getenv("HPE_MAPPING_CACHE_ENABLED", "true").lower() == "true"
+
+
+class TTLLRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters. Stores negative results (None) too."""
+
+    def __init__(self, name, max_entries, ttl_seconds):
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_many(self, keys):
+        """Returns (found, missing): found is {key: value} for live entries, missing lists the other keys."""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                    self.hits += 1
+                else:
+                    if entry is not None: del self._entries[key]
+                    missing.append(key)
+                    self.misses += 1
+        return found, missing
+
+    def set_many(self, items):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name, "entries": len(self._entries), "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+            }
+
+
+# candidate SKU -> (option_pn, pn_type, po_description), or None when the SKU has no hpe_part_mappings row
+sku_mapping_cache = TTLLRUCache("hpe_sku_mappings", HPE_MAPPING_CACHE_MAX_ENTRIES, HPE_MAPPING_CACHE_TTL_SECONDS)
+# option_pn -> po_description, or None when there is no hpe_description_mappings row
+description_cache = TTLLRUCache("hpe_descriptions", HPE_MAPPING_CACHE_MAX_ENTRIES, HPE_MAPPING_CACHE_TTL_SECONDS)
+
+
+def get_cached(cache, keys):
+    if not HPE_MAPPING_CACHE_ENABLED:
+        return {}, list(keys)
+    return cache.get_many(keys)
+
+
+def store(cache, items):
+    if HPE_MAPPING_CACHE_ENABLED and items:
+        cache.set_many(items)
+
+
+def invalidate_all(reason=None):
+    """Drops every cached mapping. Called after any write to hpe_part_mappings or hpe_description_mappings."""
+    sku_mapping_cache.clear()
+    description_cache.clear()
+    print(f"DEBUG HPE_MAPPING_CACHE: Cache invalidated{f' ({reason})' if reason else ''}.")
+
+
+def get_cache_stats():
+    return {
+        "enabled": HPE_MAPPING_CACHE_ENABLED,
+        "caches": [sku_mapping_cache.stats(), description_cache.stats()],
+    }
@@ -0,0 +1,154 @@
+# http_client.py
+# Shared outbound HTTP layer (BigCommerce, UPS, FedEx, and Postmark latency accounting).
+# One requests.Session keeps a keep-alive connection pool per host, every call gets default
+# connect/read timeouts, transient failures are retried with exponential backoff, and per-host
+# latency/error counters are kept for GET /api/utils/http-metrics.
+#
+# Retry rules: 429 is retried for every method (the server did not process the request).
+# 5xx responses and connection/read errors are only retried for idempotent methods; a POST that
+# creates a shipment or label is never re-sent after it may have reached the carrier. A connect
+# timeout is always safe to retry because nothing was sent.
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "0.5"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "10"))
+# pool_connections = number of distinct hosts kept pooled; pool_maxsize = connections per host.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+_LATENCY_SAMPLES_PER_HOST = 200
+
+_session = None
+_session_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_host_metrics = {}
+
+
+def get_session():
+    """Returns the process-wide keep-alive session, created on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def record_call(host, elapsed_seconds, status_code=None, error=None, retried=False):
+    """Adds one call to the host's metrics. Exposed so non-requests clients (Postmark) can report too."""
+    with _metrics_lock:
+        m = _host_metrics.get(host)
+        if m is None:
+            m = _host_metrics[host] = {"calls": 0, "errors": 0, "retries": 0, "status_counts": {},
+                                       "total_seconds": 0.0, "max_seconds": 0.0, "last_error": None,
+                                       "samples": deque(maxlen=_LATENCY_SAMPLES_PER_HOST)}
+        m["calls"] += 1
+        m["total_seconds"] += elapsed_seconds
+        m["max_seconds"] = max(m["max_seconds"], elapsed_seconds)
+        m["samples"].append(elapsed_seconds)
+        if retried:
+            m["retries"] += 1
+        if status_code is not None:
+            bucket = str(status_code)
+            m["status_counts"][bucket] = m["status_counts"].get(bucket, 0) + 1
+        if error is not None:
+            m["errors"] += 1
+            m["last_error"] = str(error)[:500]
+
+
+def get_metrics():
+    """Per-host call counts, status codes and latency (avg / p50 / p95 / max over recent calls, in ms)."""
+    with _metrics_lock:
+        result = {}
+        for host, m in sorted(_host_metrics.items()):
+            samples = sorted(m["samples"])
+            def pct(p):
+                return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 1) if samples else None
+            result[host] = {
+                "calls": m["calls"], "errors": m["errors"], "retries": m["retries"],
+                "status_counts": dict(m["status_counts"]), "last_error": m["last_error"],
+                "avg_ms": round(m["total_seconds"] / m["calls"] * 1000, 1) if m["calls"] else None,
+                "p50_ms": pct(0.50), "p95_ms": pct(0.95), "max_ms": round(m["max_seconds"] * 1000, 1),
+            }
+        return result
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), HTTP_BACKOFF_MAX_SECONDS)
+    delay = min(HTTP_BACKOFF_BASE_SECONDS * (2 ** attempt), HTTP_BACKOFF_MAX_SECONDS)
+    return delay * (0.5 + random.random() / 2)
+
+
+def request(method, url, timeout=None, max_retries=None, retry_statuses=None, **kwargs):
+    """
+    Sends a request through the shared session with default timeouts, retries and metrics.
+    Returns the final requests.Response (callers still call raise_for_status()); re-raises the
+    last requests exception if every attempt failed without a response.
+    """
+    method = method.upper()
+    timeout = timeout or DEFAULT_TIMEOUT
+    max_retries = HTTP_MAX_RETRIES if max_retries is None else max_retries
+    retry_statuses = RETRY_STATUSES if retry_statuses is None else frozenset(retry_statuses)
+    idempotent = method in IDEMPOTENT_METHODS
+    host = urlsplit(url).netloc
+    session = get_session()
+
+    for attempt in range(max_retries + 1):
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            can_retry = attempt < max_retries and (idempotent or isinstance(e, requests.exceptions.ConnectTimeout))
+            record_call(host, time.monotonic() - started, error=f"{type(e).__name__}: {e}", retried=can_retry)
+            if not can_retry:
+                raise
+            delay = _retry_delay(attempt)
+            print(f"WARN HTTP_CLIENT: {method} {host} failed ({type(e).__name__}); retry {attempt + 1}/{max_retries} in {delay:.2f}s.")
+            time.sleep(delay)
+            continue
+
+        status = response.status_code
+        can_retry = (attempt < max_retries and status in retry_statuses
+                     and (status == 429 or idempotent))
+        record_call(host, time.monotonic() - started, status_code=status, retried=can_retry)
+        if not can_retry:
+            return response
+        delay = _retry_delay(attempt, response)
+        print(f"WARN HTTP_CLIENT: {method} {host} returned {status}; retry {attempt + 1}/{max_retries} in {delay:.2f}s.")
+        response.close()
+        time.sleep(delay)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
@@ -0,0 +1,192 @@
+# iif_batch_store.py
+# Persistent IIF batch artifacts.
+# Every generated IIF batch is written once, content-addressed by its SHA-256, to GCS
+# (gs://<GCS_BUCKET_NAME>/<IIF_BATCH_GCS_PREFIX>/<type>/<sha256>.iif) or to a local directory,
+# with a JSON manifest beside it. The iif_batches table holds the same manifest (record IDs,
+# mapping failures, hash, email outcome) and is what the re-download endpoints read.
+#
+# Saving is idempotent: the same batch type + content maps to the same row and object, so a
+# retried sync returns the existing batch (and its email status) instead of creating a new one.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from sqlalchemy import text
+
+import gcs_service
+from gcs_service import storage
+if storage is None:
+    print("WARN IIF_BATCH_STORE: google-cloud-storage not installed; IIF batches will be stored locally.")
+
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
+# 'gcs' or 'local'. Defaults to GCS when a bucket is configured.
+IIF_BATCH_STORAGE = os.getenv("IIF_BATCH_STORAGE", "gcs" if GCS_BUCKET_NAME and storage else "local").lower()
+IIF_BATCH_GCS_PREFIX = os.getenv("IIF_BATCH_GCS_PREFIX", "iif_batches").strip("/")
+IIF_BATCH_LOCAL_DIR = os.getenv("IIF_BATCH_LOCAL_DIR", os.path.join(tempfile.gettempdir(), "iif_batches"))
+IIF_CONTENT_TYPE = "application/iif"
+
+BATCH_TYPES = ("po", "sales")
+
+_BATCH_COLUMNS = """id, batch_type, batch_label, filename, content_sha256, content_bytes, record_ids,
+                    mapping_failures, storage_uri, email_status, emailed_at, created_at"""
+
+
+class IIFBatchIntegrityError(Exception):
+    """Stored artifact is missing or does not match the hash recorded in its manifest."""
+
+
+def content_sha256(content_bytes):
+    return hashlib.sha256(content_bytes).hexdigest()
+
+
+def _get_gcs_bucket(bucket_name=None):
+    bucket_name = bucket_name or GCS_BUCKET_NAME
+    client = gcs_service.get_storage_client() if bucket_name else None
+    if client is None:
+        raise RuntimeError("GCS storage selected for IIF batches but google-cloud-storage or GCS_BUCKET_NAME is missing.")
+    return client.bucket(bucket_name)
+
+
+def _object_name(batch_type, sha256_hex, suffix):
+    return f"{IIF_BATCH_GCS_PREFIX}/{batch_type}/{sha256_hex}{suffix}"
+
+
+def _write_artifact(batch_type, sha256_hex, content_bytes, manifest):
+    """Writes the content and its manifest (skipping the content if already present). Returns the content URI."""
+    manifest_bytes = json.dumps(manifest, indent=2, default=str).encode("utf-8")
+    if IIF_BATCH_STORAGE == "gcs":
+        bucket = _get_gcs_bucket()
+        content_blob = bucket.blob(_object_name(batch_type, sha256_hex, ".iif"))
+        if not content_blob.exists():
+            content_blob.upload_from_string(content_bytes, content_type=IIF_CONTENT_TYPE)
+        bucket.blob(_object_name(batch_type, sha256_hex, ".manifest.json")).upload_from_string(
+            manifest_bytes, content_type="application/json")
+        return f"gs://{GCS_BUCKET_NAME}/{content_blob.name}"
+
+    batch_dir = os.path.join(IIF_BATCH_LOCAL_DIR, batch_type)
+    os.makedirs(batch_dir, exist_ok=True)
+    content_path = os.path.join(batch_dir, f"{sha256_hex}.iif")
+    for path, data in ((content_path, content_bytes), (os.path.join(batch_dir, f"{sha256_hex}.manifest.json"), manifest_bytes)):
+        if path == content_path and os.path.exists(path):
+            continue
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+    return f"file://{content_path}"
+
+
+def _read_artifact(storage_uri):
+    if storage_uri.startswith("gs://"):
+        bucket_name, _, blob_name = storage_uri[len("gs://"):].partition("/")
+        blob = _get_gcs_bucket(bucket_name).blob(blob_name)
+        if not blob.exists():
+            raise IIFBatchIntegrityError(f"IIF batch artifact {storage_uri} not found.")
+        return blob.download_as_bytes()
+    if storage_uri.startswith("file://"):
+        path = storage_uri[len("file://"):]
+        if not os.path.exists(path):
+            raise IIFBatchIntegrityError(f"IIF batch artifact {storage_uri} not found.")
+        with open(path, "rb") as f:
+            return f.read()
+    raise ValueError(f"Unsupported IIF batch storage URI: {storage_uri}")
+
+
+def _row_to_batch(row):
+    if row is None:
+        return None
+    batch = dict(row._mapping)
+    batch["record_ids"] = list(batch.get("record_ids") or [])
+    batch["record_count"] = len(batch["record_ids"])
+    return batch
+
+
+def get_batch(db_engine_ref, batch_id):
+    with db_engine_ref.connect() as conn:
+        row = conn.execute(text(f"SELECT {_BATCH_COLUMNS} FROM iif_batches WHERE id = :id"), {"id": batch_id}).fetchone()
+    return _row_to_batch(row)
+
+
+def list_batches(db_engine_ref, batch_type=None, limit=50):
+    sql = f"SELECT {_BATCH_COLUMNS} FROM iif_batches"
+    params = {"limit": limit}
+    if batch_type:
+        sql += " WHERE batch_type = :batch_type"
+        params["batch_type"] = batch_type
+    sql += " ORDER BY created_at DESC, id DESC LIMIT :limit"
+    with db_engine_ref.connect() as conn:
+        return [_row_to_batch(row) for row in conn.execute(text(sql), params).fetchall()]
+
+
+def save_batch(db_engine_ref, batch_type, iif_content, record_ids, mapping_failures=None, label=None, filename=None):
+    """
+    Stores an IIF batch and its manifest, returning the iif_batches row as a dict with an extra
+    'is_new' flag. An identical batch (same type and content hash) is returned as-is.
+    """
+    if batch_type not in BATCH_TYPES:
+        raise ValueError(f"Unknown IIF batch type '{batch_type}'.")
+    content_bytes = iif_content.encode("utf-8")
+    sha256_hex = content_sha256(content_bytes)
+    lookup_sql = text(f"SELECT {_BATCH_COLUMNS} FROM iif_batches WHERE batch_type = :batch_type AND content_sha256 = :sha")
+
+    with db_engine_ref.connect() as conn:
+        existing = conn.execute(lookup_sql, {"batch_type": batch_type, "sha": sha256_hex}).fetchone()
+    if existing is not None:
+        batch = _row_to_batch(existing)
+        print(f"INFO IIF_BATCH_STORE: {batch_type} batch {sha256_hex[:12]} already stored as #{batch['id']} (email: {batch['email_status']}).")
+        return dict(batch, is_new=False)
+
+    record_ids = [int(record_id) for record_id in record_ids]
+    manifest = {"batch_type": batch_type, "label": label, "filename": filename, "content_sha256": sha256_hex,
+                "content_bytes": len(content_bytes), "record_ids": record_ids,
+                "mapping_failures": mapping_failures or []}
+    storage_uri = _write_artifact(batch_type, sha256_hex, content_bytes, manifest)
+
+    with db_engine_ref.begin() as conn:
+        row = conn.execute(
+            text(f"""
+                INSERT INTO iif_batches (batch_type, batch_label, filename, content_sha256, content_bytes, record_ids,
+                                         mapping_failures, storage_uri, email_status, created_at)
+                VALUES (:batch_type, :label, :filename, :sha, :content_bytes, :record_ids,
+                        CAST(:mapping_failures AS JSONB), :storage_uri, 'pending', NOW())
+                ON CONFLICT (batch_type, content_sha256) DO NOTHING
+                RETURNING {_BATCH_COLUMNS}
+            """),
+            {"batch_type": batch_type, "label": label, "filename": filename or f"{batch_type}_{sha256_hex[:12]}.iif",
+             "sha": sha256_hex, "content_bytes": len(content_bytes), "record_ids": record_ids,
+             "mapping_failures": json.dumps(mapping_failures or [], default=str), "storage_uri": storage_uri}
+        ).fetchone()
+        is_new = row is not None
+        if row is None:  # a concurrent run stored the same batch first
+            row = conn.execute(lookup_sql, {"batch_type": batch_type, "sha": sha256_hex}).fetchone()
+    batch = _row_to_batch(row)
+    print(f"INFO IIF_BATCH_STORE: Stored {batch_type} batch #{batch['id']} ({batch['record_count']} records, {len(content_bytes)} bytes) at {storage_uri}.")
+    return dict(batch, is_new=is_new)
+
+
+def mark_email_result(db_engine_ref, batch_id, email_sent):
+    """
+    Records an email attempt. A batch that was delivered once stays 'sent' even if a later re-send
+    fails: store_and_email_iif_batch relies on that status to never email the same batch twice.
+    """
+    with db_engine_ref.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE iif_batches
+                SET email_status = CASE WHEN :sent OR email_status = 'sent' THEN 'sent' ELSE 'failed' END,
+                    emailed_at = CASE WHEN :sent THEN NOW() ELSE emailed_at END
+                WHERE id = :id
+            """),
+            {"sent": bool(email_sent), "id": batch_id}
+        )
+
+
+def read_batch_content(batch):
+    """Returns the stored IIF bytes for a batch row, verified against its recorded hash."""
+    content_bytes = _read_artifact(batch["storage_uri"])
+    if content_sha256(content_bytes) != batch["content_sha256"]:
+        raise IIFBatchIntegrityError(f"IIF batch #{batch['id']} content does not match its recorded hash.")
+    return content_bytes
@@ -8,6 +8,8 @@ from datetime import datetime, timezone, timedelta
 from decimal import Decimal
 import traceback
 import html
+import io
+import itertools
 import re # For supplier name stripping
 
 # --- Email Service Import ---
@@ -17,6 +19,13 @@ except ImportError:
     print("WARN IIF_GEN: Could not import 'email_service'. Email sending will fail.")
     email_service = None
 
+# --- IIF Batch Store Import ---
+try:
+    import iif_batch_store
+except ImportError:
+    print("WARN IIF_GEN: Could not import 'iif_batch_store'. IIF batches will not be persisted.")
+    iif_batch_store = None
+
 # --- Database Engine Import/Setup ---
 try:
     from app import engine
@@ -42,55 +51,171 @@ QUICKBOOKS_CUSTOMER_WEBSITE = "G1.com Website Customer" # Generic customer for a
 QUICKBOOKS_ITEM_SHIPPING_CHARGES = "Freight Collected" # QB Item Name for shipping charges
 QUICKBOOKS_ITEM_SALES_TAX = "Sales Tax" # QB Item Name for sales tax collected
 
-# --- QB Item Name Lookup Function (used by both PO and Sales) ---
-def get_qb_item_name_for_option_pn(conn, option_pn_from_po_or_sale):
+# --- IIF Record Layout (shared by PO and Sales) ---
+IIF_TRNS_FIELDS = (
+    "TRNSID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO",
+    "CLEAR", "TOPRINT", "NAMEISTAXABLE",
+    "ADDR1", "ADDR2", "ADDR3", "ADDR4", "ADDR5",
+    "DUEDATE", "TERMS", "PAID", "PAYMETH", "SHIPVIA", "SHIPDATE",
+    "OTHER1", "REP", "FOB", "PONUM", "INVTITLE", "INVMEMO",
+    "SADDR1", "SADDR2", "SADDR3", "SADDR4", "SADDR5"
+)
+IIF_SPL_FIELDS = (
+    "SPLID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO",
+    "CLEAR", "QNTY", "PRICE", "INVITEM",
+    "PAYMETH", "TAXABLE",
+    "VALADJ", "REIMBEXP", "SERVICEDATE", "OTHER2", "OTHER3",
+    "PAYITEM", "YEARTODATE", "WAGEBASE", "EXTRA"
+)
+IIF_LINE_END = "\r\n"
+# Rows fetched per round trip from the server-side cursor while generating a batch.
+IIF_STREAM_BATCH_ROWS = int(os.getenv("IIF_STREAM_BATCH_ROWS", "500"))
+
+
+class IIFWriter:
+    """
+    Writes IIF records straight to a text stream. The TRNS/SPL field order is bound once per writer,
+    so each record is a single sanitize-and-join over a fixed tuple instead of a list built per line.
+    """
+
+    def __init__(self, stream, trns_fields=IIF_TRNS_FIELDS, spl_fields=IIF_SPL_FIELDS):
+        self.stream = stream
+        self.trns_fields = tuple(trns_fields)
+        self.spl_fields = tuple(spl_fields)
+
+    def write_headers(self):
+        self.stream.write("!TRNS\t" + "\t".join(self.trns_fields) + IIF_LINE_END
+                          + "!SPL\t" + "\t".join(self.spl_fields) + IIF_LINE_END
+                          + "!ENDTRNS" + IIF_LINE_END)
+
+    def _write_record(self, record_type, fields, values):
+        self.stream.write(record_type + "\t" + "\t".join([sanitize_field(values.get(field, "")) for field in fields]) + IIF_LINE_END)
+
+    def trns(self, values):
+        self._write_record("TRNS", self.trns_fields, values)
+
+    def spl(self, values):
+        self._write_record("SPL", self.spl_fields, values)
+
+    def end_transaction(self):
+        self.stream.write("ENDTRNS" + IIF_LINE_END)
+
+    def write_empty_transaction(self):
+        """Placeholder TRNS/SPL/ENDTRNS block emitted when a batch has no eligible records."""
+        self.stream.write("TRNS\t" + "\t".join([""] * len(self.trns_fields)) + IIF_LINE_END
+                          + "SPL\t" + "\t".join([""] * len(self.spl_fields)) + IIF_LINE_END
+                          + "ENDTRNS" + IIF_LINE_END)
+
+
+def _stream_grouped_rows(conn, statement, params, key_column):
+    """
+    Executes statement on a server-side cursor and yields (key, [rows]) per consecutive key_column
+    value. The statement must be ordered by key_column so each header's lines arrive together.
+    """
+    result = conn.execution_options(stream_results=True, yield_per=IIF_STREAM_BATCH_ROWS).execute(statement, params)
+    try:
+        for key, rows in itertools.groupby(result, key=lambda row: getattr(row, key_column)):
+            yield key, list(rows)
+    finally:
+        result.close()
+
+
+# --- QB Item Name Lookup (used by both PO and Sales) ---
+# The batch generators resolve mappings inside their extraction query (see sql_qb_item_lateral_joins),
+# so a whole batch is one query no matter how many lines it has.
+SQL_QB_ITEM_NAMES = text("SELECT option_pn, qb_item_name FROM qb_product_mapping WHERE option_pn = ANY(:option_pns)")
+
+
+def sql_qb_item_lateral_joins(lookup_key_sql):
+    """
+    LEFT JOIN LATERAL clauses exposing qb_direct_item_name and qb_fallback_item_name for lookup_key_sql,
+    mirroring _underscore_fallback_sku: the fallback key is the part after the last underscore.
+    """
+    return f"""
+            LEFT JOIN LATERAL (
+                SELECT qpm.qb_item_name AS qb_direct_item_name FROM qb_product_mapping qpm
+                WHERE qpm.option_pn = {lookup_key_sql} AND qpm.qb_item_name IS NOT NULL AND qpm.qb_item_name <> '' LIMIT 1
+            ) qb_direct ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT qpm.qb_item_name AS qb_fallback_item_name FROM qb_product_mapping qpm
+                WHERE strpos({lookup_key_sql}, '_') > 0 AND regexp_replace({lookup_key_sql}, '^.*_', '') <> ''
+                  AND qpm.option_pn = regexp_replace({lookup_key_sql}, '^.*_', '')
+                  AND qpm.qb_item_name IS NOT NULL AND qpm.qb_item_name <> '' LIMIT 1
+            ) qb_fallback ON TRUE"""
+
+
+def _qb_item_names_from_row(row, lookup_key):
+    """Per-line qb_item_names map built from the lateral-join columns, for resolve_qb_item_name."""
+    if not lookup_key:
+        return {}
+    sku = str(lookup_key)
+    qb_item_names = {}
+    fallback_sku = _underscore_fallback_sku(sku)
+    if fallback_sku and row.qb_fallback_item_name: qb_item_names[fallback_sku] = row.qb_fallback_item_name
+    if row.qb_direct_item_name: qb_item_names[sku] = row.qb_direct_item_name
+    return qb_item_names
+
+
+def _underscore_fallback_sku(sku):
+    """Part after the last underscore, tried when the full SKU has no QB mapping (None if not applicable)."""
+    if '_' in sku:
+        sku_after_underscore = sku.split('_')[-1]
+        if sku_after_underscore and sku_after_underscore != sku:
+            return sku_after_underscore
+    return None
+
+
+def prefetch_qb_item_names(conn, option_pns):
+    """Returns {option_pn: qb_item_name} for every given option PN and its underscore fallback, in one query."""
+    lookup_keys = set()
+    for option_pn in option_pns:
+        if not option_pn: continue
+        sku = str(option_pn)
+        lookup_keys.add(sku)
+        fallback_sku = _underscore_fallback_sku(sku)
+        if fallback_sku: lookup_keys.add(fallback_sku)
+    if not lookup_keys:
+        return {}
+    rows = conn.execute(SQL_QB_ITEM_NAMES, {"option_pns": list(lookup_keys)}).fetchall()
+    return {row.option_pn: row.qb_item_name for row in rows if row.qb_item_name}
+
+
+def resolve_qb_item_name(qb_item_names, option_pn_from_po_or_sale):
+    """
+    Resolves INVITEM from a prefetched qb_item_names map. Returns (qb_item_name, mapping_found):
+    direct match first, then the part after the last underscore, else the original SKU with False.
+    """
     if not option_pn_from_po_or_sale:
         print(f"WARN IIF_GEN_MAP: Received empty or None Option PN for INVITEM.")
         return "", False
 
     original_sku_for_reporting = str(option_pn_from_po_or_sale) # For consistent reporting if lookup fails
-    sku_to_lookup = original_sku_for_reporting
+    qb_item_name = qb_item_names.get(original_sku_for_reporting)
+    if qb_item_name:
+        return qb_item_name, True
+
+    sku_after_underscore = _underscore_fallback_sku(original_sku_for_reporting)
+    if sku_after_underscore:
+        qb_item_name = qb_item_names.get(sku_after_underscore)
+        if qb_item_name:
+            print(f"DEBUG IIF_GEN_MAP: Found QB mapping for fallback SKU '{sku_after_underscore}': INVITEM='{qb_item_name}' (Original Full SKU: '{original_sku_for_reporting}')")
+            return qb_item_name, True
+        print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for original SKU '{original_sku_for_reporting}' or fallback SKU '{sku_after_underscore}'. Using original full SKU as INVITEM.")
+    elif '_' in original_sku_for_reporting:
+        print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for Option PN '{original_sku_for_reporting}'. Fallback part after underscore was invalid or same. Using original full SKU as INVITEM.")
+    else:
+        print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for Option PN '{original_sku_for_reporting}'. Using original full SKU as INVITEM.")
+    return original_sku_for_reporting, False
 
-    sql_mapping_query = text("SELECT qb_item_name FROM qb_product_mapping WHERE option_pn = :option_pn;")
-    
+
+def get_qb_item_name_for_option_pn(conn, option_pn_from_po_or_sale):
+    """Single-SKU lookup (same rules as resolve_qb_item_name); batch callers should prefetch instead."""
     try:
-        # Attempt 1: Direct lookup with the provided SKU
-        mapping_result = conn.execute(sql_mapping_query, {"option_pn": sku_to_lookup}).fetchone()
-        if mapping_result and mapping_result.qb_item_name:
-            qb_item_name = mapping_result.qb_item_name
-            print(f"DEBUG IIF_GEN_MAP: Found QB mapping for Option PN '{sku_to_lookup}': INVITEM='{qb_item_name}'")
-            return qb_item_name, True
-        
-        # Attempt 2: If direct lookup fails and SKU contains an underscore, try the part after the last underscore
-        if '_' in sku_to_lookup:
-            sku_after_underscore = sku_to_lookup.split('_')[-1]
-            if sku_after_underscore and sku_after_underscore != sku_to_lookup: # Ensure there's something after '_' and it's different
-                print(f"DEBUG IIF_GEN_MAP: Direct lookup failed for '{sku_to_lookup}'. Trying fallback with SKU part after underscore: '{sku_after_underscore}'")
-                fallback_result = conn.execute(sql_mapping_query, {"option_pn": sku_after_underscore}).fetchone()
-                if fallback_result and fallback_result.qb_item_name:
-                    qb_item_name = fallback_result.qb_item_name
-                    print(f"DEBUG IIF_GEN_MAP: Found QB mapping for fallback SKU '{sku_after_underscore}': INVITEM='{qb_item_name}' (Original Full SKU: '{original_sku_for_reporting}')")
-                    return qb_item_name, True
-                else:
-                    # Fallback also failed
-                    print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for original SKU '{original_sku_for_reporting}' or fallback SKU '{sku_after_underscore}'. Using original full SKU as INVITEM.")
-                    return original_sku_for_reporting, False
-            else:
-                # Underscore present, but no valid part after it, or it's the same as the original
-                 print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for Option PN '{original_sku_for_reporting}'. Fallback part after underscore was invalid or same. Using original full SKU as INVITEM.")
-                 return original_sku_for_reporting, False
-        else:
-            # No underscore, and direct lookup failed
-            print(f"WARN IIF_GEN_MAP: No QuickBooks mapping found for Option PN '{original_sku_for_reporting}'. Using original full SKU as INVITEM.")
-            return original_sku_for_reporting, False
-            
+        qb_item_names = prefetch_qb_item_names(conn, [option_pn_from_po_or_sale])
     except sqlalchemy.exc.SQLAlchemyError as db_err:
-         print(f"ERROR IIF_GEN_MAP: Database error looking up Option PN '{original_sku_for_reporting}': {db_err}")
-         return original_sku_for_reporting, False # Return original full SKU on DB error
-    except Exception as e:
-        print(f"ERROR IIF_GEN_MAP: Unexpected error looking up Option PN '{original_sku_for_reporting}': {e}")
-        traceback.print_exc()
-        return original_sku_for_reporting, False # Return original full SKU on other errors
+        print(f"ERROR IIF_GEN_MAP: Database error looking up Option PN '{option_pn_from_po_or_sale}': {db_err}")
+        return str(option_pn_from_po_or_sale or ""), False # Return original full SKU on DB error
+    return resolve_qb_item_name(qb_item_names, option_pn_from_po_or_sale)
 
 def sanitize_field(value, max_length=None):
     """Sanitizes a field value for IIF output."""
@@ -118,29 +243,11 @@ def strip_supplier_contact(supplier_name_full):
 
 # --- IIF Generation for Purchase Orders ---
 def generate_po_iif_content_for_date(db_engine_ref, target_date_str=None, process_all_pending=False):
-    iif_lines = []
     po_mapping_failures = []
     processed_po_db_ids = [] 
-
-    trns_header_fields = [
-        "TRNSID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO",
-        "CLEAR", "TOPRINT", "NAMEISTAXABLE",
-        "ADDR1", "ADDR2", "ADDR3", "ADDR4", "ADDR5",
-        "DUEDATE", "TERMS", "PAID", "PAYMETH", "SHIPVIA", "SHIPDATE",
-        "OTHER1", "REP", "FOB", "PONUM", "INVTITLE", "INVMEMO",
-        "SADDR1", "SADDR2", "SADDR3", "SADDR4", "SADDR5"
-    ]
-    spl_header_fields = [
-        "SPLID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO",
-        "CLEAR", "QNTY", "PRICE", "INVITEM",
-        "PAYMETH", "TAXABLE",
-        "VALADJ", "REIMBEXP", "SERVICEDATE", "OTHER2", "OTHER3",
-        "PAYITEM", "YEARTODATE", "WAGEBASE", "EXTRA"
-    ]
-
-    iif_lines.append("!TRNS\t" + "\t".join(trns_header_fields))
-    iif_lines.append("!SPL\t" + "\t".join(spl_header_fields))
-    iif_lines.append("!ENDTRNS")
+    iif_buffer = io.StringIO()
+    writer = IIFWriter(iif_buffer)
+    writer.write_headers()
 
     target_date = None
     if not process_all_pending:
@@ -163,10 +270,14 @@ def generate_po_iif_content_for_date(db_engine_ref, target_date_str=None, proces
                 o.customer_name, o.customer_shipping_address_line1, o.customer_shipping_address_line2,
                 o.customer_shipping_city, o.customer_shipping_state, o.customer_shipping_zip,
                 o.customer_shipping_country, o.customer_shipping_country_iso2, 
-                o.bigcommerce_order_id
+                o.bigcommerce_order_id,
+                pli.id AS line_item_id, pli.sku AS item_sku, pli.description AS item_description,
+                pli.quantity, pli.unit_cost,
+                qb_direct.qb_direct_item_name, qb_fallback.qb_fallback_item_name
             FROM purchase_orders po
             JOIN suppliers s ON po.supplier_id = s.id
             JOIN orders o ON po.order_id = o.id
+            LEFT JOIN po_line_items pli ON pli.purchase_order_id = po.id""" + sql_qb_item_lateral_joins("pli.sku") + """
             WHERE po.status = 'SENT_TO_SUPPLIER'
               AND (po.qb_po_sync_status IS NULL OR po.qb_po_sync_status IN ('pending_sync', 'error'))
         """
@@ -174,19 +285,12 @@ def generate_po_iif_content_for_date(db_engine_ref, target_date_str=None, proces
         if not process_all_pending and target_date:
             base_sql += " AND DATE(po.po_date AT TIME ZONE 'UTC') = :target_date"
             query_params["target_date"] = target_date
-        base_sql += " ORDER BY po.po_date, po.id;"
-
-        sql_data_query = text(base_sql)
-        purchase_orders_data = conn.execute(sql_data_query, query_params).fetchall()
-        print(f"INFO IIF_PO_GEN: Found {len(purchase_orders_data)} eligible Purchase Orders matching criteria.")
+        base_sql += " ORDER BY po.po_date, po.id, pli.id;"
 
-        if not purchase_orders_data:
-            empty_iif_trns_line = "TRNS\t" + "\t".join([""] * len(trns_header_fields))
-            empty_iif_spl_line = "SPL\t" + "\t".join([""] * len(spl_header_fields))
-            iif_lines.extend([empty_iif_trns_line, empty_iif_spl_line, "ENDTRNS"])
-            return "\r\n".join(iif_lines) + "\r\n", [], []
-
-        for po_row in purchase_orders_data:
+        purchase_orders_found = 0
+        for po_id, po_rows in _stream_grouped_rows(conn, text(base_sql), query_params, "po_id"):
+            purchase_orders_found += 1
+            po_row = po_rows[0]
             if po_row.po_date is None:
                 print(f"WARN IIF_PO_GEN: PO Number {po_row.po_number} has no po_date. Skipping this PO.")
                 continue
@@ -244,22 +348,16 @@ def generate_po_iif_content_for_date(db_engine_ref, target_date_str=None, proces
                 "SADDR1": saddr1, "SADDR2": saddr2, "SADDR3": saddr3,
                 "SADDR4": saddr4, "SADDR5": saddr5
             }
-            trns_data_ordered = [sanitize_field(trns_values_dict.get(field, "")) for field in trns_header_fields]
-            iif_lines.append("TRNS\t" + "\t".join(trns_data_ordered))
+            writer.trns(trns_values_dict)
 
-            sql_line_items_query = text("""
-                SELECT pli.sku as item_sku, pli.description AS item_description,
-                       pli.quantity, pli.unit_cost
-                FROM po_line_items pli WHERE pli.purchase_order_id = :current_po_id;
-            """)
-            line_items = conn.execute(sql_line_items_query, {"current_po_id": po_row.po_id}).fetchall()
+            line_items = [row for row in po_rows if row.line_item_id is not None]
 
             if not line_items:
                 print(f"WARN IIF_PO_GEN: No line items found for PO ID {po_row.po_id} (PO Number: {po_row.po_number}).")
 
             for item_row in line_items:
                 sku_to_lookup = item_row.item_sku
-                qb_invitem_name, mapping_found = get_qb_item_name_for_option_pn(conn, sku_to_lookup)
+                qb_invitem_name, mapping_found = resolve_qb_item_name(_qb_item_names_from_row(item_row, sku_to_lookup), sku_to_lookup)
                 if not mapping_found:
                     po_mapping_failures.append({
                         "po_number": po_row.po_number,
@@ -282,25 +380,27 @@ def generate_po_iif_content_for_date(db_engine_ref, target_date_str=None, proces
                     "VALADJ": "N", "REIMBEXP": "NOTHING", "SERVICEDATE": "", "OTHER2": "", "OTHER3": "",
                     "PAYITEM": "", "YEARTODATE": "", "WAGEBASE": "", "EXTRA": ""
                 }
-                spl_data_ordered = [sanitize_field(spl_values_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(spl_data_ordered))
+                writer.spl(spl_values_dict)
 
             if po_row.payment_instructions:
                 memo_spl_values_dict = { "TRNSTYPE": "PURCHORD", "DATE": po_date_formatted, "ACCNT": "", "AMOUNT": "", "DOCNUM": po_row.po_number, "MEMO": sanitize_field(po_row.payment_instructions, 4095)}
-                memo_spl_data_ordered = [sanitize_field(memo_spl_values_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(memo_spl_data_ordered))
+                writer.spl(memo_spl_values_dict)
 
             if po_row.bigcommerce_order_id:
                 fulfillment_note = f"Fulfillment of G1 Order #{po_row.bigcommerce_order_id}"
                 fulfillment_spl_values_dict = { "TRNSTYPE": "PURCHORD", "DATE": po_date_formatted, "ACCNT": "", "AMOUNT": "", "DOCNUM": po_row.po_number, "MEMO": sanitize_field(fulfillment_note, 4095)}
-                fulfillment_spl_data_ordered = [sanitize_field(fulfillment_spl_values_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(fulfillment_spl_data_ordered))
+                writer.spl(fulfillment_spl_values_dict)
 
-            iif_lines.append("ENDTRNS")
+            writer.end_transaction()
             processed_po_db_ids.append(po_row.po_id) 
 
+        print(f"INFO IIF_PO_GEN: Found {purchase_orders_found} eligible Purchase Orders matching criteria.")
+        if not purchase_orders_found:
+            writer.write_empty_transaction()
+            return iif_buffer.getvalue(), [], []
+
         print(f"INFO IIF_PO_GEN: Finished generating PO IIF content. Processed IDs: {len(processed_po_db_ids)}. Failures: {len(po_mapping_failures)}.")
-        return "\r\n".join(iif_lines) + "\r\n", po_mapping_failures, processed_po_db_ids
+        return iif_buffer.getvalue(), po_mapping_failures, processed_po_db_ids
 
     except sqlalchemy.exc.SQLAlchemyError as db_e:
         print(f"CRITICAL IIF_PO_GEN: Database error: {db_e}")
@@ -343,11 +443,11 @@ def get_us_state_abbreviation(state_name_full, country_name_or_iso):
 
 # --- IIF Generation for Sales Invoices & Payments ---
 def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, process_all_pending=False):
-    iif_lines, sales_item_mapping_failures = [], []
+    sales_item_mapping_failures = []
     processed_sales_order_db_ids = [] 
-    trns_header_fields = ["TRNSID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO", "CLEAR", "TOPRINT", "NAMEISTAXABLE", "ADDR1", "ADDR2", "ADDR3", "ADDR4", "ADDR5", "DUEDATE", "TERMS", "PAID", "PAYMETH", "SHIPVIA", "SHIPDATE", "OTHER1", "REP", "FOB", "PONUM", "INVTITLE", "INVMEMO", "SADDR1", "SADDR2", "SADDR3", "SADDR4", "SADDR5"]
-    spl_header_fields = ["SPLID", "TRNSTYPE", "DATE", "ACCNT", "NAME", "CLASS", "AMOUNT", "DOCNUM", "MEMO", "CLEAR", "QNTY", "PRICE", "INVITEM", "PAYMETH", "TAXABLE", "VALADJ", "REIMBEXP", "SERVICEDATE", "OTHER2", "OTHER3", "PAYITEM", "YEARTODATE", "WAGEBASE", "EXTRA"]
-    iif_lines.extend(["!TRNS\t" + "\t".join(trns_header_fields), "!SPL\t" + "\t".join(spl_header_fields), "!ENDTRNS"])
+    iif_buffer = io.StringIO()
+    writer = IIFWriter(iif_buffer)
+    writer.write_headers()
 
     target_date = None
     if not process_all_pending:
@@ -373,27 +473,31 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
                 o.customer_billing_first_name, o.customer_billing_last_name, o.customer_billing_company,
                 o.customer_billing_street_1, o.customer_billing_street_2,
                 o.customer_billing_city, o.customer_billing_state,
-                o.customer_billing_zip, o.customer_billing_country, o.customer_billing_country_iso2
+                o.customer_billing_zip, o.customer_billing_country, o.customer_billing_country_iso2,
+                oli.id AS line_item_id, oli.sku, oli.name AS product_name, oli.quantity, oli.sale_price,
+                hpe.option_pn AS hpe_option_pn, hpe_desc.po_description AS hpe_po_description,
+                qb_direct.qb_direct_item_name, qb_fallback.qb_fallback_item_name
             FROM orders o
+            LEFT JOIN order_line_items oli ON oli.order_id = o.id
+            LEFT JOIN LATERAL (
+                SELECT hpm.option_pn FROM hpe_part_mappings hpm
+                WHERE hpm.sku = oli.sku AND hpm.option_pn IS NOT NULL AND hpm.option_pn <> '' LIMIT 1
+            ) hpe ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT hdm.po_description FROM hpe_description_mappings hdm WHERE hdm.option_pn = hpe.option_pn LIMIT 1
+            ) hpe_desc ON TRUE""" + sql_qb_item_lateral_joins("COALESCE(hpe.option_pn, oli.sku)") + """
             WHERE (o.qb_sales_order_sync_status IS NULL OR o.qb_sales_order_sync_status IN ('pending_sync', 'error'))
         """
         query_params = {}
         if not process_all_pending and target_date:
             base_sql += " AND DATE(o.order_date AT TIME ZONE 'UTC') = :target_date"
             query_params["target_date"] = target_date
-        base_sql += " ORDER BY o.order_date, o.id;"
-
-        sql_sales_orders_query = text(base_sql)
-        sales_orders_data = conn.execute(sql_sales_orders_query, query_params).fetchall()
-        print(f"INFO IIF_SALES_GEN: Found {len(sales_orders_data)} eligible Sales Orders matching criteria.")
-
-        if not sales_orders_data:
-            empty_iif_trns_line = "TRNS\t" + "\t".join([""] * len(trns_header_fields))
-            empty_iif_spl_line = "SPL\t" + "\t".join([""] * len(spl_header_fields))
-            iif_lines.extend([empty_iif_trns_line, empty_iif_spl_line, "ENDTRNS"])
-            return "\r\n".join(iif_lines) + "\r\n", [], []
+        base_sql += " ORDER BY o.order_date, o.id, oli.id;"
 
-        for order_row in sales_orders_data:
+        sales_orders_found = 0
+        for app_order_id, order_rows in _stream_grouped_rows(conn, text(base_sql), query_params, "app_order_id"):
+            sales_orders_found += 1
+            order_row = order_rows[0]
             order_date_formatted = order_row.order_date.strftime("%m/%d/%Y") if order_row.order_date else datetime.now(timezone.utc).strftime("%m/%d/%Y")
             bc_order_id_str = str(order_row.bigcommerce_order_id)
             invoice_total_amount = Decimal(order_row.total_sale_price if order_row.total_sale_price is not None else '0.00')
@@ -496,25 +600,17 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
                 "SHIPDATE": order_date_formatted,
                 "PONUM": sanitize_field(customer_po_num_from_order, 25)
             }
-            trns_data_ordered = [sanitize_field(invoice_trns_dict.get(field, "")) for field in trns_header_fields]
-            iif_lines.append("TRNS\t" + "\t".join(trns_data_ordered))
+            writer.trns(invoice_trns_dict)
 
-            sql_line_items_query = text("""
-                SELECT oli.sku, oli.name as product_name, oli.quantity, oli.sale_price
-                FROM order_line_items oli WHERE oli.order_id = :app_order_id;
-            """)
-            line_items_data = conn.execute(sql_line_items_query, {"app_order_id": order_row.app_order_id}).fetchall()
+            line_items_data = [row for row in order_rows if row.line_item_id is not None]
 
             for item_row in line_items_data:
                 original_bc_sku = item_row.sku
                 option_pn_for_item = None
                 item_description_for_iif = sanitize_field(item_row.product_name, 4095)
-                sql_hpe_map = text("SELECT option_pn FROM hpe_part_mappings WHERE sku = :sku_val;")
-                hpe_res = conn.execute(sql_hpe_map, {"sku_val": original_bc_sku}).fetchone()
-                if hpe_res and hpe_res.option_pn:
-                    option_pn_for_item = hpe_res.option_pn
-                    sql_desc_map = text("SELECT po_description FROM hpe_description_mappings WHERE option_pn = :option_pn_val;")
-                    desc_res = conn.execute(sql_desc_map, {"option_pn_val": option_pn_for_item}).scalar_one_or_none()
+                if item_row.hpe_option_pn:
+                    option_pn_for_item = item_row.hpe_option_pn
+                    desc_res = item_row.hpe_po_description
                     if desc_res: item_description_for_iif = sanitize_field(desc_res, 4095)
                 else:
                     # If no HPE mapping, use original SKU as the basis for QB item lookup
@@ -522,7 +618,7 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
                     # No failure logged here for HPE mapping missing, as per existing logic.
                     # The failure will be logged if the subsequent qb_product_mapping lookup fails.
 
-                qb_invitem_name, mapping_found = get_qb_item_name_for_option_pn(conn, option_pn_for_item)
+                qb_invitem_name, mapping_found = resolve_qb_item_name(_qb_item_names_from_row(item_row, option_pn_for_item), option_pn_for_item)
                 if not mapping_found: 
                     sales_item_mapping_failures.append({
                         "bc_order_id": bc_order_id_str, 
@@ -536,8 +632,7 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
                 item_sale_price = Decimal(item_row.sale_price if item_row.sale_price is not None else 0)
                 item_line_total = item_quantity * item_sale_price
                 item_spl_dict = {"TRNSTYPE": "INVOICE", "DATE": order_date_formatted, "ACCNT": QUICKBOOKS_SALES_INCOME_MERCHANDISE, "INVITEM": qb_invitem_name, "QNTY": str(item_quantity), "PRICE": str(item_sale_price), "AMOUNT": str(item_line_total * -1), "MEMO": item_description_for_iif, "DOCNUM": bc_order_id_str, "NAME": QUICKBOOKS_CUSTOMER_WEBSITE, "TAXABLE": "N"}
-                spl_data_ordered = [sanitize_field(item_spl_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(spl_data_ordered))
+                writer.spl(item_spl_dict)
 
             shipping_memo = "Shipping Charges"
             order_shipping_method_raw = getattr(order_row, 'customer_shipping_method', "")
@@ -550,31 +645,32 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
             shipping_cost = Decimal(order_row.customer_shipping_cost if order_row.customer_shipping_cost is not None else '0.00')
             if shipping_cost > 0:
                 shipping_spl_dict = {"TRNSTYPE": "INVOICE", "DATE": order_date_formatted, "ACCNT": QUICKBOOKS_SALES_INCOME_SHIPPING, "INVITEM": QUICKBOOKS_ITEM_SHIPPING_CHARGES, "AMOUNT": str(shipping_cost * -1), "MEMO": shipping_memo, "DOCNUM": bc_order_id_str, "NAME": QUICKBOOKS_CUSTOMER_WEBSITE, "TAXABLE": "N"}
-                spl_data_ordered = [sanitize_field(shipping_spl_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(spl_data_ordered))
+                writer.spl(shipping_spl_dict)
 
             tax_amount = Decimal(order_row.bigcommerce_order_tax if order_row.bigcommerce_order_tax is not None else '0.00')
             if tax_amount > 0:
                 tax_spl_dict = {"TRNSTYPE": "INVOICE", "DATE": order_date_formatted, "ACCNT": QUICKBOOKS_OTHER_INCOME_FOR_SALES_TAX_ITEM, "INVITEM": QUICKBOOKS_ITEM_SALES_TAX, "AMOUNT": str(tax_amount * -1), "MEMO": "", "DOCNUM": bc_order_id_str, "NAME": QUICKBOOKS_CUSTOMER_WEBSITE, "TAXABLE": "N"}
-                spl_data_ordered = [sanitize_field(tax_spl_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(spl_data_ordered))
-            iif_lines.append("ENDTRNS")
+                writer.spl(tax_spl_dict)
+            writer.end_transaction()
 
             if should_create_payment:
                 payment_amount = invoice_total_amount
                 iif_payment_method = "Credit Card"
                 payment_trns_dict = {"TRNSTYPE": "PAYMENT", "DATE": order_date_formatted, "ACCNT": QUICKBOOKS_UNDEPOSITED_FUNDS, "NAME": QUICKBOOKS_CUSTOMER_WEBSITE, "AMOUNT": str(payment_amount), "DOCNUM": bc_order_id_str, "PAYMETH": iif_payment_method, "MEMO": f"Payment for Order #{bc_order_id_str}"}
-                trns_data_ordered = [sanitize_field(payment_trns_dict.get(field, "")) for field in trns_header_fields]
-                iif_lines.append("TRNS\t" + "\t".join(trns_data_ordered))
+                writer.trns(payment_trns_dict)
                 payment_spl_dict = {"TRNSTYPE": "PAYMENT", "DATE": order_date_formatted, "ACCNT": QUICKBOOKS_ACCOUNTS_RECEIVABLE, "NAME": QUICKBOOKS_CUSTOMER_WEBSITE, "AMOUNT": str(payment_amount * -1), "DOCNUM": bc_order_id_str, "MEMO": f"Applied to Invoice #{bc_order_id_str}"}
-                spl_data_ordered = [sanitize_field(payment_spl_dict.get(field, "")) for field in spl_header_fields]
-                iif_lines.append("SPL\t" + "\t".join(spl_data_ordered))
-                iif_lines.append("ENDTRNS")
+                writer.spl(payment_spl_dict)
+                writer.end_transaction()
 
             processed_sales_order_db_ids.append(order_row.app_order_id) 
 
+        print(f"INFO IIF_SALES_GEN: Found {sales_orders_found} eligible Sales Orders matching criteria.")
+        if not sales_orders_found:
+            writer.write_empty_transaction()
+            return iif_buffer.getvalue(), [], []
+
         print(f"INFO IIF_SALES_GEN: Finished Sales IIF. Processed IDs: {len(processed_sales_order_db_ids)}. Failures: {len(sales_item_mapping_failures)}.")
-        return "\r\n".join(iif_lines) + "\r\n", sales_item_mapping_failures, processed_sales_order_db_ids
+        return iif_buffer.getvalue(), sales_item_mapping_failures, processed_sales_order_db_ids
 
     except sqlalchemy.exc.SQLAlchemyError as db_e:
         print(f"CRITICAL IIF_SALES_GEN: DB error: {db_e}"); traceback.print_exc()
@@ -587,6 +683,48 @@ def generate_sales_iif_content_for_date(db_engine_ref, target_date_str=None, pro
         print(f"INFO IIF_SALES_GEN: DB connection closed for {log_message_date_part}")
 
 
+# --- Batch Persistence + Email (used by the top-level functions and blueprints/quickbooks.py) ---
+def store_iif_batch(db_engine_ref, batch_type, iif_content, record_ids, mapping_failures=None, label=None, filename=None):
+    """Persists a generated batch via iif_batch_store. Errors are logged and return None so they never block a sync."""
+    if iif_batch_store is None or not iif_content or not record_ids:
+        return None
+    try:
+        return iif_batch_store.save_batch(db_engine_ref, batch_type, iif_content, record_ids,
+                                          mapping_failures=mapping_failures, label=label, filename=filename)
+    except Exception as e:
+        print(f"ERROR IIF_GEN_STORE: Failed to store {batch_type} IIF batch ({label}): {e}")
+        traceback.print_exc()
+        return None
+
+
+def store_and_email_iif_batch(db_engine_ref, batch_type, iif_content, record_ids, mapping_failures,
+                              batch_date_str, warning_message_html=None, custom_subject=None, filename_prefix="IIF_Batch_"):
+    """
+    Stores the batch, then emails it unless an identical batch was already emailed (a retried run
+    after the email went out but before sync statuses were updated). Returns (email_sent, batch).
+    """
+    filename = email_service.iif_attachment_filename(batch_date_str, filename_prefix) if email_service else None
+    batch = store_iif_batch(db_engine_ref, batch_type, iif_content, record_ids, mapping_failures,
+                            label=batch_date_str, filename=filename)
+    if batch and batch["email_status"] == "sent":
+        print(f"INFO IIF_GEN_STORE: Identical {batch_type} batch #{batch['id']} was already emailed at {batch['emailed_at']}; not re-sending.")
+        return True, batch
+    email_sent = email_service.send_iif_batch_email(
+        iif_content_string=iif_content,
+        batch_date_str=batch_date_str,
+        warning_message_html=warning_message_html,
+        custom_subject=custom_subject,
+        filename_prefix=filename_prefix,
+        iif_filename=batch["filename"] if batch else None
+    )
+    if batch:
+        try:
+            iif_batch_store.mark_email_result(db_engine_ref, batch["id"], email_sent)
+        except Exception as e:
+            print(f"ERROR IIF_GEN_STORE: Failed to record email result for IIF batch #{batch['id']}: {e}")
+    return email_sent, batch
+
+
 # --- Top-Level Functions for POs ---
 def create_and_email_daily_iif_batch(db_engine_ref): # Renamed to be more generic, as it's called by the scheduler for POs
     # This function specifically targets POs from yesterday for the daily scheduled task
@@ -608,8 +746,8 @@ def create_and_email_daily_iif_batch(db_engine_ref): # Renamed to be more generi
     
     if iif_content and processed_ids: # Only email if there was actual content with processed items
         if email_service:
-            email_sent = email_service.send_iif_batch_email(
-                iif_content_string=iif_content, 
+            email_sent, _ = store_and_email_iif_batch(
+                db_engine_ref, "po", iif_content, processed_ids, mapping_failures,
                 batch_date_str=batch_date_str, 
                 warning_message_html=email_warning_html, 
                 filename_prefix="PurchaseOrders_Daily_"
@@ -626,7 +764,8 @@ def create_and_email_daily_iif_batch(db_engine_ref): # Renamed to be more generi
                 print(f"ERROR IIF_PO_BATCH (Daily POs): Failed to update DB status for POs {processed_ids}: {e_db}")
                 traceback.print_exc()
         else:
-            print(f"WARN IIF_PO_BATCH (Daily POs): Email service not available. IIF for {batch_date_str} generated but not sent. DB status NOT updated.")
+            store_iif_batch(db_engine_ref, "po", iif_content, processed_ids, mapping_failures, label=batch_date_str)
+            print(f"WARN IIF_PO_BATCH (Daily POs): Email service not available. IIF for {batch_date_str} generated and stored but not sent. DB status NOT updated.")
     elif not iif_content: 
         print(f"INFO IIF_PO_BATCH (Daily POs): No PO IIF content generated for {batch_date_str} (no new POs or error).")
     elif iif_content and not processed_ids:
@@ -660,8 +799,8 @@ def create_and_email_iif_for_today(db_engine_ref): # Renamed for clarity - For P
     if iif_content and processed_ids:
         if email_service:
             email_subject = f"Today's Purchase Orders IIF Batch - {batch_date_str}"
-            email_sent = email_service.send_iif_batch_email( 
-                iif_content_string=iif_content, 
+            email_sent, _ = store_and_email_iif_batch(
+                db_engine_ref, "po", iif_content, processed_ids, mapping_failures,
                 batch_date_str=batch_date_str, 
                 warning_message_html=email_warning_html, 
                 custom_subject=email_subject, 
@@ -681,7 +820,8 @@ def create_and_email_iif_for_today(db_engine_ref): # Renamed for clarity - For P
 
             return True, f"IIF for today's POs generated ({len(processed_ids)} items) and email sent."
         else:
-            print(f"WARN IIF_PO_BATCH (Today's POs - User): Email service not available. IIF generated but not sent. DB status NOT updated.")
+            store_iif_batch(db_engine_ref, "po", iif_content, processed_ids, mapping_failures, label=batch_date_str)
+            print(f"WARN IIF_PO_BATCH (Today's POs - User): Email service not available. IIF generated and stored but not sent. DB status NOT updated.")
             return True, f"IIF for today's POs generated ({len(processed_ids)} items), but email service unavailable. DB status NOT updated."
             
     elif not iif_content: 
@@ -720,7 +860,7 @@ def create_and_email_daily_sales_iif_batch(db_engine_ref): # Example: could be c
     if content and processed_ids_sales:
         if email_service:
             subject = f"Daily Sales Orders & Payments IIF Batch - {date_str}"
-            sent = email_service.send_iif_batch_email(iif_content_string=content, batch_date_str=date_str, warning_message_html=warn_html, custom_subject=subject, filename_prefix="SalesInvoicesPayments_Daily_")
+            sent, _ = store_and_email_iif_batch(db_engine_ref, "sales", content, processed_ids_sales, failures, batch_date_str=date_str, warning_message_html=warn_html, custom_subject=subject, filename_prefix="SalesInvoicesPayments_Daily_")
             print(f"IIF_SALES_BATCH (Daily Sales): Email for {date_str} {'sent' if sent else 'failed'}.")
             # Update database status for processed Sales Orders
             try:
@@ -733,7 +873,8 @@ def create_and_email_daily_sales_iif_batch(db_engine_ref): # Example: could be c
                 print(f"ERROR IIF_SALES_BATCH (Daily Sales): Failed to update DB status for Sales Orders {processed_ids_sales}: {e_db_sales_daily}")
                 traceback.print_exc()
         else:
-            print(f"WARN IIF_SALES_BATCH (Daily Sales): Email service not available. Sales IIF for {date_str} generated but not sent. DB status NOT updated.")
+            store_iif_batch(db_engine_ref, "sales", content, processed_ids_sales, failures, label=date_str)
+            print(f"WARN IIF_SALES_BATCH (Daily Sales): Email service not available. Sales IIF for {date_str} generated and stored but not sent. DB status NOT updated.")
     elif not content: 
         print(f"INFO IIF_SALES_BATCH (Daily Sales): No Sales IIF content generated for {date_str} (no new sales orders or error).")
     elif content and not processed_ids_sales:
@@ -0,0 +1,124 @@
+# json_serialization.py
+# Single-pass JSON encoding for API responses.
+# AppJSONProvider (installed as app.json) encodes Decimal and datetime values directly, so routes
+# can jsonify convert_row_to_dict() output without a second make_json_safe() walk. orjson is used
+# when installed (JSON_USE_ORJSON=false to disable); values encode the same either way:
+#   Decimal   -> string (keeps exact cents, as make_json_safe did)
+#   datetime  -> ISO 8601, naive values treated as UTC
+#   date      -> Flask's default (HTTP date string), unchanged from before
+#   non-ASCII -> raw UTF-8, not \uXXXX escapes. orjson cannot escape it, so AppJSONProvider sets
+#                ensure_ascii = False for the json path too (Flask's default is True). Any JSON
+#                parser reads both forms the same.
+# stream_query_as_json() writes large row sets straight from a server-side cursor to the response;
+# it is used by the unpaginated lists (legacy GET /api/orders, GET /api/suppliers). Paginated
+# endpoints return at most a few hundred rows and keep building their lists in memory.
+
+import itertools
+import json
+import os
+import traceback
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+JSON_USE_ORJSON = os.getenv("JSON_USE_ORJSON", "true").lower() == "true"
+JSON_STREAM_BATCH_ROWS = int(os.getenv("JSON_STREAM_BATCH_ROWS", "500"))
+
+orjson = None
+if JSON_USE_ORJSON:
+    try:
+        import orjson
+        print("DEBUG JSON_SERIALIZATION: orjson available; using it for API responses.")
+    except ImportError:
+        orjson = None
+        print("WARN JSON_SERIALIZATION: orjson not installed; using the standard json module.")
+
+
+def default(value):
+    """Encoder hook for types json/orjson do not handle the way the API expects."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None: value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    if isinstance(value, date):
+        return DefaultJSONProvider.default(value)
+    if hasattr(value, "isoformat"):  # datetime.time
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj, sort_keys=False):
+        options = _ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=options).decode("utf-8")
+else:
+    def dumps(obj, sort_keys=False):
+        return json.dumps(obj, default=default, sort_keys=sort_keys, ensure_ascii=False)
+
+
+class AppJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider: DefaultJSONProvider's behaviour with the encodings above."""
+
+    ensure_ascii = False  # match orjson, which always writes UTF-8
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs.get("indent"):
+            return dumps(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys))
+        kwargs.setdefault("default", default)
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+
+def stream_query_as_json(engine, statement, params=None, row_to_dict=None, batch_rows=None):
+    """
+    Streams `statement`'s rows as a JSON array without materializing the list. Rows are fetched
+    from a server-side cursor in batches of batch_rows on a connection held for the duration of
+    the response. The query runs and the first batch is fetched before the Response is built, so
+    connection and query errors still raise to the caller (and become a 500). A failure in a later
+    batch aborts the stream without closing the array, so the client sees a broken response rather
+    than a short, valid-looking list.
+    """
+    batch_rows = batch_rows or JSON_STREAM_BATCH_ROWS
+    convert = row_to_dict or (lambda row: dict(row._mapping))
+
+    conn = engine.connect()
+    try:
+        result = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(statement, params or {})
+        partitions = result.partitions(batch_rows)
+        first_partition = next(partitions, [])
+    except Exception:
+        conn.close()
+        raise
+
+    def generate():
+        try:
+            yield "["
+            first = True
+            for partition in itertools.chain([first_partition], partitions):
+                chunk = ",".join(dumps(convert(row)) for row in partition)
+                if not chunk:
+                    continue
+                yield chunk if first else "," + chunk
+                first = False
+            yield "]"
+        except Exception as e:
+            print(f"ERROR JSON_SERIALIZATION: Streaming query failed mid-response; aborting it: {e}")
+            traceback.print_exc()
+            raise
+        finally:
+            conn.close()
+
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    response.call_on_close(conn.close)  # also covers a response that is never iterated
+    return response
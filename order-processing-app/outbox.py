@@ -0,0 +1,240 @@
+# outbox.py
+# Transactional outbox for side effects that must not run inside a request's DB transaction
+# (supplier/sales emails, BigCommerce shipment + status updates).
+#
+# Routes call enqueue() with the same connection/transaction that writes their rows, so a job
+# exists if and only if the business data committed. A daemon thread in this process claims due
+# jobs with FOR UPDATE SKIP LOCKED, runs the registered handler without holding a connection,
+# and records success or schedules a retry with exponential backoff. Delivery is at-least-once.
+# A job enqueued with depends_on runs only once all of those jobs are done; if one of them fails
+# for good, the dependents fail with it (retry_job() re-queues them together).
+# On Cloud Run the thread may be CPU-throttled between requests; pending jobs simply wait in the
+# table until the next wake-up (or the next instance) picks them up.
+
+import json
+import os
+import threading
+import time
+import traceback
+
+from sqlalchemy import text
+
+OUTBOX_WORKER_ENABLED = os.getenv("OUTBOX_WORKER_ENABLED", "true").lower() == "true"
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "15"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "10"))
+OUTBOX_DEFAULT_MAX_ATTEMPTS = int(os.getenv("OUTBOX_DEFAULT_MAX_ATTEMPTS", "6"))
+OUTBOX_BASE_BACKOFF_SECONDS = int(os.getenv("OUTBOX_BASE_BACKOFF_SECONDS", "30"))
+OUTBOX_MAX_BACKOFF_SECONDS = int(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+# A 'running' job whose lock is older than this is assumed orphaned (process died) and re-claimed.
+OUTBOX_STALE_LOCK_SECONDS = int(os.getenv("OUTBOX_STALE_LOCK_SECONDS", "900"))
+
+_handlers = {}
+_wake_event = threading.Event()
+_worker_thread = None
+_worker_lock = threading.Lock()
+_engine = None
+_flask_app = None
+
+
+class RetryableJobError(Exception):
+    """Raised by handlers (or derived from a False return) when a job should be retried."""
+
+
+class PermanentJobError(Exception):
+    """Raised by handlers when retrying cannot succeed (e.g. the remote API rejected the request); the job fails at once."""
+
+
+def job_handler(job_type):
+    """Decorator registering fn(payload) as the handler for job_type. Return False or raise to retry; raise PermanentJobError to fail."""
+    def decorator(fn):
+        _handlers[job_type] = fn
+        return fn
+    return decorator
+
+
+def enqueue(db_conn, job_type, payload, order_id=None, max_attempts=None, depends_on=None):
+    """
+    Inserts a pending job using the caller's connection, so it commits or rolls back with the
+    caller's transaction. Returns the new job id. Call notify() after the commit.
+    depends_on: job ids that must be done before this job runs.
+    """
+    return db_conn.execute(
+        text("""
+            INSERT INTO outbox_jobs (job_type, payload, order_id, max_attempts, depends_on_job_ids, status, next_attempt_at, created_at, updated_at)
+            VALUES (:job_type, CAST(:payload AS JSONB), :order_id, :max_attempts, :depends_on, 'pending', NOW(), NOW(), NOW())
+            RETURNING id
+        """),
+        {"job_type": job_type, "payload": json.dumps(payload, default=str), "order_id": order_id,
+         "max_attempts": max_attempts or OUTBOX_DEFAULT_MAX_ATTEMPTS, "depends_on": list(depends_on) if depends_on else None}
+    ).scalar_one()
+
+
+def notify():
+    """Wakes the worker so freshly committed jobs run now instead of at the next poll."""
+    _wake_event.set()
+
+
+def _backoff_seconds(attempts):
+    return min(OUTBOX_BASE_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)), OUTBOX_MAX_BACKOFF_SECONDS)
+
+
+def _claim_due_jobs(limit):
+    with _engine.begin() as conn:
+        return conn.execute(
+            text("""
+                UPDATE outbox_jobs SET status = 'running', attempts = attempts + 1, locked_at = NOW(), updated_at = NOW()
+                WHERE id IN (
+                    SELECT j.id FROM outbox_jobs j
+                    WHERE ((j.status = 'pending' AND j.next_attempt_at <= NOW())
+                           OR (j.status = 'running' AND j.locked_at < NOW() - make_interval(secs => :stale_seconds)))
+                      AND NOT EXISTS (SELECT 1 FROM outbox_jobs dep
+                                      WHERE dep.id = ANY(j.depends_on_job_ids) AND dep.status <> 'done')
+                    ORDER BY j.next_attempt_at, j.id
+                    LIMIT :limit
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, job_type, payload, attempts, max_attempts
+            """),
+            {"limit": limit, "stale_seconds": OUTBOX_STALE_LOCK_SECONDS}
+        ).fetchall()
+
+
+def _finish_job(job_id, error_message, attempts, max_attempts, permanent=False):
+    with _engine.begin() as conn:
+        if error_message is None:
+            conn.execute(text("""
+                UPDATE outbox_jobs SET status = 'done', completed_at = NOW(), locked_at = NULL, last_error = NULL, updated_at = NOW()
+                WHERE id = :id
+            """), {"id": job_id})
+        elif permanent or attempts >= max_attempts:
+            conn.execute(text("""
+                UPDATE outbox_jobs SET status = 'failed', locked_at = NULL, last_error = :err, updated_at = NOW()
+                WHERE id = :id
+            """), {"id": job_id, "err": error_message[:4000]})
+            _fail_dependents(conn, job_id)
+        else:
+            conn.execute(text("""
+                UPDATE outbox_jobs SET status = 'pending', locked_at = NULL, last_error = :err,
+                       next_attempt_at = NOW() + make_interval(secs => :delay), updated_at = NOW()
+                WHERE id = :id
+            """), {"id": job_id, "err": error_message[:4000], "delay": _backoff_seconds(attempts)})
+
+
+def _fail_dependents(conn, job_id):
+    """Fails every pending job that waits (directly or transitively) on job_id, which has just failed."""
+    failed_ids = [job_id]
+    while failed_ids:
+        failed_ids = [row.id for row in conn.execute(text("""
+            UPDATE outbox_jobs SET status = 'failed', last_error = :err, updated_at = NOW()
+            WHERE status = 'pending' AND depends_on_job_ids && CAST(:ids AS BIGINT[])
+            RETURNING id
+        """), {"ids": failed_ids, "err": f"Dependency job(s) {', '.join(map(str, failed_ids))} failed."})]
+        for dependent_id in failed_ids:
+            print(f"WARN OUTBOX: Job {dependent_id} failed because a job it depends on failed.")
+
+
+def _run_job(job):
+    """Returns (error_message or None, permanent)."""
+    handler = _handlers.get(job.job_type)
+    if handler is None:
+        return f"No handler registered for job type '{job.job_type}'.", False
+    payload = job.payload if isinstance(job.payload, dict) else json.loads(job.payload)
+    try:
+        if _flask_app is not None:
+            with _flask_app.app_context():
+                result = handler(payload)
+        else:
+            result = handler(payload)
+        if result is False:
+            raise RetryableJobError(f"Handler for '{job.job_type}' reported failure.")
+        return None, False
+    except PermanentJobError as e:
+        return f"{type(e).__name__}: {e}", True
+    except Exception as e:
+        traceback.print_exc()
+        return f"{type(e).__name__}: {e}", False
+
+
+def run_due_jobs(limit=None):
+    """Claims and runs one batch of due jobs. Returns the number of jobs processed."""
+    if _engine is None:
+        return 0
+    jobs = _claim_due_jobs(limit or OUTBOX_BATCH_SIZE)
+    for job in jobs:
+        started = time.monotonic()
+        error_message, permanent = _run_job(job)
+        _finish_job(job.id, error_message, job.attempts, job.max_attempts, permanent)
+        if error_message is None:
+            print(f"INFO OUTBOX: Job {job.id} ({job.job_type}) done in {time.monotonic() - started:.2f}s (attempt {job.attempts}).")
+        elif permanent:
+            print(f"ERROR OUTBOX: Job {job.id} ({job.job_type}) failed permanently on attempt {job.attempts}: {error_message}")
+        else:
+            print(f"ERROR OUTBOX: Job {job.id} ({job.job_type}) attempt {job.attempts}/{job.max_attempts} failed: {error_message}")
+    return len(jobs)
+
+
+def _worker_loop():
+    print("INFO OUTBOX: Worker thread started.")
+    while True:
+        _wake_event.wait(OUTBOX_POLL_INTERVAL_SECONDS)
+        _wake_event.clear()
+        try:
+            while run_due_jobs() >= OUTBOX_BATCH_SIZE:
+                pass  # A full batch means more may be due; keep draining before sleeping.
+        except Exception as e:
+            print(f"ERROR OUTBOX: Worker loop error: {e}")
+            traceback.print_exc()
+
+
+def start_worker(engine, flask_app=None):
+    """Starts the background worker once per process (no-op if disabled or already running)."""
+    global _worker_thread, _engine, _flask_app
+    _engine = engine
+    _flask_app = flask_app
+    if not OUTBOX_WORKER_ENABLED or engine is None:
+        print(f"WARN OUTBOX: Worker not started (enabled={OUTBOX_WORKER_ENABLED}, engine={'set' if engine else 'None'}).")
+        return
+    with _worker_lock:
+        if _worker_thread is None or not _worker_thread.is_alive():
+            _worker_thread = threading.Thread(target=_worker_loop, name="outbox-worker", daemon=True)
+            _worker_thread.start()
+    notify()
+
+
+def get_outbox_summary(db_conn):
+    """Counts per job type and status, plus the most recent failures, for monitoring."""
+    counts = db_conn.execute(text("""
+        SELECT job_type, status, COUNT(*) AS job_count FROM outbox_jobs
+        WHERE status <> 'done' OR completed_at > NOW() - INTERVAL '1 day'
+        GROUP BY job_type, status ORDER BY job_type, status
+    """)).fetchall()
+    failures = db_conn.execute(text("""
+        SELECT id, job_type, order_id, attempts, last_error, updated_at FROM outbox_jobs
+        WHERE status = 'failed' ORDER BY updated_at DESC LIMIT 20
+    """)).fetchall()
+    return {
+        "counts": [{"job_type": r.job_type, "status": r.status, "count": r.job_count} for r in counts],
+        "recent_failures": [dict(r._mapping) for r in failures],
+        "worker_alive": bool(_worker_thread and _worker_thread.is_alive()),
+    }
+
+
+def retry_job(db_conn, job_id):
+    """
+    Re-queues a failed job immediately with a fresh attempt budget, along with the jobs that failed
+    because they depend on it. Returns True if the job was reset.
+    """
+    result = db_conn.execute(text("""
+        UPDATE outbox_jobs SET status = 'pending', attempts = 0, next_attempt_at = NOW(), updated_at = NOW()
+        WHERE id = :id AND status = 'failed'
+    """), {"id": job_id})
+    if result.rowcount == 0:
+        return False
+    requeued_ids = [job_id]
+    while requeued_ids:
+        requeued_ids = [row.id for row in db_conn.execute(text("""
+            UPDATE outbox_jobs SET status = 'pending', attempts = 0, next_attempt_at = NOW(), updated_at = NOW()
+            WHERE status = 'failed' AND depends_on_job_ids && CAST(:ids AS BIGINT[]) AND last_error LIKE 'Dependency job%'
+            RETURNING id
+        """), {"ids": requeued_ids})]
+    return True
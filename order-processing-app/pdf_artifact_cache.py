@@ -0,0 +1,203 @@
+# pdf_artifact_cache.py
+# Cache of rendered PDFs, keyed by what went into them.
+# The key is a SHA-256 over the document type, document_generator.TEMPLATE_VERSIONS[doc_type],
+# a fingerprint of document_generator.py itself and the normalized generator inputs (canonical
+# JSON: sorted keys, Decimal/datetime as strings). Identical inputs therefore map to the same
+# stored bytes, and any change to the order data, line items, flags or template code misses and
+# re-renders. Re-sending a receipt or wire invoice for an unchanged order serves the stored PDF.
+#
+# Artifacts live in GCS (gs://<GCS_BUCKET_NAME>/<PDF_CACHE_GCS_PREFIX>/<doc_type>/<key>.pdf) or a
+# local directory, bounded by PDF_CACHE_MAX_BYTES. Local eviction is least-recently-used (hits
+# refresh the file mtime); GCS eviction is oldest-first and runs at most every
+# PDF_CACHE_GCS_EVICT_INTERVAL_SECONDS. The logo is keyed by URI only: replacing the logo under the
+# same URI needs a TEMPLATE_VERSIONS bump (or PDF_CACHE_ENABLED=false) to take effect.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from datetime import date, datetime
+from decimal import Decimal
+
+import document_generator
+import gcs_service
+
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "true").lower() == "true"
+# 'gcs' or 'local'. Defaults to GCS when a bucket is configured.
+PDF_CACHE_STORAGE = os.getenv("PDF_CACHE_STORAGE", "gcs" if os.getenv("GCS_BUCKET_NAME") and gcs_service.storage else "local").lower()
+PDF_CACHE_GCS_PREFIX = os.getenv("PDF_CACHE_GCS_PREFIX", "pdf_cache").strip("/")
+PDF_CACHE_LOCAL_DIR = os.getenv("PDF_CACHE_LOCAL_DIR", os.path.join(tempfile.gettempdir(), "pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+PDF_CACHE_GCS_EVICT_INTERVAL_SECONDS = int(os.getenv("PDF_CACHE_GCS_EVICT_INTERVAL_SECONDS", "900"))
+
+_generator_fingerprint = None
+_evict_lock = threading.Lock()
+_last_gcs_eviction = 0.0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(stat, amount=1):
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+def _normalize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def _get_generator_fingerprint():
+    global _generator_fingerprint
+    if _generator_fingerprint is None:
+        with open(document_generator.__file__, "rb") as f:
+            _generator_fingerprint = hashlib.sha256(f.read()).hexdigest()
+    return _generator_fingerprint
+
+
+def cache_key(doc_type, inputs):
+    """SHA-256 hex key for doc_type rendered from inputs (any JSON-like structure)."""
+    payload = {"doc_type": doc_type, "template_version": document_generator.TEMPLATE_VERSIONS.get(doc_type),
+               "generator": _get_generator_fingerprint(), "inputs": inputs}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=_normalize)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _object_name(doc_type, key):
+    return f"{PDF_CACHE_GCS_PREFIX}/{doc_type}/{key}.pdf"
+
+
+def _local_path(doc_type, key):
+    return os.path.join(PDF_CACHE_LOCAL_DIR, doc_type, f"{key}.pdf")
+
+
+def _read(doc_type, key):
+    if PDF_CACHE_STORAGE == "gcs":
+        client = gcs_service.get_storage_client()
+        bucket_name = gcs_service.get_gcs_bucket_name()
+        if not client or not bucket_name:
+            return None
+        blob = client.bucket(bucket_name).blob(_object_name(doc_type, key))
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    path = _local_path(doc_type, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    os.utime(path)  # LRU: a hit makes this the most recently used file
+    return pdf_bytes
+
+
+def _evict_local():
+    entries, total = [], 0
+    for root, _, files in os.walk(PDF_CACHE_LOCAL_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    for _, size, path in sorted(entries):
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            _count("evictions")
+        except OSError:
+            pass
+
+
+def _evict_gcs():
+    global _last_gcs_eviction
+    if time.monotonic() - _last_gcs_eviction < PDF_CACHE_GCS_EVICT_INTERVAL_SECONDS:
+        return
+    _last_gcs_eviction = time.monotonic()
+    bucket = gcs_service.get_storage_client().bucket(gcs_service.get_gcs_bucket_name())
+    blobs = sorted(bucket.list_blobs(prefix=f"{PDF_CACHE_GCS_PREFIX}/"), key=lambda b: b.updated.timestamp() if b.updated else 0)
+    total = sum(blob.size or 0 for blob in blobs)
+    for blob in blobs:
+        if total <= PDF_CACHE_MAX_BYTES:
+            break
+        try:
+            blob.delete()
+            total -= blob.size or 0
+            _count("evictions")
+        except Exception as e:
+            print(f"WARN PDF_CACHE: Could not evict {blob.name}: {e}")
+
+
+def _write(doc_type, key, pdf_bytes):
+    if PDF_CACHE_STORAGE == "gcs":
+        result = gcs_service.upload_files_parallel([(pdf_bytes, _object_name(doc_type, key), "application/pdf")])[0]
+        if result["error"]:
+            raise RuntimeError(result["error"])
+    else:
+        path = _local_path(doc_type, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, path)  # atomic, so readers never see a partial PDF
+    _count("stores")
+    with _evict_lock:
+        if PDF_CACHE_STORAGE == "gcs":
+            _evict_gcs()
+        else:
+            _evict_local()
+
+
+def get_or_render(doc_type, inputs, render_fn):
+    """
+    Returns (pdf_bytes, cache_hit). On a miss render_fn() is called and a non-empty result is
+    stored under the key for (doc_type, inputs). Cache errors never fail the caller: they fall back
+    to rendering (or to returning the rendered bytes unstored).
+    """
+    if not PDF_CACHE_ENABLED:
+        return render_fn(), False
+    try:
+        key = cache_key(doc_type, inputs)
+    except Exception as e:
+        print(f"WARN PDF_CACHE: Could not build cache key for {doc_type}; rendering uncached: {e}")
+        _count("errors")
+        return render_fn(), False
+
+    try:
+        pdf_bytes = _read(doc_type, key)
+        if pdf_bytes and pdf_bytes.startswith(b"%PDF"):
+            _count("hits")
+            print(f"DEBUG PDF_CACHE: Hit for {doc_type} {key[:12]} ({len(pdf_bytes)} bytes).")
+            return pdf_bytes, True
+    except Exception as e:
+        print(f"WARN PDF_CACHE: Read failed for {doc_type} {key[:12]}: {e}")
+        _count("errors")
+
+    _count("misses")
+    pdf_bytes = render_fn()
+    if pdf_bytes:
+        try:
+            _write(doc_type, key, pdf_bytes)
+        except Exception as e:
+            print(f"WARN PDF_CACHE: Could not store {doc_type} {key[:12]}: {e}")
+            traceback.print_exc()
+            _count("errors")
+    return pdf_bytes, False
+
+
+def get_cache_stats():
+    with _stats_lock:
+        return dict(_stats, enabled=PDF_CACHE_ENABLED, storage=PDF_CACHE_STORAGE, max_bytes=PDF_CACHE_MAX_BYTES,
+                    template_versions=dict(document_generator.TEMPLATE_VERSIONS))
@@ -0,0 +1,146 @@
+# pdf_merge.py
+# Concatenates PDFs into one file that is written out as it is built.
+# pypdf's PdfWriter keeps every page of every input until write(), so a day's worth of packing
+# slips and labels would sit in memory at once. StreamingPdfMerger instead copies each input's
+# pages (and everything they reference) straight to the output with renumbered objects, as soon as
+# that input is added; only the byte offsets and page object numbers are kept until finish() writes
+# the page tree, catalog and xref. Inputs are read with pypdf and can be discarded after add().
+#
+#   merger = StreamingPdfMerger()
+#   yield merger.begin()
+#   for pdf_bytes in documents:
+#       yield merger.add(pdf_bytes)
+#   yield merger.finish()
+#
+# Links between pages (/Annots) are dropped: the output is for printing.
+
+import io
+
+try:
+    import pypdf
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NullObject, StreamObject
+except ImportError:
+    pypdf = None
+    print("WARN PDF_MERGE: pypdf not installed; merged PDF downloads are unavailable.")
+
+_CATALOG_OBJECT = 1
+_PAGES_OBJECT = 2
+_INHERITABLE_PAGE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class StreamingPdfMerger:
+    def __init__(self):
+        if pypdf is None:
+            raise RuntimeError("pypdf is not installed.")
+        self._offsets = [None, None]  # object number n is at index n - 1; 1 and 2 are written by finish()
+        self._position = 0
+        self._page_objects = []
+
+    @property
+    def page_count(self):
+        return len(self._page_objects)
+
+    def _emit(self, chunk):
+        self._position += len(chunk)
+        return chunk
+
+    def _allocate(self):
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, number, obj):
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer)
+        self._offsets[number - 1] = self._position
+        return self._emit(b"%d 0 obj\n" % number + buffer.getvalue() + b"\nendobj\n")
+
+    def _renumber(self, obj, numbers, pending):
+        """Returns obj with every reference pointing at its output object number (queueing unseen ones)."""
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in numbers:
+                numbers[key] = self._allocate()
+                pending.append(obj)
+            return IndirectObject(numbers[key], 0, None)
+        if isinstance(obj, StreamObject):  # always an indirect object, so visited once: update in place
+            for key in list(obj.keys()):
+                obj[key] = self._renumber(obj.raw_get(key), numbers, pending)
+            return obj
+        if isinstance(obj, DictionaryObject):
+            # Direct dictionaries and arrays are copied: inherited page attributes can be shared by several pages.
+            copied = DictionaryObject()
+            for key in obj.keys():
+                copied[NameObject(key)] = self._renumber(obj.raw_get(key), numbers, pending)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._renumber(item, numbers, pending) for item in obj)
+        return obj
+
+    def begin(self):
+        return self._emit(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def add(self, pdf_bytes):
+        """
+        Copies every page of pdf_bytes to the output and returns the bytes to send next. If the input
+        cannot be read the merger is left as it was, so the caller can skip it and carry on.
+        """
+        state = (len(self._offsets), len(self._page_objects), self._position)
+        try:
+            return self._add(pdf_bytes)
+        except Exception:
+            object_count, page_count, self._position = state
+            del self._offsets[object_count:]
+            del self._page_objects[page_count:]
+            raise
+
+    def _add(self, pdf_bytes):
+        reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted:
+            raise ValueError("Encrypted PDFs cannot be merged.")
+
+        numbers, pending, page_keys = {}, [], set()
+        for page in reader.pages:
+            ref = page.indirect_reference
+            page_keys.add((ref.idnum, ref.generation))
+            numbers[(ref.idnum, ref.generation)] = self._allocate()
+            self._page_objects.append(numbers[(ref.idnum, ref.generation)])
+            pending.append(ref)
+
+        chunks = []
+        while pending:
+            ref = pending.pop(0)
+            obj = reader.get_object(ref)
+            if obj is None:
+                obj = NullObject()
+            elif (ref.idnum, ref.generation) in page_keys:
+                # Attributes inherited from the source page tree must move onto the page itself.
+                page = DictionaryObject({NameObject(key): obj.raw_get(key) for key in obj.keys() if key not in ("/Parent", "/Annots")})
+                parent = obj.get("/Parent")
+                while parent is not None:
+                    for key in _INHERITABLE_PAGE_KEYS:
+                        if key not in page and key in parent:
+                            page[NameObject(key)] = parent.raw_get(key)
+                    parent = parent.get("/Parent")
+                obj = self._renumber(page, numbers, pending)
+                obj[NameObject("/Parent")] = IndirectObject(_PAGES_OBJECT, 0, None)
+            else:
+                obj = self._renumber(obj, numbers, pending)
+            chunks.append(self._write_object(numbers[(ref.idnum, ref.generation)], obj))
+        return b"".join(chunks)
+
+    def finish(self):
+        """Writes the page tree, catalog, xref table and trailer. Returns the final bytes."""
+        kids = " ".join(f"{number} 0 R" for number in self._page_objects)
+        chunks = []
+        for number, body in ((_PAGES_OBJECT, f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self._page_objects)} >>"),
+                             (_CATALOG_OBJECT, f"<< /Type /Catalog /Pages {_PAGES_OBJECT} 0 R >>")):
+            self._offsets[number - 1] = self._position
+            chunks.append(self._emit(f"{number} 0 obj\n{body}\nendobj\n".encode("ascii")))
+
+        xref_position = self._position
+        xref = [f"xref\n0 {len(self._offsets) + 1}\n", "0000000000 65535 f \n"]
+        xref.extend(f"{offset:010d} 00000 n \n" for offset in self._offsets)
+        xref.append(f"trailer\n<< /Size {len(self._offsets) + 1} /Root {_CATALOG_OBJECT} 0 R >>\n"
+                    f"startxref\n{xref_position}\n%%EOF\n")
+        chunks.append(self._emit("".join(xref).encode("ascii")))
+        return b"".join(chunks)
@@ -0,0 +1,114 @@
+# pdf_render_pool.py
+# Optional process pool for ReportLab rendering.
+# Rendering a PDF is pure-Python CPU work; under gunicorn's single worker with two threads it holds
+# the GIL and stalls the other request for the whole render. With PDF_RENDER_POOL_ENABLED=true the
+# four generators below run in PDF_RENDER_POOL_SIZE worker processes instead (the request thread
+# just waits on the result, which releases the GIL). Workers are spawned, not forked, so they do
+# not inherit the parent's DB / gRPC threads; each imports document_generator (registering fonts),
+# builds the shared stylesheet and loads the logo once, before its first job.
+#
+# The functions take the same arguments and return the same bytes as document_generator's. With
+# the pool disabled (the default), or if it breaks, they render in-process exactly as before.
+
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import document_generator
+
+PDF_RENDER_POOL_ENABLED = os.getenv("PDF_RENDER_POOL_ENABLED", "false").lower() == "true"
+PDF_RENDER_POOL_SIZE = int(os.getenv("PDF_RENDER_POOL_SIZE", "2"))
+PDF_RENDER_TIMEOUT_SECONDS = int(os.getenv("PDF_RENDER_TIMEOUT_SECONDS", "120"))
+
+GENERATOR_NAMES = ("generate_purchase_order_pdf", "generate_packing_slip_pdf",
+                   "generate_wire_transfer_invoice_pdf", "generate_receipt_pdf")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(logo_gcs_uri):
+    """Runs once in each worker process: fonts are registered by the import, then styles and logo are loaded."""
+    try:
+        document_generator.get_custom_styles()
+        document_generator.warm_logo_cache(logo_gcs_uri)
+        print(f"INFO PDF_RENDER_POOL: Worker {os.getpid()} ready.")
+    except Exception as e:
+        # Not fatal: the first render in this worker loads whatever is missing.
+        print(f"WARN PDF_RENDER_POOL: Worker {os.getpid()} preload failed: {e}")
+
+
+def _render_in_worker(generator_name, args, kwargs):
+    return getattr(document_generator, generator_name)(*args, **kwargs)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=max(1, PDF_RENDER_POOL_SIZE),
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(os.getenv("COMPANY_LOGO_GCS_URI"),))
+                print(f"INFO PDF_RENDER_POOL: Started process pool with {PDF_RENDER_POOL_SIZE} worker(s).")
+    return _pool
+
+
+def _discard_pool(broken_pool):
+    global _pool
+    with _pool_lock:
+        if _pool is broken_pool:
+            _pool = None
+    broken_pool.shutdown(wait=False)
+
+
+def is_enabled():
+    return PDF_RENDER_POOL_ENABLED
+
+
+def start():
+    """Starts the pool (if enabled) and has every worker preload, so the first PDF doesn't wait for a spawn."""
+    if not PDF_RENDER_POOL_ENABLED:
+        return
+    try:
+        pool = _get_pool()
+        for _ in range(max(1, PDF_RENDER_POOL_SIZE)):
+            pool.submit(os.getpid)
+    except Exception as e:
+        print(f"ERROR PDF_RENDER_POOL: Could not start process pool: {e}")
+        traceback.print_exc()
+
+
+def render(generator_name, *args, **kwargs):
+    """Calls document_generator.<generator_name>(*args, **kwargs) in the pool when enabled, else in-process."""
+    if generator_name not in GENERATOR_NAMES:
+        raise ValueError(f"Unknown PDF generator '{generator_name}'.")
+    if not PDF_RENDER_POOL_ENABLED:
+        return getattr(document_generator, generator_name)(*args, **kwargs)
+    pool = _get_pool()
+    try:
+        return pool.submit(_render_in_worker, generator_name, args, kwargs).result(timeout=PDF_RENDER_TIMEOUT_SECONDS)
+    except BrokenProcessPool as e:
+        # A worker died (e.g. OOM-killed). Replace the pool for later calls; render this one here.
+        print(f"ERROR PDF_RENDER_POOL: Process pool broken ({e}); rendering {generator_name} in-process.")
+        _discard_pool(pool)
+        return getattr(document_generator, generator_name)(*args, **kwargs)
+
+
+def generate_purchase_order_pdf(*args, **kwargs):
+    return render("generate_purchase_order_pdf", *args, **kwargs)
+
+
+def generate_packing_slip_pdf(*args, **kwargs):
+    return render("generate_packing_slip_pdf", *args, **kwargs)
+
+
+def generate_wire_transfer_invoice_pdf(*args, **kwargs):
+    return render("generate_wire_transfer_invoice_pdf", *args, **kwargs)
+
+
+def generate_receipt_pdf(*args, **kwargs):
+    return render("generate_receipt_pdf", *args, **kwargs)
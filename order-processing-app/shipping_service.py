@@ -11,6 +11,10 @@ from dotenv import load_dotenv
 import json
 import traceback
 
+import http_client
+
+from carrier_token_cache import token_cache as carrier_token_cache
+
 # --- LOAD DOTENV AT THE VERY TOP FOR STANDALONE EXECUTION ---
 if __name__ == '__main__':
     print("DEBUG SHIPPING_SERVICE (Top-Level Pre-Config): Running standalone, attempting to load .env.")
@@ -177,48 +181,74 @@ def _get_processed_state_code(state_input, country_code_upper, party_type="ShipT
         return processed_code
 
 
-def get_ups_oauth_token():
+UPS_TOKEN_CACHE_KEY = carrier_token_cache.make_key("ups", UPS_API_ENVIRONMENT, UPS_ACCOUNT_NUMBER or UPS_CLIENT_ID)
+FEDEX_TOKEN_CACHE_KEY = carrier_token_cache.make_key("fedex", FEDEX_API_ENVIRONMENT, FEDEX_SHIPPER_ACCOUNT_NUMBER or FEDEX_API_KEY)
+
+
+def get_ups_oauth_token(force_refresh=False):
+    """Returns a UPS access token, reusing the cached one until shortly before it expires."""
+    return carrier_token_cache.get_token(UPS_TOKEN_CACHE_KEY, _fetch_ups_oauth_token, force_refresh=force_refresh)
+
+
+def get_fedex_oauth_token(force_refresh=False):
+    """Returns a FedEx access token, reusing the cached one until shortly before it expires."""
+    return carrier_token_cache.get_token(FEDEX_TOKEN_CACHE_KEY, _fetch_fedex_oauth_token, force_refresh=force_refresh)
+
+
+def get_carrier_token_cache_stats():
+    return carrier_token_cache.get_stats()
+
+
+def _invalidate_token_on_401(http_err, cache_key):
+    # A 401 from a ship call means the cached token was revoked or expired early; the next call refetches.
+    if http_err.response is not None and http_err.response.status_code == 401:
+        carrier_token_cache.invalidate(cache_key, reason="Carrier API returned 401")
+
+
+def _fetch_ups_oauth_token():
+    """Requests a new UPS token. Returns (access_token, expires_in), or (None, None) on failure."""
     if not all([UPS_CLIENT_ID, UPS_CLIENT_SECRET]):
         print("ERROR UPS_AUTH: UPS Client ID or Client Secret not configured.")
-        return None
+        return None, None
     headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
     data = {"grant_type": "client_credentials"}
     auth = (UPS_CLIENT_ID, UPS_CLIENT_SECRET)
     try:
         print(f"DEBUG UPS_AUTH: Requesting OAuth token from {UPS_OAUTH_ENDPOINT}")
-        response = requests.post(UPS_OAUTH_ENDPOINT, headers=headers, data=data, auth=auth)
+        response = http_client.post(UPS_OAUTH_ENDPOINT, headers=headers, data=data, auth=auth)
         response.raise_for_status()
         token_data = response.json()
         access_token = token_data.get("access_token")
         if access_token:
             print(f"DEBUG UPS_AUTH: Successfully obtained UPS OAuth token. Expires in: {token_data.get('expires_in')} sec.")
-            return access_token
+            return access_token, token_data.get("expires_in")
         else:
             print(f"ERROR UPS_AUTH: UPS OAuth token response successful but missing 'access_token'. Full Response: {token_data}")
-            return None
+            return None, None
     except requests.exceptions.HTTPError as http_err:
         status_code = http_err.response.status_code if http_err.response is not None else 'N/A'
         response_text = http_err.response.text if http_err.response is not None else 'N/A'
         print(f"ERROR UPS_AUTH: OAuth HTTP Error. Status: {status_code}, Response: {response_text[:500]}..., Exception: {http_err}")
-        return None
+        return None, None
     except requests.exceptions.RequestException as req_e:
         print(f"ERROR UPS_AUTH: RequestException during OAuth token request: {req_e}")
-        return None
+        return None, None
     except Exception as e:
         print(f"ERROR UPS_AUTH: Unexpected exception during OAuth token request: {e}")
         traceback.print_exc()
-        return None
+        return None, None
 
-def get_fedex_oauth_token():
+def _fetch_fedex_oauth_token():
+    """Requests a new FedEx token. Returns (access_token, expires_in), or (None, None) on failure."""
     if not all([FEDEX_API_KEY, FEDEX_SECRET_KEY]):
         print("ERROR FEDEX_AUTH: FedEx API Key or Secret Key not configured.")
-        return None
+        return None, None
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     data = {"grant_type": FEDEX_GRANT_TYPE, "client_id": FEDEX_API_KEY, "client_secret": FEDEX_SECRET_KEY}
     print(f"DEBUG FEDEX_AUTH: Using grant_type '{FEDEX_GRANT_TYPE}'.")
     try:
-        print(f"DEBUG FEDEX_AUTH: Requesting OAuth token from {FEDEX_OAUTH_URL} with data: {data}")
-        response = requests.post(FEDEX_OAUTH_URL, headers=headers, data=data)
+        print(f"DEBUG FEDEX_AUTH: Requesting OAuth token from {FEDEX_OAUTH_URL}")
+        response = http_client.post(FEDEX_OAUTH_URL, headers=headers, data=data)
         response.raise_for_status()
         token_data = response.json()
         access_token = token_data.get("access_token")
@@ -229,22 +259,22 @@ def get_fedex_oauth_token():
             if returned_scope != "CXS-TP" and "CXS-TP" not in (returned_scope or "").split() and \
                returned_scope != "CXS" and "CXS" not in (returned_scope or "").split() :
                  print(f"WARN FEDEX_AUTH: Token obtained, but scope is '{returned_scope}'. Expected 'CXS-TP' or 'CXS'. Ship API might still fail.")
-            return access_token
+            return access_token, token_data.get("expires_in")
         else:
             print(f"ERROR FEDEX_AUTH: FedEx OAuth token response successful but 'access_token' is missing. Full Response: {token_data}")
-            return None
+            return None, None
     except requests.exceptions.HTTPError as http_err:
         error_message = f"HTTPError during FedEx OAuth token request: {http_err}."
         response_text = http_err.response.text if http_err.response is not None else "No response body."
         print(f"ERROR FEDEX_AUTH: {error_message} Status: {http_err.response.status_code if http_err.response is not None else 'N/A'}, Response: {response_text[:500]}")
-        return None
+        return None, None
     except requests.exceptions.RequestException as req_e:
         print(f"ERROR FEDEX_AUTH: RequestException during FedEx OAuth token request: {req_e}")
-        return None
+        return None, None
     except Exception as e:
         print(f"ERROR FEDEX_AUTH: Unexpected exception during FedEx OAuth token request: {e}")
         traceback.print_exc()
-        return None
+        return None, None
 
 def map_shipping_method_to_ups_code(method_name_from_bc):
     method_name = (method_name_from_bc or "").lower().strip()
@@ -483,7 +513,7 @@ def generate_ups_label_raw(order_data, ship_from_address, total_weight_lbs, cust
     print(f"DEBUG UPS_INTL_SHIPMENT: Sending payload to {UPS_SHIPPING_API_ENDPOINT}") # This line you already have
 
     try:
-        response = requests.post(UPS_SHIPPING_API_ENDPOINT, headers=headers, json=payload)
+        response = http_client.post(UPS_SHIPPING_API_ENDPOINT, headers=headers, json=payload)
         response_data = response.json()
         if response.status_code == 200 and response_data.get("ShipmentResponse", {}).get("Response", {}).get("ResponseStatus", {}).get("Code") == "1":
             print(f"DEBUG UPS_LABEL_RAW (Full Response for Success Code 1): {json.dumps(response_data, indent=2, ensure_ascii=False)}", flush=True)
@@ -510,6 +540,7 @@ def generate_ups_label_raw(order_data, ship_from_address, total_weight_lbs, cust
         response_content = "Could not decode JSON or no response."
         try: response_content = http_err.response.json() if http_err.response is not None else "No response."
         except json.JSONDecodeError: response_content = http_err.response.text if http_err.response is not None else "No text."
+        _invalidate_token_on_401(http_err, UPS_TOKEN_CACHE_KEY)
         print(f"ERROR UPS_LABEL_RAW: HTTPError: {http_err}. Response: {str(response_content)[:1000]}"); return None, None
     except requests.exceptions.RequestException as req_err: print(f"ERROR UPS_LABEL_RAW: ReqException: {req_err}"); traceback.print_exc(); return None, None
     except json.JSONDecodeError as json_err:
@@ -611,7 +642,7 @@ def generate_ups_international_shipment(shipment_payload_from_frontend):
     print(f"DEBUG UPS_INTL_SHIPMENT: EXACT PAYLOAD BEING SENT TO UPS API (after state/province conversion):\n{json.dumps(payload, indent=2)}")
 
     try:
-        response = requests.post(UPS_SHIPPING_API_ENDPOINT, headers=headers, json=payload)
+        response = http_client.post(UPS_SHIPPING_API_ENDPOINT, headers=headers, json=payload)
         response_data = response.json()
         
         if response.status_code == 200 and response_data.get("ShipmentResponse", {}).get("Response", {}).get("ResponseStatus", {}).get("Code") == "1":
@@ -681,6 +712,7 @@ def generate_ups_international_shipment(shipment_payload_from_frontend):
         response_content = "Could not decode JSON or no response body."
         try: response_content = http_err.response.json() if http_err.response is not None else "No response object."
         except json.JSONDecodeError: response_content = http_err.response.text if http_err.response is not None else "No response text."
+        _invalidate_token_on_401(http_err, UPS_TOKEN_CACHE_KEY)
         print(f"ERROR UPS_INTL_SHIPMENT: HTTPError occurred: {http_err}. Response: {str(response_content)[:1000]}")
         return None, None
     except requests.exceptions.RequestException as req_err:
@@ -808,7 +840,7 @@ def generate_fedex_label_raw(order_data, ship_from_address, total_weight_lbs, cu
 
     try:
         # ... (rest of the try-except block for API call, response handling, and base64 decoding remains the same) ...
-        response = requests.post(FEDEX_SHIP_API_URL, headers=headers, json=final_api_payload)
+        response = http_client.post(FEDEX_SHIP_API_URL, headers=headers, json=final_api_payload)
         print(f"DEBUG FEDEX_LABEL_RAW: FedEx API Response Status: {response.status_code}", flush=True)
         # Log the exact payload sent for debugging purposes, be mindful of sensitive data in production logs
         # print(f"DEBUG FEDEX_LABEL_RAW: Payload sent to FedEx: {json.dumps(final_api_payload, indent=2)}")
@@ -865,6 +897,7 @@ def generate_fedex_label_raw(order_data, ship_from_address, total_weight_lbs, cu
                 response_content = http_err.response.json()
             except json.JSONDecodeError:
                 response_content = http_err.response.text
+        _invalidate_token_on_401(http_err, FEDEX_TOKEN_CACHE_KEY)
         print(f"ERROR FEDEX_LABEL_RAW: HTTPError occurred during FedEx API call: {http_err}. Response: {str(response_content)[:1000]}")
         return None, None
     except requests.exceptions.RequestException as req_err:
@@ -937,7 +970,32 @@ def generate_ups_label(order_data, ship_from_address, total_weight_lbs, customer
     if not final_label_pdf_bytes: print(f"ERROR UPS_GEN_LABEL: PDF conversion failed for track {tracking_number}."); return None, tracking_number
     return final_label_pdf_bytes, tracking_number
 
-def create_bigcommerce_shipment(bigcommerce_order_id, tracking_number, shipping_method_name, line_items_in_shipment, order_address_id, comments=None, shipping_provider=None):
+class BigCommerceRequestRejected(Exception):
+    """BigCommerce answered 4xx (other than 429): re-sending the same request will not succeed."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def get_bigcommerce_shipments(bigcommerce_order_id):
+    """Returns the order's existing BigCommerce shipments (a list, empty if none), or None if they could not be fetched."""
+    if not CURRENT_BC_API_BASE_URL_V2 or not CURRENT_BC_HEADERS or not CURRENT_BC_HEADERS.get("X-Auth-Token"): print("ERROR BC_GET_SHIPMENTS: BC API not configured."); return None
+    shipments_url = f"{CURRENT_BC_API_BASE_URL_V2}orders/{bigcommerce_order_id}/shipments"
+    try:
+        response = http_client.get(shipments_url, headers=CURRENT_BC_HEADERS, params={"limit": 250})
+        if response.status_code == 204: return []  # BigCommerce v2 answers 204 when the order has no shipments
+        response.raise_for_status()
+        return response.json() or []
+    except Exception as e: print(f"ERROR BC_GET_SHIPMENTS: Could not list shipments for BC Order {bigcommerce_order_id}: {e}"); return None
+
+def create_bigcommerce_shipment(bigcommerce_order_id, tracking_number, shipping_method_name, line_items_in_shipment, order_address_id, comments=None, shipping_provider=None,
+                                raise_on_rejection=False):
+    """
+    POSTs one shipment. Returns True on success, False on failure. With raise_on_rejection=True a 4xx
+    response (other than 429) raises BigCommerceRequestRejected instead, so callers that retry can
+    tell a rejected request from a transient failure.
+    """
     print(f"DEBUG BC_CREATE_SHIPMENT: Order {bigcommerce_order_id}, Track {tracking_number}, Provider: {shipping_provider}")
     if not CURRENT_BC_API_BASE_URL_V2 or not CURRENT_BC_HEADERS or not CURRENT_BC_HEADERS.get("X-Auth-Token"): print("ERROR BC_CREATE_SHIPMENT: BC API not configured."); return False
     if not all([bigcommerce_order_id, tracking_number, line_items_in_shipment]) or order_address_id is None: print(f"ERROR BC_CREATE_SHIPMENT: Missing args."); return False
@@ -960,10 +1018,15 @@ def create_bigcommerce_shipment(bigcommerce_order_id, tracking_number, shipping_
     if shipping_provider: shipment_payload["shipping_provider"] = str(shipping_provider)
     print(f"DEBUG BC_CREATE_SHIPMENT: Payload to BC: {json.dumps(shipment_payload)}")
     try:
-        response = requests.post(shipments_url, headers=CURRENT_BC_HEADERS, json=shipment_payload)
+        response = http_client.post(shipments_url, headers=CURRENT_BC_HEADERS, json=shipment_payload)
         response.raise_for_status(); shipment_creation_data = response.json()
         print(f"INFO BC_CREATE_SHIPMENT: Success for BC Order {bigcommerce_order_id}. BC Ship ID: {shipment_creation_data.get('id')}"); return True
-    except requests.exceptions.HTTPError as http_err: print(f"ERROR BC_CREATE_SHIPMENT: HTTPError for {bigcommerce_order_id}: {http_err}. Resp: {http_err.response.text if http_err.response else 'N/A'}"); return False
+    except requests.exceptions.HTTPError as http_err:
+        status_code = http_err.response.status_code if http_err.response is not None else None
+        print(f"ERROR BC_CREATE_SHIPMENT: HTTPError for {bigcommerce_order_id}: {http_err}. Resp: {http_err.response.text if http_err.response is not None else 'N/A'}")
+        if raise_on_rejection and status_code and 400 <= status_code < 500 and status_code != 429:
+            raise BigCommerceRequestRejected(f"BigCommerce rejected shipment for order {bigcommerce_order_id} ({status_code}): {http_err.response.text[:500]}", status_code)
+        return False
     except Exception as e: print(f"ERROR BC_CREATE_SHIPMENT: Unexpected error for {bigcommerce_order_id}: {e}"); traceback.print_exc(); return False
 
 def set_bigcommerce_order_status(bigcommerce_order_id, status_id):
@@ -973,7 +1036,7 @@ def set_bigcommerce_order_status(bigcommerce_order_id, status_id):
     order_update_url = f"{CURRENT_BC_API_BASE_URL_V2}orders/{bigcommerce_order_id}"; status_update_payload = {"status_id": int(status_id)}
     print(f"DEBUG BC_SET_STATUS: Payload: {json.dumps(status_update_payload)}")
     try:
-        response = requests.put(order_update_url, headers=CURRENT_BC_HEADERS, json=status_update_payload)
+        response = http_client.put(order_update_url, headers=CURRENT_BC_HEADERS, json=status_update_payload)
         response.raise_for_status()
         print(f"INFO BC_SET_STATUS: Success for BC Order {bigcommerce_order_id} to Status ID {status_id}."); return True
     except requests.exceptions.HTTPError as http_err: print(f"ERROR BC_SET_STATUS: HTTPError for {bigcommerce_order_id}: {http_err}. Resp: {http_err.response.text if http_err.response else 'N/A'}"); return False